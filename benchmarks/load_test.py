@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""Open-loop load generator that replays realistic Telegram traffic against the handlers.
+
+Updates arrive as a Poisson process at --rate per second for --duration seconds,
+spread over --users chats with a text/photo/voice mix. Text and voice transcripts
+come from an anonymized corpus (benchmarks/fixtures/corpus.txt); photos come
+from a directory of fixture receipts or from synthetic receipts at common phone
+resolutions. Updates go through PerChatUpdateProcessor into the registered
+photo_handler / text_handler / voice_handler, with Gemini, ASR, Postgres and the
+Bot API replaced by the latency-modelled stubs from benchmarks/stubs.py.
+
+Reported (stdout and optional JSON):
+  - throughput: completed updates/s, overall and per kind
+  - queueing delay: arrival -> handler start (waiting for a slot or the chat's FIFO)
+  - latency: arrival -> handler finished, including background tasks it spawned
+  - error rate: handler exceptions, error replies and load-shedding notices
+  - memory growth: RSS and traced Python allocations sampled during the run
+
+Usage:
+    python3 benchmarks/load_test.py --rate 20 --duration 60 --users 200
+    python3 benchmarks/load_test.py --rate 50 --mix text=0.6,photo=0.3,voice=0.1 --output load.json
+    python3 benchmarks/load_test.py --rate 20 --with-admission   # keep limits from config.yaml
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+BENCH_DIR = Path(__file__).resolve().parent
+if str(BENCH_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(BENCH_DIR.parent))
+
+from benchmarks import stubs  # noqa: E402
+from benchmarks.run_benchmarks import percentile  # noqa: E402
+
+DEFAULT_CORPUS = BENCH_DIR / "fixtures" / "corpus.txt"
+KINDS = ("text", "photo", "voice")
+# Common phone-camera resolutions used when no fixture directory is given
+SYNTHETIC_RESOLUTIONS = ((720, 1280), (1080, 1920), (1536, 2048), (3024, 4032))
+ERROR_MARKERS = ("❌", "Đã có lỗi", "Không thể")
+
+logger = logging.getLogger("load_test")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse 'text=0.7,photo=0.2,voice=0.1' into normalized weights."""
+    weights: Dict[str, float] = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        kind, _, value = part.partition("=")
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f"Unknown update kind in mix: {kind}")
+        weights[kind] = float(value)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Mix weights must sum to a positive number")
+    return {k: v / total for k, v in weights.items()}
+
+
+def load_corpus(path: Path) -> List[str]:
+    lines = [line.strip() for line in path.read_text(encoding="utf-8").splitlines()]
+    corpus = [line for line in lines if line and not line.startswith("#")]
+    if not corpus:
+        raise ValueError(f"Corpus {path} is empty")
+    return corpus
+
+
+def arrival_schedule(rate: float, duration: float, rng: random.Random) -> List[float]:
+    """Poisson arrival offsets (seconds from start) for an open-loop load test."""
+    offsets = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        offsets.append(t)
+        t += rng.expovariate(rate)
+    return offsets
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process (Linux /proc, falling back to peak RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class UpdateRecord:
+    kind: str
+    chat_id: int
+    arrived: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: bool = False
+
+
+@dataclass
+class MemorySampler:
+    interval: float
+    samples: List[Tuple[float, int, int]] = field(default_factory=list)
+
+    async def run(self, start: float, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+            self.samples.append((time.perf_counter() - start, current_rss_bytes(), traced))
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+class TrafficFactory:
+    """Builds synthetic Telegram updates from the corpus and fixture receipts."""
+
+    def __init__(self, corpus: List[str], http: stubs.FakeHTTPSession, image_dir: Optional[Path],
+                 users: int, rng: random.Random):
+        self.corpus = corpus
+        self.users = users
+        self.rng = rng
+        self.voice_bytes = stubs.make_wav_bytes(1.0)
+        self.photo_urls = self._load_images(http, image_dir)
+        self._message_id = 0
+
+    def _load_images(self, http: stubs.FakeHTTPSession, image_dir: Optional[Path]) -> List[str]:
+        if image_dir is not None:
+            paths = sorted(p for p in image_dir.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+            if not paths:
+                raise ValueError(f"No fixture images found in {image_dir}")
+            return [http.add(p.name, p.read_bytes()) for p in paths]
+        return [
+            http.add(f"synthetic_{w}x{h}.jpg", stubs.make_receipt_image(w, h, seed=i))
+            for i, (w, h) in enumerate(SYNTHETIC_RESOLUTIONS)
+        ]
+
+    def make(self, kind: str) -> Tuple[stubs.FakeUpdate, int]:
+        self._message_id += 1
+        chat_id = 10_000 + self.rng.randrange(self.users)
+        mid = self._message_id
+        if kind == "photo":
+            photo = stubs.FakePhotoSize(self.rng.choice(self.photo_urls), file_unique_id=f"load-{mid}")
+            message = stubs.FakeMessage(chat_id, mid, photo=[photo])
+        elif kind == "voice":
+            message = stubs.FakeMessage(chat_id, mid, voice=stubs.FakeVoice(self.voice_bytes, f"load-voice-{mid}"))
+        else:
+            message = stubs.FakeMessage(chat_id, mid, text=self.rng.choice(self.corpus))
+        return stubs.FakeUpdate(message), chat_id
+
+
+class TrackingApplication(stubs.FakeApplication):
+    """Attributes background tasks (e.g. voice processing) to the update that spawned them."""
+
+    def __init__(self, bot: stubs.FakeBot):
+        super().__init__(bot)
+        self.by_update: Dict[int, List[asyncio.Task]] = {}
+
+    def create_task(self, coroutine, update=None, name=None):
+        task = super().create_task(coroutine, update=update, name=name)
+        if update is not None:
+            self.by_update.setdefault(update.update_id, []).append(task)
+        return task
+
+
+async def run_load(args, harness, handlers: Dict[str, object], factory: TrafficFactory,
+                   mix: Dict[str, float], rng: random.Random) -> Dict[str, object]:
+    from utils.update_processor import PerChatUpdateProcessor, install_blocking_executor
+
+    try:
+        from utils import rate_limiter
+        shed_texts = set(rate_limiter.SHED_MESSAGES.values())
+    except Exception:
+        shed_texts = set()
+
+    bot = stubs.FakeBot(latency=stubs.LatencyModel.parse(args.telegram_latency, seed=args.seed))
+    app = TrackingApplication(bot)
+    context = stubs.FakeContext(bot, app)
+    processor = PerChatUpdateProcessor(args.concurrency)
+    await processor.initialize()
+    # As in bot._post_init; the job queue's workers are not part of this harness
+    install_blocking_executor(args.concurrency)
+
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    offsets = arrival_schedule(args.rate, args.duration, rng)
+    records: List[UpdateRecord] = []
+
+    async def _handle(update, record: UpdateRecord):
+        record.started = time.perf_counter()
+        try:
+            await handlers[record.kind](update, context)
+            spawned = app.by_update.pop(update.update_id, [])
+            if spawned:
+                results = await asyncio.gather(*spawned, return_exceptions=True)
+                record.error = any(isinstance(r, BaseException) for r in results)
+        except Exception:
+            logger.exception("Handler raised for %s update", record.kind)
+            record.error = True
+        finally:
+            record.finished = time.perf_counter()
+
+    async def _arrive(offset: float, start: float):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind = rng.choices(kinds, weights)[0]
+        update, chat_id = factory.make(kind)
+        record = UpdateRecord(kind=kind, chat_id=chat_id, arrived=time.perf_counter())
+        records.append(record)
+        await processor.process_update(update, _handle(update, record))
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    stop_sampling = asyncio.Event()
+    sampler = MemorySampler(args.memory_interval)
+    start = time.perf_counter()
+    sampler_task = asyncio.create_task(sampler.run(start, stop_sampling))
+    baseline_snapshot = tracemalloc.take_snapshot() if args.tracemalloc else None
+
+    await asyncio.gather(*(_arrive(o, start) for o in offsets))
+    await app.wait_tasks()
+    await processor.shutdown()
+    elapsed = time.perf_counter() - start
+    stop_sampling.set()
+    await sampler_task
+    sampler.samples.append((elapsed, current_rss_bytes(), tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0))
+
+    top_allocations = []
+    if baseline_snapshot is not None:
+        diff = tracemalloc.take_snapshot().compare_to(baseline_snapshot, "lineno")
+        top_allocations = [str(stat) for stat in diff[:args.tracemalloc_top]]
+        tracemalloc.stop()
+
+    # Error replies and shed notices are counted from the bot's outgoing messages
+    error_replies = sum(1 for m in bot.sent if any(str(m.get("text", "")).startswith(p) for p in ERROR_MARKERS))
+    shed_notices = sum(1 for m in bot.sent if m.get("text") in shed_texts)
+
+    return summarize(records, elapsed, sampler.samples, error_replies, shed_notices, top_allocations, args)
+
+
+def _latency_stats(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50_s": percentile(values, 0.5),
+        "p90_s": percentile(values, 0.9),
+        "p99_s": percentile(values, 0.99),
+        "max_s": max(values) if values else 0.0,
+    }
+
+
+def summarize(records: List[UpdateRecord], elapsed: float, memory: List[Tuple[float, int, int]],
+              error_replies: int, shed_notices: int, top_allocations: List[str], args) -> Dict[str, object]:
+    done = [r for r in records if r.finished is not None and r.started is not None]
+    per_kind = {}
+    for kind in KINDS:
+        rs = [r for r in done if r.kind == kind]
+        if not rs:
+            continue
+        per_kind[kind] = {
+            "updates": len(rs),
+            "throughput_per_s": len(rs) / elapsed if elapsed > 0 else 0.0,
+            "queue_delay": _latency_stats([r.started - r.arrived for r in rs]),
+            "latency": _latency_stats([r.finished - r.arrived for r in rs]),
+            "exceptions": sum(1 for r in rs if r.error),
+        }
+
+    exceptions = sum(1 for r in done if r.error)
+    rss = [m[1] for m in memory]
+    traced = [m[2] for m in memory]
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "rate_per_s": args.rate,
+            "duration_s": args.duration,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "gemini_latency": args.gemini_latency,
+            "asr_latency": args.asr_latency,
+            "db_latency": args.db_latency,
+            "telegram_latency": args.telegram_latency,
+            "admission": args.with_admission,
+        },
+        "overall": {
+            "offered": len(records),
+            "completed": len(done),
+            "elapsed_s": elapsed,
+            "throughput_per_s": len(done) / elapsed if elapsed > 0 else 0.0,
+            "queue_delay": _latency_stats([r.started - r.arrived for r in done]),
+            "latency": _latency_stats([r.finished - r.arrived for r in done]),
+            "exceptions": exceptions,
+            "error_replies": error_replies,
+            "shed_notices": shed_notices,
+            "error_rate": (exceptions + error_replies + shed_notices) / len(records) if records else 0.0,
+        },
+        "per_kind": per_kind,
+        "memory": {
+            "rss_start_mb": rss[0] / 2**20 if rss else 0.0,
+            "rss_end_mb": rss[-1] / 2**20 if rss else 0.0,
+            "rss_peak_mb": max(rss) / 2**20 if rss else 0.0,
+            "rss_growth_mb": (rss[-1] - rss[0]) / 2**20 if rss else 0.0,
+            "traced_peak_mb": max(traced) / 2**20 if traced else 0.0,
+            "traced_growth_mb": (traced[-1] - traced[0]) / 2**20 if traced else 0.0,
+            "timeline": [{"t_s": round(t, 2), "rss_mb": round(r / 2**20, 1)} for t, r, _ in memory],
+            "top_allocations": top_allocations,
+        },
+    }
+
+
+def format_report(result: Dict[str, object]) -> str:
+    o = result["overall"]
+    m = result["memory"]
+    lines = [
+        f"Offered {o['offered']} updates, completed {o['completed']} in {o['elapsed_s']:.1f}s "
+        f"({o['throughput_per_s']:.1f}/s)",
+        f"Queueing delay p50={o['queue_delay']['p50_s'] * 1000:.0f}ms p99={o['queue_delay']['p99_s'] * 1000:.0f}ms",
+        f"Latency        p50={o['latency']['p50_s'] * 1000:.0f}ms p99={o['latency']['p99_s'] * 1000:.0f}ms "
+        f"max={o['latency']['max_s'] * 1000:.0f}ms",
+        f"Errors: {o['exceptions']} exceptions, {o['error_replies']} error replies, {o['shed_notices']} shed "
+        f"(error rate {o['error_rate']:.1%})",
+        f"Memory: RSS {m['rss_start_mb']:.0f} -> {m['rss_end_mb']:.0f} MB (peak {m['rss_peak_mb']:.0f} MB, "
+        f"growth {m['rss_growth_mb']:+.1f} MB)",
+    ]
+    for kind, k in result["per_kind"].items():
+        lines.append(
+            f"  {kind:<5} n={k['updates']:<5} {k['throughput_per_s']:.1f}/s "
+            f"queue p99={k['queue_delay']['p99_s'] * 1000:.0f}ms latency p50={k['latency']['p50_s'] * 1000:.0f}ms "
+            f"p99={k['latency']['p99_s'] * 1000:.0f}ms exceptions={k['exceptions']}"
+        )
+    for line in m["top_allocations"]:
+        lines.append(f"  alloc: {line}")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=10.0, help="Mean arrival rate (updates/s)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic to generate")
+    parser.add_argument("--users", type=int, default=100, help="Number of distinct chats")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent update slots (CONCURRENT_UPDATES)")
+    parser.add_argument("--mix", default="text=0.7,photo=0.2,voice=0.1", help="Update kind weights")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS, help="Anonymized messages, one per line")
+    parser.add_argument("--images", type=Path, help="Directory of fixture receipt images (default: synthetic)")
+    parser.add_argument("--gemini-latency", default="lognormal:0.8:0.5", help="Stub Gemini latency distribution")
+    parser.add_argument("--asr-latency", default="lognormal:1.0:0.4", help="Stub ASR latency distribution")
+    parser.add_argument("--db-latency", default="lognormal:0.005:0.5", help="Stub DB latency per checkout")
+    parser.add_argument("--telegram-latency", default="lognormal:0.08:0.4", help="Stub Bot API latency per call")
+    parser.add_argument("--with-admission", action="store_true",
+                        help="Keep per-chat rate limits and load shedding from config instead of disabling them")
+    parser.add_argument("--memory-interval", type=float, default=1.0, help="Seconds between memory samples")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace Python allocations (slower)")
+    parser.add_argument("--tracemalloc-top", type=int, default=5, help="Allocation sites to report")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", type=Path, help="Write the full result as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for name in ("utils", "src", "database", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+
+    from benchmarks.run_benchmarks import Harness
+
+    harness = Harness(args.gemini_latency, args.db_latency, seed=args.seed)
+    if args.with_admission:
+        # Rebuild the controllers lazily from config.yaml on first use
+        for name in ("utils.rate_limiter", "src.utils.rate_limiter"):
+            mod = sys.modules.get(name)
+            if mod is not None:
+                mod._CONTROLLER = None
+    corpus = load_corpus(args.corpus)
+    stubs.install_asr_stub(stubs.LatencyModel.parse(args.asr_latency, seed=args.seed), corpus)
+    # Give report requests a realistically sized history to summarize
+    harness.db.seed_bills(5000)
+
+    handlers = {
+        "text": harness.handlers.text_handler,
+        "photo": harness.handlers.photo_handler,
+        "voice": harness.voice.voice_handler,
+    }
+    factory = TrafficFactory(corpus, harness.http, args.images, args.users, rng)
+    logger.info("Generating ~%.0f updates over %.0fs (%s)", args.rate * args.duration, args.duration, args.mix)
+    result = asyncio.run(run_load(args, harness, handlers, factory, mix, rng))
+
+    print(format_report(result))
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
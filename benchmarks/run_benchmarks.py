@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""Reproducible offline benchmark suite for the bot.
+
+Gemini, Telegram and Postgres are replaced by the stand-ins in benchmarks/stubs.py,
+so results only depend on our own code and the configured latency distributions.
+
+Benchmarks:
+  text_throughput       text handler messages/s through PerChatUpdateProcessor
+  concurrent_chats_N    p50/p99 handler latency with N chats sending at once
+  text_multi_transaction  messages logging 2-3 transactions: one parse call and one insert each
+  redelivery            the same text updates delivered twice: replies replayed, no parse call or insert
+  photo_handler         photo handler latency (download + preprocessing + vision stub + DB)
+  photo_album_N         albums of N photos: one batched vision call, insert and reply per album
+  summary_rows_N        get_transactions_summary time with N rows in the table
+  image_preprocess_WxH  image preprocessing time and payload size per resolution
+  ocr_preprocess_MODE   legacy vs adaptive preprocessing over the receipt fixture set:
+                        payload bytes, time and StubReceiptReader accuracy
+  preprocess_pool_N     images/s preprocessing the fixture set from concurrent threads,
+                        in-process (N=0) or in an N-worker image_workers pool
+  spoken_numbers        voice transcripts (benchmarks/fixtures/spoken.tsv) through
+                        normalize_spoken and parse_spoken_transaction: time, accuracy
+                        and the share saved without a Gemini call
+
+Usage:
+    python3 benchmarks/run_benchmarks.py                 # run and save to benchmarks/results/
+    python3 benchmarks/run_benchmarks.py --quick         # small sizes, for smoke checks
+    python3 benchmarks/run_benchmarks.py --save-baseline # also store as benchmarks/results/baseline.json
+    python3 benchmarks/run_benchmarks.py --compare benchmarks/results/baseline.json --threshold 0.2
+
+With --compare the exit code is 1 when any metric regressed by more than the
+threshold (relative), so the suite can gate changes in CI.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+if str(BENCH_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(BENCH_DIR.parent))
+
+from benchmarks import stubs  # noqa: E402
+
+RESULTS_DIR = BENCH_DIR / "results"
+
+logger = logging.getLogger("benchmarks")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class Harness:
+    """Imports the bot modules once and wires them to the stand-ins."""
+
+    def __init__(self, gemini_latency: str, db_latency: str, seed: int = 1234):
+        from utils import telegram_handlers, voice_handlers  # noqa: F401 - registers modules for stubbing
+
+        self.handlers = telegram_handlers
+        self.voice = voice_handlers
+        self.db = stubs.SqliteDatabase(latency=stubs.LatencyModel.parse(db_latency, seed=seed))
+        stubs.install_database_stub(self.db)
+        stubs.install_gemini_stub(stubs.LatencyModel.parse(gemini_latency, seed=seed))
+        stubs.install_unlimited_admission()
+        stubs.install_memory_vision_cache()
+        self.http = stubs.FakeHTTPSession()
+        stubs.install_http_stub(self.http)
+
+    async def run_updates(self, updates, handler: Callable, concurrency: int) -> Dict[str, Any]:
+        """Feed updates through PerChatUpdateProcessor and time each one from arrival to completion."""
+        from utils.update_processor import PerChatUpdateProcessor, install_blocking_executor
+
+        bot = stubs.FakeBot()
+        context = stubs.FakeContext(bot)
+        processor = PerChatUpdateProcessor(concurrency)
+        await processor.initialize()
+        install_blocking_executor(concurrency)
+        latencies: List[float] = []
+
+        async def _one(update, arrived):
+            await handler(update, context)
+            latencies.append(time.perf_counter() - arrived)
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(processor.process_update(u, _one(u, time.perf_counter()))) for u in updates]
+        await asyncio.gather(*tasks)
+        await context.application.wait_tasks()
+        await processor.shutdown()
+        elapsed = time.perf_counter() - start
+        return {
+            "updates": len(updates),
+            "throughput_per_s": len(updates) / elapsed if elapsed > 0 else 0.0,
+            "latency_p50_s": percentile(latencies, 0.5),
+            "latency_p99_s": percentile(latencies, 0.99),
+            "messages_sent": sum(1 for m in bot.sent if "edit" not in m),
+            "bot_api_calls": len(bot.sent),
+        }
+
+
+def text_updates(n: int, chats: int) -> list:
+    texts = ["ăn sáng 30k", "grab 45k", "cafe 55k", "mua sách 120k"]
+    return [
+        stubs.FakeUpdate(stubs.FakeMessage(
+            chat_id=1000 + i % chats, message_id=stubs.next_message_id(), text=texts[i % len(texts)]
+        ))
+        for i in range(n)
+    ]
+
+
+def bench_text_throughput(h: Harness, n: int, concurrency: int) -> Dict[str, Any]:
+    return asyncio.run(h.run_updates(text_updates(n, chats=concurrency), h.handlers.text_handler, concurrency))
+
+
+def bench_concurrent_chats(h: Harness, chats: int, per_chat: int) -> Dict[str, Any]:
+    return asyncio.run(h.run_updates(text_updates(chats * per_chat, chats), h.handlers.text_handler, chats))
+
+
+def bench_text_multi(h: Harness, n: int, concurrency: int) -> Dict[str, Any]:
+    from utils import model_router
+
+    texts = ["ăn sáng 30k, grab 45k, cafe 55k", "mua sách 120k; ăn trưa 40k", "xăng 70k\ngửi xe 5k\ntrà sữa 35k"]
+    updates = [
+        stubs.FakeUpdate(stubs.FakeMessage(
+            chat_id=4000 + i % concurrency, message_id=stubs.next_message_id(), text=texts[i % len(texts)]
+        ))
+        for i in range(n)
+    ]
+    calls_before = model_router.snapshot().get("parse_text_calls", 0)
+    bills_before = h.db.count_bills()
+    result = asyncio.run(h.run_updates(updates, h.handlers.text_handler, concurrency))
+    result["parse_calls"] = model_router.snapshot().get("parse_text_calls", 0) - calls_before
+    result["bills_saved"] = h.db.count_bills() - bills_before
+    return result
+
+
+def bench_redelivery(h: Harness, n: int, concurrency: int) -> Dict[str, Any]:
+    """Deliver `n` text updates, then every one of them again (as after a restart or retried webhook)."""
+    from utils import model_router
+
+    updates = text_updates(n, chats=concurrency)
+    asyncio.run(h.run_updates(updates, h.handlers.text_handler, concurrency))
+    calls_before = model_router.snapshot().get("parse_text_calls", 0)
+    bills_before = h.db.count_bills()
+    result = asyncio.run(h.run_updates(updates, h.handlers.text_handler, concurrency))
+    result["parse_calls"] = model_router.snapshot().get("parse_text_calls", 0) - calls_before
+    result["bills_saved"] = h.db.count_bills() - bills_before
+    return result
+
+
+def bench_photo_handler(h: Harness, n: int, concurrency: int) -> Dict[str, Any]:
+    urls = [h.http.add(f"receipt_{i}.jpg", stubs.make_receipt_image(1200, 1600, seed=i)) for i in range(4)]
+    updates = [
+        # One sender per photo: repeated images from the same user would be answered by receipt dedup
+        stubs.FakeUpdate(stubs.FakeMessage(
+            chat_id=2000 + i,
+            message_id=stubs.next_message_id(),
+            photo=[stubs.FakePhotoSize(urls[i % len(urls)], file_unique_id=f"bench-photo-{i}")],
+        ))
+        for i in range(n)
+    ]
+    return asyncio.run(h.run_updates(updates, h.handlers.photo_handler, concurrency))
+
+
+def bench_photo_album(h: Harness, albums: int, size: int) -> Dict[str, Any]:
+    import dataclasses
+
+    import config
+    from utils import model_router
+
+    urls = [h.http.add(f"album_{i}.jpg", stubs.make_receipt_image(1200, 1600, seed=100 + i)) for i in range(size)]
+    updates = [
+        stubs.FakeUpdate(stubs.FakeMessage(
+            chat_id=3000 + a,
+            message_id=stubs.next_message_id(),
+            media_group_id=f"album-{a}",
+            photo=[stubs.FakePhotoSize(urls[i], file_unique_id=f"bench-album-{a}-{i}")],
+        ))
+        for a in range(albums)
+        for i in range(size)
+    ]
+    original = config.get_settings()
+    config._apply_settings(dataclasses.replace(original, image_album_window=0.05))
+    # Applying settings reconfigures the admission limits too
+    stubs.install_unlimited_admission()
+    calls_before = model_router.snapshot().get("vision_calls", 0)
+    try:
+        result = asyncio.run(h.run_updates(updates, h.handlers.photo_handler, albums))
+    finally:
+        config._apply_settings(original)
+        stubs.install_unlimited_admission()
+    result["vision_calls"] = model_router.snapshot().get("vision_calls", 0) - calls_before
+    return result
+
+
+def bench_summary_query(h: Harness, rows: int, repeats: int) -> Dict[str, Any]:
+    from datetime import date, timedelta
+
+    from database.db_operations import get_transactions_summary
+
+    current = h.db.count_bills()
+    if current < rows:
+        h.db.seed_bills(rows - current)
+    end = date.today()
+    start = end - timedelta(days=30)
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        summary = get_transactions_summary(2, start.isoformat(), end.isoformat(), "both")
+        timings.append(time.perf_counter() - t0)
+        if summary.get("error"):
+            raise RuntimeError(summary["error"])
+    return {"rows": rows, "mean_s": statistics.mean(timings), "p99_s": percentile(timings, 0.99)}
+
+
+def bench_image_preprocess(h: Harness, width: int, height: int, repeats: int) -> Dict[str, Any]:
+    from utils.image_preprocessing import preprocess
+    from utils.image_processor import process_image_from_url
+
+    image = stubs.make_receipt_image(width, height, seed=width)
+    url = h.http.add(f"preprocess_{width}x{height}.jpg", image)
+    timings = []
+    size = 0
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = process_image_from_url(url)
+        timings.append(time.perf_counter() - t0)
+        size = len(out or b"")
+    return {
+        "mean_s": statistics.mean(timings),
+        "p99_s": percentile(timings, 0.99),
+        "payload_bytes": size,
+        # Decoded image size after JPEG draft scaling (the source is width x height)
+        "decoded_mpix": round(preprocess(image).decoded_pixels / 1e6, 3),
+    }
+
+
+_FIXTURES: List[Any] = []
+
+
+def bench_ocr_preprocess(h: Harness, adaptive: bool, repeats: int) -> Dict[str, Any]:
+    from utils.image_preprocessing import preprocess
+
+    if not _FIXTURES:
+        _FIXTURES.extend(stubs.receipt_fixture_set())
+    timings = []
+    payloads = []
+    cropped = passthrough = decoded = 0
+    for fixture in _FIXTURES:
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            result = preprocess(fixture.image, adaptive=adaptive)
+            timings.append(time.perf_counter() - t0)
+        payloads.append(result.data)
+        cropped += result.cropped
+        decoded += result.decoded_pixels
+        passthrough += result.passthrough
+    return {
+        "fixtures": len(_FIXTURES),
+        "mean_s": statistics.mean(timings),
+        "p99_s": percentile(timings, 0.99),
+        "payload_bytes": int(statistics.mean(len(p) for p in payloads)),
+        "accuracy": stubs.StubReceiptReader().accuracy(payloads, _FIXTURES),
+        "decoded_mpix": round(decoded / len(_FIXTURES) / 1e6, 3),
+        "cropped": cropped,
+        "passthrough": passthrough,
+    }
+
+
+def bench_preprocess_pool(h: Harness, workers: int, rounds: int) -> Dict[str, Any]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from utils.image_preprocessing import preprocess
+    from utils.image_workers import ImageWorkerPool
+
+    if not _FIXTURES:
+        _FIXTURES.extend(stubs.receipt_fixture_set())
+    images = [f.image for f in _FIXTURES] * rounds
+    pool = ImageWorkerPool(workers, queue_size=len(images), timeout=120.0) if workers else None
+    run = pool.run if pool is not None else preprocess
+    try:
+        if pool is not None:
+            pool.warm_up()
+
+        def _timed(image):
+            t0 = time.perf_counter()
+            run(image, with_hash=True)
+            return time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(2, workers * 2)) as threads:
+            timings = list(threads.map(_timed, images))
+        elapsed = time.perf_counter() - t0
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return {
+        "images": len(images),
+        "images_per_s": len(images) / elapsed,
+        "p50_s": percentile(timings, 0.5),
+        "p99_s": percentile(timings, 0.99),
+    }
+
+
+SPOKEN_FIXTURES = BENCH_DIR / "fixtures" / "spoken.tsv"
+
+
+def bench_spoken_numbers(h: Harness, repeats: int) -> Dict[str, Any]:
+    from datetime import date
+
+    from utils.spoken_numbers import normalize_spoken
+    from utils.text_processor import parse_spoken_transaction
+
+    # The expected dates in the fixture file assume this day
+    today = date(2025, 11, 20)
+    rows = [
+        line.rstrip("\n").split("\t")
+        for line in SPOKEN_FIXTURES.read_text(encoding="utf-8").splitlines()
+        if line.strip() and not line.startswith("#")
+    ]
+    timings = []
+    normalized = categorized = local = 0
+    for transcript, expected, category in rows:
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            text = normalize_spoken(transcript, today)
+            payload = parse_spoken_transaction(text, today)
+            timings.append(time.perf_counter() - t0)
+        normalized += text == expected
+        categorized += (payload["category_name"] if payload else "-") == category
+        local += payload is not None
+    return {
+        "transcripts": len(rows),
+        "mean_s": statistics.mean(timings),
+        "p99_s": percentile(timings, 0.99),
+        "accuracy": normalized / len(rows),
+        "category_accuracy": categorized / len(rows),
+        "local_parse_share": local / len(rows),
+    }
+
+
+def run_suite(args) -> Dict[str, Dict[str, Any]]:
+    h = Harness(args.gemini_latency, args.db_latency, seed=args.seed)
+    quick = args.quick
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def _record(name, fn, *a):
+        logger.info("Running %s ...", name)
+        results[name] = fn(h, *a)
+        logger.info("  %s", results[name])
+
+    _record("text_throughput", bench_text_throughput, 20 if quick else 200, 8)
+    for chats in ((1, 4) if quick else (1, 8, 32)):
+        _record(f"concurrent_chats_{chats}", bench_concurrent_chats, chats, 2 if quick else 5)
+    _record("text_multi_transaction", bench_text_multi, 6 if quick else 60, 4)
+    _record("redelivery", bench_redelivery, 8 if quick else 80, 4)
+    _record("photo_handler", bench_photo_handler, 4 if quick else 40, 4)
+    _record("photo_album_10", bench_photo_album, 1 if quick else 4, 10)
+    for rows in ((1000,) if quick else (1000, 10000, 100000)):
+        _record(f"summary_rows_{rows}", bench_summary_query, rows, 3 if quick else 20)
+    for w, hgt in (((640, 960),) if quick else ((640, 960), (1280, 1920), (3024, 4032))):
+        _record(f"image_preprocess_{w}x{hgt}", bench_image_preprocess, w, hgt, 2 if quick else 10)
+    for mode in ("legacy", "adaptive"):
+        _record(f"ocr_preprocess_{mode}", bench_ocr_preprocess, mode == "adaptive", 1 if quick else 5)
+    for workers in ((0, 2) if quick else (0, 2, 4)):
+        _record(f"preprocess_pool_{workers}", bench_preprocess_pool, workers, 1 if quick else 4)
+    _record("spoken_numbers", bench_spoken_numbers, 1 if quick else 20)
+    return results
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _lower_is_better(metric: str) -> bool:
+    return not metric.endswith("_per_s")
+
+
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """Return human-readable regressions where a metric got worse by more than `threshold`."""
+    regressions = []
+    for name, metrics in current.items():
+        base = baseline.get(name, {})
+        for metric, value in metrics.items():
+            if not (metric.endswith("_s") or metric.endswith("_per_s")):
+                continue
+            old = base.get(metric)
+            if not isinstance(old, (int, float)) or old <= 0:
+                continue
+            change = (value - old) / old
+            worse = change > threshold if _lower_is_better(metric) else -change > threshold
+            if worse:
+                regressions.append(f"{name}.{metric}: {old:.4g} -> {value:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="Small sizes for smoke checks")
+    parser.add_argument("--gemini-latency", default="lognormal:0.05:0.5",
+                        help="Stub Gemini latency: const:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--db-latency", default="const:0.002", help="Stub DB latency per connection checkout")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write benchmarks/results/baseline.json")
+    parser.add_argument("--compare", type=Path, help="Baseline result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Handlers log every message at INFO; keep benchmark output readable
+    for name in ("utils", "src", "database", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    results = run_suite(args)
+    doc = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "gemini_latency": args.gemini_latency,
+            "db_latency": args.db_latency,
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(doc, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Results written to {output}")
+    if args.save_baseline:
+        (RESULTS_DIR / "baseline.json").write_text(json.dumps(doc, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8")).get("results", {})
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Performance regressions:")
+            for r in regressions:
+                print(f"  ✗ {r}")
+            return 1
+        print("✓ No regressions beyond threshold")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,681 @@
+"""Offline stand-ins for Gemini, Telegram and Postgres used by the benchmarks.
+
+Nothing here talks to the network:
+
+  - StubGenerativeModel replaces google.generativeai.GenerativeModel and answers
+    with canned JSON after sleeping for a configurable latency distribution.
+  - FakeBot / FakeUpdate / FakeContext mimic the parts of python-telegram-bot the
+    handlers use (send_message, get_file, chat_id, ...).
+  - SqliteDatabase is an in-process stand-in for Postgres. It runs the real SQL
+    from database/db_operations.py after a light dialect translation.
+  - FakeHTTPSession serves fixture images for "fixture://" URLs; receipt_fixture_set()
+    renders receipt photos with a known number of print lines and StubReceiptReader
+    scores preprocessed payloads against them.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, timedelta
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+for _p in (REPO_ROOT, REPO_ROOT / "src"):
+    if str(_p) not in sys.path:
+        sys.path.insert(0, str(_p))
+
+
+# --- Latency distributions -------------------------------------------------------
+class LatencyModel:
+    """Seeded latency sampler: constant, uniform or lognormal (seconds)."""
+
+    def __init__(self, kind: str = "lognormal", median: float = 0.3, sigma: float = 0.4, low: float = 0.0,
+                 high: float = 0.0, seed: int = 1234):
+        self.kind = kind
+        self.median = median
+        self.sigma = sigma
+        self.low = low
+        self.high = high
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str, seed: int = 1234) -> "LatencyModel":
+        """Parse 'const:0.2', 'uniform:0.1:0.5' or 'lognormal:0.3:0.4' (median, sigma)."""
+        parts = spec.split(":")
+        kind = parts[0]
+        nums = [float(p) for p in parts[1:]]
+        if kind == "const":
+            return cls("const", median=nums[0], seed=seed)
+        if kind == "uniform":
+            return cls("uniform", low=nums[0], high=nums[1], seed=seed)
+        if kind == "lognormal":
+            return cls("lognormal", median=nums[0], sigma=nums[1] if len(nums) > 1 else 0.4, seed=seed)
+        raise ValueError(f"Unknown latency spec: {spec}")
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "const":
+                return self.median
+            if self.kind == "uniform":
+                return self._rng.uniform(self.low, self.high)
+            return self._rng.lognormvariate(0.0, self.sigma) * self.median
+
+
+# --- Gemini ------------------------------------------------------------------------
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def default_responder(model_name: str, inputs: Any) -> str:
+    """Return a plausible response for the prompt contained in `inputs`."""
+    parts = inputs if isinstance(inputs, (list, tuple)) else [inputs]
+    text_parts = [p for p in parts if isinstance(p, str)]
+    joined = "\n".join(text_parts)
+    has_image = any(isinstance(p, dict) and p.get("mime_type", "").startswith("image/") for p in parts)
+    user_text = text_parts[-1] if text_parts else ""
+
+    if "summarize_expenses" in joined:
+        intent = "summarize_expenses" if "tổng" in user_text.lower() else "record_transaction"
+        return json.dumps({"intent": intent, "confidence": 0.9, "explanation": "stub"})
+    if "INPUT JSON" in joined:
+        return "# Báo cáo\n- Tổng thu: 0 VND\n- Tổng chi: 0 VND"
+    amounts = re.findall(r"(\d+)\s*k\b", user_text.lower())
+    amount = int(amounts[0]) * 1000 if amounts else 55000
+    transaction = {
+        "merchant_name": "Stub Merchant",
+        "total_amount": amount,
+        "bill_date": date.today().isoformat(),
+        "category_name": "Ăn uống",
+        "category_type": 0,
+        "note": "receipt" if has_image else user_text[:50],
+    }
+    if "one object per transaction" in joined:
+        # Multi-transaction text request: one transaction per "<words> <N>k" segment
+        segments = [s.strip() for s in re.split(r"[,;\n]", user_text) if re.search(r"\d+\s*k\b", s.lower())]
+        return json.dumps([
+            {**transaction, "total_amount": int(re.findall(r"(\d+)\s*k\b", s.lower())[0]) * 1000, "note": s[:50]}
+            for s in segments
+        ], ensure_ascii=False)
+    images = sum(1 for p in parts if isinstance(p, dict) and p.get("mime_type", "").startswith("image/"))
+    if images > 1:
+        # Album request: one receipt per image
+        return json.dumps([transaction] * images, ensure_ascii=False)
+    return json.dumps(transaction, ensure_ascii=False)
+
+
+class StubGenerativeModel:
+    """Drop-in for genai.GenerativeModel with configurable latency and responses."""
+
+    latency: LatencyModel = LatencyModel("const", median=0.0)
+    responder: Callable[[str, Any], str] = staticmethod(default_responder)
+    calls = 0
+    _calls_lock = threading.Lock()
+
+    def __init__(self, model_name: str = "stub", system_instruction: Optional[str] = None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, generation_config=None, request_options=None, **kwargs):
+        with StubGenerativeModel._calls_lock:
+            StubGenerativeModel.calls += 1
+        delay = StubGenerativeModel.latency.sample()
+        if delay > 0:
+            time.sleep(delay)
+        inputs = list(contents) if isinstance(contents, (list, tuple)) else [contents]
+        if self.system_instruction:
+            inputs.insert(0, self.system_instruction)
+        return StubResponse(StubGenerativeModel.responder(self.model_name, inputs))
+
+
+def install_gemini_stub(latency: LatencyModel, responder: Optional[Callable[[str, Any], str]] = None) -> None:
+    """Replace genai.GenerativeModel with the stub and drop any cached real models."""
+    import google.generativeai as genai
+
+    StubGenerativeModel.latency = latency
+    StubGenerativeModel.calls = 0
+    if responder is not None:
+        StubGenerativeModel.responder = staticmethod(responder)
+    genai.GenerativeModel = StubGenerativeModel
+    genai.configure = lambda *a, **k: None
+    for name in ("config", "src.config"):
+        mod = sys.modules.get(name)
+        if mod is None:
+            continue
+        for attr in ("_text_model", "_vision_model"):
+            if hasattr(mod, attr):
+                setattr(mod, attr, None)
+        if hasattr(mod, "_prompt_models"):
+            mod._prompt_models.clear()
+        if hasattr(mod, "genai"):
+            mod.genai = genai
+
+
+# --- Postgres stand-in -------------------------------------------------------------
+_SCHEMA = """
+CREATE TABLE users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, user_name TEXT NOT NULL);
+CREATE TABLE bills (
+    bill_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bill_date TEXT NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(user_id),
+    merchant_name TEXT,
+    category_name TEXT NOT NULL,
+    category_type TEXT NOT NULL,
+    total_amount NUMERIC NOT NULL,
+    note TEXT
+);
+CREATE INDEX idx_bills_date ON bills(bill_date);
+CREATE INDEX idx_bills_user ON bills(user_id);
+CREATE INDEX idx_bills_category_name ON bills(category_name);
+CREATE TABLE idempotency_keys (key TEXT PRIMARY KEY, created_at TEXT DEFAULT CURRENT_TIMESTAMP, result TEXT, owner TEXT);
+"""
+
+_CAST_RE = re.compile(r"::\s*(text|bigint|int|integer|numeric|date|jsonb|bit\(\d+\))", re.IGNORECASE)
+
+
+def translate_sql(sql: str) -> str:
+    """Translate the Postgres dialect used by db_operations into SQLite."""
+    sql = _CAST_RE.sub("", sql)
+    sql = re.sub(r"\bNOW\(\)\s*-\s*%s\s*\*\s*INTERVAL\s*'1 second'", "datetime('now', -%s || ' seconds')", sql,
+                 flags=re.IGNORECASE)
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"\bFOR UPDATE SKIP LOCKED\b", "", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bNOW\(\)", "CURRENT_TIMESTAMP", sql, flags=re.IGNORECASE)
+    return sql
+
+
+class _Cursor:
+    def __init__(self, db: "SqliteDatabase"):
+        self._db = db
+        self._cur = db.conn.cursor()
+        self._rows: List[Any] = []
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def execute(self, sql, params=()):
+        params = [str(p) if isinstance(p, date) else p for p in (params or ())]
+        with self._db.lock:
+            self._cur.execute(translate_sql(sql), params)
+            # Step the statement to completion now: the connection is shared between threads,
+            # and SQLite refuses to commit while another cursor's statement is still open
+            self._rows = self._cur.fetchall() if self._cur.description else []
+        return self
+
+    def executemany(self, sql, seq):
+        with self._db.lock:
+            self._cur.executemany(translate_sql(sql), list(seq))
+            self._rows = []
+        return self
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Connection:
+    def __init__(self, db: "SqliteDatabase"):
+        self._db = db
+
+    def cursor(self):
+        return _Cursor(self._db)
+
+    def commit(self):
+        with self._db.lock:
+            self._db.conn.commit()
+
+    def rollback(self):
+        with self._db.lock:
+            self._db.conn.rollback()
+
+
+class SqliteDatabase:
+    """In-memory SQLite database exposing a psycopg2-like connection."""
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.lock = threading.RLock()
+        self.latency = latency
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute("INSERT INTO users (user_name) VALUES ('bench1'), ('bench2')")
+        self.conn.commit()
+
+    @contextmanager
+    def connect(self):
+        if self.latency is not None:
+            delay = self.latency.sample()
+            if delay > 0:
+                time.sleep(delay)
+        yield _Connection(self)
+
+    def seed_bills(self, n: int, user_id: int = 2, days: int = 365, seed: int = 42) -> None:
+        """Insert `n` random bills spread over the last `days` days."""
+        rng = random.Random(seed)
+        today = date.today()
+        categories = ["Ăn uống", "Xe cộ", "Mua sắm", "Giải trí", "Y tế", "Lương"]
+        rows = []
+        for _ in range(n):
+            cat = rng.choice(categories)
+            rows.append((
+                (today - timedelta(days=rng.randrange(days))).isoformat(),
+                user_id,
+                f"Merchant {rng.randrange(200)}",
+                cat,
+                "1" if cat == "Lương" else "0",
+                rng.randrange(10, 5000) * 1000,
+                "seed",
+            ))
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO bills (bill_date, user_id, merchant_name, category_name, category_type, total_amount, note)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def count_bills(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM bills").fetchone()[0]
+
+
+def install_database_stub(db: SqliteDatabase) -> None:
+    """Point database.db_operations at the SQLite stand-in."""
+    import database.db_operations as db_ops
+
+    db_ops.connect_to_heroku_db = db.connect
+
+
+# --- HTTP (image downloads) -------------------------------------------------------
+def make_receipt_image(width: int, height: int, seed: int = 0) -> bytes:
+    """Render a synthetic receipt-like JPEG: white paper with dark text lines on a grey background."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (90, 90, 95))
+    draw = ImageDraw.Draw(img)
+    margin_x, margin_y = width // 6, height // 12
+    draw.rectangle([margin_x, margin_y, width - margin_x, height - margin_y], fill=(245, 245, 240))
+    line_h = max(8, height // 40)
+    y = margin_y + line_h
+    while y < height - margin_y - line_h:
+        x_end = rng.randint(margin_x + width // 5, width - margin_x - 10)
+        draw.rectangle([margin_x + 10, y, x_end, y + line_h // 2], fill=(30, 30, 30))
+        y += line_h
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+@dataclass(frozen=True)
+class ReceiptFixture:
+    name: str
+    image: bytes
+    lines: int  # number of printed lines, the ground truth for StubReceiptReader
+
+
+def render_receipt(width: int, height: int, paper_box=(0.17, 0.08, 0.83, 0.92), line_h: int = 40,
+                   ink: int = 30, paper: int = 245, background: int = 90, seed: int = 0,
+                   quality: int = 90) -> ReceiptFixture:
+    """Render a receipt photo: paper at `paper_box` (fractions of the frame) with `line_h`-spaced print lines."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (background, background, background + 5))
+    draw = ImageDraw.Draw(img)
+    x0, y0, x1, y1 = (int(paper_box[0] * width), int(paper_box[1] * height),
+                      int(paper_box[2] * width), int(paper_box[3] * height))
+    draw.rectangle([x0, y0, x1, y1], fill=(paper, paper, paper - 5))
+    pad = max(10, (x1 - x0) // 12)
+    lines = 0
+    y = y0 + pad
+    while y + line_h // 2 < y1 - pad:
+        x_end = rng.randint(x0 + pad + (x1 - x0) // 4, x1 - pad)
+        draw.rectangle([x0 + pad, y, x_end, y + line_h // 2 - 1], fill=(ink, ink, ink))
+        lines += 1
+        y += line_h
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return ReceiptFixture(f"{width}x{height}", buf.getvalue(), lines)
+
+
+def receipt_fixture_set() -> List[ReceiptFixture]:
+    """Deterministic receipt photos covering the shapes the preprocessing has to handle."""
+    specs = [
+        ("photo_3x4", dict(width=1200, height=1600, line_h=40)),
+        ("photo_12mp", dict(width=3024, height=4032, line_h=96, seed=1)),
+        ("long_receipt", dict(width=1080, height=3840, paper_box=(0.2, 0.02, 0.8, 0.98), line_h=26, seed=2)),
+        ("faded_thermal", dict(width=1500, height=2000, line_h=44, ink=165, paper=225, background=70, seed=3)),
+        ("scan_a4", dict(width=1240, height=1754, paper_box=(0.0, 0.0, 1.0, 1.0), line_h=36, seed=4)),
+        ("landscape", dict(width=1600, height=1200, paper_box=(0.3, 0.05, 0.7, 0.95), line_h=30, seed=5)),
+        ("small_photo", dict(width=480, height=640, line_h=16, quality=75, seed=6)),
+    ]
+    fixtures = []
+    for name, spec in specs:
+        fixture = render_receipt(**spec)
+        fixtures.append(ReceiptFixture(name, fixture.image, fixture.lines))
+    return fixtures
+
+
+class StubReceiptReader:
+    """Stand-in for vision extraction accuracy: counts the print lines it can still separate.
+
+    Within each row the paper is the span between the first and last bright pixel
+    (Otsu threshold); a row is print when its darkest 5% inside the paper is
+    closer to the ink than to the paper. Lines squashed together, blurred away or
+    washed out merge or disappear, so the count stops matching the fixture.
+    Print rows thinner than `min_glyph_px` are too small to read and not counted.
+    """
+
+    def __init__(self, min_glyph_px: int = 6):
+        self.min_glyph_px = min_glyph_px
+
+    def count_lines(self, jpeg: bytes) -> int:
+        from PIL import Image
+
+        from utils.image_preprocessing import otsu_threshold
+
+        gray = Image.open(BytesIO(jpeg)).convert("L")
+        width, height = gray.size
+        bright = otsu_threshold(gray.histogram())
+        pixels = gray.tobytes()
+        levels = []
+        for row in range(height):
+            values = pixels[row * width:(row + 1) * width]
+            inside = [i for i, v in enumerate(values) if v > bright]
+            if len(inside) < width // 20:
+                levels.append(None)
+                continue
+            span = sorted(values[inside[0]:inside[-1] + 1])
+            levels.append(span[len(span) // 20])
+        known = [v for v in levels if v is not None]
+        if not known or max(known) - min(known) < 20:
+            return 0
+        threshold = (max(known) + min(known)) / 2
+        count, run = 0, 0
+        for level in levels + [None]:
+            if level is not None and level < threshold:
+                run += 1
+                continue
+            if run >= self.min_glyph_px:
+                count += 1
+            run = 0
+        return count
+
+    def accuracy(self, payloads: List[bytes], fixtures: List[ReceiptFixture]) -> float:
+        """Share of fixtures whose line count is read back exactly."""
+        hits = sum(self.count_lines(p) == f.lines for p, f in zip(payloads, fixtures))
+        return hits / len(fixtures) if fixtures else 0.0
+
+
+class _FakeHTTPResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+        self.status_code = 200
+        self.headers = {"Content-Length": str(len(content))}
+
+    def raise_for_status(self):
+        return None
+
+    def iter_content(self, chunk_size=65536):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeHTTPSession:
+    """requests.Session stand-in serving registered fixtures for fixture:// URLs."""
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.fixtures: Dict[str, bytes] = {}
+        self.latency = latency
+
+    def add(self, name: str, content: bytes) -> str:
+        self.fixtures[name] = content
+        return f"fixture://{name}"
+
+    def get(self, url, timeout=None, stream=False, **kwargs):
+        if self.latency is not None:
+            delay = self.latency.sample()
+            if delay > 0:
+                time.sleep(delay)
+        name = url.split("fixture://", 1)[-1]
+        return _FakeHTTPResponse(self.fixtures[name])
+
+
+def install_http_stub(session: FakeHTTPSession) -> None:
+    for name in ("utils.http_session", "src.utils.http_session"):
+        mod = sys.modules.get(name)
+        if mod is None:
+            try:
+                __import__(name)
+                mod = sys.modules[name]
+            except Exception:
+                continue
+        mod._SESSION = session
+
+
+# --- Telegram ---------------------------------------------------------------------
+class FakeSentMessage:
+    def __init__(self, chat_id: int, message_id: int, text: str):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+
+
+class FakeBot:
+    """Records outgoing messages; optional latency per Bot API call."""
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.sent: List[Dict[str, Any]] = []
+        self.latency = latency
+        self._next_id = 1
+
+    async def _delay(self):
+        if self.latency is not None:
+            delay = self.latency.sample()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._delay()
+        self._next_id += 1
+        self.sent.append({"chat_id": chat_id, "text": text, **kwargs})
+        return FakeSentMessage(chat_id, self._next_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._delay()
+        self.sent.append({"chat_id": chat_id, "text": text, "edit": message_id, **kwargs})
+        return FakeSentMessage(chat_id, message_id, text)
+
+    async def get_file(self, file_id):
+        await self._delay()
+        return FakeFile(_PHOTO_URLS[file_id])
+
+
+class FakeFile:
+    def __init__(self, file_path: str, content: bytes = b""):
+        self.file_path = file_path
+        self._content = content
+
+    async def download_to_drive(self, custom_path=None):
+        Path(custom_path).write_bytes(self._content)
+        return Path(custom_path)
+
+
+# file_id -> URL of every FakePhotoSize, for FakeBot.get_file
+_PHOTO_URLS: Dict[str, str] = {}
+
+
+class FakePhotoSize:
+    def __init__(self, url: str, file_unique_id: str, width: int = 800, height: int = 1200):
+        self.file_unique_id = file_unique_id
+        self.file_id = file_unique_id
+        _PHOTO_URLS[self.file_id] = url
+        self.width = width
+        self.height = height
+        self._url = url
+
+    async def get_file(self):
+        return FakeFile(self._url)
+
+
+class FakeVoice:
+    def __init__(self, content: bytes, file_unique_id: str, duration: int = 3):
+        self.file_unique_id = file_unique_id
+        self.file_id = file_unique_id
+        self.duration = duration
+        self._content = content
+
+    async def get_file(self):
+        return FakeFile(f"voice/{self.file_unique_id}.wav", self._content)
+
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self.type = "private"
+
+
+_MESSAGE_IDS = itertools.count(1)
+
+
+def next_message_id() -> int:
+    """Message ids unique within the process, so a later benchmark is never taken for a redelivery."""
+    return next(_MESSAGE_IDS)
+
+
+class FakeMessage:
+    def __init__(self, chat_id: int, message_id: int, text: Optional[str] = None, photo=None, voice=None,
+                 media_group_id: Optional[str] = None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.photo = photo or []
+        self.voice = voice
+        self.media_group_id = media_group_id
+        self.chat = FakeChat(chat_id)
+
+
+class FakeUpdate:
+    _next_update_id = 1
+
+    def __init__(self, message: FakeMessage):
+        self.update_id = FakeUpdate._next_update_id
+        FakeUpdate._next_update_id += 1
+        self.message = message
+        self.effective_message = message
+        self.effective_chat = message.chat
+
+
+class FakeApplication:
+    """Tracks tasks created through context.application.create_task."""
+
+    def __init__(self, bot: FakeBot):
+        self.bot = bot
+        self.bot_data: Dict[str, Any] = {}
+        self.tasks: set = set()
+
+    def create_task(self, coroutine, update=None, name=None):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def wait_tasks(self):
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+
+class FakeContext:
+    def __init__(self, bot: FakeBot, application: Optional[FakeApplication] = None):
+        self.bot = bot
+        self.application = application or FakeApplication(bot)
+        self.bot_data = self.application.bot_data
+
+
+def make_wav_bytes(duration_s: float = 1.0, sr: int = 16000) -> bytes:
+    """Silent mono 16-bit WAV used as a voice fixture (ASR is stubbed)."""
+    import wave
+
+    buf = BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sr)
+        wf.writeframes(b"\x00\x00" * int(duration_s * sr))
+    return buf.getvalue()
+
+
+def install_asr_stub(latency: LatencyModel, transcripts: Optional[List[str]] = None) -> None:
+    """Replace the PhoWhisper pipeline with a stub that returns canned transcripts."""
+    texts = transcripts or ["mua cà phê 50k"]
+    counter = {"i": 0}
+    lock = threading.Lock()
+
+    def _transcribe(path):
+        delay = latency.sample()
+        if delay > 0:
+            time.sleep(delay)
+        with lock:
+            text = texts[counter["i"] % len(texts)]
+            counter["i"] += 1
+        return {"text": text}
+
+    for name in ("utils.voice_handlers", "src.utils.voice_handlers"):
+        mod = sys.modules.get(name)
+        if mod is not None:
+            mod._transcriber = _transcribe
+
+
+def install_unlimited_admission() -> None:
+    """Disable per-chat limits and load shedding so benchmarks measure the handlers."""
+    for name in ("utils.rate_limiter", "src.utils.rate_limiter"):
+        mod = sys.modules.get(name)
+        if mod is not None:
+            mod._CONTROLLER = mod.AdmissionController(
+                per_chat_rate=1e9, per_chat_burst=1e9, max_in_flight=10**9, gemini_min_samples=10**9
+            )
+
+
+def install_memory_vision_cache() -> None:
+    """Use an empty in-memory vision cache so runs neither read nor write cache/vision_cache.sqlite3."""
+    for name in ("utils.vision_cache", "src.utils.vision_cache"):
+        mod = sys.modules.get(name)
+        if mod is not None:
+            mod._CACHE = mod.VisionCache(":memory:")
@@ -1,24 +1,27 @@
 import sys
 import atexit
+import threading
 from pathlib import Path
-import psycopg2
-from psycopg2 import OperationalError
-from psycopg2.pool import SimpleConnectionPool
 from contextlib import contextmanager
 
 # Module-level connection pool (initialized lazily)
 _POOL = None
+# Handlers check connections out from worker threads (asyncio.to_thread); callers beyond
+# pool_max wait for a free connection instead of getting "connection pool exhausted"
+_CHECKOUTS = None
+_POOL_LOCK = threading.Lock()
 
 
 def close_pool():
     """Close the connection pool on shutdown."""
-    global _POOL
+    global _POOL, _CHECKOUTS
     if _POOL:
         try:
             _POOL.closeall()
         except Exception:
             pass
         _POOL = None
+        _CHECKOUTS = None
 
 
 # Register cleanup on exit
@@ -27,6 +30,10 @@ atexit.register(close_pool)
 @contextmanager
 def connect_to_heroku_db():
     """Context manager that yields a pooled DB connection and returns it to the pool on exit."""
+    # psycopg2 is imported on first use so importing this module stays cheap
+    from psycopg2 import OperationalError
+    from psycopg2.pool import ThreadedConnectionPool
+
     try:
         # Ensure repo root on sys.path so `from src import config` works when CWD is database/
         repo_root = Path(__file__).resolve().parents[1]
@@ -43,27 +50,35 @@ def connect_to_heroku_db():
         pool_min = getattr(app_config, "DB_POOL_MIN", 1)
         pool_max = getattr(app_config, "DB_POOL_MAX", 10)
 
-        # Initialize pool lazily
-        global _POOL
+        # Initialize pool lazily; its size is fixed until restart (config.RESTART_REQUIRED)
+        global _POOL, _CHECKOUTS
         if _POOL is None:
-            try:
-                _POOL = SimpleConnectionPool(int(pool_min), int(pool_max), database_url)
-            except Exception as exc:
-                raise ValueError("Không thể khởi tạo connection pool cho database") from exc
+            with _POOL_LOCK:
+                if _POOL is None:
+                    try:
+                        _POOL = ThreadedConnectionPool(int(pool_min), int(pool_max), database_url)
+                    except Exception as exc:
+                        raise ValueError("Không thể khởi tạo connection pool cho database") from exc
+                    _CHECKOUTS = threading.BoundedSemaphore(int(pool_max))
 
         # Get a connection from the pool
-        conn = _POOL.getconn()
+        pool, checkouts = _POOL, _CHECKOUTS
+        checkouts.acquire()
         try:
-            yield conn
-        finally:
+            conn = pool.getconn()
             try:
-                _POOL.putconn(conn)
-            except Exception:
-                # If returning to pool fails, close connection to avoid leaks
+                yield conn
+            finally:
                 try:
-                    conn.close()
+                    pool.putconn(conn)
                 except Exception:
-                    pass
+                    # If returning to pool fails, close connection to avoid leaks
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+        finally:
+            checkouts.release()
 
     except (OperationalError, ValueError) as e:
         print(f"❌ Lỗi: Không thể kết nối. '{e}'")
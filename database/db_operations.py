@@ -1,8 +1,5 @@
 import logging
-from typing import Any, Dict, Optional
-
-import psycopg2
-from psycopg2 import errorcodes
+from typing import Any, Dict, List, Optional
 
 try:
     # Prefer local database module at database/database.py
@@ -73,6 +70,10 @@ def add_bill(bill_data: Dict[str, Any]) -> Dict[str, Any]:
         bill_data["merchant_name"],
     )
 
+    # Imported lazily: only needed once we actually talk to Postgres
+    import psycopg2
+    from psycopg2 import errorcodes
+
     try:
         with connect_to_heroku_db() as connection:
             cursor = connection.cursor()
@@ -125,6 +126,210 @@ def add_bill(bill_data: Dict[str, Any]) -> Dict[str, Any]:
     # connection returned to pool by context manager
 
 
+_BILL_COLUMNS = ("user_id", "total_amount", "category_name", "category_type", "bill_date", "note", "merchant_name")
+
+
+def _is_income(bill_data: Dict[str, Any]) -> bool:
+    return str(bill_data["category_type"]).strip().lower() in ("1", "income")
+
+
+def format_bills_summary(bills: List[Dict[str, Any]]) -> str:
+    """One confirmation message for several saved bills, with expense/income totals."""
+    lines = [f"✅ Đã lưu {len(bills)} giao dịch:"]
+    spent = earned = 0
+    for index, bill in enumerate(bills, start=1):
+        amount = bill["total_amount"]
+        if _is_income(bill):
+            earned += amount
+        else:
+            spent += amount
+        lines.append(
+            f"{index}. 📅 {bill['bill_date']} · 🏪 {bill['merchant_name']} · "
+            f"📂 {bill['category_name']} · 💰 {amount:,.0f} VND"
+        )
+    totals = [f"Tổng chi: {spent:,.0f} VND"] if spent or not earned else []
+    if earned:
+        totals.append(f"Tổng thu: {earned:,.0f} VND")
+    lines.append("💵 " + " · ".join(totals))
+    return "\n".join(lines)
+
+
+def add_bills(bills: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Add several bills in a single INSERT, so they are saved together or not at all.
+
+    Args:
+        bills: list of dictionaries with the same fields as `add_bill`.
+
+    Returns:
+        Dictionary containing:
+            - success: bool
+            - bill_ids: list of int, in the order of `bills` (if successful)
+            - transaction_info: str (one consolidated message, see format_bills_summary)
+            - error: str (if not successful)
+    """
+    if not bills:
+        return {"success": True, "bill_ids": [], "transaction_info": ""}
+
+    rows = []
+    for index, bill_data in enumerate(bills, start=1):
+        bill_data.setdefault("user_id", 2)
+        for field in _BILL_COLUMNS:
+            if field not in bill_data:
+                return {"success": False, "error": f"Thiếu trường bắt buộc: {field} (giao dịch {index})"}
+        rows.append(tuple(bill_data[field] for field in _BILL_COLUMNS))
+
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+    sql = f"INSERT INTO bills ({', '.join(_BILL_COLUMNS)}) VALUES {placeholders} RETURNING bill_id;"
+    values = [value for row in rows for value in row]
+
+    import psycopg2
+    from psycopg2 import errorcodes
+
+    try:
+        with connect_to_heroku_db() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql, values)
+                bill_ids = [row[0] for row in cursor.fetchall()]
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+        if len(bill_ids) != len(bills):
+            return {"success": False, "error": "Không thể thêm hóa đơn"}
+        return {
+            "success": True,
+            "message": f"Đã thêm {len(bills)} hóa đơn thành công",
+            "transaction_info": format_bills_summary(bills),
+            "bill_ids": bill_ids,
+        }
+
+    except psycopg2.Error as e:
+        logger.exception("Database error when adding bills")
+        error_msg = "Lỗi database"
+        if e.pgcode == errorcodes.FOREIGN_KEY_VIOLATION:
+            error_msg = "user_id không tồn tại"
+        return {"success": False, "error": error_msg}
+
+    except Exception as e:
+        logger.exception("Unexpected error when adding bills")
+        return {"success": False, "error": f"Lỗi không xác định: {str(e)}"}
+
+
+def save_bills(bills: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Save the transactions of one message: `add_bill` (and its usual confirmation)
+    for a single bill, one `add_bills` INSERT with a consolidated summary for several.
+    """
+    if len(bills) == 1:
+        return add_bill(bills[0])
+    return add_bills(bills)
+
+
+def claim_idempotency_key(key: str, owner: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Claim `key` (a processed Telegram update) in the idempotency_keys table for the
+    bot instance `owner`.
+
+    Returns:
+        {"claimed": True} when this caller inserted the key and should process the update,
+        otherwise {"claimed": False, "result": str or None}: the reply recorded for the
+        first delivery, None while that delivery is still being processed.
+    """
+    with connect_to_heroku_db() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                "INSERT INTO idempotency_keys (key, owner) VALUES (%s, %s) ON CONFLICT (key) DO NOTHING RETURNING key;",
+                (key, owner),
+            )
+            inserted = bool(cursor.fetchall())
+            rows = []
+            if not inserted:
+                cursor.execute("SELECT result FROM idempotency_keys WHERE key = %s;", (key,))
+                rows = cursor.fetchall()
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    if inserted:
+        return {"claimed": True}
+    return {"claimed": False, "result": rows[0][0] if rows else None}
+
+
+def complete_idempotency_key(key: str, result: str) -> None:
+    """Record the reply sent for a claimed key; later deliveries of the update get it back."""
+    with connect_to_heroku_db() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("UPDATE idempotency_keys SET result = %s WHERE key = %s;", (result, key))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def release_idempotency_keys(
+    keys: Optional[List[str]] = None, owner: Optional[str] = None, stale_after: Optional[float] = None
+) -> int:
+    """
+    Delete claims that never got a result so their updates can be processed again.
+
+    `keys` releases those claims (a handler failed). Without keys, the claims held by
+    `owner` (at startup: left by this instance before it stopped) and the claims older
+    than `stale_after` seconds (left by an instance that is gone) are released; with
+    neither, every unfinished claim. Returns the rows deleted.
+    """
+    sql = "DELETE FROM idempotency_keys WHERE result IS NULL"
+    params: List[Any] = []
+    if keys is not None:
+        if not keys:
+            return 0
+        sql += " AND key IN (" + ", ".join(["%s"] * len(keys)) + ")"
+        params = list(keys)
+    elif owner is not None or stale_after is not None:
+        conditions = []
+        if owner is not None:
+            conditions.append("owner = %s")
+            params.append(owner)
+        if stale_after is not None:
+            conditions.append("created_at < NOW() - %s * INTERVAL '1 second'")
+            params.append(stale_after)
+        sql += " AND (" + " OR ".join(conditions) + ")"
+    return _delete_idempotency_keys(sql, params)
+
+
+def purge_idempotency_keys(max_age: float) -> int:
+    """Delete the recorded results of updates older than `max_age` seconds (Telegram no longer redelivers them)."""
+    return _delete_idempotency_keys(
+        "DELETE FROM idempotency_keys WHERE result IS NOT NULL AND created_at < NOW() - %s * INTERVAL '1 second'",
+        [max_age],
+    )
+
+
+def _delete_idempotency_keys(sql: str, params: List[Any]) -> int:
+    with connect_to_heroku_db() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql + ";", params)
+            deleted = cursor.rowcount
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    return deleted
+
+
 def get_transactions_summary(user_id: int = 2, start_date: Optional[str] = None, end_date: Optional[str] = None, tx_type: str = "both") -> Dict[str, Any]:
     """Return aggregated transaction summary for a user between start_date and end_date.
 
@@ -32,4 +32,13 @@ CREATE INDEX idx_bills_category_name ON bills(category_name);
 CREATE TABLE IF NOT EXISTS idempotency_keys (
     key TEXT PRIMARY KEY,
     created_at TIMESTAMP DEFAULT NOW()
-);
\ No newline at end of file
+);
+
+-- Kết quả đã trả lời cho một update Telegram (key = "tg:<chat_id>:<message_id>");
+-- NULL khi update đang được xử lý. Xem src/utils/idempotency.py
+ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS result TEXT;
+
+-- Bot instance đang xử lý update (idempotency.instance); khi khởi động, bot chỉ giải phóng
+-- claim của chính nó và claim quá hạn (idempotency.claim_timeout), không đụng replica khác
+ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS owner TEXT;
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys(created_at);
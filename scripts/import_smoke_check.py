@@ -3,10 +3,23 @@
 
 This script adds the repo root to sys.path and attempts to import a list of modules,
 printing a short pass/fail and the exception traceback for failures.
+
+It then measures the cumulative import cost of each module in a fresh interpreter
+(`python -X importtime`) and fails if a module exceeds its import-time budget or
+pulls in a heavy dependency (Gemini SDK, PIL, psycopg2, transformers, ...) that
+should only be loaded on first use.
+
+Usage:
+    python3 scripts/import_smoke_check.py
+    python3 scripts/import_smoke_check.py --budget-ms 800 --top 10
 """
+import argparse
+import json
+import subprocess
 import sys
 import traceback
 from pathlib import Path
+from typing import Dict, List, Tuple
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
 if str(REPO_ROOT) not in sys.path:
@@ -19,15 +32,124 @@ modules = [
     "database.database",
 ]
 
-print(f"Repo root: {REPO_ROOT}")
+# Cumulative import budget per module in milliseconds; modules not listed use --budget-ms.
+# Most of the handler budget is python-telegram-bot itself.
+IMPORT_BUDGETS_MS = {
+    "src.config": 150,
+    "src.utils.text_processor": 200,
+    "src.utils.telegram_handlers": 600,
+    "database.database": 100,
+}
+
+# Dependencies that must stay lazy: they are loaded by the code paths that need them
+HEAVY_MODULES = (
+    "google.generativeai",
+    "google.api_core",
+    "PIL",
+    "psycopg2",
+    "requests",
+    "transformers",
+    "torch",
+)
+
+_PROBE = (
+    "import importlib, json, sys; importlib.import_module({module!r}); "
+    "print(json.dumps(sorted(m for m in {heavy!r} if m in sys.modules)))"
+)
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Return (name, cumulative_us, depth) for every `-X importtime` line."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        try:
+            _, rest = line.split(":", 1)
+            _self_us, cumulative_us, name = rest.split("|", 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(cumulative_us), depth))
+    return rows
+
+
+def _run_probe(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-W", "ignore", "-c", code],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+
+
+def measure_import(module: str, startup: set) -> Dict[str, object]:
+    """Import `module` in a fresh interpreter and report its cumulative cost and heavy deps."""
+    proc = _run_probe(_PROBE.format(module=module, heavy=HEAVY_MODULES))
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"}
+    rows = _parse_importtime(proc.stderr)
+    # Top-level imports triggered by this module (interpreter startup imports excluded)
+    top_level = [(name, us) for name, us, depth in rows if depth == 0 and name not in startup]
+    total_ms = sum(us for _, us in top_level) / 1000
+    heaviest = sorted(((name, us / 1000) for name, us, _ in rows if name not in startup), key=lambda r: -r[1])
+    return {
+        "total_ms": total_ms,
+        "heaviest": heaviest,
+        "heavy_loaded": json.loads(proc.stdout.strip().splitlines()[-1] or "[]"),
+    }
+
+
+def check_import_budgets(budget_ms: float, top: int) -> int:
+    """Print per-module import cost and return the number of budget/laziness violations."""
+    startup = {name for name, _, _ in _parse_importtime(_run_probe("pass").stderr)}
+    failures = 0
+    print("\nImport-time budget check (fresh interpreter per module):")
+    for m in modules:
+        result = measure_import(m, startup)
+        budget = IMPORT_BUDGETS_MS.get(m, budget_ms)
+        if "error" in result:
+            print(f"✖ {m}: {result['error']}")
+            failures += 1
+            continue
+        ok = result["total_ms"] <= budget and not result["heavy_loaded"]
+        mark = "✔" if ok else "✖"
+        print(f"{mark} {m}: {result['total_ms']:.0f} ms (budget {budget:.0f} ms)")
+        if result["heavy_loaded"]:
+            print(f"    heavy dependencies loaded at import: {', '.join(result['heavy_loaded'])}")
+        if not ok:
+            failures += 1
+            for name, ms in result["heaviest"][:top]:
+                print(f"    {ms:8.1f} ms  {name}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import smoke test with import-time budgets")
+    parser.add_argument("--budget-ms", type=float, default=500, help="Default budget for modules without one")
+    parser.add_argument("--top", type=int, default=8, help="Heaviest imports to show for a module over budget")
+    parser.add_argument("--skip-budget", action="store_true", help="Only check that modules import")
+    args = parser.parse_args()
+
+    print(f"Repo root: {REPO_ROOT}")
+
+    failures = 0
+    for m in modules:
+        print(f"\nImporting {m}...")
+        try:
+            __import__(m, fromlist=["*"])
+            print(f"✔ {m} imported OK")
+        except Exception as e:
+            failures += 1
+            print(f"✖ {m} import FAILED: {e}")
+            traceback.print_exc()
+
+    if not args.skip_budget:
+        failures += check_import_budgets(args.budget_ms, args.top)
+
+    print("\nSmoke import check complete.")
+    return 1 if failures else 0
 
-for m in modules:
-    print(f"\nImporting {m}...")
-    try:
-        __import__(m, fromlist=["*"])
-        print(f"✔ {m} imported OK")
-    except Exception as e:
-        print(f"✖ {m} import FAILED: {e}")
-        traceback.print_exc()
 
-print("\nSmoke import check complete.")
+if __name__ == "__main__":
+    sys.exit(main())
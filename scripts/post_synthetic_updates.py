@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Post synthetic Telegram updates to a locally running webhook server.
+
+Start the bot with `telegram.mode: webhook` in config.yaml, then run for example:
+
+    python3 scripts/post_synthetic_updates.py --count 50 --concurrency 10
+
+Each update is a private text message. The script prints the HTTP status
+distribution and request latency so webhook throughput can be checked without
+Telegram in the loop. Note that the handlers still call the Bot API to reply.
+"""
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+DEFAULT_TEXTS = [
+    "Cafe Highland 55k",
+    "ăn sáng 30k",
+    "tổng hợp tháng này",
+    "grab 45k đi làm",
+]
+
+
+def build_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Return a minimal Bot API Update dict for a private text message."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Load"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+        },
+    }
+
+
+def post_update(url: str, update: dict, secret_token, timeout: float):
+    body = json.dumps(update).encode("utf-8")
+    req = urllib.request.Request(url, data=body, method="POST")
+    req.add_header("Content-Type", "application/json")
+    if secret_token:
+        req.add_header("X-Telegram-Bot-Api-Secret-Token", secret_token)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Webhook URL (default: built from config.yaml listen/port/path)")
+    parser.add_argument("--secret-token", help="Secret token (default: telegram.webhook.secret_token)")
+    parser.add_argument("--count", type=int, default=20, help="Number of updates to post")
+    parser.add_argument("--chats", type=int, default=5, help="Number of distinct chat ids to spread updates over")
+    parser.add_argument("--concurrency", type=int, default=5, help="Parallel HTTP requests")
+    parser.add_argument("--text", action="append", help="Message text (repeatable); defaults to a small corpus")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    url = args.url
+    secret_token = args.secret_token
+    if url is None or secret_token is None:
+        from src import config
+
+        if url is None:
+            host = "127.0.0.1" if config.WEBHOOK_LISTEN in ("0.0.0.0", "::") else config.WEBHOOK_LISTEN
+            url = f"http://{host}:{config.WEBHOOK_PORT}/{config.WEBHOOK_PATH}"
+        if secret_token is None:
+            secret_token = config.WEBHOOK_SECRET_TOKEN
+
+    texts = args.text or DEFAULT_TEXTS
+    base_id = int(time.time())
+    updates = [
+        build_update(base_id + i, 900000 + (i % max(1, args.chats)), texts[i % len(texts)]) for i in range(args.count)
+    ]
+
+    print(f"Posting {len(updates)} updates to {url} (concurrency={args.concurrency})")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        results = list(pool.map(lambda u: post_update(url, u, secret_token, args.timeout), updates))
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(str(status) for status, _ in results)
+    latencies = sorted(lat for _, lat in results)
+    print(f"Status codes: {dict(statuses)}")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"Latency p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+    print(f"Throughput: {len(results) / elapsed:.1f} updates/s")
+    return 0 if statuses.get("200", 0) == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
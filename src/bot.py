@@ -1,10 +1,17 @@
+import asyncio
 import logging
 
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from telegram.request import HTTPXRequest
 
+import config
 from config import TOKEN, initialize_directories
+from utils import flood_control, idempotency, image_workers, job_queue, metrics, model_router, replies
+from utils.rate_limiter import get_admission_controller
+from utils.receipt_dedup import get_receipt_index
+from utils.vision_cache import get_vision_cache
 from utils.telegram_handlers import photo_handler, text_handler
+from utils.update_processor import PerChatUpdateProcessor, install_blocking_executor
 from utils.voice_handlers import voice_handler
 
 # Configure logging - reduce noise from httpx and telegram
@@ -18,19 +25,117 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("telegram").setLevel(logging.WARNING)
 logging.getLogger("telegram.ext").setLevel(logging.WARNING)
 
+logger = logging.getLogger(__name__)
 
-def main() -> None:
-    # Khởi tạo các thư mục cần thiết
-    initialize_directories()
 
+class TimedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API call as a metrics stage."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        stage = "telegram_send" if endpoint.startswith(("send", "edit")) else f"telegram_{endpoint}"
+        with metrics.span(stage):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+async def _post_init(application: Application) -> None:
+    """Start metrics exporters and config hot reload once the Application is initialized."""
+    # `kill -HUP <pid>` re-reads config.yaml; tunables apply without a restart
+    if config.install_sighup_handler(asyncio.get_running_loop()):
+        logger.info("Config reload on SIGHUP enabled")
+    settings = config.get_settings()
+    # One thread per update slot and job worker for the handlers' blocking Gemini/DB calls
+    install_blocking_executor(settings.concurrent_updates, extra=settings.jobs_workers)
+    if settings.config_watch_interval > 0:
+        application.bot_data["config_watch_stop"] = config.start_config_watcher(settings.config_watch_interval)
+    metrics.register_source("admission", get_admission_controller().snapshot)
+    metrics.register_source("model_router", model_router.snapshot)
+    metrics.register_source("receipt_dedup", get_receipt_index().snapshot)
+    cache = get_vision_cache()
+    if cache is not None:
+        metrics.register_source("vision_cache", cache.snapshot)
+    metrics.register_source("image_workers", image_workers.snapshot)
+    metrics.register_source("idempotency", idempotency.snapshot)
+    metrics.register_source("replies", replies.snapshot)
+    scheduler = flood_control.get_scheduler()
+    if scheduler is not None:
+        metrics.register_source("outbound", scheduler.snapshot)
+    # Claims left unfinished by a stopped process must not block the redelivered updates
+    await asyncio.to_thread(idempotency.release_unfinished)
+    await asyncio.to_thread(idempotency.cleanup)
+    if settings.idempotency_cleanup_interval > 0:
+        application.bot_data["idempotency_cleanup_stop"] = idempotency.start_cleanup(
+            settings.idempotency_cleanup_interval
+        )
+    pool = image_workers.get_pool()
+    if pool is not None:
+        # Spawn the preprocessing workers now rather than on the first photos
+        await asyncio.to_thread(pool.warm_up)
+    queue = job_queue.get_queue()
+    if queue is not None:
+        # Jobs left queued or running by a stopped process are picked up again here
+        queue.start(application.bot)
+        metrics.register_source("jobs", queue.snapshot)
+        # Voice and album handlers return once their job is queued; admission counts the jobs instead
+        get_admission_controller().backlog = queue.depth
+    if config.METRICS_OPENTELEMETRY:
+        metrics.enable_opentelemetry()
+    if config.METRICS_PORT:
+        application.bot_data["metrics_server"] = metrics.start_http_exporter(config.METRICS_PORT, config.METRICS_HOST)
+    if config.METRICS_LOG_INTERVAL > 0:
+        application.bot_data["metrics_log_stop"] = metrics.start_log_dumper(config.METRICS_LOG_INTERVAL)
+
+
+async def _post_stop(application: Application) -> None:
+    """Let running jobs finish (or hand them back to the queue) while the bot can still reply."""
+    queue = job_queue.get_queue()
+    if queue is not None and queue.started:
+        await queue.drain(config.get_settings().jobs_drain_timeout)
+
+
+async def _post_shutdown(application: Application) -> None:
+    watch_stop = application.bot_data.pop("config_watch_stop", None)
+    if watch_stop is not None:
+        watch_stop.set()
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.shutdown()
+    for name in ("metrics_log_stop", "idempotency_cleanup_stop"):
+        stop = application.bot_data.pop(name, None)
+        if stop is not None:
+            stop.set()
+    image_workers.shutdown_pool()
+    summary = metrics.format_summary()
+    if summary:
+        logger.info("Stage latency summary at shutdown:\n%s", summary)
+
+
+def build_application() -> Application:
+    """Create the Application with request settings, concurrency and all handlers registered."""
     # Tạo đối tượng Application với timeout cao hơn để tránh TimedOut
-    request = HTTPXRequest(
+    request = TimedHTTPXRequest(
         connect_timeout=30,
         read_timeout=60,
         write_timeout=30,
         pool_timeout=30,
+        # Allow as many parallel Bot API calls as updates we process concurrently
+        connection_pool_size=max(1, config.CONCURRENT_UPDATES),
+    )
+    builder = (
+        Application.builder()
+        .token(TOKEN)  # type: ignore
+        .request(request)
+        # Different chats run in parallel; updates of one chat keep their order
+        .concurrent_updates(PerChatUpdateProcessor(config.CONCURRENT_UPDATES))
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .post_shutdown(_post_shutdown)
     )
-    application = Application.builder().token(TOKEN).request(request).build()  # type: ignore
+    scheduler = flood_control.get_scheduler()
+    if scheduler is not None:
+        # Outgoing sends/edits are queued per chat under Telegram's flood limits
+        builder = builder.rate_limiter(scheduler)
+    application = builder.build()
 
     # Thêm trình xử lý cho tin nhắn ảnh
     application.add_handler(MessageHandler(filters.PHOTO, photo_handler))
@@ -39,11 +144,33 @@ def main() -> None:
     application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), text_handler))
 
     application.add_handler(MessageHandler(filters.VOICE, voice_handler))
-    
-    # Bắt đầu chạy bot
-    logger = logging.getLogger(__name__)
-    logger.info("🤖 Bot started successfully")
-    application.run_polling()
+    return application
+
+
+def main() -> None:
+    # Khởi tạo các thư mục cần thiết
+    initialize_directories()
+
+    application = build_application()
+
+    # Bắt đầu chạy bot. Both run_* methods stop on SIGINT/SIGTERM and Application.stop()
+    # waits for in-flight handlers and tasks created via application.create_task.
+    logger.info(
+        "🤖 Bot started successfully (mode=%s, concurrent_updates=%s)",
+        config.TELEGRAM_MODE,
+        config.CONCURRENT_UPDATES,
+    )
+    if config.TELEGRAM_MODE == "webhook":
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET_TOKEN,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
 import logging
+import signal
+import sys
+import threading
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-
-import google.generativeai as genai
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 _have_yaml = False
 
@@ -28,22 +31,19 @@ def _load_yaml_from_fileobj(f):
 _ROOT = Path(__file__).resolve().parents[1]
 _YAML_PATH = _ROOT / "config.yaml"
 
-# Load YAML (if present) using whichever YAML implementation is installed
-_yaml_conf = {}
-if _YAML_PATH.exists():
-    try:
-        with open(_YAML_PATH, "r", encoding="utf-8") as f:
-            _yaml_conf = _load_yaml_from_fileobj(f) or {}
-    except Exception:
-        logging.exception("Không thể đọc config.yaml (no YAML parser available or file invalid)")
 
+def _read_yaml(path: Path) -> Dict[str, Any]:
+    """Load config.yaml (if present) using whichever YAML implementation is installed."""
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return _load_yaml_from_fileobj(f) or {}
 
-# Helper to get config values (env override YAML)
-def _get(path, env_var=None, default=None):
+
+def _lookup(conf: Dict[str, Any], path, default=None):
     # path: list or dot-separated string
-    # env_var is accepted for backward compatibility but is ignored; only YAML is used.
     keys = path.split(".") if isinstance(path, str) else list(path)
-    val = _yaml_conf
+    val = conf
     try:
         for k in keys:
             val = val.get(k, {})
@@ -51,39 +51,525 @@ def _get(path, env_var=None, default=None):
         val = {}
     if isinstance(val, dict) and not val:
         val = None
-    # Only return values from YAML; do not override from environment variables.
     return val if val is not None else default
 
 
-# --- TELEGRAM ---
-TOKEN = _get("telegram.token")
-if not TOKEN:
-    raise ValueError("Vui lòng cấu hình 'telegram.token' trong config.yaml")
+_yaml_conf = {}
+try:
+    _yaml_conf = _read_yaml(_YAML_PATH)
+except Exception:
+    logging.exception("Không thể đọc config.yaml (no YAML parser available or file invalid)")
+
+
+# Helper to get config values (env override YAML)
+def _get(path, env_var=None, default=None):
+    # env_var is accepted for backward compatibility but is ignored; only YAML is used.
+    return _lookup(_yaml_conf, path, default)
+
+
+def _num(conf, path, default, cast=int, minimum=None, maximum=None):
+    """Read a number from the YAML dict, falling back to `default` if it is missing or invalid.
+
+    The value is clamped to [`minimum`, `maximum`] where given.
+    """
+    try:
+        value = cast(_lookup(conf, path, default=default))
+    except Exception:
+        value = default
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
+def _opt_str(conf, path) -> Optional[str]:
+    val = _lookup(conf, path)
+    return str(val) if val is not None else None
+
+
+@dataclass(frozen=True, slots=True)
+class ModelRoute:
+    """Model and retry policy for one Gemini task (used by utils/model_router.py).
+
+    `escalate_to` is tried once the primary model's JSON fails validation;
+    None disables escalation.
+    """
+
+    model: str
+    escalate_to: Optional[str] = None
+    timeout: float = 20.0
+    retries: int = 2
+    backoff: float = 1.0
+
+
+
+def _parse_model_routes(conf: Dict[str, Any], text_model: str, vision_model: str) -> Dict[str, ModelRoute]:
+    """Per-task routes from the `models:` section on top of the built-in defaults."""
+    # Short prompts go to the lite model and escalate to the configured text model;
+    # receipts start on the vision model and escalate to pro.
+    defaults = {
+        "classify": ModelRoute("gemini-2.5-flash-lite", escalate_to=text_model, timeout=20, retries=2),
+        "parse_text": ModelRoute("gemini-2.5-flash-lite", escalate_to=text_model, timeout=60, retries=3),
+        "parse_report_request": ModelRoute("gemini-2.5-flash-lite", escalate_to=text_model, timeout=20, retries=2),
+        "vision": ModelRoute(vision_model, escalate_to="gemini-2.5-pro", timeout=30, retries=2, backoff=0.5),
+        "report_writer": ModelRoute(text_model, timeout=20, retries=1),
+    }
+    routes = {}
+    for task, default in defaults.items():
+        prefix = f"models.{task}"
+        escalate_to = _lookup(conf, f"{prefix}.escalate_to", default=default.escalate_to)
+        if escalate_to is False or str(escalate_to).strip().lower() in ("", "none", "false"):
+            escalate_to = None
+        routes[task] = ModelRoute(
+            model=str(_lookup(conf, f"{prefix}.model", default=default.model)),
+            escalate_to=str(escalate_to) if escalate_to is not None else None,
+            timeout=_num(conf, f"{prefix}.timeout", default.timeout, cast=float, minimum=1.0),
+            retries=_num(conf, f"{prefix}.retries", default.retries, minimum=1),
+            backoff=_num(conf, f"{prefix}.backoff", default.backoff, cast=float, minimum=0.0),
+        )
+    return routes
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Typed, validated snapshot of config.yaml.
+
+    Parsed once at import and replaced as a whole by `reload_settings()`; never
+    mutated in place, so a reader always sees one consistent version.
+    """
+
+    # --- Telegram ---
+    token: str
+    telegram_mode: str = "polling"
+    webhook_listen: str = "0.0.0.0"
+    webhook_port: int = 8443
+    webhook_path: str = "telegram"
+    webhook_url: Optional[str] = None
+    webhook_secret_token: Optional[str] = None
+    webhook_max_connections: int = 40
+    concurrent_updates: int = 32
+    # --- Uploads ---
+    upload_dir: str = "uploads"
+    # --- Google Gemini ---
+    gemini_api_key: str = ""
+    text_model: str = "gemini-2.5-flash"
+    vision_model: str = "gemini-2.5-flash"
+    context_cache: bool = True
+    context_cache_ttl: int = 3600
+    context_cache_min_tokens: int = 1024
+    model_routes: Dict[str, ModelRoute] = field(default_factory=dict)
+    # --- Receipt images ---
+    image_adaptive: bool = True
+    image_max_side: int = 800
+    image_long_side_cap: int = 2400
+    image_quality: int = 60
+    image_passthrough_kb: int = 150
+    image_max_download_mb: float = 10.0
+    image_workers: int = 0
+    image_queue_size: int = 16
+    image_worker_timeout: float = 15.0
+    image_album_window: float = 1.5
+    # --- Receipts ---
+    receipt_dedup: bool = True
+    receipt_dedup_distance: int = 4
+    receipt_dedup_ttl_days: float = 30.0
+    receipt_dedup_max_per_user: int = 500
+    vision_cache: bool = True
+    vision_cache_path: str = "cache/vision_cache.sqlite3"
+    vision_cache_max_entries: int = 5000
+    # --- Idempotent ingestion ---
+    idempotency: bool = True
+    idempotency_persistent: bool = True
+    idempotency_cache_size: int = 10000
+    idempotency_instance: Optional[str] = None
+    idempotency_claim_timeout: float = 900.0
+    idempotency_ttl: float = 172800.0
+    idempotency_cleanup_interval: float = 3600.0
+    # --- Background jobs ---
+    jobs: bool = True
+    jobs_path: str = "cache/jobs.sqlite3"
+    jobs_workers: int = 2
+    jobs_max_attempts: int = 3
+    jobs_visibility_timeout: float = 60.0
+    jobs_retry_delay: float = 5.0
+    jobs_drain_timeout: float = 20.0
+    # --- Voice ---
+    voice_local_parse: bool = True
+    # --- Database ---
+    database_url: Optional[str] = None
+    db_pool_min: int = 1
+    db_pool_max: int = 10
+    # --- Timeouts ---
+    http_timeout: int = 10
+    llm_default_timeout: int = 120
+    # --- Rate limiting / load shedding ---
+    rate_limit_per_chat_rate: float = 0.5
+    rate_limit_per_chat_burst: float = 6.0
+    rate_limit_max_in_flight: int = 32
+    rate_limit_gemini_error_rate: float = 0.5
+    rate_limit_gemini_window: float = 60.0
+    rate_limit_gemini_min_samples: int = 10
+    # --- Outgoing Bot API calls (flood control) ---
+    outbound: bool = True
+    outbound_global_rate: float = 30.0
+    outbound_global_burst: float = 30.0
+    outbound_per_chat_rate: float = 1.0
+    outbound_per_chat_burst: float = 3.0
+    outbound_group_rate: float = 0.33
+    outbound_progress_reserve: float = 5.0
+    outbound_max_retries: int = 3
+    # --- Metrics ---
+    metrics_port: int = 0
+    metrics_host: str = "0.0.0.0"
+    metrics_log_interval: float = 300.0
+    metrics_opentelemetry: bool = False
+    # --- App ---
+    default_user_id: int = 2
+    config_watch_interval: float = 0.0
+
+    @classmethod
+    def from_mapping(cls, conf: Dict[str, Any]) -> "Settings":
+        """Parse and validate the YAML dict; raises ValueError for missing or invalid required keys."""
+        token = _lookup(conf, "telegram.token")
+        if not token:
+            raise ValueError("Vui lòng cấu hình 'telegram.token' trong config.yaml")
+
+        # "polling" (default) uses getUpdates; "webhook" starts PTB's embedded webhook server.
+        mode = str(_lookup(conf, "telegram.mode", default="polling")).strip().lower()
+        if mode not in ("polling", "webhook"):
+            raise ValueError("'telegram.mode' phải là 'polling' hoặc 'webhook'")
+        # Public HTTPS URL Telegram should call, e.g. https://bot.example.com/telegram
+        webhook_url = _opt_str(conf, "telegram.webhook.url")
+        if mode == "webhook" and not webhook_url:
+            raise ValueError("Vui lòng cấu hình 'telegram.webhook.url' khi dùng telegram.mode = webhook")
+
+        gemini_api_key = _opt_str(conf, "google.gemini_api_key")
+        if not gemini_api_key:
+            raise ValueError("Vui lòng cấu hình 'google.gemini_api_key' trong config.yaml")
+
+        pool_min = _num(conf, "database.pool_min", 1, minimum=1)
+        pool_max = _num(conf, "database.pool_max", 10, minimum=1)
+        if pool_max < pool_min:
+            raise ValueError("'database.pool_max' phải lớn hơn hoặc bằng 'database.pool_min'")
+
+        text_model = str(_lookup(conf, "google.text_model", default="gemini-2.5-flash"))
+        vision_model = str(_lookup(conf, "google.vision_model", default="gemini-2.5-flash"))
+
+        return cls(
+            token=str(token),
+            telegram_mode=mode,
+            webhook_listen=str(_lookup(conf, "telegram.webhook.listen", default="0.0.0.0")),
+            webhook_port=_num(conf, "telegram.webhook.port", 8443, minimum=1, maximum=65535),
+            webhook_path=str(_lookup(conf, "telegram.webhook.path", default="telegram")).strip("/"),
+            webhook_url=webhook_url,
+            webhook_secret_token=_opt_str(conf, "telegram.webhook.secret_token"),
+            webhook_max_connections=_num(conf, "telegram.webhook.max_connections", 40, minimum=1, maximum=100),
+            # Maximum number of chats processed concurrently; updates within a chat stay in order
+            concurrent_updates=_num(conf, "telegram.concurrent_updates", 32, minimum=1),
+            upload_dir=str(_lookup(conf, "uploads.dir", default="uploads")),
+            gemini_api_key=gemini_api_key,
+            text_model=text_model,
+            vision_model=vision_model,
+            # Explicit Gemini context caching for the static system prompts (falls back to plain models)
+            context_cache=bool(_lookup(conf, "google.context_cache", default=True)),
+            context_cache_ttl=_num(conf, "google.context_cache_ttl", 3600, minimum=300),
+            context_cache_min_tokens=_num(conf, "google.context_cache_min_tokens", 1024, minimum=0),
+            model_routes=_parse_model_routes(conf, text_model, vision_model),
+            # Receipt photo preprocessing before Gemini Vision (see utils/image_preprocessing.py)
+            image_adaptive=bool(_lookup(conf, "images.adaptive", default=True)),
+            image_max_side=_num(conf, "images.max_side", 800, minimum=256),
+            image_long_side_cap=_num(conf, "images.long_side_cap", 2400, minimum=256),
+            image_quality=_num(conf, "images.quality", 60, minimum=20, maximum=95),
+            image_passthrough_kb=_num(conf, "images.passthrough_kb", 150, minimum=0),
+            image_max_download_mb=_num(conf, "images.max_download_mb", 10.0, cast=float, minimum=0.1),
+            # Worker processes for preprocessing (0 = in the calling thread), see utils/image_workers.py
+            image_workers=_num(conf, "images.workers", 0, minimum=0),
+            image_queue_size=_num(conf, "images.queue_size", 16, minimum=0),
+            image_worker_timeout=_num(conf, "images.worker_timeout", 15.0, cast=float, minimum=1.0),
+            # Albums: photos sharing a media_group_id are extracted in one Gemini request (0 = one by one)
+            image_album_window=_num(conf, "images.album_window", 1.5, cast=float, minimum=0.0),
+            # Near-duplicate receipt photos (dHash Hamming distance out of 256 bits) reuse the saved result
+            receipt_dedup=bool(_lookup(conf, "receipts.dedup", default=True)),
+            receipt_dedup_distance=_num(conf, "receipts.dedup_distance", 4, minimum=0, maximum=256),
+            receipt_dedup_ttl_days=_num(conf, "receipts.dedup_ttl_days", 30.0, cast=float, minimum=0.0),
+            receipt_dedup_max_per_user=_num(conf, "receipts.dedup_max_per_user", 500, minimum=1),
+            # Persistent cache of validated vision results keyed by file_unique_id / JPEG hash + prompt version
+            vision_cache=bool(_lookup(conf, "vision_cache.enabled", default=True)),
+            vision_cache_path=str(_lookup(conf, "vision_cache.path", default="cache/vision_cache.sqlite3")),
+            vision_cache_max_entries=_num(conf, "vision_cache.max_entries", 5000, minimum=1),
+            # Redelivered updates (same chat_id + message_id) get the original reply instead of a re-run
+            idempotency=bool(_lookup(conf, "idempotency.enabled", default=True)),
+            idempotency_persistent=bool(_lookup(conf, "idempotency.persistent", default=True)),
+            idempotency_cache_size=_num(conf, "idempotency.cache_size", 10000, minimum=1),
+            # Claims are tagged with this instance; unfinished claims older than claim_timeout belong to a dead one
+            idempotency_instance=_opt_str(conf, "idempotency.instance"),
+            idempotency_claim_timeout=_num(conf, "idempotency.claim_timeout", 900.0, cast=float, minimum=60.0),
+            idempotency_ttl=_num(conf, "idempotency.ttl", 172800.0, cast=float, minimum=3600.0),
+            idempotency_cleanup_interval=_num(conf, "idempotency.cleanup_interval", 3600.0, cast=float, minimum=0.0),
+            # Durable SQLite queue for voice transcription and album extraction (see utils/job_queue.py)
+            jobs=bool(_lookup(conf, "jobs.enabled", default=True)),
+            jobs_path=str(_lookup(conf, "jobs.path", default="cache/jobs.sqlite3")),
+            jobs_workers=_num(conf, "jobs.workers", 2, minimum=1),
+            jobs_max_attempts=_num(conf, "jobs.max_attempts", 3, minimum=1),
+            jobs_visibility_timeout=_num(conf, "jobs.visibility_timeout", 60.0, cast=float, minimum=5.0),
+            jobs_retry_delay=_num(conf, "jobs.retry_delay", 5.0, cast=float, minimum=0.0),
+            jobs_drain_timeout=_num(conf, "jobs.drain_timeout", 20.0, cast=float, minimum=0.0),
+            # Single spoken transactions with a clear amount and category skip Gemini (see utils/spoken_numbers.py)
+            voice_local_parse=bool(_lookup(conf, "voice.local_parse", default=True)),
+            database_url=_opt_str(conf, "database.url"),
+            db_pool_min=pool_min,
+            db_pool_max=pool_max,
+            http_timeout=_num(conf, "http.timeout", 10),
+            llm_default_timeout=_num(conf, "llm.default_timeout", 120),
+            # Per-chat token bucket: text costs 1 token, photo/voice cost 2
+            rate_limit_per_chat_rate=_num(conf, "limits.per_chat_rate", 0.5, cast=float),
+            rate_limit_per_chat_burst=_num(conf, "limits.per_chat_burst", 6.0, cast=float),
+            # Global admission: max handlers in flight before new updates are shed
+            rate_limit_max_in_flight=_num(conf, "limits.max_in_flight", 32),
+            # Shed photo/voice work while the Gemini error rate over the window exceeds the threshold
+            rate_limit_gemini_error_rate=_num(conf, "limits.gemini_error_rate", 0.5, cast=float, minimum=0.0, maximum=1.0),
+            rate_limit_gemini_window=_num(conf, "limits.gemini_window", 60.0, cast=float),
+            rate_limit_gemini_min_samples=_num(conf, "limits.gemini_min_samples", 10),
+            # Telegram allows ~30 messages/s overall, ~1/s per chat and 20/min per group
+            outbound=bool(_lookup(conf, "outbound.enabled", default=True)),
+            outbound_global_rate=_num(conf, "outbound.global_rate", 30.0, cast=float, minimum=0.1),
+            outbound_global_burst=_num(conf, "outbound.global_burst", 30.0, cast=float, minimum=1.0),
+            outbound_per_chat_rate=_num(conf, "outbound.per_chat_rate", 1.0, cast=float, minimum=0.01),
+            outbound_per_chat_burst=_num(conf, "outbound.per_chat_burst", 3.0, cast=float, minimum=1.0),
+            outbound_group_rate=_num(conf, "outbound.group_rate", 0.33, cast=float, minimum=0.01),
+            outbound_progress_reserve=_num(conf, "outbound.progress_reserve", 5.0, cast=float, minimum=0.0),
+            outbound_max_retries=_num(conf, "outbound.max_retries", 3, minimum=0),
+            # Prometheus text endpoint on this port (0 disables), periodic log summary interval in seconds
+            metrics_port=_num(conf, "metrics.port", 0, minimum=0, maximum=65535),
+            metrics_host=str(_lookup(conf, "metrics.host", default="0.0.0.0")),
+            metrics_log_interval=_num(conf, "metrics.log_interval", 300.0, cast=float),
+            metrics_opentelemetry=bool(_lookup(conf, "metrics.opentelemetry", default=False)),
+            # Default user id to use when a request cannot be mapped to a DB user (2 matches the test data)
+            default_user_id=_num(conf, "app.default_user_id", 2),
+            config_watch_interval=_num(conf, "app.config_watch_interval", 0.0, cast=float),
+        )
+
+
+# Settings that are bound once at startup (bot token, server sockets, worker count,
+# DB URL, ...). A reload that changes them logs a warning and keeps the old value.
+RESTART_REQUIRED = frozenset({
+    "token",
+    "telegram_mode",
+    "webhook_listen",
+    "webhook_port",
+    "webhook_path",
+    "webhook_url",
+    "webhook_secret_token",
+    "webhook_max_connections",
+    "concurrent_updates",
+    "upload_dir",
+    "vision_cache_path",
+    "jobs",
+    "outbound",
+    "jobs_path",
+    "jobs_workers",
+    "db_pool_min",
+    "db_pool_max",
+    "idempotency_instance",
+    "idempotency_cleanup_interval",
+    "gemini_api_key",
+    "database_url",
+    "metrics_port",
+    "metrics_host",
+    "metrics_opentelemetry",
+    "config_watch_interval",
+})
+
+# Legacy module-level names kept in sync with the current Settings for existing callers
+_LEGACY_NAMES = {
+    "TOKEN": "token",
+    "TELEGRAM_MODE": "telegram_mode",
+    "WEBHOOK_LISTEN": "webhook_listen",
+    "WEBHOOK_PORT": "webhook_port",
+    "WEBHOOK_PATH": "webhook_path",
+    "WEBHOOK_URL": "webhook_url",
+    "WEBHOOK_SECRET_TOKEN": "webhook_secret_token",
+    "WEBHOOK_MAX_CONNECTIONS": "webhook_max_connections",
+    "CONCURRENT_UPDATES": "concurrent_updates",
+    "UPLOAD_DIR": "upload_dir",
+    "GEMINI_API_KEY": "gemini_api_key",
+    "DATABASE_URL": "database_url",
+    "DB_POOL_MIN": "db_pool_min",
+    "DB_POOL_MAX": "db_pool_max",
+    "HTTP_TIMEOUT": "http_timeout",
+    "LLM_DEFAULT_TIMEOUT": "llm_default_timeout",
+    "RATE_LIMIT_PER_CHAT_RATE": "rate_limit_per_chat_rate",
+    "RATE_LIMIT_PER_CHAT_BURST": "rate_limit_per_chat_burst",
+    "RATE_LIMIT_MAX_IN_FLIGHT": "rate_limit_max_in_flight",
+    "RATE_LIMIT_GEMINI_ERROR_RATE": "rate_limit_gemini_error_rate",
+    "RATE_LIMIT_GEMINI_WINDOW": "rate_limit_gemini_window",
+    "RATE_LIMIT_GEMINI_MIN_SAMPLES": "rate_limit_gemini_min_samples",
+    "METRICS_PORT": "metrics_port",
+    "METRICS_HOST": "metrics_host",
+    "METRICS_LOG_INTERVAL": "metrics_log_interval",
+    "METRICS_OPENTELEMETRY": "metrics_opentelemetry",
+    "DEFAULT_USER_ID": "default_user_id",
+}
+
+_settings: Settings = Settings.from_mapping(_yaml_conf)
+_reload_listeners: List[Callable[[Settings], None]] = []
+_reload_lock = threading.Lock()
+
 
-# --- UPLOADS ---
-_upload_dir_val = _get("uploads.dir", env_var="UPLOAD_DIR", default="uploads")
-UPLOAD_DIR = str(_upload_dir_val) if _upload_dir_val is not None else "uploads"
+def get_settings() -> Settings:
+    """Return the current Settings (cheap: a module global read)."""
+    return _settings
+
+
+def _apply_settings(new: Settings) -> None:
+    """Install `new` as the current Settings, refresh legacy globals and notify listeners."""
+    global _settings
+    _settings = new
+    module = sys.modules[__name__]
+    for legacy, attr in _LEGACY_NAMES.items():
+        setattr(module, legacy, getattr(new, attr))
+    for listener in list(_reload_listeners):
+        try:
+            listener(new)
+        except Exception:
+            logging.exception("Config reload listener %r failed", listener)
+
+
+def add_reload_listener(fn: Callable[[Settings], None]) -> None:
+    """Call `fn(settings)` after every successful reload (e.g. to resize limits in place)."""
+    if fn not in _reload_listeners:
+        _reload_listeners.append(fn)
+
+
+def _merge_reloadable(old: Settings, new: Settings) -> Settings:
+    """Take hot-reloadable fields from `new`; keep restart-only fields from `old`."""
+    values = {}
+    for f in fields(Settings):
+        name = f.name
+        old_val, new_val = getattr(old, name), getattr(new, name)
+        if name in RESTART_REQUIRED and old_val != new_val:
+            logging.warning("config.yaml: '%s' changed but only takes effect after a restart", name)
+            new_val = old_val
+        values[name] = new_val
+    return Settings(**values)
+
+
+def reload_settings(path: Optional[Path] = None) -> bool:
+    """Re-read config.yaml and apply tunables (timeouts, model names, limits).
+
+    An invalid file is logged and ignored so a typo never takes the bot down.
+    Returns True if a new version was applied.
+    """
+    global _yaml_conf
+    with _reload_lock:
+        try:
+            conf = _read_yaml(path or _YAML_PATH)
+            new = _merge_reloadable(_settings, Settings.from_mapping(conf))
+        except Exception:
+            logging.exception("Không thể reload config.yaml; giữ cấu hình hiện tại")
+            return False
+        if new == _settings:
+            return False
+        changed = [f.name for f in fields(Settings) if getattr(new, f.name) != getattr(_settings, f.name)]
+        _yaml_conf = conf
+        # The same file may be loaded as both `config` and `src.config` depending on the entry point
+        for name in ("config", "src.config"):
+            mod = sys.modules.get(name)
+            if mod is not None and getattr(mod, "_YAML_PATH", None) == _YAML_PATH:
+                mod._yaml_conf = conf
+                mod._apply_settings(new)
+        logging.info("Đã reload config.yaml: %s", ", ".join(changed))
+        return True
+
+
+def install_sighup_handler(loop=None) -> bool:
+    """Reload config.yaml on SIGHUP (POSIX only). Uses the asyncio loop when one is given."""
+    if not hasattr(signal, "SIGHUP"):
+        return False
+    if loop is not None:
+        loop.add_signal_handler(signal.SIGHUP, lambda: loop.run_in_executor(None, reload_settings))
+    else:
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_settings())
+    return True
+
+
+def start_config_watcher(interval: float, path: Optional[Path] = None) -> threading.Event:
+    """Poll config.yaml's mtime every `interval` seconds and reload on change; set the event to stop."""
+    target = path or _YAML_PATH
+    stop = threading.Event()
+
+    def _mtime():
+        try:
+            return target.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _loop():
+        last = _mtime()
+        while not stop.wait(interval):
+            current = _mtime()
+            if current is not None and current != last:
+                last = current
+                reload_settings(target)
+
+    threading.Thread(target=_loop, name="config-watcher", daemon=True).start()
+    return stop
+
+
+# Module-level values (kept for existing `config.X` callers; refreshed on reload)
+TOKEN = _settings.token
+TELEGRAM_MODE = _settings.telegram_mode
+WEBHOOK_LISTEN = _settings.webhook_listen
+WEBHOOK_PORT = _settings.webhook_port
+WEBHOOK_PATH = _settings.webhook_path
+WEBHOOK_URL = _settings.webhook_url
+WEBHOOK_SECRET_TOKEN = _settings.webhook_secret_token
+WEBHOOK_MAX_CONNECTIONS = _settings.webhook_max_connections
+CONCURRENT_UPDATES = _settings.concurrent_updates
+UPLOAD_DIR = _settings.upload_dir
+GEMINI_API_KEY = _settings.gemini_api_key
+DATABASE_URL = _settings.database_url
+DB_POOL_MIN = _settings.db_pool_min
+DB_POOL_MAX = _settings.db_pool_max
+HTTP_TIMEOUT = _settings.http_timeout
+LLM_DEFAULT_TIMEOUT = _settings.llm_default_timeout
+RATE_LIMIT_PER_CHAT_RATE = _settings.rate_limit_per_chat_rate
+RATE_LIMIT_PER_CHAT_BURST = _settings.rate_limit_per_chat_burst
+RATE_LIMIT_MAX_IN_FLIGHT = _settings.rate_limit_max_in_flight
+RATE_LIMIT_GEMINI_ERROR_RATE = _settings.rate_limit_gemini_error_rate
+RATE_LIMIT_GEMINI_WINDOW = _settings.rate_limit_gemini_window
+RATE_LIMIT_GEMINI_MIN_SAMPLES = _settings.rate_limit_gemini_min_samples
+METRICS_PORT = _settings.metrics_port
+METRICS_HOST = _settings.metrics_host
+METRICS_LOG_INTERVAL = _settings.metrics_log_interval
+METRICS_OPENTELEMETRY = _settings.metrics_opentelemetry
+DEFAULT_USER_ID = _settings.default_user_id
 
 
 def initialize_directories():
+    """Create runtime directories; called from bot startup, never at import time."""
     Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
     logging.info(f"Đã tạo/kiểm tra thư mục: {UPLOAD_DIR}")
 
+
 # --- GOOGLE GEMINI ---
-_gemini_key_val = _get("google.gemini_api_key")
-GEMINI_API_KEY = str(_gemini_key_val) if _gemini_key_val is not None else None
-if not GEMINI_API_KEY:
-    raise ValueError("Vui lòng cấu hình 'google.gemini_api_key' trong config.yaml")
 _genai_configured = False
 
 
 def _ensure_genai_configured():
-    """Configure google.generativeai lazily using the GEMINI_API_KEY from YAML."""
+    """Import and configure google.generativeai lazily using the GEMINI_API_KEY from YAML.
+
+    The SDK takes most of a second to import, so it is only loaded when the
+    first model is requested rather than whenever config is imported.
+    """
     global _genai_configured
-    if _genai_configured:
-        return
-    genai.configure(api_key=str(GEMINI_API_KEY))
-    _genai_configured = True
+    import google.generativeai as genai
+
+    if not _genai_configured:
+        genai.configure(api_key=str(GEMINI_API_KEY))
+        _genai_configured = True
+    return genai
 
 
 # ---- Gemini model helpers with caching ----
@@ -91,55 +577,105 @@ _text_model = None
 _vision_model = None
 
 
-def get_text_model(model_name: str = "gemini-2.5-flash"):
+def get_text_model(model_name: Optional[str] = None):
     """Return a cached text-capable GenerativeModel.
 
-    Default model is fast and supports text I/O.
+    Defaults to `google.text_model` from config.yaml; the cached model is
+    replaced when that setting changes on reload.
     """
     global _text_model
-    if _text_model is None:
-        _ensure_genai_configured()
+    model_name = model_name or _settings.text_model
+    if _text_model is None or getattr(_text_model, "model_name", "").split("/")[-1] != model_name:
+        genai = _ensure_genai_configured()
         _text_model = genai.GenerativeModel(model_name)
     return _text_model
 
 
-def get_vision_model(model_name: str = "gemini-2.5-flash"):
+def get_vision_model(model_name: Optional[str] = None):
     """Return a cached multimodal GenerativeModel for image+text prompts."""
     global _vision_model
-    if _vision_model is None:
-        _ensure_genai_configured()
+    model_name = model_name or _settings.vision_model
+    if _vision_model is None or getattr(_vision_model, "model_name", "").split("/")[-1] != model_name:
+        genai = _ensure_genai_configured()
         _vision_model = genai.GenerativeModel(model_name)
     return _vision_model
 
 
-# --- DATABASE ---
-_db_url_val = _get("database.url")
-DATABASE_URL = str(_db_url_val) if _db_url_val is not None else None
-# Database pool sizing (configurable)
-try:
-    DB_POOL_MIN = int(_get("database.pool_min", default=1))
-except Exception:
-    DB_POOL_MIN = 1
-try:
-    DB_POOL_MAX = int(_get("database.pool_max", default=10))
-except Exception:
-    DB_POOL_MAX = 10
+# ---- Per-prompt models ----
+# The large static prompts (rules, examples, category lists) go into `system_instruction`
+# of one cached model per prompt version instead of being sent as request content on
+# every call. When enabled and supported, the instruction is additionally stored with
+# Gemini explicit context caching so its input tokens are not re-processed each call.
+_prompt_models: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+_context_cache_retry_at: Dict[Tuple[str, str], float] = {}
+_prompt_models_lock = threading.Lock()
+# Recreate cached content this long before it expires; retry failed creation after this long
+_CONTEXT_CACHE_REFRESH_MARGIN = 60.0
+_CONTEXT_CACHE_RETRY_AFTER = 600.0
 
-# HTTP and LLM timeouts
-try:
-    HTTP_TIMEOUT = int(_get("http.timeout", default=10))
-except Exception:
-    HTTP_TIMEOUT = 10
-try:
-    LLM_DEFAULT_TIMEOUT = int(_get("llm.default_timeout", default=120))
-except Exception:
-    LLM_DEFAULT_TIMEOUT = 120
 
+def _prompt_version(system_instruction: str) -> str:
+    import hashlib
 
-# Default user id to use when a request cannot be mapped to a DB user.
-# This can be overridden in config.yaml under `app.default_user_id` if desired,
-# but will fall back to 2 to match the project's current test/default behavior.
-try:
-    DEFAULT_USER_ID = int(_get("app.default_user_id", default=2))
-except Exception:
-    DEFAULT_USER_ID = 2
+    return hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:12]
+
+
+def _create_context_cached_model(genai, model_name: str, system_instruction: str, ttl: int):
+    """Return a model backed by explicit context caching, or None if the SDK/model lacks support."""
+    caching = getattr(genai, "caching", None)
+    from_cached_content = getattr(genai.GenerativeModel, "from_cached_content", None)
+    if caching is None or from_cached_content is None:
+        return None
+    import datetime
+
+    cached = caching.CachedContent.create(
+        model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+        display_name=f"pefi-{_prompt_version(system_instruction)}",
+        system_instruction=system_instruction,
+        ttl=datetime.timedelta(seconds=ttl),
+    )
+    return from_cached_content(cached_content=cached)
+
+
+def get_prompt_model(system_instruction: str, version: Optional[str] = None, model_name: Optional[str] = None):
+    """Return a cached GenerativeModel whose system_instruction is the given static prompt.
+
+    Models are keyed on (model name, prompt version), so editing a prompt file or
+    changing `google.text_model` yields a fresh model. Callers then send only the
+    per-request content (user text, image, JSON) to `generate_content`.
+    """
+    import time
+
+    settings = _settings
+    model_name = model_name or settings.text_model
+    key = (model_name, version or _prompt_version(system_instruction))
+    now = time.monotonic()
+    entry = _prompt_models.get(key)
+    if entry is not None and now < entry[1]:
+        return entry[0]
+
+    with _prompt_models_lock:
+        entry = _prompt_models.get(key)
+        if entry is not None and now < entry[1]:
+            return entry[0]
+        genai = _ensure_genai_configured()
+        model, expires_at = None, float("inf")
+        approx_tokens = len(system_instruction) // 4
+        if (
+            settings.context_cache
+            and approx_tokens >= settings.context_cache_min_tokens
+            and now >= _context_cache_retry_at.get(key, 0.0)
+        ):
+            try:
+                model = _create_context_cached_model(genai, model_name, system_instruction, settings.context_cache_ttl)
+                if model is not None:
+                    expires_at = now + settings.context_cache_ttl - _CONTEXT_CACHE_REFRESH_MARGIN
+                    logging.info("Gemini context cache created for prompt %s on %s", key[1], model_name)
+            except Exception as exc:
+                _context_cache_retry_at[key] = now + _CONTEXT_CACHE_RETRY_AFTER
+                logging.warning("Gemini context caching unavailable for prompt %s (%s); using system_instruction", key[1], exc)
+                model = None
+        if model is None:
+            model = genai.GenerativeModel(model_name, system_instruction=system_instruction)
+        _prompt_models[key] = (model, expires_at)
+        return model
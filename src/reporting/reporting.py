@@ -3,19 +3,21 @@ import logging
 import json
 from datetime import date
 
-try:
-    # Prefer the project's config which reads config.yaml
-    from src import config
-except Exception:
-    import config
 try:
     # prompt helpers
-    from src.utils.promt import get_prompt_path, read_promt_file
+    from src.utils import model_router
+    from src.utils.promt import PromptTemplate, get_prompt
 except Exception:
-    from utils.promt import get_prompt_path, read_promt_file
+    from utils import model_router
+    from utils.promt import PromptTemplate, get_prompt
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
+
+# Used when prompts/report_generation.txt cannot be read
+_FALLBACK_REPORT_TEMPLATE = PromptTemplate(
+    "report_generation.fallback",
+    "INPUT JSON:\n{INPUT_JSON}\n\n{TEMPLATE_FRAGMENT}\n\nProduce a concise Markdown report in Vietnamese.",
+)
 
 
 def get_summary(user_id: int, start_date: Optional[str], end_date: Optional[str], tx_type: str = "both") -> Dict[str, Any]:
@@ -67,14 +69,11 @@ def generate_report(summary: Dict[str, Any], period_text: str = "", tx_type: str
         "daily_average_expense": summary.get("daily_average_expense", 0.0),
     }
 
-    # Load prompt template and provide both placeholders used in the file.
+    # Load the pre-split prompt template and provide both placeholders used in the file.
     try:
-        prompt_template = read_promt_file(get_prompt_path("report_generation.txt"))
+        prompt_template = get_prompt("report_generation.txt")
     except Exception:
-        # fallback simple template
-        prompt_template = (
-            "INPUT JSON:\n{INPUT_JSON}\n\n{TEMPLATE_FRAGMENT}\n\nProduce a concise Markdown report in Vietnamese."
-        )
+        prompt_template = _FALLBACK_REPORT_TEMPLATE
 
     # Provide a small template fragment depending on tx_type if needed; keep empty otherwise.
     template_fragment = ""
@@ -83,20 +82,20 @@ def generate_report(summary: Dict[str, Any], period_text: str = "", tx_type: str
     elif tx_type == "chi":
         template_fragment = "# Báo cáo chi"
 
-    try:
-        prompt = prompt_template.format(INPUT_JSON=json.dumps(context, ensure_ascii=False), TEMPLATE_FRAGMENT=template_fragment)
-    except Exception:
-        # If formatting fails, fallback to injecting only the JSON
-        prompt = prompt_template.replace("{INPUT_JSON}", json.dumps(context, ensure_ascii=False))
+    # The rendered template (without the per-report numbers) is the cached system_instruction;
+    # the context JSON is the only per-request content.
+    system_instruction = prompt_template.render(
+        INPUT_JSON="(xem INPUT JSON trong tin nhắn của người dùng)", TEMPLATE_FRAGMENT=template_fragment
+    )
+    prompt = f"INPUT JSON:\n{json.dumps(context, ensure_ascii=False)}"
 
-    # Use project's Gemini model helper
-    model = config.get_text_model()
-
-    # Try LLM generation with one retry and increased timeout on failure.
+    # Model, timeout and retries come from the "report_writer" route.
     generation_config = {"temperature": 0.2}
     try:
-        resp = model.generate_content([prompt], generation_config=generation_config, request_options={"timeout": 20})
-        text = getattr(resp, "text", "").strip()
+        text = model_router.generate_text(
+            "report_writer", system_instruction, [prompt], version=f"{prompt_template.version}:{tx_type}",
+            generation_config=generation_config, span_name="gemini_report",
+        )
         return {"text": text, "used_fallback": False}
     except Exception:
         logger.exception("LLM generation failed; falling back to deterministic report")
@@ -0,0 +1,321 @@
+"""Flood-control-aware scheduling of outgoing Bot API calls.
+
+Telegram accepts about 30 messages per second from a bot, about one per second
+in a private chat and 20 per minute in a group; above that it answers 429
+RetryAfter and the handler that was sending fails. `OutboundScheduler` is
+installed as the Application's rate limiter, so every call goes through it:
+
+- send*/edit* calls queue in a lane per chat, which sends them one at a time
+  after taking a token from the chat's bucket and from the global bucket
+  (`outbound.*`; groups refill at `outbound.group_rate`);
+- a RetryAfter pauses all calls for the time Telegram asks, then the call is
+  retried up to `outbound.max_retries` times;
+- final results go before progress notices: ReplyManager marks its ack and
+  progress edits with ``rate_limit_args={"priority": PRIORITY_PROGRESS}``. Under
+  load, progress calls leave `outbound.progress_reserve` global tokens to
+  results, a queued result overtakes queued progress in its chat, and an edit
+  replaced by a newer edit of the same message is never sent;
+- plain text results queued back to back for one chat go out as one message.
+
+Other calls (getFile, setWebhook, ...) are not throttled but wait out a RetryAfter pause.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from .metrics import observe
+from .path_setup import setup_project_root
+from .rate_limiter import TokenBucket
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_RESULT = 0
+PRIORITY_PROGRESS = 1
+
+# Telegram rejects longer message texts
+_MAX_TEXT = 4096
+# A merged message cannot carry these for several callers
+_UNMERGEABLE = (
+    "reply_markup", "reply_parameters", "reply_to_message_id", "entities", "message_thread_id",
+    "business_connection_id", "message_effect_id", "protect_content", "disable_notification",
+)
+
+
+def _seconds(retry_after: Any) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class _Call:
+    __slots__ = ("callback", "args", "kwargs", "endpoint", "data", "priority", "future", "queued_at")
+
+    def __init__(self, callback, args, kwargs, endpoint, data, priority, queued_at):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.endpoint = endpoint
+        self.data = data
+        self.priority = priority
+        self.future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self.queued_at = queued_at
+
+    @property
+    def mergeable(self) -> bool:
+        return (
+            self.endpoint == "sendMessage"
+            and self.priority == PRIORITY_RESULT
+            and isinstance(self.data.get("text"), str)
+            and not any(self.data.get(name) is not None for name in _UNMERGEABLE)
+        )
+
+
+class _Lane:
+    __slots__ = ("calls", "task")
+
+    def __init__(self) -> None:
+        self.calls: List[_Call] = []
+        self.task: Optional["asyncio.Task[None]"] = None
+
+
+class OutboundScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """Per-chat lanes of outgoing calls behind a global and a per-chat token bucket."""
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        global_burst: float = 30.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 3.0,
+        group_rate: float = 0.33,
+        progress_reserve: float = 5.0,
+        max_retries: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.group_rate = group_rate
+        self.progress_reserve = progress_reserve
+        self.max_retries = max_retries
+        self._clock = clock
+        self._global = TokenBucket(global_rate, global_burst, clock=clock)
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._lanes: Dict[Any, _Lane] = {}
+        self._paused_until = 0.0
+        self.counters: Counter = Counter()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        for lane in self._lanes.values():
+            if lane.task is not None:
+                lane.task.cancel()
+        self._lanes.clear()
+
+    # --- Buckets -------------------------------------------------------------------
+    def _rate(self, chat_id: Any) -> float:
+        # Group and channel ids are negative
+        return self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.per_chat_rate
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # A full bucket carries no state worth keeping
+                for key in [k for k, b in self._buckets.items() if b.is_full and k not in self._lanes]:
+                    del self._buckets[key]
+            bucket = TokenBucket(self._rate(chat_id), self.per_chat_burst, clock=self._clock)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def reconfigure(self, **limits: Any) -> None:
+        """Apply new limits in place (config reload); buckets keep their tokens."""
+        global_rate = limits.pop("global_rate", None)
+        global_burst = limits.pop("global_burst", None)
+        for name, value in limits.items():
+            setattr(self, name, value)
+        if global_rate is not None:
+            self._global.rate = float(global_rate)
+        if global_burst is not None:
+            self._global.capacity = float(global_burst)
+            self._global.tokens = min(self._global.tokens, self._global.capacity)
+        for chat_id, bucket in self._buckets.items():
+            bucket.rate = float(self._rate(chat_id))
+            bucket.capacity = float(self.per_chat_burst)
+            bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    async def _acquire(self, bucket: TokenBucket, priority: int) -> None:
+        # Never reserve the whole global bucket, or progress would starve
+        reserve = min(self.progress_reserve, self._global.capacity - 1.0) if priority == PRIORITY_PROGRESS else 0.0
+        while True:
+            wait = max(
+                self._paused_until - self._clock(),
+                bucket.time_until_available(1.0),
+                self._global.time_until_available(1.0 + max(reserve, 0.0)),
+            )
+            if wait <= 0:
+                bucket.try_acquire(1.0)
+                self._global.try_acquire(1.0)
+                return
+            await asyncio.sleep(wait)
+
+    async def _wait_pause(self) -> None:
+        while True:
+            wait = self._paused_until - self._clock()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    # --- Calls ---------------------------------------------------------------------
+    async def _call(self, callback, args, kwargs) -> Any:
+        attempt = 0
+        while True:
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = _seconds(e._retry_after)
+                self.counters["retry_after"] += 1
+                self._paused_until = max(self._paused_until, self._clock() + delay)
+                if attempt >= self.max_retries:
+                    logger.error("Flood limit still hit after %d retries", attempt)
+                    raise
+                attempt += 1
+                logger.warning("Telegram flood limit: pausing outgoing calls for %.1fs", delay)
+                await self._wait_pause()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None or not endpoint.startswith(("send", "edit")):
+            await self._wait_pause()
+            return await self._call(callback, args, kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_RESULT)
+        call = _Call(callback, args, kwargs, endpoint, data, priority, self._clock())
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane()
+            lane.task = asyncio.get_running_loop().create_task(self._drain(chat_id, lane))
+        lane.calls.append(call)
+        return await call.future
+
+    def _next_batch(self, lane: _Lane) -> List[_Call]:
+        """Pick the next call to send and the queued calls it also answers."""
+        lane.calls = [c for c in lane.calls if not c.future.done()]
+        if not lane.calls:
+            return []
+        head = min(lane.calls, key=lambda c: c.priority)
+        index = lane.calls.index(head)
+
+        if head.endpoint == "editMessageText":
+            # Only the newest text of a message is worth sending
+            target = head.data.get("message_id")
+            batch = [c for c in lane.calls if c.endpoint == "editMessageText" and c.data.get("message_id") == target]
+            self.counters["superseded"] += len(batch) - 1
+            for c in batch:
+                lane.calls.remove(c)
+            return [batch[-1], *batch[:-1]]
+
+        batch = [head]
+        if head.mergeable:
+            parse_mode = head.data.get("parse_mode")
+            text = head.data["text"]
+            for c in lane.calls[index + 1:]:
+                if not c.mergeable or c.data.get("parse_mode") != parse_mode:
+                    break
+                merged = f"{text}\n\n{c.data['text']}"
+                if len(merged) > _MAX_TEXT:
+                    break
+                text = merged
+                batch.append(c)
+            if len(batch) > 1:
+                # `args` holds this same dict, so the request carries the merged text
+                head.data["text"] = text
+                self.counters["merged"] += len(batch) - 1
+        for c in batch:
+            lane.calls.remove(c)
+        return batch
+
+    async def _drain(self, chat_id: Any, lane: _Lane) -> None:
+        bucket = self._bucket(chat_id)
+        try:
+            while lane.calls:
+                pending = [c for c in lane.calls if not c.future.done()]
+                if not pending:
+                    lane.calls.clear()
+                    break
+                await self._acquire(bucket, min(c.priority for c in pending))
+                # Chosen after the wait, so calls queued meanwhile can supersede or join it
+                batch = self._next_batch(lane)
+                if not batch:
+                    continue
+                sent = batch[0]
+                observe("telegram_queue", self._clock() - min(c.queued_at for c in batch))
+                self.counters["sent"] += 1
+                try:
+                    result = await self._call(sent.callback, sent.args, sent.kwargs)
+                except Exception as e:
+                    for c in batch:
+                        if not c.future.done():
+                            c.future.set_exception(e)
+                else:
+                    for c in batch:
+                        if not c.future.done():
+                            c.future.set_result(result)
+        finally:
+            for c in lane.calls:
+                if not c.future.done():
+                    c.future.cancel()
+            if self._lanes.get(chat_id) is lane:
+                del self._lanes[chat_id]
+
+    def snapshot(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = dict(self.counters)
+        data["queued"] = sum(len(lane.calls) for lane in self._lanes.values())
+        data["active_chats"] = len(self._lanes)
+        data["paused_s"] = round(max(0.0, self._paused_until - self._clock()), 3)
+        return data
+
+
+def _limits_from_settings(settings) -> Dict[str, Any]:
+    return {
+        "global_rate": settings.outbound_global_rate,
+        "global_burst": settings.outbound_global_burst,
+        "per_chat_rate": settings.outbound_per_chat_rate,
+        "per_chat_burst": settings.outbound_per_chat_burst,
+        "group_rate": settings.outbound_group_rate,
+        "progress_reserve": settings.outbound_progress_reserve,
+        "max_retries": settings.outbound_max_retries,
+    }
+
+
+_SCHEDULER: Optional[OutboundScheduler] = None
+
+
+def get_scheduler() -> Optional[OutboundScheduler]:
+    """Return the process-wide scheduler, or None when `outbound.enabled` is off."""
+    global _SCHEDULER
+    settings = config.get_settings()
+    if not settings.outbound:
+        return None
+    if _SCHEDULER is None:
+        _SCHEDULER = OutboundScheduler(**_limits_from_settings(settings))
+    return _SCHEDULER
+
+
+def _on_config_reload(settings) -> None:
+    if _SCHEDULER is not None:
+        _SCHEDULER.reconfigure(**_limits_from_settings(settings))
+
+
+config.add_reload_listener(_on_config_reload)
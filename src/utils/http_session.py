@@ -1,14 +1,22 @@
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
 
 _SESSION = None
 
 
-def get_session() -> requests.Session:
-    """Return a singleton requests.Session with sensible retry/backoff for idempotent requests."""
+def get_session() -> "requests.Session":
+    """Return a singleton requests.Session with sensible retry/backoff for idempotent requests.
+
+    requests/urllib3 are imported on first use so importing the handlers stays cheap.
+    """
     global _SESSION
     if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
         session = requests.Session()
         # Add User-Agent header
         session.headers.update({"User-Agent": "PeFi-Bot/1.0"})
@@ -0,0 +1,388 @@
+"""Idempotent ingestion of Telegram updates.
+
+Telegram redelivers an update when the bot did not confirm it (a restart, a
+webhook timeout), and a message can reach the handlers twice after a retried
+request. Without a guard the whole pipeline (download, ASR, Gemini, `add_bill`)
+runs again and the transaction is saved twice.
+
+`idempotent_update` wraps a handler and keys every message by
+``tg:<chat_id>:<message_id>``:
+
+- the first delivery claims the key and runs the handler; the last message the
+  bot sends for it is recorded as the result. Acks and progress updates shown
+  through `ReplyManager` are not recorded, only the confirmation;
+- a handler that queued a job calls `defer_result()`: the key stays claimed
+  when it returns and the job records the result (`recording_bot`);
+- a later delivery gets that result sent again and nothing else runs; a
+  delivery that arrives while the first one is still running is dropped;
+- if the handler raises, its update is shed (`rate_limiter.Shed`) or it sent
+  no result, the claim is released so a redelivery is processed again.
+
+Recent keys live in an in-memory LRU (`idempotency.cache_size`). With
+`idempotency.persistent` they are also recorded in the `idempotency_keys` table,
+so a redelivery after a restart is still recognized. Each claim names the bot
+instance that made it (`idempotency.instance`, the hostname by default): at
+startup an instance releases its own unfinished claims and those older than
+`idempotency.claim_timeout` (`release_unfinished`), never the fresh claims of
+another live replica. Recorded replies expire after `idempotency.ttl`
+(`start_cleanup`).
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import socket
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from .path_setup import setup_project_root
+from .rate_limiter import Shed
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of UpdateLedger.begin
+NEW = "new"
+DONE = "done"
+IN_FLIGHT = "in_flight"
+
+
+def update_key(message: Any) -> Optional[str]:
+    chat_id = getattr(message, "chat_id", None)
+    message_id = getattr(message, "message_id", None)
+    if chat_id is None or message_id is None:
+        return None
+    return f"tg:{chat_id}:{message_id}"
+
+
+class DatabaseStore:
+    """The idempotency_keys table through database.db_operations (blocking; called via to_thread)."""
+
+    def __init__(self, owner: Optional[str] = None):
+        self.owner = owner or socket.gethostname()
+
+    @staticmethod
+    def _ops():
+        try:
+            from database import db_operations
+        except Exception:
+            setup_project_root(__file__)
+            from database import db_operations
+        return db_operations
+
+    def claim(self, key: str) -> Dict[str, Any]:
+        return self._ops().claim_idempotency_key(key, self.owner)
+
+    def complete(self, key: str, result: str) -> None:
+        self._ops().complete_idempotency_key(key, result)
+
+    def release(self, keys=None) -> int:
+        return self._ops().release_idempotency_keys(keys)
+
+    def release_unfinished(self, stale_after: float) -> int:
+        return self._ops().release_idempotency_keys(None, owner=self.owner, stale_after=stale_after)
+
+    def cleanup(self, ttl: float, stale_after: float) -> int:
+        ops = self._ops()
+        return ops.release_idempotency_keys(None, stale_after=stale_after) + ops.purge_idempotency_keys(ttl)
+
+
+class UpdateLedger:
+    """In-memory LRU of processed update keys in front of an optional persistent store.
+
+    All methods run on the event loop thread; store calls are moved to a worker thread.
+    A failing store is logged and skipped, so the bot keeps answering without it.
+    """
+
+    def __init__(self, max_entries: int = 10000, store: Optional[Any] = None):
+        self.max_entries = max_entries
+        self.store = store
+        self._done: "OrderedDict[str, str]" = OrderedDict()
+        self._in_flight: Set[str] = set()
+        self._counters = {"processed": 0, "replayed": 0, "dropped_in_flight": 0, "released": 0, "store_errors": 0}
+
+    def _remember(self, key: str, result: str) -> None:
+        self._done[key] = result
+        self._done.move_to_end(key)
+        while len(self._done) > self.max_entries:
+            self._done.popitem(last=False)
+
+    async def _call_store(self, method: str, *args: Any) -> Any:
+        try:
+            return await asyncio.to_thread(getattr(self.store, method), *args)
+        except Exception:
+            self._counters["store_errors"] += 1
+            logger.warning("Idempotency store %s failed for %s", method, args[:1], exc_info=True)
+            return None
+
+    async def begin(self, key: str) -> Tuple[str, Optional[str]]:
+        """Return (NEW, None) when the caller should process the update, (DONE, result) or (IN_FLIGHT, None)."""
+        if key in self._done:
+            self._done.move_to_end(key)
+            self._counters["replayed"] += 1
+            return DONE, self._done[key]
+        if key in self._in_flight:
+            self._counters["dropped_in_flight"] += 1
+            return IN_FLIGHT, None
+        # Claimed before the first await so a concurrent duplicate sees it
+        self._in_flight.add(key)
+        if self.store is not None:
+            claim = await self._call_store("claim", key)
+            if claim is not None and not claim["claimed"]:
+                self._in_flight.discard(key)
+                if claim["result"] is None:
+                    self._counters["dropped_in_flight"] += 1
+                    return IN_FLIGHT, None
+                self._remember(key, claim["result"])
+                self._counters["replayed"] += 1
+                return DONE, claim["result"]
+        return NEW, None
+
+    async def finish(self, key: str, result: str) -> None:
+        """Record the result of a processed update (also for replies sent after the handler returned)."""
+        if key in self._in_flight:
+            self._in_flight.discard(key)
+            self._counters["processed"] += 1
+        self._remember(key, result)
+        if self.store is not None:
+            await self._call_store("complete", key, result)
+
+    async def abort(self, key: str) -> None:
+        """Forget a claim whose handler failed, so a redelivery is processed again."""
+        self._in_flight.discard(key)
+        self._counters["released"] += 1
+        if self.store is not None:
+            await self._call_store("release", [key])
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"entries": len(self._done), "in_flight": len(self._in_flight), **self._counters}
+
+
+class _RecordingBot:
+    """Bot proxy that reports the text of every message sent or edited through it.
+
+    `unrecorded` is the wrapped bot, for acks and progress updates that must not
+    be replayed as the result.
+    """
+
+    def __init__(self, bot: Any, on_reply: Callable[[str], Awaitable[None]]):
+        self._bot = bot
+        self._on_reply = on_reply
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._bot, name)
+
+    @property
+    def unrecorded(self) -> Any:
+        return self._bot
+
+    async def send_message(self, *args: Any, **kwargs: Any) -> Any:
+        message = await self._bot.send_message(*args, **kwargs)
+        text = kwargs.get("text", args[1] if len(args) > 1 else None)
+        if text:
+            await self._on_reply(str(text))
+        return message
+
+    async def edit_message_text(self, *args: Any, **kwargs: Any) -> Any:
+        # ReplyManager edits the ack into the final result
+        message = await self._bot.edit_message_text(*args, **kwargs)
+        text = kwargs.get("text", args[0] if args else None)
+        if text:
+            await self._on_reply(str(text))
+        return message
+
+
+class _RecordingContext:
+    """Handler context whose `bot` records replies; everything else is the original context."""
+
+    def __init__(self, context: Any, bot: _RecordingBot):
+        self._context = context
+        self.bot = bot
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._context, name)
+
+
+class _Replies:
+    __slots__ = ("ledger", "keys", "last", "finished", "deferred")
+
+    def __init__(self, ledger: UpdateLedger, keys: Tuple[str, ...]):
+        self.ledger = ledger
+        self.keys = keys
+        self.last = ""
+        self.finished = False
+        self.deferred = False
+
+    async def __call__(self, text: str) -> None:
+        self.last = text
+        if self.finished:
+            # A background task or queued job (album, voice transcription) answered after the handler returned
+            for key in self.keys:
+                await self.ledger.finish(key, text)
+
+
+# The replies of the idempotent handler running in the current task, for defer_result
+_CURRENT: "contextvars.ContextVar[Optional[_Replies]]" = contextvars.ContextVar("idempotent_update", default=None)
+
+
+def defer_result() -> None:
+    """Keep the current update claimed after its handler returns; the job it queued records the result.
+
+    Call it once the job is queued, from inside an `idempotent_update` handler. The
+    job must answer through `recording_bot`, which finishes the key (also with its
+    error reply on the last attempt).
+    """
+    replies = _CURRENT.get()
+    if replies is not None:
+        replies.deferred = True
+
+
+def recording_bot(bot: Any, *keys: Optional[str]) -> Any:
+    """`bot` whose replies are recorded as the result of updates `keys`, for work finished outside the handler."""
+    ledger = get_ledger()
+    keys = tuple(key for key in keys if key is not None)
+    if ledger is None or not keys:
+        return bot
+    replies = _Replies(ledger, keys)
+    replies.finished = True
+    return _RecordingBot(bot, replies)
+
+
+def idempotent_update(handler: Callable[..., Awaitable[Any]]):
+    """Decorator for PTB handlers: run each (chat_id, message_id) once and replay its reply on redelivery.
+
+    Apply it outside `admission_controlled`, so duplicates neither spend rate-limit
+    tokens nor reach any download, ASR or Gemini call.
+    """
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        ledger = get_ledger()
+        message = getattr(update, "message", None)
+        key = update_key(message)
+        if ledger is None or key is None:
+            return await handler(update, context)
+
+        state, result = await ledger.begin(key)
+        if state == DONE:
+            logger.info("Update %s was already processed; replaying its reply", key)
+            if result:
+                await context.bot.send_message(chat_id=message.chat_id, text=result)
+            return None
+        if state == IN_FLIGHT:
+            logger.info("Update %s is already being processed; dropping the duplicate", key)
+            return None
+
+        replies = _Replies(ledger, (key,))
+        token = _CURRENT.set(replies)
+        try:
+            outcome = await handler(update, _RecordingContext(context, _RecordingBot(context.bot, replies)))
+        except BaseException:
+            await ledger.abort(key)
+            raise
+        finally:
+            _CURRENT.reset(token)
+        replies.finished = True
+        if isinstance(outcome, Shed):
+            # Not processed: the shed notice is not a result, a redelivery must run the handler
+            await ledger.abort(key)
+            return None
+        if replies.deferred:
+            return outcome
+        if replies.last:
+            await ledger.finish(key, replies.last)
+        else:
+            await ledger.abort(key)
+        return outcome
+
+    return wrapper
+
+
+_LEDGER: Optional[UpdateLedger] = None
+_LEDGER_LOCK = threading.Lock()
+
+
+def _store_from_settings(settings) -> Optional[DatabaseStore]:
+    return DatabaseStore(settings.idempotency_instance) if settings.idempotency_persistent else None
+
+
+def get_ledger() -> Optional[UpdateLedger]:
+    """Return the process-wide ledger, or None when `idempotency.enabled` is off."""
+    global _LEDGER
+    settings = config.get_settings()
+    if not settings.idempotency:
+        return None
+    if _LEDGER is None:
+        with _LEDGER_LOCK:
+            if _LEDGER is None:
+                _LEDGER = UpdateLedger(settings.idempotency_cache_size, _store_from_settings(settings))
+    return _LEDGER
+
+
+def snapshot() -> Dict[str, int]:
+    ledger = _LEDGER
+    return ledger.snapshot() if ledger is not None else {"entries": 0}
+
+
+def release_unfinished() -> int:
+    """Release this instance's claims left without a result by its previous run, and stale claims
+    of any instance (blocking; call once at startup)."""
+    ledger = get_ledger()
+    if ledger is None or ledger.store is None:
+        return 0
+    try:
+        released = ledger.store.release_unfinished(config.get_settings().idempotency_claim_timeout)
+    except Exception:
+        logger.warning("Could not release unfinished idempotency claims", exc_info=True)
+        return 0
+    if released:
+        logger.info("Released %d unfinished update claims from a previous run", released)
+    return released
+
+
+def cleanup() -> int:
+    """Delete recorded replies older than `idempotency.ttl` and claims older than
+    `idempotency.claim_timeout` (blocking). Returns the rows deleted."""
+    ledger = get_ledger()
+    if ledger is None or ledger.store is None:
+        return 0
+    settings = config.get_settings()
+    try:
+        deleted = ledger.store.cleanup(settings.idempotency_ttl, settings.idempotency_claim_timeout)
+    except Exception:
+        logger.warning("Could not clean up the idempotency_keys table", exc_info=True)
+        return 0
+    if deleted:
+        logger.info("Deleted %d expired idempotency keys", deleted)
+    return deleted
+
+
+def start_cleanup(interval: float) -> threading.Event:
+    """Run `cleanup()` every `interval` seconds in a daemon thread; set the returned event to stop."""
+    stop = threading.Event()
+
+    def _loop():
+        while not stop.wait(interval):
+            cleanup()
+
+    threading.Thread(target=_loop, name="idempotency-cleanup", daemon=True).start()
+    return stop
+
+
+def _on_config_reload(settings) -> None:
+    ledger = _LEDGER
+    if ledger is None:
+        return
+    ledger.max_entries = settings.idempotency_cache_size
+    if (ledger.store is not None) != settings.idempotency_persistent:
+        ledger.store = _store_from_settings(settings)
+
+
+config.add_reload_listener(_on_config_reload)
@@ -0,0 +1,260 @@
+"""Receipt photo preprocessing for the Gemini vision call.
+
+`preprocess()` turns the downloaded bytes into the JPEG that is sent to Gemini:
+
+1. small JPEGs that need no resize are passed through untouched (no re-encode);
+2. EXIF rotation is applied and the receipt region is cropped: the paper is the
+   bright class of an Otsu threshold, located with row/column projections on a
+   small probe image, so tables and hands around the receipt are dropped;
+3. the crop is converted to grayscale with a light autocontrast, which keeps
+   faded thermal print readable, and encoded with optimized Huffman tables:
+   the sharp ink/paper edges of a receipt compress a third smaller that way;
+4. the target size follows the aspect ratio: ordinary photos fit `max_side` on
+   the long side, long receipts keep at least `max_side / 2` across (capped at
+   `long_side_cap` on the long side) so their lines are not squashed together.
+
+JPEGs are decoded with `Image.draft`, so libjpeg scales the DCT by 1/2, 1/4 or
+1/8 (and skips the colour conversion) as long as the short side still covers
+`max_side`; the remaining integer factor is taken with `Image.reduce` before the
+final BILINEAR resize. A 12 MP photo is never materialized at full resolution.
+
+The module only depends on Pillow and takes every setting as an argument, so it
+can run in a worker process. `adaptive=False` keeps the previous behaviour
+(RGB, long side to `max_side`, always re-encoded) for comparison.
+"""
+
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional, Tuple
+
+# Aspect ratio (long / short) above which a photo is treated as a long receipt
+LONG_ASPECT = 2.0
+# Size of the grayscale probe used to locate the paper
+_PROBE_SIZE = 160
+# A row/column belongs to the paper when at least this share of it is bright
+_PAPER_FILL = 0.35
+# Crops keeping more than this share of the area are not worth a re-encode of the borders
+_MAX_CROP_AREA = 0.9
+# ... and crops smaller than this are more likely a glare spot than a receipt
+_MIN_CROP_AREA = 0.08
+# Otsu classes closer than this (0-255) mean there is no paper/background contrast
+_MIN_CONTRAST = 40
+_CROP_MARGIN = 0.02
+_EXIF_ORIENTATION = 0x0112
+
+
+@dataclass(frozen=True)
+class PreprocessResult:
+    data: bytes
+    width: int
+    height: int
+    cropped: bool = False
+    passthrough: bool = False
+    image_hash: Optional[int] = None
+    # Pixels actually decoded (after draft scaling); a proxy for decode time and memory
+    decoded_pixels: int = 0
+
+
+def otsu_threshold(histogram) -> int:
+    """Gray level that best separates the 256-bin `histogram` into two classes."""
+    total = sum(histogram)
+    if not total:
+        return 127
+    sum_all = sum(i * h for i, h in enumerate(histogram))
+    sum_bg = weight_bg = 0
+    best_t, best_var = 127, -1.0
+    for t, count in enumerate(histogram):
+        weight_bg += count
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best_var:
+            best_t, best_var = t, between
+    return best_t
+
+
+def _class_means(histogram, threshold: int) -> Tuple[float, float]:
+    low = histogram[: threshold + 1]
+    high = histogram[threshold + 1:]
+    n_low, n_high = sum(low), sum(high)
+    mean_low = sum(i * h for i, h in enumerate(low)) / n_low if n_low else 0.0
+    mean_high = sum((threshold + 1 + i) * h for i, h in enumerate(high)) / n_high if n_high else 255.0
+    return mean_low, mean_high
+
+
+def _span(profile: bytes, fill: float) -> Optional[Tuple[int, int]]:
+    """First and last index whose mean (0-255) reaches `fill`, or None."""
+    level = fill * 255
+    inside = [i for i, value in enumerate(profile) if value >= level]
+    if not inside:
+        return None
+    return inside[0], inside[-1] + 1
+
+
+def find_receipt_box(gray) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box (left, top, right, bottom) of the bright paper in a grayscale image, or None.
+
+    None means there is nothing worth cropping: no contrast between paper and
+    background, the paper already fills the frame, or the bright area is too small.
+    """
+    from PIL import Image
+
+    width, height = gray.size
+    probe = gray.copy()
+    probe.thumbnail((_PROBE_SIZE, _PROBE_SIZE), Image.Resampling.BILINEAR)
+    histogram = probe.histogram()
+    threshold = otsu_threshold(histogram)
+    dark, bright = _class_means(histogram, threshold)
+    if bright - dark < _MIN_CONTRAST:
+        return None
+
+    mask = probe.point([255 if i > threshold else 0 for i in range(256)])
+    pw, ph = mask.size
+    # BOX-resizing the mask to one row/column gives the bright share of every column/row
+    columns = _span(mask.resize((pw, 1), Image.Resampling.BOX).tobytes(), _PAPER_FILL)
+    rows = _span(mask.resize((1, ph), Image.Resampling.BOX).tobytes(), _PAPER_FILL)
+    if columns is None or rows is None:
+        return None
+
+    area = (columns[1] - columns[0]) * (rows[1] - rows[0]) / float(pw * ph)
+    if not (_MIN_CROP_AREA <= area <= _MAX_CROP_AREA):
+        return None
+
+    sx, sy = width / pw, height / ph
+    mx, my = int(width * _CROP_MARGIN), int(height * _CROP_MARGIN)
+    return (
+        max(0, int(columns[0] * sx) - mx),
+        max(0, int(rows[0] * sy) - my),
+        min(width, int(columns[1] * sx) + mx),
+        min(height, int(rows[1] * sy) + my),
+    )
+
+
+def target_size(width: int, height: int, max_side: int, long_side_cap: Optional[int] = None) -> Tuple[int, int]:
+    """Output size for a `width` x `height` image; never upscales."""
+    long_side, short_side = max(width, height), min(width, height)
+    scale = max_side / long_side
+    if short_side and long_side / short_side > LONG_ASPECT:
+        # Long receipt: size by the short side so line height survives the downscale
+        scale = max(scale, (max_side / 2) / short_side)
+        scale = min(scale, (long_side_cap or max_side * 3) / long_side)
+    scale = min(1.0, scale)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def preprocess(
+    content: bytes,
+    max_side: int = 800,
+    quality: int = 60,
+    adaptive: bool = True,
+    passthrough_bytes: int = 150_000,
+    long_side_cap: Optional[int] = None,
+    with_hash: bool = False,
+) -> PreprocessResult:
+    """Decode `content` and return the JPEG payload for the vision model (see module docstring)."""
+    from PIL import Image, ImageOps
+
+    # BytesIO over bytes shares the buffer instead of copying it
+    img = Image.open(BytesIO(content))
+
+    if not adaptive:
+        return _legacy(img, max_side, quality, with_hash)
+
+    width, height = img.size
+    if (
+        img.format == "JPEG"
+        and len(content) <= passthrough_bytes
+        and max(width, height) <= max_side
+        and img.getexif().get(_EXIF_ORIENTATION, 1) == 1
+    ):
+        image_hash = _hash(img) if with_hash else None
+        return PreprocessResult(content, width, height, passthrough=True, image_hash=image_hash,
+                                decoded_pixels=width * height if with_hash else 0)
+
+    # The crop is not known before decoding: keep the short side >= max_side so even a
+    # receipt spanning only the frame's short side keeps full output resolution
+    if img.format == "JPEG":
+        img.draft("L", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    decoded_pixels = img.width * img.height
+    gray = img if img.mode == "L" else img.convert("L")
+    box = find_receipt_box(gray)
+    if box is not None:
+        gray = gray.crop(box)
+
+    gray = _resize(gray, target_size(gray.width, gray.height, max_side, long_side_cap))
+    gray = ImageOps.autocontrast(gray, cutoff=1)
+
+    return PreprocessResult(
+        _encode(gray, quality, optimize=True), gray.width, gray.height, cropped=box is not None,
+        image_hash=_hash(gray) if with_hash else None, decoded_pixels=decoded_pixels,
+    )
+
+
+def _resize(img, size: Tuple[int, int]):
+    """Resize to `size`: integer box reduction first when the factor is >= 2, then BILINEAR."""
+    from PIL import Image
+
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.BILINEAR)
+    return img
+
+
+def _legacy(img, max_side: int, quality: int, with_hash: bool) -> PreprocessResult:
+    width, height = img.size
+    size = (width, height)
+    if max(width, height) > max_side:
+        ratio = max_side / max(width, height)
+        size = (int(width * ratio), int(height * ratio))
+    if img.format == "JPEG":
+        img.draft("RGB", size)
+    decoded_pixels = img.width * img.height
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img = _resize(img, size)
+    return PreprocessResult(
+        _encode(img, quality), img.width, img.height, image_hash=_hash(img) if with_hash else None,
+        decoded_pixels=decoded_pixels,
+    )
+
+
+def _encode(img, quality: int, optimize: bool = False) -> bytes:
+    buffer = BytesIO()
+    # Progressive encoding costs time for no gain here; optimized Huffman tables cost an
+    # extra pass but shrink grayscale text by ~1/3 (photos in colour gain much less)
+    img.save(buffer, format="JPEG", quality=quality, optimize=optimize, progressive=False)
+    return buffer.getvalue()
+
+
+def _hash(img) -> int:
+    from .receipt_dedup import dhash
+
+    return dhash(img)
+
+
+def preprocess_shared(shm_name: str, size: int, options: dict) -> Tuple[PreprocessResult, float]:
+    """Worker-process entry point: preprocess `size` bytes from a shared memory block.
+
+    Returns the result and the seconds spent in the worker, so the caller can tell
+    queueing from processing time.
+    """
+    import time
+    from multiprocessing import shared_memory
+
+    start = time.perf_counter()
+    block = shared_memory.SharedMemory(name=shm_name)
+    try:
+        content = bytes(block.buf[:size])
+    finally:
+        block.close()
+    result = preprocess(content, **options)
+    return result, time.perf_counter() - start
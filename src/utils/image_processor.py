@@ -1,17 +1,13 @@
-import json
+import hashlib
 import logging
-import time
-from io import BytesIO
-from typing import Any, Dict, Optional
-
-import requests
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
+from . import image_preprocessing, image_workers, model_router, receipt_dedup, schemas, vision_cache
 from .http_session import get_session
-from PIL import Image
-from google.api_core.exceptions import DeadlineExceeded
-
 from .path_setup import setup_project_root
-from .promt import get_prompt_path, read_promt_file
+from .promt import get_prompt
+from .metrics import span
 
 # Ensure consistent config import across run contexts
 try:
@@ -20,151 +16,253 @@ except Exception:
     setup_project_root(__file__)
     from src import config  # when running from repo root
 
-from datetime import date
-
 logger = logging.getLogger(__name__)
 
 
-def extract_text(file_path: str) -> Dict[str, Any]:
-    payload = process_image_from_url(file_path)
-    if payload is None:
+@dataclass
+class _Photo:
+    """One receipt photo on its way through the cache, dedup and Gemini steps."""
+
+    fuid_key: Optional[str]
+    image_hash: Optional[int] = None
+    payload: Optional[bytes] = None
+    # Cache keys to store a fresh result under (empty for a file_unique_id hit)
+    keys: List[str] = field(default_factory=list)
+    # Final answer once known without Gemini: cached data, a duplicate or {"raw": "Invalid"}
+    result: Optional[Dict[str, Any]] = None
+
+
+def _prepare(file_path: str, user_key: Any, file_unique_id: Optional[str], cache, version: str) -> _Photo:
+    """Resolve a photo from the vision cache or receipt index, downloading it only when needed."""
+    photo = _Photo(f"fuid:{file_unique_id}" if file_unique_id else None)
+
+    # 1. Same Telegram file as before: no download needed
+    data = cache.get(photo.fuid_key, version) if cache is not None and photo.fuid_key else None
+    if data is not None:
+        photo.image_hash = data.pop("receipt_hash", None)
+    else:
+        processed = process_image_from_url(file_path, with_hash=True)
+        if processed is None:
+            photo.result = {"raw": "Invalid"}
+            return photo
+        photo.payload, photo.image_hash = processed
+
+    # 2. A receipt this user already saved
+    if user_key is not None and photo.image_hash is not None and receipt_dedup.dedup_enabled():
+        entry = receipt_dedup.get_receipt_index().find(user_key, photo.image_hash)
+        if entry is not None:
+            photo.result = {**entry.payload, "duplicate_of": entry.bill_id, "receipt_hash": photo.image_hash}
+            return photo
+
+    if data is None:
+        photo.keys = [photo.fuid_key] if photo.fuid_key else []
+        if cache is not None:
+            # 3. Same image bytes under another file id
+            sha_key = "sha:" + hashlib.sha256(photo.payload).hexdigest()
+            photo.keys.append(sha_key)
+            data = cache.get(sha_key, version)
+            if data is not None:
+                data.pop("receipt_hash", None)
+    if data is not None:
+        photo.result = _finish(photo, data, cache, version)
+    return photo
+
+
+def _finish(photo: _Photo, data: Dict[str, Any], cache, version: str) -> Dict[str, Any]:
+    if cache is not None and photo.keys:
+        cache.put(photo.keys, version, {**data, "receipt_hash": photo.image_hash})
+    # For testing, we set a fixed user_id; in real use this should come from the context
+    data["user_id"] = 2
+    if photo.image_hash is not None:
+        data["receipt_hash"] = photo.image_hash
+    return data
+
+
+def extract_text(file_path: str, user_key: Any = None, file_unique_id: Optional[str] = None) -> Dict[str, Any]:
+    """Extract a transaction from the receipt image at `file_path`.
+
+    The result carries the image's dHash as "receipt_hash". With `user_key`, a
+    near-duplicate of a receipt this user already saved is answered from the
+    receipt index: the stored payload plus "duplicate_of" (its bill_id).
+    Validated results are cached by `file_unique_id` and by the hash of the
+    preprocessed JPEG (see vision_cache), so resends and retries skip Gemini.
+    """
+    template = get_prompt("image_input.txt")
+    cache = vision_cache.get_vision_cache()
+    photo = _prepare(file_path, user_key, file_unique_id, cache, template.version)
+    if photo.result is not None:
+        return photo.result
+
+    # 4. Gemini vision
+    data = _extract_with_gemini(photo.payload, template)
+    if data is None:
         return {"raw": "Invalid"}
-    prompt = read_promt_file(get_prompt_path("image_input.txt"))
+    return _finish(photo, data, cache, template.version)
 
+
+def extract_batch(
+    file_paths: Sequence[str], user_key: Any = None, file_unique_ids: Optional[Sequence[Optional[str]]] = None
+) -> List[Dict[str, Any]]:
+    """`extract_text` for an album: one result per photo, in order.
+
+    Cached and duplicate photos are resolved first; the remaining images go to
+    Gemini together in a single request (prompts/image_batch_input.txt) that
+    answers with an array. If that answer is unusable, each image is retried on
+    its own with the single-receipt prompt.
+    """
+    template = get_prompt("image_input.txt")
+    cache = vision_cache.get_vision_cache()
+    fuids = list(file_unique_ids or [None] * len(file_paths))
+    photos = [
+        _prepare(path, user_key, fuid, cache, template.version) for path, fuid in zip(file_paths, fuids)
+    ]
+    pending = [photo for photo in photos if photo.result is None]
+
+    answers: Optional[List[Optional[Dict[str, Any]]]] = None
+    if len(pending) > 1:
+        answers = _extract_batch_with_gemini([photo.payload for photo in pending], template)
+    if answers is None:
+        answers = [_extract_with_gemini(photo.payload, template) for photo in pending]
+    for photo, data in zip(pending, answers):
+        photo.result = {"raw": "Invalid"} if data is None else _finish(photo, data, cache, template.version)
+    return [photo.result for photo in photos]
+
+
+def _extract_batch_with_gemini(payloads: List[bytes], template) -> Optional[List[Optional[Dict[str, Any]]]]:
+    """One vision request for several images; None when the answer is unusable (caller falls back)."""
+    batch = get_prompt("image_batch_input.txt")
+    contents: List[Any] = []
+    for index, payload in enumerate(payloads, start=1):
+        contents.append(f"Receipt {index}")
+        contents.append({"mime_type": "image/jpeg", "data": payload})
     try:
-        model = config.get_vision_model()
+        data = model_router.generate_json(
+            "vision", template.text + "\n\n" + batch.text, contents, version=f"{template.version}+{batch.version}",
+            schema=schemas.TRANSACTION_LIST, validate=lambda items: len(items) == len(payloads),
+            generation_config={"temperature": 0.1, "response_mime_type": "application/json"},
+            span_name="gemini_vision_batch",
+        )
+    except model_router.RouteTimeout:
+        logger.error("Gemini batch vision request timed out after retries")
+        return None
+    except Exception as e:
+        logger.exception(f"Error in batch extraction: {e}")
+        return None
+    if data is None:
+        logger.warning("Gemini returned no valid answer for %d receipts", len(payloads))
+        return None
+    return [None if schemas.TRANSACTION.declined(item) else item for item in data]
+
 
+def _extract_with_gemini(payload: bytes, template) -> Optional[Dict[str, Any]]:
+    """Run the vision route on the preprocessed JPEG; None if no valid transaction came back."""
+    try:
         # Use generation_config to enforce JSON output
         generation_config = {"temperature": 0.1, "response_mime_type": "application/json"}
 
-        # Call Gemini with optimized timeout and fewer retries for faster response
-        def _call_generate():
-            return model.generate_content(
-                [
-                    prompt,
-                    {"mime_type": "image/jpeg", "data": payload},
-                ],
-                generation_config=generation_config,
-                request_options={"timeout": 30},  # Reduced from 60s to 30s
-            )
-
-        max_retries = 2  # Reduced from 3 to 2 for faster failure
-        backoff = 0.5  # Reduced from 1s to 0.5s
-        response = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                response = _call_generate()
-                break
-            except DeadlineExceeded as e:
-                logger.warning(f"Gemini DeadlineExceeded (attempt {attempt}/{max_retries}): {e}")
-                if attempt == max_retries:
-                    logger.error("Gemini requests timed out after retries")
-                    return {"raw": "Invalid"}
-                time.sleep(backoff)
-                backoff *= 1.5  # Reduced backoff multiplier
-        if response is None:
-            logger.error("No response from Gemini after retries")
-            return {"raw": "Invalid"}
-        result_str = response.text if response.text else ""
-        logger.info(f"Gemini vision response: {result_str[:200]}...")  # Log first 200 chars
-
-        if not result_str or not result_str.strip():
-            logger.warning("Gemini returned empty response")
-            return {"raw": "Invalid"}
-
-        # Try to extract JSON if wrapped in markdown code blocks
-        cleaned_str = result_str.strip()
-        if cleaned_str.startswith("```json"):
-            cleaned_str = cleaned_str[7:]  # Remove ```json
-        if cleaned_str.startswith("```"):
-            cleaned_str = cleaned_str[3:]  # Remove ```
-        if cleaned_str.endswith("```"):
-            cleaned_str = cleaned_str[:-3]  # Remove trailing ```
-        cleaned_str = cleaned_str.strip()
-
-        data = json.loads(cleaned_str)
-
-        if not isinstance(data, dict):
-            logger.warning(f"Gemini response is not a dict: {type(data)}")
-            return {"raw": "Invalid"}
-
-        if data.get("total_amount") is None:
-            logger.warning("Gemini response missing total_amount")
-            return {"raw": "Invalid"}
-
-        # For testing, we set a fixed user_id; in real use this should come from the context
-        data["user_id"] = 2
-        if not data.get("bill_date"):
-            data["bill_date"] = date.today().isoformat()
+        # The extraction rules are the system_instruction; each call only carries the image.
+        # Answers are validated against the transaction schema, repaired once, then escalated.
+        data = model_router.generate_json(
+            "vision", template.text, [{"mime_type": "image/jpeg", "data": payload}], version=template.version,
+            schema=schemas.TRANSACTION, generation_config=generation_config, span_name="gemini_vision",
+        )
+        if data is None or schemas.TRANSACTION.declined(data):
+            logger.warning("Gemini returned no valid receipt data")
+            return None
         return data
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse Gemini response as JSON: {e}")
-        logger.error(f"Raw response was: {result_str[:200]}...")
-        return {"raw": "Invalid"}
+    except model_router.RouteTimeout:
+        logger.error("Gemini requests timed out after retries")
+        return None
     except Exception as e:
         logger.exception(f"Error in extract_text: {e}")
-        return {"raw": "Invalid"}
+        return None
 
 
-def process_image_from_url(image_url: str, max_size: int = 800, quality: int = 60) -> Optional[bytes]:
+def process_image_from_url(
+    image_url: str, max_size: Optional[int] = None, quality: Optional[int] = None, with_hash: bool = False
+) -> Optional[Union[bytes, Tuple[bytes, int]]]:
     """
     Optimized image processing for faster Gemini API calls.
     
     :param image_url: Đường link (URL) đến tệp ảnh (thường là link từ Telegram file_path).
-    :param max_size: Kích thước tối đa cho cạnh dài nhất của ảnh (pixel). Mặc định là 800px (giảm từ 1024).
-    :param quality: Chất lượng ảnh JPEG (1-100). Mặc định là 60 (giảm từ 70).
-    :return: Dữ liệu ảnh đã xử lý dưới dạng bytes, hoặc None nếu lỗi.
+    :param max_size: Kích thước tối đa cho cạnh dài nhất của ảnh (pixel). Mặc định lấy `images.max_side` (800px).
+    :param quality: Chất lượng ảnh JPEG (1-100). Mặc định lấy `images.quality` (60).
+    :param with_hash: Trả về thêm dHash của ảnh đã resize (dùng để phát hiện hóa đơn gửi trùng).
+    :return: Dữ liệu ảnh đã xử lý dưới dạng bytes (hoặc (bytes, dhash) nếu with_hash), hoặc None nếu lỗi.
     """
+    import requests
+
+    settings = config.get_settings()
+    max_size = max_size or settings.image_max_side
+    quality = quality or settings.image_quality
     try:
         # 1. Tải ảnh từ URL vào bộ nhớ (with streaming for large files)
         session = get_session()
         timeout = getattr(config, "HTTP_TIMEOUT", 10)
-        response = session.get(image_url, timeout=timeout, stream=True)
-        response.raise_for_status()
-
-        # 2. Mở ảnh trực tiếp từ dữ liệu nhị phân đã tải
-        image_data = BytesIO(response.content)
-        img = Image.open(image_data)
-
-        # 3. Convert to RGB if needed (faster processing)
-        if img.mode not in ('RGB', 'L'):
-            img = img.convert('RGB')
-
-        # 4. Tính toán và Thay đổi Kích thước (nếu cần)
-        width, height = img.size
-
-        if max(width, height) > max_size:
-            ratio = max_size / max(width, height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-
-            # Use BILINEAR for faster resizing (LANCZOS is slower but higher quality)
-            # For OCR, BILINEAR is sufficient and 2-3x faster
-            img = img.resize((new_width, new_height), Image.Resampling.BILINEAR)
-
-        # 5. Lưu ảnh đã thay đổi kích thước vào một đối tượng BytesIO mới trong bộ nhớ
-        output_buffer = BytesIO()
-
-        # Optimize JPEG encoding for speed
-        save_params = {
-            "quality": quality,
-            "optimize": False,  # Disable optimize for faster encoding
-            "progressive": False,  # Disable progressive for faster encoding
-        }
-
-        # Lưu vào bộ nhớ
-        img.save(output_buffer, format="JPEG", **save_params)
-
-        # Đặt con trỏ về đầu để đọc toàn bộ dữ liệu (bytes)
-        output_buffer.seek(0)
-        processed_bytes = output_buffer.read()
+        max_bytes = int(settings.image_max_download_mb * 1024 * 1024)
+        with span("download"):
+            response = session.get(image_url, timeout=timeout, stream=True)
+            try:
+                response.raise_for_status()
+                content = _read_capped(response, max_bytes)
+            finally:
+                response.close()
 
-        return processed_bytes
+        with span("image_resize"):
+            return _resize_and_encode(content, max_size, quality, with_hash=with_hash)
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Error downloading image: {e}")
         return None
+    except ImageTooLarge as e:
+        logger.warning(f"Image rejected: {e}")
+        return None
     except Exception as e:
         logger.exception(f"Error processing image: {e}")
         return None
+
+
+class ImageTooLarge(Exception):
+    """The image download exceeds `images.max_download_mb`."""
+
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def _read_capped(response, max_bytes: int) -> bytes:
+    """Read a streamed response body, aborting as soon as it exceeds `max_bytes`."""
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ImageTooLarge(f"Content-Length {length} > {max_bytes} bytes")
+    chunks = []
+    total = 0
+    for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+        total += len(chunk)
+        if total > max_bytes:
+            raise ImageTooLarge(f"download exceeded {max_bytes} bytes")
+        chunks.append(chunk)
+    # A single chunk is returned as-is; otherwise one join, and Pillow reads it without a further copy
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+def _resize_and_encode(content: bytes, max_size: int, quality: int, with_hash: bool = False):
+    """Preprocess image bytes into the JPEG sent to Gemini; optionally also return its dHash."""
+    settings = config.get_settings()
+    options = {
+        "max_side": max_size,
+        "quality": quality,
+        "adaptive": settings.image_adaptive,
+        "passthrough_bytes": settings.image_passthrough_kb * 1024,
+        "long_side_cap": settings.image_long_side_cap,
+        "with_hash": with_hash,
+    }
+    pool = image_workers.get_pool()
+    if pool is not None:
+        result = pool.run(content, **options)
+    else:
+        result = image_preprocessing.preprocess(content, **options)
+    if with_hash:
+        # Hash of the preprocessed image: cheap, and independent of the upload resolution
+        return result.data, result.image_hash
+    return result.data
@@ -0,0 +1,176 @@
+"""Process pool for receipt image preprocessing.
+
+Decoding, cropping and JPEG encoding are CPU-bound, so with `images.workers > 0`
+`image_processor` hands them to a pool of worker processes instead of running
+them on the calling thread:
+
+- the downloaded bytes go through a `multiprocessing.shared_memory` block, so
+  only its name is pickled; the preprocessed JPEG (tens of KB) comes back as the
+  result;
+- at most `workers + queue_size` images are in flight; further callers wait up
+  to `worker_timeout` seconds for a slot and then get PreprocessQueueFull;
+- each image must finish within `worker_timeout` seconds (PreprocessTimeout);
+- queue wait and worker time are recorded as the `image_queue` and
+  `image_worker` metrics stages, and `snapshot()` is a metrics source.
+
+Workers are spawned (not forked), so they never inherit the bot's threads or
+sockets. `images.workers: 0` keeps preprocessing in-process.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+from . import image_preprocessing
+from .metrics import observe
+from .path_setup import setup_project_root
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+
+class PreprocessQueueFull(Exception):
+    """No pool slot became free within the timeout."""
+
+
+class PreprocessTimeout(Exception):
+    """A worker did not finish the image within the timeout."""
+
+
+def _ping() -> bool:
+    return True
+
+
+class ImageWorkerPool:
+    """Bounded front of a ProcessPoolExecutor running image_preprocessing.preprocess."""
+
+    def __init__(self, workers: int, queue_size: int = 16, timeout: float = 15.0):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "timeouts": 0, "rejected": 0, "in_flight": 0}
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _count(self, name: str, delta: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += delta
+
+    def warm_up(self) -> None:
+        """Start every worker now instead of on the first photos."""
+        for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+            future.result(timeout=self.timeout * 4)
+
+    def run(self, content: bytes, **options: Any) -> "image_preprocessing.PreprocessResult":
+        """Preprocess `content` in a worker; `options` are passed to image_preprocessing.preprocess."""
+        from multiprocessing import shared_memory
+
+        queued_at = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("rejected")
+            raise PreprocessQueueFull(f"{self.workers + self.queue_size} images already in flight")
+        self._count("submitted")
+        self._count("in_flight")
+        block = shared_memory.SharedMemory(create=True, size=max(1, len(content)))
+        try:
+            block.buf[:len(content)] = content
+            future = self._executor.submit(image_preprocessing.preprocess_shared, block.name, len(content), options)
+            remaining = max(0.0, self.timeout - (time.perf_counter() - queued_at))
+            try:
+                result, worker_s = future.result(timeout=remaining)
+            except FutureTimeout:
+                future.cancel()
+                self._count("timeouts")
+                observe("image_worker", time.perf_counter() - queued_at, error=True)
+                raise PreprocessTimeout(f"image not preprocessed within {self.timeout:g}s") from None
+            except BrokenProcessPool:
+                self._count("failed")
+                logger.error("Image worker pool broke (a worker died); starting a new one")
+                self._restart()
+                raise
+            except Exception:
+                self._count("failed")
+                raise
+        finally:
+            # Unlinking only drops the name; a worker still reading keeps its mapping
+            block.close()
+            block.unlink()
+            self._count("in_flight", -1)
+            self._slots.release()
+
+        observe("image_queue", max(0.0, time.perf_counter() - queued_at - worker_s))
+        observe("image_worker", worker_s)
+        self._count("completed")
+        return result
+
+    def _restart(self) -> None:
+        with self._lock:
+            broken, self._executor = self._executor, self._new_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {"workers": self.workers, **self._counters}
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+_POOL: Optional[ImageWorkerPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> Optional[ImageWorkerPool]:
+    """Return the process-wide pool, or None when `images.workers` is 0."""
+    global _POOL
+    settings = config.get_settings()
+    if settings.image_workers <= 0:
+        return None
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ImageWorkerPool(settings.image_workers, settings.image_queue_size,
+                                        settings.image_worker_timeout)
+    return _POOL
+
+
+def shutdown_pool(wait: bool = True) -> None:
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+def snapshot() -> Dict[str, int]:
+    pool = _POOL
+    return pool.snapshot() if pool is not None else {"workers": 0}
+
+
+def _on_config_reload(settings) -> None:
+    pool = _POOL
+    if pool is None:
+        return
+    if (pool.workers, pool.queue_size) != (settings.image_workers, settings.image_queue_size):
+        # The next photo builds a pool with the new size; images in flight finish on the old one
+        logger.info("Image worker pool resized to %d workers", settings.image_workers)
+        shutdown_pool(wait=False)
+    else:
+        pool.timeout = settings.image_worker_timeout
+
+
+config.add_reload_listener(_on_config_reload)
@@ -0,0 +1,366 @@
+"""Durable queue for background work: voice transcription and album extraction.
+
+Handlers that answer later (after an "đang xử lý" ack) used to schedule their
+work with `application.create_task`; a deploy or crash silently dropped it. They
+now `submit` a job instead, and the work survives restarts:
+
+- jobs are rows in a small SQLite file (`jobs.path`); a payload holds only
+  JSON (chat id, file path or URL, ...), never Telegram objects;
+- `jobs.workers` asyncio workers claim jobs, which stay invisible to other
+  workers for `jobs.visibility_timeout` seconds; the lease is renewed while the
+  job runs, so the job of a crashed process becomes claimable again shortly
+  after (also by another process sharing the file);
+- a handler records the outcome of a step that must not run twice (the bills it
+  inserted) with `checkpoint`, which stores it in the job's payload; a retry
+  finds it there and reports it instead of inserting again;
+- a handler that raises is retried after `jobs.retry_delay * 2**(attempt-1)`
+  seconds, up to `jobs.max_attempts`; then the row is kept with status
+  ``failed`` for inspection. Handlers see `job.last_attempt` to tell the user;
+- `drain()` (on shutdown) stops claiming, lets running jobs finish for up to
+  `jobs.drain_timeout` seconds and puts the rest back in the queue without
+  counting the attempt.
+
+With `jobs.enabled: false`, or before the queue is started (tests, benchmarks),
+`submit` runs the handler once as an application task, as before.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .metrics import observe
+from .path_setup import setup_project_root
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, run_at);
+"""
+
+
+@dataclass
+class Job:
+    job_id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int = 1
+    max_attempts: int = 1
+
+    @property
+    def last_attempt(self) -> bool:
+        return self.attempts >= self.max_attempts
+
+
+JobHandler = Callable[[Job, Any], Awaitable[None]]
+
+# kind -> async handler(job, bot); filled by the modules that submit jobs
+_HANDLERS: Dict[str, JobHandler] = {}
+
+
+def register(kind: str, handler: JobHandler) -> None:
+    _HANDLERS[kind] = handler
+
+
+class JobStore:
+    """SQLite table of jobs with lease-based claiming (safe across threads and processes)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _write(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], max_attempts: int) -> int:
+        now = time.time()
+        cursor = self._write(
+            "INSERT INTO jobs (kind, payload, max_attempts, run_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), max_attempts, now, now),
+        )
+        return cursor.lastrowid
+
+    def claim(self, kinds, lease_s: float) -> Optional[Job]:
+        """Take the oldest ready job of `kinds` (queued and due, or running with an expired lease)."""
+        if not kinds:
+            return None
+        now = time.time()
+        marks = ", ".join("?" * len(kinds))
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes cannot claim the same row
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT job_id, kind, payload, attempts, max_attempts FROM jobs WHERE kind IN ({marks}) "
+                    "AND ((status = 'queued' AND run_at <= ?) OR (status = 'running' AND lease_until < ?)) "
+                    "ORDER BY run_at, job_id LIMIT 1",
+                    (*kinds, now, now),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ? WHERE job_id = ?",
+                        (now + lease_s, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job_id, kind, payload, attempts, max_attempts = row
+        return Job(job_id, kind, json.loads(payload), attempts + 1, max_attempts)
+
+    def extend(self, job_id: int, lease_s: float) -> None:
+        self._write("UPDATE jobs SET lease_until = ? WHERE job_id = ? AND status = 'running'",
+                    (time.time() + lease_s, job_id))
+
+    def update_payload(self, job_id: int, payload: Dict[str, Any]) -> None:
+        self._write("UPDATE jobs SET payload = ? WHERE job_id = ?",
+                    (json.dumps(payload, ensure_ascii=False), job_id))
+
+    def complete(self, job_id: int) -> None:
+        self._write("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def retry(self, job_id: int, delay: float, error: str) -> None:
+        self._write(
+            "UPDATE jobs SET status = 'queued', run_at = ?, lease_until = NULL, last_error = ? WHERE job_id = ?",
+            (time.time() + delay, error, job_id),
+        )
+
+    def bury(self, job_id: int, error: str) -> None:
+        self._write("UPDATE jobs SET status = 'failed', lease_until = NULL, last_error = ? WHERE job_id = ?",
+                    (error, job_id))
+
+    def release(self, job_id: int) -> None:
+        """Put a job interrupted by shutdown back in the queue; the attempt does not count."""
+        self._write(
+            "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), run_at = ?, lease_until = NULL "
+            "WHERE job_id = ?",
+            (time.time(), job_id),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """Asyncio workers running the registered handlers for jobs claimed from a JobStore."""
+
+    def __init__(self, store: JobStore, workers: int = 2, max_attempts: int = 3, visibility_timeout: float = 60.0,
+                 retry_delay: float = 5.0, poll_interval: float = 1.0):
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.bot: Any = None
+        self._workers: List["asyncio.Task[None]"] = []
+        self._running: Dict[int, "asyncio.Task[None]"] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        # Jobs queued or running, kept in memory so admission control can read it on every update
+        self._depth = 0
+        self._counters = {"enqueued": 0, "completed": 0, "retried": 0, "failed": 0, "released": 0}
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers) and not self._stopping
+
+    def depth(self) -> int:
+        """Jobs queued or running (including those left by a previous process)."""
+        return max(0, self._depth)
+
+    def start(self, bot: Any) -> None:
+        """Start the workers on the running loop; jobs left by a previous process are picked up too."""
+        self.bot = bot
+        self._stopping = False
+        stored = self.store.counts()
+        self._depth = stored.get("queued", 0) + stored.get("running", 0)
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._work(), name=f"job-worker-{i}") for i in range(self.workers)]
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any]) -> int:
+        job_id = await asyncio.to_thread(self.store.enqueue, kind, payload, self.max_attempts)
+        self._depth += 1
+        self._counters["enqueued"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def _work(self) -> None:
+        while not self._stopping:
+            try:
+                job = await asyncio.to_thread(self.store.claim, tuple(_HANDLERS), self.visibility_timeout)
+            except Exception:
+                logger.exception("Could not claim a job")
+                job = None
+            if job is not None and self._stopping:
+                await asyncio.to_thread(self.store.release, job.job_id)
+                break
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        start = time.perf_counter()
+        task = asyncio.get_running_loop().create_task(_HANDLERS[job.kind](job, self.bot))
+        self._running[job.job_id] = task
+        try:
+            # Renew the lease while the handler runs, so only a dead process lets it expire
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.visibility_timeout / 3)
+                if done:
+                    break
+                await asyncio.to_thread(self.store.extend, job.job_id, self.visibility_timeout)
+        finally:
+            self._running.pop(job.job_id, None)
+
+        if task.cancelled():
+            self._counters["released"] += 1
+            logger.info("Job %s (%s) interrupted by shutdown; back in the queue", job.job_id, job.kind)
+            await asyncio.to_thread(self.store.release, job.job_id)
+            return
+        error = task.exception()
+        observe(f"job_{job.kind}", time.perf_counter() - start, error=error is not None)
+        if error is None or job.last_attempt:
+            self._depth -= 1
+        if error is None:
+            self._counters["completed"] += 1
+            await asyncio.to_thread(self.store.complete, job.job_id)
+        elif job.last_attempt:
+            self._counters["failed"] += 1
+            logger.error("Job %s (%s) failed after %d attempts", job.job_id, job.kind, job.attempts,
+                         exc_info=error)
+            await asyncio.to_thread(self.store.bury, job.job_id, repr(error))
+        else:
+            self._counters["retried"] += 1
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            logger.warning("Job %s (%s) failed (attempt %d/%d), retrying in %.0fs: %r",
+                           job.job_id, job.kind, job.attempts, job.max_attempts, delay, error)
+            await asyncio.to_thread(self.store.retry, job.job_id, delay, repr(error))
+
+    async def drain(self, timeout: float) -> None:
+        """Stop claiming, give running jobs `timeout` seconds, then put the unfinished ones back."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        running = list(self._running.values())
+        if running:
+            logger.info("Waiting up to %.0fs for %d running jobs", timeout, len(running))
+            _, pending = await asyncio.wait(running, timeout=timeout) if timeout > 0 else (set(), set(running))
+            for task in pending:
+                task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def snapshot(self) -> Dict[str, int]:
+        try:
+            stored = self.store.counts()
+        except sqlite3.Error:
+            stored = {}
+        return {
+            "queued": stored.get("queued", 0),
+            "running": stored.get("running", 0),
+            "dead": stored.get("failed", 0),
+            "depth": self.depth(),
+            **self._counters,
+        }
+
+
+_QUEUE: Optional[JobQueue] = None
+_QUEUE_LOCK = threading.Lock()
+_OPEN_FAILED = False
+
+
+def get_queue() -> Optional[JobQueue]:
+    """Return the process-wide queue, or None when `jobs.enabled` is off or the file cannot be opened."""
+    global _QUEUE, _OPEN_FAILED
+    settings = config.get_settings()
+    if not settings.jobs or _OPEN_FAILED:
+        return None
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None and not _OPEN_FAILED:
+                try:
+                    _QUEUE = JobQueue(JobStore(settings.jobs_path), settings.jobs_workers, settings.jobs_max_attempts,
+                                      settings.jobs_visibility_timeout, settings.jobs_retry_delay)
+                except (OSError, sqlite3.Error):
+                    _OPEN_FAILED = True
+                    logger.exception("Cannot open job queue at %s; running jobs in-process", settings.jobs_path)
+    return _QUEUE
+
+
+async def submit(application: Any, kind: str, payload: Dict[str, Any], update: Any = None) -> None:
+    """Queue `payload` for the `kind` handler; without a started queue, run it once as an application task."""
+    queue = _QUEUE
+    if queue is not None and queue.started:
+        await queue.enqueue(kind, payload)
+        return
+    application.create_task(_HANDLERS[kind](Job(0, kind, payload), application.bot), update=update)
+
+
+async def checkpoint(job: Job, **values: Any) -> None:
+    """Add `values` to the job's payload, in the queue too, so that a retry of the job sees them."""
+    job.payload.update(values)
+    queue = _QUEUE
+    if job.job_id and queue is not None:
+        await asyncio.to_thread(queue.store.update_payload, job.job_id, job.payload)
+
+
+def snapshot() -> Dict[str, int]:
+    queue = _QUEUE
+    return queue.snapshot() if queue is not None else {"queued": 0}
+
+
+def _on_config_reload(settings) -> None:
+    queue = _QUEUE
+    if queue is None:
+        return
+    queue.max_attempts = settings.jobs_max_attempts
+    queue.visibility_timeout = settings.jobs_visibility_timeout
+    queue.retry_delay = settings.jobs_retry_delay
+
+
+config.add_reload_listener(_on_config_reload)
@@ -0,0 +1,274 @@
+"""Weighted keyword scoring for the text and voice heuristics (intent, transaction category).
+
+All phrases are compiled once into an Aho-Corasick automaton, so a message is
+scored in one pass over its characters however many phrases there are.
+
+Matching works on a folded copy of the text (lowercase, Vietnamese diacritics
+removed, every digit replaced by ``#``, one character per character), so:
+
+- "tong chi thang 11" matches "tổng chi" and "tháng #" like the accented text;
+- text written with diacritics (an ASR transcript, most typed messages) must
+  carry the phrase's own: "thu tiền" matches "thu", "thứ hai" does not, and
+  "cho mẹ" does not match "chó";
+- phrases match whole words: "chi" does not match "chiều", while "k" matches
+  the unit in "50k" because only letters count as word characters; a ``#`` at
+  the edge of a phrase matches a whole number of that many digits ("tháng ##"
+  matches "tháng 11", not "tháng 150k"), except in digit-only phrases ("###"
+  matches any number of at least three digits).
+
+Each distinct phrase adds its weight to its label once per message; phrases that
+share a `group` add the group's highest weight once (e.g. any currency unit).
+"""
+
+import re
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+
+_COMBINING_RE = re.compile("[\u0300-\u036f]")
+
+
+def _build_fold_table() -> Dict[int, str]:
+    table = {ord(d): "#" for d in "0123456789"}
+    table[ord("đ")] = "d"
+    # Latin-1 Supplement, Latin Extended-A/B and Latin Extended Additional cover Vietnamese
+    for start, end in ((0x00C0, 0x0250), (0x1E00, 0x1F00)):
+        for code in range(start, end):
+            base = _COMBINING_RE.sub("", unicodedata.normalize("NFD", chr(code)))
+            if len(base) == 1 and base != chr(code):
+                table[code] = base
+    return table
+
+
+_FOLD = _build_fold_table()
+_DIGITS = {ord(d): "#" for d in "0123456789"}
+
+
+def fold(text: str) -> str:
+    """Lowercase, strip diacritics and mark digits as ``#``, keeping one character per character."""
+    return text.lower().translate(_FOLD)
+
+
+def _joined(phrase: str, edge: str, neighbour) -> bool:
+    """True if `neighbour` continues the word or number at the `edge` of a matched phrase."""
+    if not neighbour:
+        return False
+    if edge == "#":
+        # "tháng #" matches "tháng 5", not the start of "tháng 150k"; an all-digit
+        # phrase ("###") matches inside any longer number
+        return neighbour == "#" and phrase.strip("#") != ""
+    return edge.isalpha() and neighbour.isalpha()
+
+
+class Keyword(NamedTuple):
+    label: str
+    phrase: str
+    weight: float = 1.0
+    group: Optional[str] = None
+
+
+class KeywordHits(NamedTuple):
+    scores: Dict[str, float]
+    phrases: FrozenSet[str]
+
+    def score(self, label: str) -> float:
+        return self.scores.get(label, 0.0)
+
+
+class KeywordEngine:
+    """Aho-Corasick automaton over folded phrases, built once."""
+
+    def __init__(self, keywords: Iterable[Keyword]):
+        self.keywords: List[Keyword] = list(keywords)
+        # Phrase as written (lowercase, digits as "#"): compared when the text has diacritics
+        self._marked = [k.phrase.lower().translate(_DIGITS) for k in self.keywords]
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in fold(keyword.phrase):
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(index)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # Outputs of the longest proper suffix are reported from this state too
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text: str) -> KeywordHits:
+        """Score `text` against every phrase in one pass."""
+        marked = text.lower().translate(_DIGITS)
+        folded = marked.translate(_FOLD)
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        # Text typed without diacritics matches on the folded form alone
+        accented = marked != folded
+        state = 0
+        n = len(folded)
+        for i, ch in enumerate(folded):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for index in out[state]:
+                if index in found:
+                    continue
+                phrase = self._marked[index]
+                start = i - len(phrase) + 1
+                if _joined(phrase, phrase[0], start > 0 and folded[start - 1]):
+                    continue
+                if _joined(phrase, phrase[-1], i + 1 < n and folded[i + 1]):
+                    continue
+                if accented and marked[start:i + 1] != phrase:
+                    continue
+                found.add(index)
+
+        scores: Dict[str, float] = {}
+        groups: Dict[tuple, float] = {}
+        for index in found:
+            keyword = self.keywords[index]
+            if keyword.group is None:
+                scores[keyword.label] = scores.get(keyword.label, 0.0) + keyword.weight
+            else:
+                key = (keyword.label, keyword.group)
+                groups[key] = max(groups.get(key, 0.0), keyword.weight)
+        for (label, _), weight in groups.items():
+            scores[label] = scores.get(label, 0.0) + weight
+        return KeywordHits(scores, frozenset(self.keywords[i].phrase for i in found))
+
+
+# Labels: "report_request" triggers the text handler's report path without a Gemini
+# call; "transaction" and "report" are the voice handler's intent scores.
+INTENT_KEYWORDS = (
+    Keyword("report_request", "tổng chi"),
+    Keyword("report_request", "tổng thu"),
+    Keyword("report_request", "tổng hợp"),
+    Keyword("report_request", "báo cáo"),
+    Keyword("report_request", "tháng #"),
+    Keyword("report_request", "tháng ##"),
+    Keyword("report_request", "tháng#"),
+    Keyword("report_request", "tháng##"),
+    Keyword("report_request", "# ngày"),
+    Keyword("report_request", "## ngày"),
+    Keyword("report_request", "### ngày"),
+    Keyword("report_request", "#ngày"),
+    Keyword("report_request", "##ngày"),
+    Keyword("report_request", "###ngày"),
+
+    Keyword("transaction", "mua", 3),
+    Keyword("transaction", "chi", 3),
+    Keyword("transaction", "trả", 3),
+    Keyword("transaction", "thanh toán", 3),
+    Keyword("transaction", "chuyển khoản", 3),
+    Keyword("transaction", "ck", 2),
+    Keyword("transaction", "nạp", 2),
+    Keyword("transaction", "rút", 2),
+    Keyword("transaction", "gửi", 2),
+    Keyword("transaction", "bán", 2),
+    Keyword("transaction", "thu", 2),
+    Keyword("transaction", "nhận", 2),
+    # An amount is a strong transaction signal, a currency unit a weaker one. Spoken
+    # amounts arrive as digits with the unit folded in (utils/spoken_numbers.py:
+    # "năm mươi nghìn" -> "50000"); numbers under 100 are mostly days and months.
+    Keyword("transaction", "###", 6),
+    Keyword("transaction", "nghìn", 2, group="currency"),
+    Keyword("transaction", "ngàn", 2, group="currency"),
+    Keyword("transaction", "triệu", 2, group="currency"),
+    Keyword("transaction", "k", 2, group="currency"),
+    Keyword("transaction", "đồng", 2, group="currency"),
+    Keyword("transaction", "vnd", 2, group="currency"),
+    Keyword("transaction", "vnđ", 2, group="currency"),
+
+    Keyword("report", "tổng chi", 5),
+    Keyword("report", "tổng thu", 5),
+    Keyword("report", "tổng hợp", 5),
+    Keyword("report", "báo cáo", 4),
+    Keyword("report", "xem chi tiêu", 4),
+    Keyword("report", "xem thu nhập", 4),
+    Keyword("report", "thống kê", 3),
+    Keyword("report", "tổng kết", 3),
+    Keyword("report", "chi tiết", 2),
+    Keyword("report", "tháng này", 2),
+    Keyword("report", "tháng trước", 2),
+    Keyword("report", "hôm nay", 1),
+    Keyword("report", "tuần này", 2),
+    Keyword("report", "năm nay", 2),
+    # Periods; a date range ("từ ngày một tháng mười một" -> "từ 2025-11-01")
+    Keyword("report", "tháng #", 2, group="period"),
+    Keyword("report", "tháng ##", 2, group="period"),
+    Keyword("report", "# ngày", 2, group="period"),
+    Keyword("report", "## ngày", 2, group="period"),
+    Keyword("report", "### ngày", 2, group="period"),
+    Keyword("report", "từ ####-##-##", 3),
+)
+
+# Categories of prompts/text_input.txt that a voice transaction can be filed under
+# without Gemini (utils/text_processor.parse_spoken_transaction). Only one category may
+# match; phrases shared by two categories ("cho thuê nhà" / "thuê nhà") send the
+# transcript to Gemini. "income" marks words that say money came in.
+CATEGORY_KEYWORDS = tuple(
+    Keyword(label, phrase)
+    for label, phrases in (
+        ("Ăn uống", ("ăn", "cà phê", "cafe", "cơm", "phở", "bún", "bánh mì", "trà sữa", "nhà hàng", "lẩu", "bia")),
+        ("Xe cộ", ("xăng", "grab", "taxi", "gửi xe", "vé xe", "xe ôm", "rửa xe")),
+        ("Mua sắm", ("mua sắm", "quần áo", "giày", "siêu thị", "shopee", "lazada", "tiki", "mỹ phẩm")),
+        ("Học tập", ("học phí", "sách", "khóa học", "khoá học")),
+        ("Đầu tư", ("đầu tư", "chứng khoán", "cổ phiếu")),
+        ("Y tế", ("thuốc", "khám", "bệnh viện", "nha khoa")),
+        ("Du lịch", ("du lịch", "khách sạn", "vé máy bay")),
+        ("Điện", ("tiền điện", "hóa đơn điện", "hoá đơn điện")),
+        ("Nước", ("tiền nước", "hóa đơn nước", "hoá đơn nước")),
+        ("Mạng Internet", ("internet", "wifi", "tiền mạng", "cước mạng", "cước điện thoại")),
+        ("Thuê Nhà", ("tiền nhà", "thuê nhà", "tiền trọ", "phòng trọ")),
+        ("Giải trí", ("xem phim", "karaoke", "netflix", "spotify", "game")),
+        ("Thú cưng", ("thú cưng", "chó", "mèo")),
+        ("Dịch vụ", ("cắt tóc", "gội đầu", "giặt", "spa")),
+        ("Sửa chữa", ("sửa", "sửa chữa", "bảo dưỡng")),
+        ("Quà tặng", ("quà", "tặng", "mừng cưới", "biếu")),
+        ("Lương", ("lương",)),
+        ("Tiền lãi đầu tư", ("tiền lãi", "cổ tức")),
+        ("Tiền cho thuê nhà", ("cho thuê",)),
+        ("income", ("nhận", "thu", "được trả", "hoàn tiền")),
+    )
+    for phrase in phrases
+)
+INCOME_CATEGORIES = frozenset(("Lương", "Tiền lãi đầu tư", "Tiền cho thuê nhà", "Thu nhập khác"))
+
+_ENGINES: Dict[str, KeywordEngine] = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def _engine(name: str, keywords: Iterable[Keyword]) -> KeywordEngine:
+    engine = _ENGINES.get(name)
+    if engine is None:
+        with _ENGINES_LOCK:
+            engine = _ENGINES.get(name)
+            if engine is None:
+                engine = _ENGINES[name] = KeywordEngine(keywords)
+    return engine
+
+
+def get_intent_engine() -> KeywordEngine:
+    """Return the automaton for INTENT_KEYWORDS, compiled on first use."""
+    return _engine("intent", INTENT_KEYWORDS)
+
+
+def get_category_engine() -> KeywordEngine:
+    """Return the automaton for CATEGORY_KEYWORDS, compiled on first use."""
+    return _engine("category", CATEGORY_KEYWORDS)
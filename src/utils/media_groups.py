@@ -0,0 +1,56 @@
+"""Collects the photos of a Telegram album (media group) before they are processed.
+
+Telegram delivers an album as separate updates sharing `media_group_id`, a few
+milliseconds to a second apart, with no marker for the last one. The first
+photo of a group starts a task that waits until no new photo has arrived for
+`images.album_window` seconds (or the album is full) and then takes the whole
+group; the other updates only add their photo and return immediately, so the
+per-chat update queue is never blocked waiting for the rest of the album.
+
+All methods run on the event loop thread; no locking is needed.
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, Hashable, List
+
+# Telegram albums hold at most 10 items
+MAX_ALBUM_SIZE = 10
+
+
+class _Group:
+    __slots__ = ("items", "last_added")
+
+    def __init__(self) -> None:
+        self.items: List[Any] = []
+        self.last_added = time.monotonic()
+
+
+class MediaGroupCollector:
+    def __init__(self, max_items: int = MAX_ALBUM_SIZE):
+        self.max_items = max_items
+        self._groups: Dict[Hashable, _Group] = {}
+
+    def add(self, key: Hashable, item: Any) -> bool:
+        """Add `item` to its group; True for the first item, whose caller must then `collect` the group."""
+        group = self._groups.get(key)
+        first = group is None
+        if first:
+            group = self._groups[key] = _Group()
+        group.items.append(item)
+        group.last_added = time.monotonic()
+        return first
+
+    async def collect(self, key: Hashable, window: float) -> List[Any]:
+        """Wait until the group has been quiet for `window` seconds (or is full) and take its items."""
+        group = self._groups[key]
+        while len(group.items) < self.max_items:
+            remaining = group.last_added + window - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        del self._groups[key]
+        return group.items
+
+    def pending(self) -> int:
+        return len(self._groups)
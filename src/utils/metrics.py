@@ -0,0 +1,244 @@
+"""Per-stage latency instrumentation for the bot.
+
+Use `span("stage")` around a unit of work (download, ffmpeg, Gemini call, DB
+query, Telegram send, ...). Durations are measured with time.perf_counter and
+aggregated per stage into a Prometheus-style histogram plus a bounded sample
+reservoir for p50/p90/p99. Results can be exported via:
+
+  - `render_prometheus()` / `start_http_exporter(port)` for a /metrics endpoint
+  - `start_log_dumper(interval)` for a periodic log summary
+  - `enable_opentelemetry()` to also emit OpenTelemetry spans (optional dependency)
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Deque, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.9, 0.99)
+RESERVOIR_SIZE = 2048
+
+_LOCK = threading.Lock()
+_tracer = None
+
+
+class StageHistogram:
+    """Cumulative bucket counts plus a reservoir of the most recent samples for quantiles."""
+
+    __slots__ = ("count", "total", "errors", "bucket_counts", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.samples: Deque[float] = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+        self.samples.append(seconds)
+
+    def quantiles(self) -> Dict[float, float]:
+        if not self.samples:
+            return {q: 0.0 for q in QUANTILES}
+        ordered = sorted(self.samples)
+        last = len(ordered) - 1
+        return {q: ordered[min(last, int(round(q * last)))] for q in QUANTILES}
+
+
+_HISTOGRAMS: Dict[str, StageHistogram] = {}
+_SOURCES: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def observe(stage: str, seconds: float, error: bool = False) -> None:
+    """Record one duration for `stage`."""
+    with _LOCK:
+        hist = _HISTOGRAMS.get(stage)
+        if hist is None:
+            hist = _HISTOGRAMS[stage] = StageHistogram()
+        hist.observe(seconds, error)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[None]:
+    """Time the enclosed block and record it under `stage` (also as an OTel span if enabled)."""
+    otel_cm = _tracer.start_as_current_span(stage, attributes=attributes or None) if _tracer is not None else None
+    if otel_cm is not None:
+        otel_cm.__enter__()
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, error)
+        if otel_cm is not None:
+            otel_cm.__exit__(None, None, None)
+
+
+def register_source(name: str, fn: Callable[[], Dict[str, Any]]) -> None:
+    """Register a callable returning numeric counters/gauges to include in exports."""
+    _SOURCES[name] = fn
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """Return {stage: {count, sum, errors, p50, p90, p99}} for all recorded stages."""
+    with _LOCK:
+        out = {}
+        for stage, hist in _HISTOGRAMS.items():
+            q = hist.quantiles()
+            out[stage] = {
+                "count": hist.count,
+                "sum": hist.total,
+                "errors": hist.errors,
+                "p50": q[0.5],
+                "p90": q[0.9],
+                "p99": q[0.99],
+            }
+        return out
+
+
+def reset() -> None:
+    """Drop all recorded samples (useful for tests and benchmarks)."""
+    with _LOCK:
+        _HISTOGRAMS.clear()
+
+
+def _label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus() -> str:
+    """Render all histograms and registered sources in the Prometheus text exposition format."""
+    lines: List[str] = [
+        "# HELP pefi_stage_duration_seconds Duration of bot processing stages.",
+        "# TYPE pefi_stage_duration_seconds histogram",
+    ]
+    with _LOCK:
+        stages = sorted(_HISTOGRAMS.items())
+        for stage, hist in stages:
+            s = _label(stage)
+            for bound, count in zip(BUCKETS, hist.bucket_counts):
+                lines.append(f'pefi_stage_duration_seconds_bucket{{stage="{s}",le="{bound}"}} {count}')
+            lines.append(f'pefi_stage_duration_seconds_bucket{{stage="{s}",le="+Inf"}} {hist.count}')
+            lines.append(f'pefi_stage_duration_seconds_sum{{stage="{s}"}} {hist.total:.6f}')
+            lines.append(f'pefi_stage_duration_seconds_count{{stage="{s}"}} {hist.count}')
+
+        lines.append("# HELP pefi_stage_duration_quantile_seconds Recent-sample quantiles per stage.")
+        lines.append("# TYPE pefi_stage_duration_quantile_seconds gauge")
+        for stage, hist in stages:
+            for q, value in hist.quantiles().items():
+                lines.append(f'pefi_stage_duration_quantile_seconds{{stage="{_label(stage)}",quantile="{q}"}} {value:.6f}')
+
+        lines.append("# HELP pefi_stage_errors_total Stages that raised an exception.")
+        lines.append("# TYPE pefi_stage_errors_total counter")
+        for stage, hist in stages:
+            lines.append(f'pefi_stage_errors_total{{stage="{_label(stage)}"}} {hist.errors}')
+
+    for name, fn in sorted(_SOURCES.items()):
+        try:
+            values = fn() or {}
+        except Exception:
+            logger.exception("Metrics source %s failed", name)
+            continue
+        metric = f"pefi_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)):
+                lines.append(f'{metric}{{key="{_label(key)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def format_summary() -> str:
+    """One line per stage with count and p50/p90/p99 in milliseconds."""
+    parts = []
+    for stage, s in sorted(snapshot().items()):
+        parts.append(
+            f"{stage}: n={s['count']} p50={s['p50'] * 1000:.0f}ms p90={s['p90'] * 1000:.0f}ms "
+            f"p99={s['p99'] * 1000:.0f}ms err={s['errors']}"
+        )
+    return "\n".join(parts)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802 - http.server API
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # silence per-request logging
+        return
+
+
+def start_http_exporter(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics on host:port from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True)
+    thread.start()
+    logger.info("Metrics exporter listening on http://%s:%s/metrics", host, port)
+    return server
+
+
+def start_log_dumper(interval: float) -> threading.Event:
+    """Log `format_summary()` every `interval` seconds; set the returned event to stop."""
+    stop = threading.Event()
+
+    def _loop():
+        while not stop.wait(interval):
+            summary = format_summary()
+            if summary:
+                logger.info("Stage latency summary:\n%s", summary)
+
+    threading.Thread(target=_loop, name="metrics-log-dumper", daemon=True).start()
+    return stop
+
+
+def enable_opentelemetry(service_name: str = "pefi-bot") -> bool:
+    """Emit OpenTelemetry spans from `span()` if opentelemetry is installed.
+
+    If the SDK and OTLP exporter are available a provider exporting to the
+    standard OTEL_EXPORTER_OTLP_* endpoint is installed; otherwise the globally
+    configured tracer provider is used. Returns False if OpenTelemetry is missing.
+    """
+    global _tracer
+    try:
+        from opentelemetry import trace
+    except Exception:
+        logger.warning("opentelemetry is not installed; OTel export disabled")
+        return False
+
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    except Exception:
+        logger.info("OpenTelemetry SDK/OTLP exporter not available; using the global tracer provider")
+
+    _tracer = trace.get_tracer("pefi")
+    return True
@@ -0,0 +1,182 @@
+"""Per-task Gemini model routing.
+
+Every Gemini call site names its task (classify, parse_text, parse_report_request,
+vision, report_writer) and the route in `config.get_settings().model_routes`
+decides which model answers it, with what timeout and how many retries on
+DeadlineExceeded. JSON tasks start on the route's (usually cheaper) model and are
+re-asked once on `escalate_to` only when the answer is not valid JSON or fails the
+caller's validator, so easy requests stay fast and cheap without losing accuracy.
+With a ResponseSchema (utils/schemas.py) the schema is also sent as Gemini
+`response_schema` and an invalid answer first gets one targeted repair prompt.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import span
+from .path_setup import setup_project_root
+from .rate_limiter import record_gemini_result
+from .schemas import ResponseSchema, SchemaError
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+_counters: Dict[str, int] = {}
+_counters_lock = threading.Lock()
+
+
+class RouteTimeout(Exception):
+    """All attempts for a task timed out (DeadlineExceeded)."""
+
+
+def _count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + 1
+
+
+def snapshot() -> Dict[str, int]:
+    """Calls, escalations and invalid answers per task (registered as a metrics source)."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+def get_route(task: str) -> "config.ModelRoute":
+    """Return the configured route for `task`, or a plain text-model route for unknown tasks."""
+    settings = config.get_settings()
+    route = settings.model_routes.get(task)
+    if route is None:
+        route = config.ModelRoute(settings.text_model)
+    return route
+
+
+def strip_code_fences(text: str) -> str:
+    """Remove a surrounding ```json ... ``` block if the model added one."""
+    cleaned = (text or "").strip()
+    if cleaned.startswith("```json"):
+        cleaned = cleaned[7:]
+    if cleaned.startswith("```"):
+        cleaned = cleaned[3:]
+    if cleaned.endswith("```"):
+        cleaned = cleaned[:-3]
+    return cleaned.strip()
+
+
+def _generate(task: str, model_name: str, route, system_instruction: str, version: Optional[str],
+              contents: List[Any], generation_config: Optional[Dict[str, Any]], span_name: str):
+    """Call one model with the route's timeout, retrying DeadlineExceeded with exponential backoff."""
+    # Imported here so the Gemini SDK stays out of module import time
+    from google.api_core.exceptions import DeadlineExceeded
+
+    model = config.get_prompt_model(system_instruction, version, model_name=model_name)
+    backoff = route.backoff
+    for attempt in range(1, route.retries + 1):
+        try:
+            with span(span_name, model=model_name):
+                response = model.generate_content(
+                    contents, generation_config=generation_config, request_options={"timeout": route.timeout}
+                )
+            record_gemini_result(True)
+            _count(f"{task}_calls")
+            return response
+        except DeadlineExceeded as e:
+            record_gemini_result(False)
+            logger.warning(f"Gemini DeadlineExceeded for {task} on {model_name} (attempt {attempt}/{route.retries}): {e}")
+            if attempt == route.retries:
+                _count(f"{task}_timeouts")
+                raise RouteTimeout(f"{task}: {model_name} timed out after {route.retries} attempts") from e
+            time.sleep(backoff)
+            backoff *= 2
+        except Exception:
+            record_gemini_result(False)
+            raise
+
+
+def generate_text(task: str, system_instruction: str, contents: List[Any], version: Optional[str] = None,
+                  generation_config: Optional[Dict[str, Any]] = None, span_name: Optional[str] = None) -> str:
+    """Free-text task (e.g. report_writer) on the route's model; raises RouteTimeout on timeouts."""
+    route = get_route(task)
+    response = _generate(task, route.model, route, system_instruction, version, contents,
+                         generation_config, span_name or f"gemini_{task}")
+    return (getattr(response, "text", None) or "").strip()
+
+
+_REPAIR_PROMPT = (
+    "Your previous answer was not valid for the required JSON schema:\n{errors}\n"
+    "Previous answer:\n{answer}\n"
+    "Return only the corrected JSON object."
+)
+
+
+def _check(result_str: str, schema: Optional[ResponseSchema], validate: Optional[Callable[[Any], bool]]):
+    """Return (data, errors); errors is None when the answer is usable."""
+    try:
+        data = json.loads(strip_code_fences(result_str))
+    except json.JSONDecodeError as exc:
+        return None, [f"invalid JSON: {exc}"]
+    if schema is not None:
+        if schema.declined(data):
+            return data, None
+        try:
+            data = schema.validate(data)
+        except SchemaError as exc:
+            return data, exc.errors
+    if validate is not None and not validate(data):
+        return data, ["failed validation"]
+    return data, None
+
+
+def generate_json(task: str, system_instruction: str, contents: List[Any], version: Optional[str] = None,
+                  validate: Optional[Callable[[Any], bool]] = None, schema: Optional[ResponseSchema] = None,
+                  generation_config: Optional[Dict[str, Any]] = None, span_name: Optional[str] = None) -> Optional[Any]:
+    """Return the parsed JSON answer for `task`, repairing or escalating once if it is invalid.
+
+    With `schema`, it is sent as Gemini `response_schema` and the answer is
+    returned normalized by `schema.validate`. An invalid first answer gets one
+    repair prompt listing the errors on the same model, then the route's
+    escalation model is tried. Answers the schema marks as declined (e.g.
+    {"error": "..."}) are returned as-is. Returns None when no model gave a
+    valid answer; raises RouteTimeout if a model times out.
+    """
+    route = get_route(task)
+    span_name = span_name or f"gemini_{task}"
+    if schema is not None:
+        generation_config = {**(generation_config or {}), "response_schema": schema.gemini_schema()}
+    models = [route.model]
+    if route.escalate_to and route.escalate_to != route.model:
+        models.append(route.escalate_to)
+    repaired = False
+    for index, model_name in enumerate(models):
+        if index:
+            _count(f"{task}_escalations")
+            logger.info(f"Escalating {task} from {models[index - 1]} to {model_name}")
+        response = _generate(task, model_name, route, system_instruction, version, contents,
+                             generation_config, span_name)
+        result_str = getattr(response, "text", None) or ""
+        logger.info(f"Gemini {task} response ({model_name}): {result_str[:200]}...")
+        data, errors = _check(result_str, schema, validate)
+        if errors is None:
+            return data
+        _count(f"{task}_invalid")
+        logger.warning(f"Gemini {task} answer from {model_name} invalid: {'; '.join(errors)}")
+
+        if schema is not None and not repaired:
+            # One targeted repair turn on the same model before paying for a larger one
+            repaired = True
+            _count(f"{task}_repairs")
+            repair = _REPAIR_PROMPT.format(errors="\n".join(f"- {e}" for e in errors), answer=result_str[:2000])
+            response = _generate(task, model_name, route, system_instruction, version, list(contents) + [repair],
+                                 generation_config, span_name)
+            result_str = getattr(response, "text", None) or ""
+            data, errors = _check(result_str, schema, validate)
+            if errors is None:
+                return data
+            logger.warning(f"Gemini {task} repair on {model_name} still invalid: {'; '.join(errors)}")
+    return None
@@ -1,4 +1,13 @@
+import hashlib
+import logging
+import re
+import threading
+import time
 from pathlib import Path
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 # Cache for prompt files to avoid repeated I/O
 _PROMPT_CACHE = {}
@@ -27,3 +36,149 @@ def clear_prompt_cache():
     """Clear the prompt cache (useful for development/testing)."""
     global _PROMPT_CACHE
     _PROMPT_CACHE = {}
+    if _REGISTRY is not None:
+        _REGISTRY.clear()
+
+
+# Placeholders used when a file is not valid str.format syntax (e.g. raw JSON examples)
+_PLACEHOLDER_RE = re.compile(r"\{([A-Z_][A-Z0-9_]*)\}")
+
+
+class PromptTemplate:
+    """A prompt file pre-split into static text and `{NAME}` slots.
+
+    `render(NAME=...)` only joins strings; the template is parsed once when the
+    file is loaded. `version` is a short content hash, suitable as part of LLM
+    cache keys so cached answers are invalidated when the prompt changes.
+    """
+
+    __slots__ = ("name", "text", "version", "mtime_ns", "_parts", "_slots")
+
+    def __init__(self, name: str, text: str, mtime_ns: int = 0):
+        self.name = name
+        self.text = text
+        self.version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        self.mtime_ns = mtime_ns
+        self._parts, self._slots = self._compile(text)
+
+    @staticmethod
+    def _compile(text: str) -> Tuple[List[str], List[Tuple[int, str]]]:
+        """Split into literal parts; slot entries hold (index in parts, field name)."""
+        parts: List[str] = []
+        slots: List[Tuple[int, str]] = []
+        try:
+            # str.format syntax: `{NAME}` is a slot, `{{...}}` is a literal brace
+            for literal, field, spec, conv in Formatter().parse(text):
+                if literal:
+                    parts.append(literal)
+                if field is not None:
+                    if not field.isidentifier() or spec or conv:
+                        raise ValueError(f"not a plain placeholder: {field!r}")
+                    slots.append((len(parts), field))
+                    parts.append("{" + field + "}")
+        except ValueError:
+            # Not format syntax (e.g. JSON examples): only substitute explicit {UPPER_CASE} names, keep the rest verbatim
+            parts, slots = [], []
+            pos = 0
+            for m in _PLACEHOLDER_RE.finditer(text):
+                parts.append(text[pos:m.start()])
+                slots.append((len(parts), m.group(1)))
+                parts.append(m.group(0))
+                pos = m.end()
+            parts.append(text[pos:])
+        return parts, slots
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return tuple(name for _, name in self._slots)
+
+    def render(self, **values: str) -> str:
+        """Fill the slots; unknown slots are left as `{NAME}` like the old `.replace` fallback."""
+        if not self._slots:
+            return self.text
+        parts = list(self._parts)
+        for index, name in self._slots:
+            if name in values:
+                parts[index] = str(values[name])
+        return "".join(parts)
+
+
+class PromptRegistry:
+    """Loads every prompt in a directory once and reloads a file when its mtime changes.
+
+    mtime checks are throttled to one `stat` per file every `check_interval`
+    seconds, so lookups on the hot path are a dict read.
+    """
+
+    def __init__(self, directory: Path, check_interval: float = 2.0):
+        self.directory = Path(directory)
+        self.check_interval = check_interval
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._checked: Dict[str, float] = {}
+        self._loaded_all = False
+        self._lock = threading.Lock()
+
+    def _load(self, name: str) -> PromptTemplate:
+        path = self.directory / name
+        mtime_ns = path.stat().st_mtime_ns
+        text = path.read_text(encoding="utf-8")
+        template = PromptTemplate(name, text, mtime_ns)
+        previous = self._templates.get(name)
+        if previous is not None and previous.version != template.version:
+            logger.info("Prompt %s reloaded (version %s -> %s)", name, previous.version, template.version)
+        self._templates[name] = template
+        self._checked[name] = time.monotonic()
+        return template
+
+    def load_all(self) -> None:
+        with self._lock:
+            for path in sorted(self.directory.glob("*.txt")):
+                self._load(path.name)
+            self._loaded_all = True
+
+    def get(self, name: str) -> PromptTemplate:
+        """Return the current template for `name` (e.g. "report_generation.txt")."""
+        if not self._loaded_all:
+            self.load_all()
+        template = self._templates.get(name)
+        now = time.monotonic()
+        if template is not None and now - self._checked.get(name, 0.0) < self.check_interval:
+            return template
+        with self._lock:
+            template = self._templates.get(name)
+            if template is None:
+                return self._load(name)
+            self._checked[name] = now
+            try:
+                if (self.directory / name).stat().st_mtime_ns != template.mtime_ns:
+                    return self._load(name)
+            except OSError:
+                logger.warning("Prompt %s is no longer readable; keeping version %s", name, template.version)
+            return template
+
+    def versions(self) -> Dict[str, str]:
+        if not self._loaded_all:
+            self.load_all()
+        return {name: t.version for name, t in sorted(self._templates.items())}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+            self._checked.clear()
+            self._loaded_all = False
+
+
+_REGISTRY: Optional[PromptRegistry] = None
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """Return the process-wide registry for the project's prompts/ directory."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = PromptRegistry(get_project_root() / "prompts")
+    return _REGISTRY
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    """Shortcut for `get_prompt_registry().get(name)`."""
+    return get_prompt_registry().get(name)
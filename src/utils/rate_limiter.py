@@ -0,0 +1,318 @@
+"""Per-chat rate limiting and global load shedding for the Telegram handlers.
+
+Every handler is wrapped with `admission_controlled(kind)`. Before any download,
+ASR or Gemini work starts, the AdmissionController checks three things:
+
+  - the chat's token bucket (stops one chat from flooding photo/voice handlers)
+  - the number of handlers currently in flight (global queue depth); for photo and
+    voice updates plus the background jobs (voice transcription, albums) that are
+    queued or running, since their handler returns as soon as the job is queued
+  - the recent Gemini error rate (stop queueing work Gemini cannot serve)
+
+Shed requests get a short friendly reply (at most once per cooldown per chat) and
+are counted so the numbers can be exported with the other bot metrics. The
+wrapper then returns a `Shed`, so an outer decorator (`idempotent_update`) can
+tell a shed update from a processed one.
+"""
+
+import functools
+import logging
+import time
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from .path_setup import setup_project_root
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+# Token cost of each handler kind; photo/voice use vision or ASR and cost more.
+# Album photos share one batched vision call, so a 10-photo album costs about one burst.
+HANDLER_COSTS = {"text": 1.0, "photo": 2.0, "voice": 2.0, "album_photo": 0.5}
+
+SHED_RATE_LIMITED = "rate_limited"
+SHED_OVERLOADED = "overloaded"
+SHED_GEMINI_DEGRADED = "gemini_degraded"
+
+SHED_MESSAGES = {
+    SHED_RATE_LIMITED: "⏳ Bạn đang gửi hơi nhanh. Vui lòng đợi vài giây rồi gửi lại nhé!",
+    SHED_OVERLOADED: "🚦 Hệ thống đang quá tải. Vui lòng thử lại sau ít phút.",
+    SHED_GEMINI_DEGRADED: "🤖 Dịch vụ AI đang gặp sự cố tạm thời. Vui lòng thử lại sau ít phút.",
+}
+
+
+class Shed:
+    """Returned by an `admission_controlled` handler whose update was shed instead of processed."""
+
+    __slots__ = ("reason",)
+
+    def __init__(self, reason: str):
+        self.reason = reason
+
+    def __repr__(self) -> str:
+        return f"Shed({self.reason!r})"
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens are added per second, up to `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "_clock")
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self._clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take `tokens` if available and return True; otherwise leave the bucket unchanged."""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def time_until_available(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` could be acquired (0 if available now)."""
+        self._refill()
+        missing = tokens - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """Decide whether a new handler invocation may start, and keep counters about it."""
+
+    def __init__(
+        self,
+        per_chat_rate: float = 0.5,
+        per_chat_burst: float = 6.0,
+        max_in_flight: int = 32,
+        gemini_error_threshold: float = 0.5,
+        gemini_window_s: float = 60.0,
+        gemini_min_samples: int = 10,
+        notice_cooldown_s: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_in_flight = max_in_flight
+        self.gemini_error_threshold = gemini_error_threshold
+        self.gemini_window_s = gemini_window_s
+        self.gemini_min_samples = gemini_min_samples
+        self.notice_cooldown_s = notice_cooldown_s
+        self._clock = clock
+
+        self.in_flight = 0
+        # Background work not counted in `in_flight` (job queue depth), set by bot._post_init
+        self.backlog: Optional[Callable[[], int]] = None
+        self.counters: Counter = Counter()
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._last_notice: Dict[Any, float] = {}
+        self._gemini_results: Deque[Tuple[float, bool]] = deque()
+
+    # --- Gemini health -------------------------------------------------------------
+    def record_gemini_result(self, ok: bool) -> None:
+        now = self._clock()
+        self._gemini_results.append((now, bool(ok)))
+        self.counters["gemini_ok" if ok else "gemini_error"] += 1
+        self._trim_gemini_window(now)
+
+    def _trim_gemini_window(self, now: float) -> None:
+        cutoff = now - self.gemini_window_s
+        while self._gemini_results and self._gemini_results[0][0] < cutoff:
+            self._gemini_results.popleft()
+
+    def gemini_error_rate(self) -> float:
+        self._trim_gemini_window(self._clock())
+        total = len(self._gemini_results)
+        if total == 0:
+            return 0.0
+        errors = sum(1 for _, ok in self._gemini_results if not ok)
+        return errors / total
+
+    def gemini_degraded(self) -> bool:
+        return (
+            len(self._gemini_results) >= self.gemini_min_samples
+            and self.gemini_error_rate() >= self.gemini_error_threshold
+        )
+
+    # --- Admission -----------------------------------------------------------------
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._evict_idle_buckets()
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst, clock=self._clock)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _evict_idle_buckets(self) -> None:
+        # A full bucket carries no state worth keeping
+        for key in [k for k, b in self._buckets.items() if b.is_full]:
+            del self._buckets[key]
+            self._last_notice.pop(key, None)
+
+    def admit(self, chat_id: Any, kind: str = "text") -> Optional[str]:
+        """Return None if the request may run (and count it as in flight), else a shed reason."""
+        reason = None
+        load = self.in_flight
+        if kind != "text":
+            load += self.backlog_depth()
+        if load >= self.max_in_flight:
+            reason = SHED_OVERLOADED
+        elif kind != "text" and self.gemini_degraded():
+            # Text also covers deterministic reports, so only shed the Gemini-heavy kinds
+            reason = SHED_GEMINI_DEGRADED
+        elif not self._bucket(chat_id).try_acquire(HANDLER_COSTS.get(kind, 1.0)):
+            reason = SHED_RATE_LIMITED
+
+        if reason is not None:
+            self.counters[f"shed_{reason}"] += 1
+            self.counters[f"shed_{kind}"] += 1
+            return reason
+
+        self.in_flight += 1
+        self.counters["admitted"] += 1
+        self.counters[f"admitted_{kind}"] += 1
+        return None
+
+    def release(self) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def backlog_depth(self) -> int:
+        if self.backlog is None:
+            return 0
+        try:
+            return self.backlog()
+        except Exception:
+            logger.debug("Failed to read the background backlog", exc_info=True)
+            return 0
+
+    def should_notify(self, chat_id: Any) -> bool:
+        """Rate-limit the shed notices themselves so a flooding chat gets one reply per cooldown."""
+        now = self._clock()
+        last = self._last_notice.get(chat_id)
+        if last is not None and now - last < self.notice_cooldown_s:
+            return False
+        self._last_notice[chat_id] = now
+        return True
+
+    def reconfigure(self, **limits: Any) -> None:
+        """Apply new limits in place (config reload); existing per-chat buckets keep their tokens."""
+        for name, value in limits.items():
+            setattr(self, name, value)
+        for bucket in self._buckets.values():
+            bucket.rate = float(self.per_chat_rate)
+            bucket.capacity = float(self.per_chat_burst)
+            bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters plus current gauges, for logging/metrics export."""
+        data: Dict[str, Any] = dict(self.counters)
+        data["in_flight"] = self.in_flight
+        data["backlog"] = self.backlog_depth()
+        data["tracked_chats"] = len(self._buckets)
+        data["gemini_error_rate"] = round(self.gemini_error_rate(), 4)
+        return data
+
+
+_CONTROLLER: Optional[AdmissionController] = None
+
+
+def _cfg_number(name: str, default: float) -> float:
+    try:
+        return float(getattr(config, name, default))
+    except Exception:
+        return default
+
+
+def _limits_from_config() -> Dict[str, Any]:
+    return {
+        "per_chat_rate": _cfg_number("RATE_LIMIT_PER_CHAT_RATE", 0.5),
+        "per_chat_burst": _cfg_number("RATE_LIMIT_PER_CHAT_BURST", 6.0),
+        "max_in_flight": int(_cfg_number("RATE_LIMIT_MAX_IN_FLIGHT", 32)),
+        "gemini_error_threshold": _cfg_number("RATE_LIMIT_GEMINI_ERROR_RATE", 0.5),
+        "gemini_window_s": _cfg_number("RATE_LIMIT_GEMINI_WINDOW", 60.0),
+        "gemini_min_samples": int(_cfg_number("RATE_LIMIT_GEMINI_MIN_SAMPLES", 10)),
+    }
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide AdmissionController configured from config.yaml."""
+    global _CONTROLLER
+    if _CONTROLLER is None:
+        _CONTROLLER = AdmissionController(**_limits_from_config())
+    return _CONTROLLER
+
+
+def _on_config_reload(settings) -> None:
+    # Keep counters, in-flight count and per-chat state; only the limits change
+    if _CONTROLLER is not None:
+        _CONTROLLER.reconfigure(**_limits_from_config())
+
+
+if hasattr(config, "add_reload_listener"):
+    config.add_reload_listener(_on_config_reload)
+
+
+def record_gemini_result(ok: bool) -> None:
+    """Feed a Gemini call outcome into the admission controller's error-rate window."""
+    try:
+        get_admission_controller().record_gemini_result(ok)
+    except Exception:
+        logger.debug("Failed to record Gemini result", exc_info=True)
+
+
+def admission_controlled(kind: str):
+    """Decorator for PTB handlers that applies per-chat limits and global load shedding."""
+
+    def decorator(handler: Callable[..., Awaitable[Any]]):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            message = getattr(update, "message", None)
+            chat_id = getattr(message, "chat_id", None)
+            if chat_id is None:
+                return await handler(update, context)
+
+            controller = get_admission_controller()
+            update_kind = kind
+            if kind == "photo" and getattr(message, "media_group_id", None):
+                update_kind = "album_photo"
+            reason = controller.admit(chat_id, update_kind)
+            if reason is not None:
+                logger.warning("Shedding %s update from chat %s: %s", update_kind, chat_id, reason)
+                if controller.should_notify(chat_id):
+                    try:
+                        await context.bot.send_message(chat_id=chat_id, text=SHED_MESSAGES[reason])
+                    except Exception:
+                        logger.exception("Failed to send load-shedding notice")
+                return Shed(reason)
+
+            try:
+                return await handler(update, context)
+            finally:
+                controller.release()
+
+        return wrapper
+
+    return decorator
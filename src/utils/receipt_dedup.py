@@ -0,0 +1,160 @@
+"""Near-duplicate detection for receipt photos.
+
+`process_image_from_url(..., with_hash=True)` computes a difference hash (dHash)
+of the preprocessed image. The hash of every saved receipt is kept per user together
+with the extracted payload, so sending or forwarding the same receipt again is
+answered from the index (Hamming distance <= `receipts.dedup_distance`) instead
+of another Gemini vision call and a duplicate row in `bills`.
+
+The index lives in process memory: entries expire after `receipts.dedup_ttl_days`
+and each user keeps at most `receipts.dedup_max_per_user` hashes.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .path_setup import setup_project_root
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+# 16x16 gradients = 256-bit hash; finer than the classic 8x8 so receipts that only
+# differ in their printed lines do not collide
+HASH_SIZE = 16
+
+
+def dhash(img, hash_size: int = HASH_SIZE) -> int:
+    """Difference hash of a PIL image: one bit per horizontally adjacent pixel pair."""
+    from PIL import Image
+
+    gray = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = gray.tobytes()
+    value = 0
+    width = hash_size + 1
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+@dataclass
+class ReceiptEntry:
+    image_hash: int
+    payload: Dict[str, Any]
+    bill_id: Optional[int]
+    created_at: float
+
+
+class ReceiptHashIndex:
+    """Per-user receipt hashes with a nearest-match lookup by Hamming distance."""
+
+    def __init__(self, max_distance: int = 4, ttl_s: float = 30 * 86400, max_per_user: int = 500):
+        self.max_distance = max_distance
+        self.ttl_s = ttl_s
+        self.max_per_user = max_per_user
+        self._users: Dict[Any, "OrderedDict[int, ReceiptEntry]"] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def reconfigure(self, **limits: Any) -> None:
+        with self._lock:
+            for name, value in limits.items():
+                setattr(self, name, value)
+
+    def _prune(self, entries: "OrderedDict[int, ReceiptEntry]", now: float) -> None:
+        # Oldest first: stop at the first entry that has not expired
+        while entries:
+            first = next(iter(entries.values()))
+            if now - first.created_at <= self.ttl_s:
+                break
+            entries.popitem(last=False)
+        while len(entries) > self.max_per_user:
+            entries.popitem(last=False)
+
+    def find(self, user_key: Any, image_hash: int) -> Optional[ReceiptEntry]:
+        """Return the closest stored receipt of this user within `max_distance`, if any."""
+        now = time.time()
+        with self._lock:
+            entries = self._users.get(user_key)
+            best, best_distance = None, self.max_distance + 1
+            if entries:
+                self._prune(entries, now)
+                for entry in entries.values():
+                    distance = hamming(entry.image_hash, image_hash)
+                    if distance < best_distance:
+                        best, best_distance = entry, distance
+                        if distance == 0:
+                            break
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                logger.info("Receipt near-duplicate for user %s (distance %d, bill %s)", user_key, best_distance, best.bill_id)
+            return best
+
+    def add(self, user_key: Any, image_hash: int, payload: Dict[str, Any], bill_id: Optional[int] = None) -> None:
+        """Remember a saved receipt so later copies of it are recognized."""
+        now = time.time()
+        with self._lock:
+            entries = self._users.setdefault(user_key, OrderedDict())
+            entries.pop(image_hash, None)
+            entries[image_hash] = ReceiptEntry(image_hash, dict(payload), bill_id, now)
+            self._prune(entries, now)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "entries": sum(len(e) for e in self._users.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_INDEX: Optional[ReceiptHashIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def _limits_from_settings(settings) -> Dict[str, Any]:
+    return {
+        "max_distance": settings.receipt_dedup_distance,
+        "ttl_s": settings.receipt_dedup_ttl_days * 86400,
+        "max_per_user": settings.receipt_dedup_max_per_user,
+    }
+
+
+def get_receipt_index() -> ReceiptHashIndex:
+    """Return the process-wide receipt index configured from config.yaml."""
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                _INDEX = ReceiptHashIndex(**_limits_from_settings(config.get_settings()))
+    return _INDEX
+
+
+def dedup_enabled() -> bool:
+    return config.get_settings().receipt_dedup
+
+
+def _on_config_reload(settings) -> None:
+    if _INDEX is not None:
+        _INDEX.reconfigure(**_limits_from_settings(settings))
+
+
+config.add_reload_listener(_on_config_reload)
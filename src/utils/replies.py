@@ -0,0 +1,224 @@
+"""One Telegram message per interaction.
+
+Handlers used to send an ack ("đang xử lý...") and then every result as a new
+message; a report could take three more (the Markdown report, a plain-text resend
+when Telegram rejected the markup, and the fallback notice). `ReplyManager` keeps
+the ack's message id and edits that message into progress updates and the final
+result, so an interaction costs two Bot API calls and leaves one message in the
+chat. The ack and progress edits are marked as progress for the outbound
+scheduler (utils/flood_control.py), which lets final results go first under load.
+
+Markdown from the report writer is converted to Telegram's legacy Markdown and
+checked locally (`to_telegram_markdown`): headings and ``**bold**`` are rewritten,
+and any ``*``, ``_``, `````` or ``[`` that would not form a complete entity is
+escaped, so Telegram does not reject the message with "can't parse entities".
+"""
+
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from telegram.error import BadRequest
+
+from .flood_control import PRIORITY_PROGRESS, PRIORITY_RESULT
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects longer message texts
+MAX_MESSAGE_LENGTH = 4096
+MARKDOWN = "Markdown"
+
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)[\s#]*$")
+# "* item" would open a bold entity that never closes
+_BULLET_RE = re.compile(r"^(\s*)[*+]\s+")
+_DOUBLE_RE = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+_LINK_RE = re.compile(r"\[[^\]\n]+\]\([^)\s]+\)")
+_SPECIAL_RE = re.compile(r"([_*`\[])")
+
+_counters: Dict[str, int] = {}
+_counters_lock = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + 1
+
+
+def snapshot() -> Dict[str, int]:
+    """Messages sent and edited, failed edits and rejected Markdown (registered as a metrics source)."""
+    with _counters_lock:
+        return dict(_counters)
+
+
+def escape_markdown(text: str) -> str:
+    """Escape plain text for a legacy-Markdown message."""
+    return _SPECIAL_RE.sub(r"\\\1", text)
+
+
+def _rewrite_line(line: str) -> str:
+    heading = _HEADING_RE.match(line)
+    if heading:
+        title = heading.group(1).replace("*", "")
+        return f"*{title}*" if title else ""
+    line = _BULLET_RE.sub(r"\1• ", line)
+    return _DOUBLE_RE.sub(lambda m: m.group(1)[0] + m.group(2) + m.group(1)[0], line)
+
+
+def _balance(text: str) -> str:
+    """Keep complete entities and escape every marker that does not close."""
+    out: List[str] = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n and text[i + 1] in "_*`[":
+            out.append(text[i:i + 2])
+            i += 2
+        elif text.startswith("```", i):
+            end = text.find("```", i + 3)
+            if end == -1:
+                out.append("\\`\\`\\`")
+                i += 3
+            else:
+                out.append(text[i:end + 3])
+                i = end + 3
+        elif ch in "*_`":
+            # Entities do not nest: everything up to the closing marker is literal
+            end = text.find(ch, i + 1)
+            if end > i + 1:
+                out.append(text[i:end + 1])
+                i = end + 1
+            else:
+                out.append("\\" + ch)
+                i += 1
+        elif ch == "[":
+            link = _LINK_RE.match(text, i)
+            if link:
+                out.append(link.group())
+                i = link.end()
+            else:
+                out.append("\\[")
+                i += 1
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def to_telegram_markdown(text: str) -> str:
+    """Convert LLM Markdown into legacy Telegram Markdown that always parses."""
+    lines, in_fence = [], False
+    for line in text.split("\n"):
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+            lines.append(line)
+        else:
+            lines.append(line if in_fence else _rewrite_line(line))
+    return _balance("\n".join(lines))
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split `text` into message-sized chunks, at line breaks where possible."""
+    chunks: List[str] = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class ReplyManager:
+    """The replies of one interaction: an ack that is edited into progress and the final result.
+
+    `message_id` is the ack of an earlier step (e.g. the handler that queued a job);
+    without one, the first reply is sent and becomes the message to edit. Acks and
+    progress go through `bot.unrecorded` when the bot records replies for
+    idempotency, so only the final result is replayed on a redelivery.
+    """
+
+    def __init__(self, bot: Any, chat_id: int, message_id: Optional[int] = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self._shown: Optional[tuple] = None
+
+    async def ack(self, text: str) -> None:
+        await self._show(text, progress=True)
+
+    async def progress(self, text: str) -> None:
+        await self._show(text, progress=True)
+
+    async def finish(self, text: str, markdown: bool = False, header: Optional[str] = None,
+                     footer: Optional[str] = None) -> None:
+        """Show the final result; `markdown` text is converted and checked, `header`/`footer` are plain text."""
+        plain = "\n\n".join(part for part in (header, text, footer) if part)
+        if not markdown:
+            chunks = split_message(plain)
+            await self._show(chunks[0])
+            for chunk in chunks[1:]:
+                await self._send(chunk)
+            return
+        body = "\n\n".join(
+            part for part in (
+                escape_markdown(header) if header else "",
+                to_telegram_markdown(text),
+                escape_markdown(footer) if footer else "",
+            ) if part
+        )
+        chunks = split_message(body)
+        await self._show(chunks[0], MARKDOWN, plain=plain if len(chunks) == 1 else None)
+        for chunk in chunks[1:]:
+            await self._send(chunk, MARKDOWN)
+
+    def _bot(self, progress: bool) -> Any:
+        return getattr(self.bot, "unrecorded", self.bot) if progress else self.bot
+
+    def _priority(self, progress: bool) -> Dict[str, Any]:
+        # rate_limit_args is only accepted by a bot that has a rate limiter
+        if getattr(self.bot, "rate_limiter", None) is None:
+            return {}
+        return {"rate_limit_args": {"priority": PRIORITY_PROGRESS if progress else PRIORITY_RESULT}}
+
+    async def _show(self, text: str, parse_mode: Optional[str] = None, plain: Optional[str] = None,
+                    progress: bool = False) -> None:
+        if self._shown == (text, parse_mode):
+            # Telegram answers an identical edit with "message is not modified"
+            return
+        if self.message_id is not None:
+            try:
+                await self._bot(progress).edit_message_text(text=text, chat_id=self.chat_id,
+                                                            message_id=self.message_id, parse_mode=parse_mode,
+                                                            **self._priority(progress))
+                _count("edited")
+                self._shown = (text, parse_mode)
+                return
+            except BadRequest as e:
+                if parse_mode and "entities" in str(e).lower():
+                    _count("markdown_rejected")
+                    logger.warning("Telegram rejected Markdown the local check accepted: %s", e)
+                    await self._show(plain or text, None, progress=progress)
+                    return
+                # The ack was deleted or can no longer be edited: reply with a new message
+                _count("edit_failed")
+                logger.warning("Could not edit message %s in chat %s: %s", self.message_id, self.chat_id, e)
+        message = await self._send(text, parse_mode, plain, progress=progress)
+        self.message_id = getattr(message, "message_id", None)
+        self._shown = (text, parse_mode)
+
+    async def _send(self, text: str, parse_mode: Optional[str] = None, plain: Optional[str] = None,
+                    progress: bool = False) -> Any:
+        priority = self._priority(progress)
+        try:
+            message = await self._bot(progress).send_message(chat_id=self.chat_id, text=text, parse_mode=parse_mode,
+                                                             **priority)
+        except BadRequest as e:
+            if not (parse_mode and "entities" in str(e).lower()):
+                raise
+            _count("markdown_rejected")
+            logger.warning("Telegram rejected Markdown the local check accepted: %s", e)
+            message = await self._bot(progress).send_message(chat_id=self.chat_id, text=plain or text, **priority)
+        _count("sent")
+        return message
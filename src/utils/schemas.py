@@ -0,0 +1,278 @@
+"""Response schemas for the JSON-producing Gemini tasks.
+
+Each ResponseSchema is declared once and used twice:
+
+- `gemini_schema()` is passed as `response_schema` in the generation config so the
+  model is constrained to the expected shape;
+- `validate(data)` checks and normalizes the answer before it reaches the database
+  (integer amounts, ISO dates, category_type 0/1), raising SchemaError listing every
+  problem so a single targeted repair prompt can fix them.
+
+Converters are resolved per field when the schema is built, so validation is a
+straight loop over pre-bound functions.
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class SchemaError(ValueError):
+    """The answer does not match the schema; `errors` holds one message per field."""
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+_AMOUNT_SEPARATORS_RE = re.compile(r"^\d{1,3}([.,]\d{3})+$")
+_AMOUNT_MULTIPLIERS = (("triệu", 1_000_000), ("tr", 1_000_000), ("k", 1_000), ("nghìn", 1_000), ("ngàn", 1_000))
+_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d")
+
+
+def _to_integer(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError("expected an integer")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("expected an integer")
+        return int(value)
+    text = str(value).strip().lower()
+    for suffix in ("vnđ", "vnd", "đ", "d"):
+        if text.endswith(suffix):
+            text = text[: -len(suffix)].strip()
+            break
+    multiplier = 1
+    for suffix, factor in _AMOUNT_MULTIPLIERS:
+        if text.endswith(suffix):
+            text, multiplier = text[: -len(suffix)].strip(), factor
+            break
+    text = text.replace(" ", "")
+    if _AMOUNT_SEPARATORS_RE.match(text):
+        # 55.000 / 1,250,000: thousands separators
+        text = text.replace(".", "").replace(",", "")
+    number = float(text.replace(",", "."))
+    if not (number * multiplier).is_integer():
+        raise ValueError("expected an integer")
+    return int(number * multiplier)
+
+
+def _to_number(value: Any) -> float:
+    if isinstance(value, bool):
+        raise ValueError("expected a number")
+    return float(value)
+
+
+def _to_date(value: Any) -> str:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    text = str(value).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text[:10], fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError("expected a YYYY-MM-DD date")
+
+
+def _to_string(value: Any) -> str:
+    if isinstance(value, (dict, list)):
+        raise ValueError("expected a string")
+    return str(value).strip()
+
+
+_CONVERTERS: Dict[str, Tuple[Callable[[Any], Any], str]] = {
+    # kind -> (converter, Gemini schema type)
+    "integer": (_to_integer, "integer"),
+    "number": (_to_number, "number"),
+    "date": (_to_date, "string"),
+    "string": (_to_string, "string"),
+}
+
+
+@dataclass(frozen=True)
+class FieldSpec:
+    name: str
+    kind: str
+    required: bool = False
+    enum: Optional[Tuple[Any, ...]] = None
+    default: Any = None
+    description: str = ""
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+
+def _empty(value: Any) -> bool:
+    if isinstance(value, str):
+        return not value.strip()
+    return value is None or (not isinstance(value, bool) and value == 0)
+
+
+class ResponseSchema:
+    """A flat JSON object schema with a precompiled validator."""
+
+    __slots__ = ("name", "fields", "decline_key", "_plan", "_gemini")
+
+    def __init__(self, name: str, fields: Tuple[FieldSpec, ...], decline_key: Optional[str] = None):
+        self.name = name
+        self.fields = fields
+        # An answer carrying this key (e.g. {"error": "..."}) is the model declining the input
+        self.decline_key = decline_key
+        self._plan = tuple((f, _CONVERTERS[f.kind][0]) for f in fields)
+        self._gemini = self._build_gemini_schema()
+
+    def _build_gemini_schema(self) -> Dict[str, Any]:
+        properties: Dict[str, Any] = {}
+        for f in self.fields:
+            prop: Dict[str, Any] = {"type": _CONVERTERS[f.kind][1]}
+            if not f.required or self.decline_key:
+                # Under constrained decoding a declining answer ({"error": ...}) must be able to
+                # leave the required fields empty; validate() still requires them otherwise
+                prop["nullable"] = True
+            if f.enum is not None and f.kind == "string":
+                prop["enum"] = list(f.enum)
+            description = f.description
+            if f.enum is not None and f.kind != "string":
+                description = (description + " " if description else "") + "One of: " + ", ".join(map(str, f.enum))
+            if description:
+                prop["description"] = description
+            properties[f.name] = prop
+        if self.decline_key:
+            properties[self.decline_key] = {"type": "string", "nullable": True}
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": [f.name for f in self.fields if f.required],
+        }
+
+    def gemini_schema(self) -> Dict[str, Any]:
+        """The schema in the dict form accepted as `response_schema` by google-generativeai."""
+        return self._gemini
+
+    def declined(self, data: Any) -> bool:
+        """True when the model answered with the decline key instead of the required fields.
+
+        A constrained answer may still carry the required keys, null or zeroed
+        (0, ""); those count as empty.
+        """
+        if not self.decline_key or not isinstance(data, dict) or not data.get(self.decline_key):
+            return False
+        return all(_empty(data.get(f.name)) for f in self.fields if f.required)
+
+    def validate(self, data: Any) -> Dict[str, Any]:
+        """Return a normalized copy of `data`; raise SchemaError listing every invalid field."""
+        if not isinstance(data, dict):
+            raise SchemaError([f"expected a JSON object, got {type(data).__name__}"])
+        out = dict(data)
+        errors: List[str] = []
+        for f, convert in self._plan:
+            value = data.get(f.name)
+            if value is None or (isinstance(value, str) and not value.strip()):
+                if f.required:
+                    errors.append(f"{f.name}: required")
+                    continue
+                out[f.name] = f.default() if callable(f.default) else f.default
+                continue
+            try:
+                value = convert(value)
+            except (TypeError, ValueError) as exc:
+                errors.append(f"{f.name}: {exc} (got {value!r})")
+                continue
+            if f.minimum is not None and value < f.minimum:
+                errors.append(f"{f.name}: must be >= {f.minimum:g}")
+                continue
+            if f.maximum is not None and value > f.maximum:
+                errors.append(f"{f.name}: must be <= {f.maximum:g}")
+                continue
+            if f.enum is not None and value not in f.enum:
+                errors.append(f"{f.name}: must be one of {list(f.enum)} (got {value!r})")
+                continue
+            out[f.name] = value
+        if errors:
+            raise SchemaError(errors)
+        return out
+
+
+class ListSchema:
+    """A JSON array of `item` objects (several receipts or transactions in one answer).
+
+    Items the item schema marks as declined are kept as-is so the caller can tell
+    which input had no transaction; the other items are validated and normalized.
+    """
+
+    __slots__ = ("name", "item", "_gemini")
+
+    def __init__(self, name: str, item: ResponseSchema):
+        self.name = name
+        self.item = item
+        self._gemini = {"type": "array", "items": item.gemini_schema()}
+
+    def gemini_schema(self) -> Dict[str, Any]:
+        return self._gemini
+
+    def declined(self, data: Any) -> bool:
+        return False
+
+    def validate(self, data: Any) -> List[Any]:
+        """Return the normalized items; raise SchemaError with every item's errors prefixed by its index."""
+        if not isinstance(data, list):
+            raise SchemaError([f"expected a JSON array, got {type(data).__name__}"])
+        out: List[Any] = []
+        errors: List[str] = []
+        for index, item in enumerate(data):
+            if self.item.declined(item):
+                out.append(item)
+                continue
+            try:
+                out.append(self.item.validate(item))
+            except SchemaError as exc:
+                errors.extend(f"[{index}] {e}" for e in exc.errors)
+        if errors:
+            raise SchemaError(errors)
+        return out
+
+
+def _today() -> str:
+    return date.today().isoformat()
+
+
+# Output of prompts/text_input.txt and prompts/image_input.txt; the shape add_bill expects.
+TRANSACTION = ResponseSchema(
+    "transaction",
+    (
+        FieldSpec("merchant_name", "string", default="Payment", description="Store or recipient name"),
+        FieldSpec("total_amount", "integer", required=True, minimum=1, description="Total amount in VND, integer"),
+        FieldSpec("bill_date", "date", default=_today, description="Transaction date, YYYY-MM-DD"),
+        FieldSpec("category_name", "string", required=True, description="Category from the prompt's list"),
+        FieldSpec("category_type", "integer", required=True, enum=(0, 1), description="1 = income, 0 = expense."),
+        FieldSpec("note", "string", default="", description="Short description"),
+    ),
+    decline_key="error",
+)
+
+# Output of prompts/image_batch_input.txt: one TRANSACTION (or {"error": ...}) per image, in order
+TRANSACTION_LIST = ListSchema("transaction_list", TRANSACTION)
+
+# Output of prompts/classifier_intent.txt
+INTENT = ResponseSchema(
+    "intent",
+    (
+        FieldSpec("intent", "string", required=True, enum=("summarize_expenses", "record_transaction", "unclear")),
+        FieldSpec("confidence", "number", default=0.0),
+        FieldSpec("explanation", "string", default=""),
+    ),
+)
+
+# Output of prompts/report_request_parse.txt
+REPORT_REQUEST = ResponseSchema(
+    "report_request",
+    (
+        FieldSpec("start_date", "date", description="YYYY-MM-DD or null"),
+        FieldSpec("end_date", "date", description="YYYY-MM-DD or null"),
+        FieldSpec("type", "string", enum=("thu", "chi", "both"), default="both"),
+        FieldSpec("raw_period_text", "string", default=""),
+    ),
+)
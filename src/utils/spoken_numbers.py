@@ -0,0 +1,220 @@
+"""Vietnamese spoken numbers and dates in ASR transcripts, rewritten as digits.
+
+PhoWhisper writes amounts the way they are said ("mua cà phê năm mươi nghìn",
+"hai triệu rưỡi"), which neither the keyword heuristics nor a local parser can
+read. `normalize_spoken` rewrites them deterministically:
+
+- number words become one integer: "năm mươi nghìn" -> "50000",
+  "một trăm linh năm" -> "105", "hai triệu rưỡi" -> "2500000", with the spoken
+  forms mốt (1), tư (4), lăm/nhăm (5), rưỡi (half the unit before it) and a
+  trailing digit after a unit ("hai triệu tư" -> "2400000", "trăm mốt" -> "110");
+- digits followed by a unit are multiplied out: "50 nghìn" -> "50000",
+  "1,5 triệu" -> "1500000";
+- explicit dates become ISO dates: "ngày mười lăm tháng mười một" -> "2025-11-15"
+  (the current year unless "năm ..." follows). Relative days ("hôm qua") stay.
+
+Number words that are also ordinary words are left alone unless they are part
+of a longer number or come before a currency unit: a lone "năm" (year), "ba"
+(father), "một" (a/an) or "tư" (fourth) is not rewritten, and "mười năm" (ten
+years) becomes "10 năm", not 15.
+"""
+
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+
+_DIGIT_WORDS = {
+    "không": 0, "một": 1, "mốt": 1, "hai": 2, "ba": 3, "bốn": 4, "tư": 4,
+    "năm": 5, "lăm": 5, "nhăm": 5, "sáu": 6, "bảy": 7, "bẩy": 7, "tám": 8, "chín": 9,
+}
+# Only valid after another number word ("hai mươi mốt", "hai triệu tư")
+_CONTINUATIONS = frozenset(("mốt", "tư", "lăm", "nhăm"))
+_SCALES = {"nghìn": 1_000, "ngàn": 1_000, "triệu": 1_000_000, "tỷ": 1_000_000_000, "tỉ": 1_000_000_000}
+_CURRENCY = frozenset(("đồng", "đ", "vnd", "vnđ", "k"))
+
+_TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|[^\W\d_]+")
+_THOUSANDS_RE = re.compile(r"^\d{1,3}([.,]\d{3})+$")
+
+_DAY_WORDS = {w: v for w, v in _DIGIT_WORDS.items() if w not in _CONTINUATIONS and v > 0}
+_MONTH_WORDS = {**_DAY_WORDS, "tư": 4}
+_DATE_RE = re.compile(
+    r"\b(?:ngày\s+(?:(?:mùng|mồng)\s+)?|(?:mùng|mồng)\s+)"
+    rf"(\d{{1,2}}|{'|'.join(_DAY_WORDS)})\s+tháng\s+(\d{{1,2}}|{'|'.join(_MONTH_WORDS)})"
+    r"(?:\s+năm\s+(\d{4}))?\b",
+    re.IGNORECASE,
+)
+
+
+def _to_number(token: str) -> Optional[float]:
+    if _THOUSANDS_RE.match(token):
+        # 50.000 / 1,250,000
+        return float(token.replace(".", "").replace(",", ""))
+    try:
+        return float(token.replace(",", "."))
+    except ValueError:
+        return None
+
+
+class _Number:
+    """Reads one spoken number a word at a time; `feed` returns False where the number ends."""
+
+    def __init__(self) -> None:
+        self.total = 0.0      # completed nghìn/triệu/tỷ groups
+        self.block = 0.0      # the group being read, below 1000
+        self.digit: Optional[float] = None  # a digit not yet placed
+        self.trailing = False  # `digit` came right after a unit: "hai triệu tư"
+        self.unit = 1         # the last trăm/nghìn/triệu/tỷ
+        self.prev: Optional[str] = None
+        self.multiplied = False
+
+    @property
+    def complete(self) -> bool:
+        return self.prev != "linh" and not (self.digit == 0 and self.prev is not None)
+
+    def feed(self, token: str) -> bool:
+        prev = self.prev
+        if token[0].isdigit():
+            value = _to_number(token)
+            if prev is not None or value is None:
+                return False
+            self.digit, self.prev = value, "digit"
+            return True
+        if token in _DIGIT_WORDS:
+            return self._feed_digit(token, _DIGIT_WORDS[token])
+        if token == "mười":
+            if prev not in (None, "trăm", "scale") or self.digit is not None:
+                return False
+            self.block += 10
+        elif token in ("mươi", "chục"):
+            d = self.digit
+            if d is None or d < 1 or d > 9 or d != int(d):
+                return False
+            self.block += d * 10
+            self.digit, self.trailing = None, False
+        elif token == "trăm":
+            d = self.digit
+            if self.block or (d is None and prev is not None) or (self.trailing and self.unit == 100):
+                return False
+            self.block = (1 if d is None else d) * 100
+            self.digit, self.trailing, self.unit = None, False, 100
+        elif token in ("linh", "lẻ"):
+            if prev not in ("trăm", "scale") or self.digit is not None:
+                return False
+        elif token in _SCALES:
+            scale = _SCALES[token]
+            if prev is None or prev == "linh" or (prev == "rưỡi" and self.unit != 100):
+                return False
+            if prev == "scale" and self.digit is None and not self.block:
+                # "một nghìn tỷ"
+                self.total *= scale
+            else:
+                self.total += self._group() * scale
+            self.block, self.digit, self.trailing, self.unit = 0.0, None, False, scale
+            token = "scale"
+        elif token == "rưỡi":
+            if prev not in ("trăm", "scale") or self.digit is not None:
+                return False
+            if prev == "trăm":
+                self.block += 50
+            else:
+                self.total += self.unit / 2
+        else:
+            return False
+        self.prev = token
+        self.multiplied = True
+        return True
+
+    def _feed_digit(self, word: str, d: int) -> bool:
+        prev = self.prev
+        if prev in ("mười", "mươi"):
+            # "mười năm" is ten years, and the tens take no zero
+            if word == "năm" or d == 0 or (word == "mốt" and prev == "mười"):
+                return False
+            self.block += d
+            self.prev = "unit"
+            return True
+        if prev == "linh":
+            if d == 0:
+                return False
+            self.block += d
+            self.prev = "unit"
+            return True
+        if prev is None:
+            if word in _CONTINUATIONS or d == 0:
+                return False
+            self.digit, self.prev = d, "digit"
+            return True
+        if prev in ("trăm", "scale") and self.digit is None:
+            # "không" only as "không trăm"; other digits may end the number ("hai triệu tư")
+            self.digit, self.trailing, self.prev = d, True, "digit"
+            return True
+        return False
+
+    def _group(self) -> float:
+        if self.digit is None:
+            return self.block
+        if self.trailing and self.unit == 100:
+            return self.block + self.digit * 10
+        return self.block + self.digit
+
+    def value(self) -> Optional[int]:
+        if self.trailing and self.digit is not None and self.unit > 100:
+            number = self.total + self.block + self.digit * self.unit / 10
+        else:
+            number = self.total + self._group()
+        return int(number) if number == int(number) else None
+
+
+def _rewrite_numbers(text: str) -> str:
+    tokens: List[Tuple[int, int, str]] = [(m.start(), m.end(), m.group().lower()) for m in _TOKEN_RE.finditer(text)]
+    out: List[str] = []
+    pos = i = 0
+    while i < len(tokens):
+        number = _Number()
+        j = i
+        end_index = None
+        while j < len(tokens):
+            if j > i and text[tokens[j - 1][1]:tokens[j][0]].strip():
+                # Punctuation between the words ends the number
+                break
+            if not number.feed(tokens[j][2]):
+                break
+            j += 1
+            if number.complete:
+                end_index, value = j, number.value()
+        if end_index is None:
+            i += 1
+            continue
+        follows_unit = end_index < len(tokens) and tokens[end_index][2] in _CURRENCY
+        spoken = number.multiplied or (follows_unit and tokens[i][2][0].isalpha())
+        if not spoken or value is None:
+            i += 1
+            continue
+        out.append(text[pos:tokens[i][0]])
+        out.append(str(value))
+        pos = tokens[end_index - 1][1]
+        i = end_index
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def _rewrite_dates(text: str, today: date) -> str:
+    def replace(m: "re.Match[str]") -> str:
+        day, month, year = m.group(1).lower(), m.group(2).lower(), m.group(3)
+        try:
+            return date(
+                int(year) if year else today.year,
+                _MONTH_WORDS[month] if month in _MONTH_WORDS else int(month),
+                _DAY_WORDS[day] if day in _DAY_WORDS else int(day),
+            ).isoformat()
+        except ValueError:
+            return m.group()
+
+    return _DATE_RE.sub(replace, text)
+
+
+def normalize_spoken(text: str, today: Optional[date] = None) -> str:
+    """Rewrite spoken numbers as digits and spoken dates as ISO dates; other text is unchanged."""
+    if not text:
+        return text
+    return _rewrite_dates(_rewrite_numbers(text), today or date.today())
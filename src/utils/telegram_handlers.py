@@ -3,6 +3,7 @@ import logging
 import os
 import sys
 import re
+import time
 from pathlib import Path
 from typing import Optional
 
@@ -11,15 +12,24 @@ from telegram.error import TimedOut
 from telegram.ext import ContextTypes
 
 # Import các hàm chức năng từ các module khác
-from .image_processor import extract_text
+from .image_processor import extract_batch, extract_text
+from .media_groups import MediaGroupCollector
 from .text_processor import (
-    parse_text_for_info,
+    parse_transactions,
     generate_user_response,
     extract_period_and_type,
     build_report_text,
     generate_report_from_gemini_and_db,
 )
 from .text_processor import preprocess_text
+from .rate_limiter import admission_controlled, record_gemini_result
+from . import job_queue
+from .idempotency import defer_result, idempotent_update, recording_bot, update_key
+from .job_queue import Job
+from .keywords import get_intent_engine
+from .metrics import observe, span
+from .receipt_dedup import get_receipt_index
+from .replies import ReplyManager
 # Import reporting module (DB-first reporting + LLM for language)
 try:
     from src.reporting.reporting import get_summary, generate_report
@@ -41,33 +51,181 @@ except Exception:  # ensure repo root is on sys.path then retry
 
 # Import database operations
 try:
-    from database.db_operations import add_bill, get_transactions_summary
+    from database.db_operations import add_bill, add_bills, get_transactions_summary, save_bills
 except Exception:
     # Ensure database module is in path
     repo_root = Path(__file__).resolve().parents[2]
     if str(repo_root) not in sys.path:
         sys.path.insert(0, str(repo_root))
-    from database.db_operations import add_bill, get_transactions_summary
+    from database.db_operations import add_bill, add_bills, get_transactions_summary, save_bills
 
-UPLOAD_DIR = config.UPLOAD_DIR
-
-config.initialize_directories()
 logger = logging.getLogger(__name__)
 
+REPORT_FALLBACK_NOTE = "(Lưu ý: báo cáo được gửi ở dạng văn bản cơ bản vì trình tạo ngôn ngữ hiện không phản hồi.)"
+
+# Caption that bypasses duplicate-receipt detection ("lưu lại", "luu lai")
+_FORCE_SAVE_RE = re.compile(r"\bl(ư|u)u\s+l(ạ|a)i\b", re.IGNORECASE)
+
+
+def _duplicate_receipt_text(payload: dict) -> str:
+    bill = f" (#{payload['duplicate_of']})" if payload.get("duplicate_of") else ""
+    amount = payload.get("total_amount")
+    amount_text = f"{amount:,.0f} VND" if isinstance(amount, (int, float)) else "?"
+    return (
+        f"⚠️ Ảnh này trùng với hóa đơn đã lưu trước đó{bill}:\n"
+        f"📅 {payload.get('bill_date')} · 🏪 {payload.get('merchant_name')} · 💰 {amount_text}\n"
+        "Hóa đơn không được lưu lại. Nếu đây là giao dịch khác, hãy gửi lại ảnh kèm chú thích \"lưu lại\"."
+    )
+
+
+_ALBUMS = MediaGroupCollector()
+
+
+async def _process_album(context: ContextTypes.DEFAULT_TYPE, chat_id: int, key) -> None:
+    """Collect an album, acknowledge it and queue one job to extract, save and confirm all its receipts."""
+    messages = await _ALBUMS.collect(key, config.get_settings().image_album_window)
+    # Every photo of the album deferred its result to this task and the job it queues
+    keys = [update_key(m) for m in messages]
+    replies = ReplyManager(recording_bot(context.application.bot, *keys), chat_id)
+    try:
+        await replies.ack(f"Đã nhận được {len(messages)} ảnh, đang xử lý...")
+        sender = getattr(messages[0], "from_user", None)
+        await job_queue.submit(context.application, "album", {
+            "chat_id": chat_id,
+            "user_key": sender.id if sender is not None else chat_id,
+            # Telegram puts an album's caption on one of its messages
+            "force_save": any(_FORCE_SAVE_RE.search(getattr(m, "caption", None) or "") for m in messages),
+            # File ids, not URLs: a URL contains the bot token and expires; the job resolves them
+            "files": [[m.photo[-1].file_id, m.photo[-1].file_unique_id] for m in messages],
+            "count": len(messages),
+            "update_keys": keys,
+            "ack_message_id": replies.message_id,
+        })
+    except Exception as e:
+        logger.exception("Lỗi khi nhận album ảnh")
+        await replies.finish(f"Đã có lỗi xảy ra: {e}")
+
+
+async def _save_album(job: Job, user_key: str, bot) -> str:
+    """Extract and insert the album's receipts; return the reply text.
+
+    The reply is checkpointed in the job as soon as the bills are inserted, so a
+    retry (the reply could not be sent, shutdown) sends it instead of inserting
+    the bills again.
+    """
+    data = job.payload
+    # Resolved on every attempt, so a retry gets fresh download URLs
+    files = await asyncio.gather(*(bot.get_file(file_id) for file_id, _ in data["files"]), return_exceptions=True)
+    fetched = [
+        (f.file_path, file_unique_id)
+        for f, (_, file_unique_id) in zip(files, data["files"])
+        if not isinstance(f, BaseException) and f.file_path
+    ]
+    failed = data["count"] - len(fetched)
+    results = await asyncio.to_thread(
+        extract_batch,
+        [path for path, _ in fetched],
+        user_key=None if data["force_save"] else user_key,
+        file_unique_ids=[fuid for _, fuid in fetched],
+    )
+
+    bills, hashes, duplicates = [], [], []
+    for payload in results:
+        if payload == {"raw": "Invalid"}:
+            failed += 1
+        elif "duplicate_of" in payload:
+            duplicates.append(payload)
+        else:
+            hashes.append(payload.pop("receipt_hash", None))
+            payload.setdefault("user_id", getattr(config, "DEFAULT_USER_ID", 2))
+            bills.append(payload)
+
+    parts = []
+    result = {}
+    if bills:
+        with span("db_insert"):
+            result = await asyncio.to_thread(add_bills, bills)
+        if result.get("success"):
+            parts.append(result["transaction_info"])
+        else:
+            logger.error("Lỗi khi lưu album hóa đơn: %s", result.get("error"))
+            parts.append(f"❌ Lỗi: {result.get('error', 'Không thể lưu giao dịch')}")
+    if duplicates:
+        ids = ", ".join(f"#{d['duplicate_of']}" for d in duplicates if d.get("duplicate_of"))
+        parts.append(
+            f"⚠️ {len(duplicates)} ảnh trùng với hóa đơn đã lưu trước đó{f' ({ids})' if ids else ''}, không lưu lại. "
+            "Nếu đây là giao dịch khác, hãy gửi lại kèm chú thích \"lưu lại\"."
+        )
+    if failed:
+        parts.append(f"⚠️ {failed} ảnh không chứa thông tin giao dịch hợp lệ.")
+    reply = "\n\n".join(parts)
+
+    if result.get("success"):
+        await job_queue.checkpoint(job, reply=reply)
+        for payload, receipt_hash, bill_id in zip(bills, hashes, result["bill_ids"]):
+            if receipt_hash is not None:
+                get_receipt_index().add(user_key, receipt_hash, payload, bill_id)
+    return reply
+
+
+async def process_album_job(job: Job, bot) -> None:
+    """Queued album job: one Gemini call, one insert and one reply for all receipts of an album.
+
+    Payload: chat_id, user_key (dedup index owner), force_save, files ([file_id,
+    file_unique_id] per photo), count (photos in the album), the update_keys of the
+    album's messages and ack_message_id (the ack that the result replaces). The
+    download URLs are fetched by the job with `bot.get_file`: they contain the bot
+    token and expire, so they are never stored in the queue.
+    """
+    data = job.payload
+    chat_id, user_key = data["chat_id"], data["user_key"]
+    replies = ReplyManager(recording_bot(bot, *data.get("update_keys", ())), chat_id, data.get("ack_message_id"))
+    start_time = time.perf_counter()
+    try:
+        reply = data.get("reply")
+        if reply is None:
+            reply = await _save_album(job, user_key, bot)
+
+        elapsed_time = time.perf_counter() - start_time
+        observe("handler_photo_album", elapsed_time)
+        logger.info(f"✅ Album of {data['count']} images processed in {elapsed_time:.2f}s")
+        await replies.finish(reply)
 
+    except Exception as e:
+        observe("handler_photo_album", time.perf_counter() - start_time, error=True)
+        if not job.last_attempt:
+            # Retried by the queue
+            raise
+        logger.exception("Lỗi khi xử lý album ảnh")
+        await replies.finish(f"Đã có lỗi xảy ra: {e}")
+
+
+job_queue.register("album", process_album_job)
+
+
+@idempotent_update
+@admission_controlled("photo")
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle photo messages: download, process, save to database, and reply."""
     if not update.message or not update.message.photo:
         return
 
     chat_id = update.message.chat_id
+    media_group_id = getattr(update.message, "media_group_id", None)
+    if media_group_id and config.get_settings().image_album_window > 0:
+        # Album: the first photo schedules one batch for the whole group, the others just join it
+        key = (chat_id, media_group_id)
+        if _ALBUMS.add(key, update.message):
+            context.application.create_task(_process_album(context, chat_id, key), update=update)
+        defer_result()
+        return
+
     file_path: Optional[str] = None
-    
-    import time
-    start_time = time.time()
+    start_time = time.perf_counter()
+    replies = ReplyManager(context.bot, chat_id)
 
     try:
-        await context.bot.send_message(chat_id=chat_id, text="Đã nhận được thông tin đang xử lý...")
+        await replies.ack("Đã nhận được thông tin đang xử lý...")
         # Thêm retry 1 lần nếu get_file bị timeout
         try:
             photo_file = await update.message.photo[-1].get_file()
@@ -77,13 +235,30 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         # Lấy link ảnh trực tiếp để xử lý
         file_path = photo_file.file_path
         if not file_path:
-            await context.bot.send_message(chat_id=chat_id, text="Không thể tải ảnh. Vui lòng thử lại.")
+            await replies.finish("Không thể tải ảnh. Vui lòng thử lại.")
             return
 
-        # Extract transaction data from image
-        payload = extract_text(file_path)
+        # Extract transaction data from image; copies of a receipt this user already saved are
+        # recognized by perceptual hash unless the caption asks to save it again
+        sender = getattr(update.message, "from_user", None)
+        user_key = sender.id if sender is not None else chat_id
+        force_save = bool(_FORCE_SAVE_RE.search(getattr(update.message, "caption", None) or ""))
+        # Off the event loop: other chats keep being served while this photo downloads and
+        # is preprocessed (in the image worker pool when images.workers > 0)
+        payload = await asyncio.to_thread(
+            extract_text,
+            file_path,
+            user_key=None if force_save else user_key,
+            file_unique_id=getattr(update.message.photo[-1], "file_unique_id", None),
+        )
         if payload == {"raw": "Invalid"}:
-            await context.bot.send_message(chat_id=chat_id, text="Ảnh không chứa thông tin giao dịch hợp lệ.")
+            await replies.finish("Ảnh không chứa thông tin giao dịch hợp lệ.")
+            return
+
+        receipt_hash = payload.pop("receipt_hash", None)
+        if "duplicate_of" in payload:
+            observe("handler_photo", time.perf_counter() - start_time)
+            await replies.finish(_duplicate_receipt_text(payload))
             return
 
         # Ensure payload contains a user_id; fall back to default configured user
@@ -97,24 +272,29 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             payload["user_id"] = getattr(_cfg, "DEFAULT_USER_ID", 2)
 
         # Save directly to database
-        result = add_bill(payload)
+        with span("db_insert"):
+            result = await asyncio.to_thread(add_bill, payload)
 
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
+        observe("handler_photo", elapsed_time)
         logger.info(f"✅ Image processing completed in {elapsed_time:.2f}s")
 
         if result.get("success"):
+            if receipt_hash is not None:
+                get_receipt_index().add(user_key, receipt_hash, payload, result.get("bill_id"))
             transaction_info = result.get("transaction_info", "Đã lưu giao dịch thành công")
-            await context.bot.send_message(chat_id=chat_id, text=transaction_info)
+            await replies.finish(transaction_info)
         else:
             error_msg = result.get("error", "Không thể lưu giao dịch")
             logger.error("Lỗi khi lưu bill từ ảnh: %s", error_msg)
-            await context.bot.send_message(chat_id=chat_id, text=f"❌ Lỗi: {error_msg}")
+            await replies.finish(f"❌ Lỗi: {error_msg}")
 
     except Exception as e:
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
+        observe("handler_photo", elapsed_time, error=True)
         logger.error(f"❌ Image processing failed after {elapsed_time:.2f}s")
         logger.exception("Lỗi trong photo_handler")
-        await context.bot.send_message(chat_id=chat_id, text=f"Đã có lỗi xảy ra: {e}")
+        await replies.finish(f"Đã có lỗi xảy ra: {e}")
 
     finally:
         if file_path and os.path.exists(file_path):
@@ -125,6 +305,8 @@ async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 logger.exception("Không thể xóa file tạm: %s", file_path)
 
 
+@idempotent_update
+@admission_controlled("text")
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle text messages: parse transaction info, save to database, and reply."""
     if not update.message or not update.message.text:
@@ -132,33 +314,23 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     user_text = update.message.text
     chat_id = update.message.chat_id
-    
-    import time
-    start_time = time.time()
+    start_time = time.perf_counter()
+    replies = ReplyManager(context.bot, chat_id)
 
     try:
-        await context.bot.send_message(chat_id=chat_id, text="Đã nhận được thông tin đang xử lý...")
+        await replies.ack("Đã nhận được thông tin đang xử lý...")
         
         # Preprocess text once and reuse
         norm = preprocess_text(user_text).lower()
         
         # Use heuristic detection for reports (faster than LLM classification)
-        is_report_heuristic = False
-        if (
-            "tổng chi" in norm
-            or "tổng thu" in norm
-            or "tổng hợp" in norm
-            or "báo cáo" in norm
-            or re.search(r"tháng\s*\d{1,2}", norm)
-            or re.search(r"\d+\s*ngày", norm)
-        ):
-            is_report_heuristic = True
+        is_report_heuristic = get_intent_engine().scan(norm).score("report_request") > 0
 
         if is_report_heuristic:
             resp = {"loai_yeu_cau": "Báo cáo", "reply_text": "Đang tạo báo cáo...", "classification": {}}
         else:
             # Classify the user's intent and generate an appropriate reply
-            resp = generate_user_response(user_text)
+            resp = await asyncio.to_thread(generate_user_response, user_text)
         
         loai = resp.get("loai_yeu_cau")
         reply_text = resp.get("reply_text", "")
@@ -178,9 +350,8 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 # Use deterministic extraction (no LLM fallback for better performance)
                 report_req = extract_period_and_type(user_text)
                 if not report_req:
-                    await context.bot.send_message(
-                        chat_id=chat_id, 
-                        text="Không thể hiểu yêu cầu báo cáo. Vui lòng thử:\n• 'tổng hợp tháng 11'\n• 'báo cáo 30 ngày'\n• 'tổng chi tháng này'"
+                    await replies.finish(
+                        "Không thể hiểu yêu cầu báo cáo. Vui lòng thử:\n• 'tổng hợp tháng 11'\n• 'báo cáo 30 ngày'\n• 'tổng chi tháng này'"
                     )
                     return
 
@@ -189,44 +360,44 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 end = report_req.get("end_date")
                 typ = report_req.get("type", "both")
 
-                summary = await asyncio.to_thread(get_summary, user_id, start, end, typ)
+                with span("summary_query"):
+                    summary = await asyncio.to_thread(get_summary, user_id, start, end, typ)
                 if not summary or summary.get("error"):
                     err_text = "Lỗi khi truy vấn dữ liệu"
                     if isinstance(summary, dict) and summary.get("error"):
                         err_text = str(summary.get("error"))
-                    await context.bot.send_message(chat_id=chat_id, text=err_text)
+                    await replies.finish(err_text)
                     return
 
                 # Generate natural language report via LLM (in thread)
                 period_text = report_req.get("raw_period_text") or f"{start} đến {end}"
-                report_resp = await asyncio.to_thread(generate_report, summary, period_text, typ, start, end)
-                
-                elapsed_time = time.time() - start_time
+                with span("report_llm"):
+                    report_resp = await asyncio.to_thread(generate_report, summary, period_text, typ, start, end)
+                if isinstance(report_resp, dict):
+                    record_gemini_result(not report_resp.get("used_fallback"))
+
+                elapsed_time = time.perf_counter() - start_time
+                observe("handler_text_report", elapsed_time)
                 logger.info(f"✅ Report generation completed in {elapsed_time:.2f}s")
                 
                 # report_resp is a dict {text, used_fallback}
                 if isinstance(report_resp, dict):
                     text = str(report_resp.get("text") or "")
-                    # Send as Markdown so the LLM's formatting is rendered
-                    try:
-                        await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
-                    except Exception:
-                        # Fallback if the parse mode is unsupported or markup invalid
-                        await context.bot.send_message(chat_id=chat_id, text=text)
-                    if report_resp.get("used_fallback"):
-                        # Notify user that LLM formatting was unavailable and a deterministic report was used
-                        await context.bot.send_message(chat_id=chat_id, text="(Lưu ý: báo cáo được gửi ở dạng văn bản cơ bản vì trình tạo ngôn ngữ hiện không phản hồi.)")
+                    # Rendered as Markdown (checked locally, so Telegram does not reject it); the
+                    # note that LLM formatting was unavailable goes into the same message
+                    note = REPORT_FALLBACK_NOTE if report_resp.get("used_fallback") else None
+                    await replies.finish(text, markdown=True, footer=note)
                 else:
                     # backward compatibility: plain string
                     rpt = str(report_resp)
-                    await context.bot.send_message(chat_id=chat_id, text=rpt)
+                    await replies.finish(rpt)
                 return
 
         if loai == "Ghi nhận giao dịch":
-            # Try to parse and save transaction
-            payload = parse_text_for_info(user_text)
-            if payload == {"raw": "Invalid"}:
-                await context.bot.send_message(chat_id=chat_id, text="Vui lòng nhập thông tin giao dịch hợp lệ.")
+            # One message may log several transactions ("ăn sáng 30k, grab 45k"): one parse, one insert
+            payloads = await asyncio.to_thread(parse_transactions, user_text)
+            if not payloads:
+                await replies.finish("Vui lòng nhập thông tin giao dịch hợp lệ.")
                 return
 
             # Ensure payload has user_id (parsers may not set it); use default if missing
@@ -235,30 +406,32 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             except Exception:
                 _cfg = None
 
-            if "user_id" not in payload or not payload.get("user_id"):
-                payload["user_id"] = getattr(_cfg, "DEFAULT_USER_ID", 2)
+            for payload in payloads:
+                if "user_id" not in payload or not payload.get("user_id"):
+                    payload["user_id"] = getattr(_cfg, "DEFAULT_USER_ID", 2)
 
-            result = add_bill(payload)
-            
-            elapsed_time = time.time() - start_time
+            with span("db_insert"):
+                result = await asyncio.to_thread(save_bills, payloads)
+
+            elapsed_time = time.perf_counter() - start_time
+            observe("handler_text_transaction", elapsed_time)
             logger.info(f"✅ Text processing completed in {elapsed_time:.2f}s")
             
             if result.get("success"):
                 transaction_info = result.get("transaction_info", "Đã lưu giao dịch thành công")
-                await context.bot.send_message(chat_id=chat_id, text=transaction_info)
+                await replies.finish(transaction_info)
             else:
                 error_msg = result.get("error", "Không thể lưu giao dịch")
                 logger.error("Lỗi khi lưu bill từ text: %s", error_msg)
-                await context.bot.send_message(chat_id=chat_id, text=f"❌ Lỗi: {error_msg}")
+                await replies.finish(f"❌ Lỗi: {error_msg}")
             return
 
         # Otherwise, invalid request
-        await context.bot.send_message(chat_id=chat_id, text=reply_text)
+        await replies.finish(reply_text)
 
     except Exception:
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
+        observe("handler_text", elapsed_time, error=True)
         logger.error(f"❌ Text processing failed after {elapsed_time:.2f}s")
         logger.exception("Đã xảy ra lỗi trong text_handler")
-        await context.bot.send_message(
-            chat_id=chat_id, text="🙁 Đã có lỗi xảy ra trong quá trình xử lý. Vui lòng thử lại sau."
-        )
+        await replies.finish("🙁 Đã có lỗi xảy ra trong quá trình xử lý. Vui lòng thử lại sau.")
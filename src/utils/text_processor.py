@@ -1,97 +1,141 @@
-import json
 import logging
-import time
-from google.api_core.exceptions import DeadlineExceeded
-from datetime import date
-from typing import Any, Dict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
 import re
 
-from .path_setup import setup_project_root
-from .promt import get_prompt_path, read_promt_file
-
-# Standardize import of config across run contexts
-try:
-    import config  # when running from src/
-except Exception:
-    setup_project_root(__file__)
-    from src import config  # when running from repo root
+from . import model_router, schemas
+from .keywords import INCOME_CATEGORIES, get_category_engine
+from .promt import get_prompt
 
 logger = logging.getLogger(__name__)
 
 
 def parse_text_for_info(raw_text: str) -> Dict[str, Any]:
     try:
-        prompt = read_promt_file(get_prompt_path("text_input.txt"))
-        model = config.get_text_model()
-
+        # Static rules/examples are the model's system_instruction; only the user text is sent per call
+        template = get_prompt("text_input.txt")
         # Use generation_config to enforce JSON output
         generation_config = {"temperature": 0.1, "response_mime_type": "application/json"}
 
-        # Call Gemini with retries on DeadlineExceeded (504)
-        def _call_generate():
-            return model.generate_content(
-                [prompt, raw_text], generation_config=generation_config, request_options={"timeout": 60}
-            )
-
-        max_retries = 3
-        backoff = 1
-        response = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                response = _call_generate()
-                break
-            except DeadlineExceeded as e:
-                logger.warning(f"Gemini DeadlineExceeded (attempt {attempt}/{max_retries}): {e}")
-                if attempt == max_retries:
-                    logger.error("Gemini requests timed out after retries")
-                    return {"raw": "Invalid"}
-                time.sleep(backoff)
-                backoff *= 2
-        if response is None:
-            logger.error("No response from Gemini after retries")
-            return {"raw": "Invalid"}
-        result_str = response.text if response.text else ""
-        logger.info(f"Gemini text response: {result_str[:200]}...")  # Log first 200 chars
-
-        if not result_str or not result_str.strip():
-            logger.warning("Gemini returned empty response")
-            return {"raw": "Invalid"}
-
-        # Try to extract JSON if wrapped in markdown code blocks
-        cleaned_str = result_str.strip()
-        if cleaned_str.startswith("```json"):
-            cleaned_str = cleaned_str[7:]  # Remove ```json
-        if cleaned_str.startswith("```"):
-            cleaned_str = cleaned_str[3:]  # Remove ```
-        if cleaned_str.endswith("```"):
-            cleaned_str = cleaned_str[:-3]  # Remove trailing ```
-        cleaned_str = cleaned_str.strip()
-
-        data = json.loads(cleaned_str)
-
-        if not isinstance(data, dict):
-            logger.warning(f"Gemini response is not a dict: {type(data)}")
-            return {"raw": "Invalid"}
-
-        if data.get("total_amount") is None:
-            logger.warning("Gemini response missing total_amount")
+        # Constrained by the transaction schema and normalized (int amount, ISO date, category_type 0/1);
+        # an invalid answer is repaired once, then escalated to the larger model
+        data = model_router.generate_json(
+            "parse_text", template.text, [raw_text], version=template.version, schema=schemas.TRANSACTION,
+            generation_config=generation_config, span_name="gemini_parse",
+        )
+        if data is None or schemas.TRANSACTION.declined(data):
+            logger.warning("Gemini returned no valid transaction")
             return {"raw": "Invalid"}
 
         # For testing, set a fixed user_id; in real use get from context/session
         data["user_id"] = 2
-        if not data.get("bill_date"):
-            data["bill_date"] = date.today().isoformat()
         return data
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse Gemini response as JSON: {e}")
-        logger.error(f"Raw response was: {result_str[:200]}...")
+    except model_router.RouteTimeout:
+        logger.error("Gemini requests timed out after retries")
         return {"raw": "Invalid"}
     except Exception as e:
         logger.exception(f"Error in parse_text_for_info: {e}")
         return {"raw": "Invalid"}
 
 
+def parse_transactions(raw_text: str) -> List[Dict[str, Any]]:
+    """Extract every transaction in one message ("ăn sáng 30k, grab 45k, cafe 55k") with one Gemini call.
+
+    The single-transaction rules of text_input.txt are the system instruction, with the
+    text_multi_input.txt addendum asking for a JSON array; each item is validated like
+    `parse_text_for_info`'s answer. Returns [] when the text holds no valid transaction.
+    """
+    try:
+        template = get_prompt("text_input.txt")
+        multi = get_prompt("text_multi_input.txt")
+        generation_config = {"temperature": 0.1, "response_mime_type": "application/json"}
+        data = model_router.generate_json(
+            "parse_text", template.text + "\n\n" + multi.text, [raw_text], version=f"{template.version}+{multi.version}",
+            schema=schemas.TRANSACTION_LIST, generation_config=generation_config, span_name="gemini_parse",
+        )
+    except model_router.RouteTimeout:
+        logger.error("Gemini requests timed out after retries")
+        return []
+    except Exception as e:
+        logger.exception(f"Error in parse_transactions: {e}")
+        return []
+
+    if data is None:
+        logger.warning("Gemini returned no valid transaction list")
+        return []
+    transactions = [item for item in data if not schemas.TRANSACTION.declined(item)]
+    for item in transactions:
+        # Same fixed user_id as parse_text_for_info
+        item["user_id"] = 2
+    return transactions
+
+
+_ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+# An amount may end a clause ("50000, trả nợ..."); "1,5tr" or "1.500.000" is one number but not an amount
+_AMOUNT_RE = re.compile(r"(?<![\w.,])(\d+)\s*(k|nghìn|ngàn|tr|triệu|vnđ|vnd|đồng|đ)?(?!\w|[.,]\d)", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+_AMOUNT_UNITS = {"k": 1_000, "nghìn": 1_000, "ngàn": 1_000, "tr": 1_000_000, "triệu": 1_000_000}
+_MONTH_RE = re.compile(r"\btháng\s*\d{1,2}\b", re.IGNORECASE)
+_RELATIVE_DAYS = (("hôm kia", 2), ("hôm qua", 1))
+
+
+def parse_spoken_transaction(text: str, today: Optional[date] = None) -> Optional[Dict[str, Any]]:
+    """Parse one transaction from a normalized voice transcript without Gemini, or return None.
+
+    `text` has gone through `spoken_numbers.normalize_spoken`, so amounts are digits and
+    dates ISO. Only unambiguous transcripts are parsed: exactly one number, an amount of
+    at least 1,000 VND, and exactly one category from keywords.CATEGORY_KEYWORDS, whose direction
+    agrees with income words ("nhận", "thu"). Anything else returns None and goes to
+    `parse_transactions`. The payload passes the same TRANSACTION schema as Gemini's.
+    """
+    today = today or date.today()
+    dates = _ISO_DATE_RE.findall(text)
+    if len(dates) > 1:
+        return None
+    # Dates and months are not amounts; any other number may be one Gemini should see
+    rest = _MONTH_RE.sub(" ", _ISO_DATE_RE.sub(" ", text))
+    if len(_NUMBER_RE.findall(rest)) != 1:
+        return None
+    amounts = []
+    for m in _AMOUNT_RE.finditer(rest):
+        unit = (m.group(2) or "").lower()
+        amounts.append(int(m.group(1)) * _AMOUNT_UNITS.get(unit, 1))
+    if len(amounts) != 1 or amounts[0] < 1000:
+        return None
+
+    hits = get_category_engine().scan(text)
+    categories = [label for label in hits.scores if label != "income"]
+    if len(categories) != 1:
+        return None
+    category = categories[0]
+    category_type = 1 if category in INCOME_CATEGORIES else 0
+    if hits.score("income") and not category_type:
+        return None
+
+    if dates:
+        bill_date = "-".join(dates[0])
+    else:
+        lowered = text.lower()
+        offset = next((days for phrase, days in _RELATIVE_DAYS if phrase in lowered), 0)
+        bill_date = (today - timedelta(days=offset)).isoformat()
+
+    try:
+        data = schemas.TRANSACTION.validate({
+            "merchant_name": "Payment",
+            "total_amount": amounts[0],
+            "bill_date": bill_date,
+            "category_name": category,
+            "category_type": category_type,
+            "note": preprocess_text(text),
+        })
+    except schemas.SchemaError:
+        return None
+    # Same fixed user_id as parse_text_for_info
+    data["user_id"] = 2
+    return data
+
+
 def preprocess_text(raw_text: str) -> str:
     """Lightweight text normalization used before classification/parsing.
 
@@ -111,11 +155,10 @@ def preprocess_text(raw_text: str) -> str:
 def classify_user_intent(raw_text: str) -> Dict[str, Any]:
     """Classify the user's intent into one of: summarize_expenses, record_transaction, unclear.
 
-    Uses the project's configured Gemini text model (`config.get_text_model()`). Returns a
+    Uses the "classify" route of `model_router` (cheap model, escalated on invalid JSON). Returns a
     dict with keys: intent (str), confidence (float 0-1), explanation (str).
 
-    This function mirrors the retry/backoff behavior used in `parse_text_for_info` to
-    handle transient DeadlineExceeded errors from Gemini.
+    Timeouts and retries on DeadlineExceeded follow the route's policy, like `parse_text_for_info`.
     """
     try:
         text = preprocess_text(raw_text)
@@ -124,11 +167,11 @@ def classify_user_intent(raw_text: str) -> Dict[str, Any]:
 
         # All classification should use Gemini per project policy; do not short-circuit with heuristics.
 
-        model = config.get_text_model()
-
         # Load prompt from prompts/classifier_intent.txt
+        version = None
         try:
-            prompt = read_promt_file(get_prompt_path("classifier_intent.txt"))
+            template = get_prompt("classifier_intent.txt")
+            prompt, version = template.text, template.version
         except Exception:
             # fallback to the inline prompt if reading fails
             prompt = (
@@ -142,54 +185,22 @@ def classify_user_intent(raw_text: str) -> Dict[str, Any]:
             )
 
         generation_config = {"temperature": 0.0, "response_mime_type": "application/json"}
-
-        def _call_generate():
-            return model.generate_content([prompt, text], generation_config=generation_config, request_options={"timeout": 20})
-
-        max_retries = 2
-        backoff = 1
-        response = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                response = _call_generate()
-                break
-            except DeadlineExceeded as e:
-                logger.warning(f"Gemini DeadlineExceeded during classification (attempt {attempt}/{max_retries}): {e}")
-                if attempt == max_retries:
-                    logger.error("Gemini classification timed out after retries")
-                    return {"intent": "unclear", "confidence": 0.0, "explanation": "gemini timeout"}
-                time.sleep(backoff)
-                backoff *= 2
-
-        if response is None or not getattr(response, "text", None):
-            logger.error("No response text from Gemini classifier")
-            return {"intent": "unclear", "confidence": 0.0, "explanation": "no response"}
-
-        result_str = response.text.strip()
-        # strip markdown code fences if present
-        if result_str.startswith("```json"):
-            result_str = result_str[7:]
-        if result_str.startswith("```"):
-            result_str = result_str[3:]
-        if result_str.endswith("```"):
-            result_str = result_str[:-3]
-        result_str = result_str.strip()
-
         try:
-            parsed = json.loads(result_str)
-            intent = parsed.get("intent") if isinstance(parsed.get("intent"), str) else "unclear"
-            confidence = float(parsed.get("confidence", 0.0)) if parsed.get("confidence") is not None else 0.0
-            explanation = parsed.get("explanation", "")
-            # sanitize
-            if intent not in {"summarize_expenses", "record_transaction", "unclear"}:
-                logger.warning(f"Unknown intent from Gemini: {intent}")
-                intent = "unclear"
-            confidence = max(0.0, min(1.0, confidence))
-            return {"intent": intent, "confidence": confidence, "explanation": explanation}
-        except json.JSONDecodeError:
+            parsed = model_router.generate_json(
+                "classify", prompt, [text], version=version, schema=schemas.INTENT,
+                generation_config=generation_config, span_name="intent_classification",
+            )
+        except model_router.RouteTimeout:
+            logger.error("Gemini classification timed out after retries")
+            return {"intent": "unclear", "confidence": 0.0, "explanation": "gemini timeout"}
+
+        if parsed is None:
             logger.warning("Failed to parse Gemini classification response as JSON; returning 'unclear'")
-            logger.debug(f"Raw classifier output: {result_str[:200]}...")
             return {"intent": "unclear", "confidence": 0.0, "explanation": "invalid json from classifier"}
+
+        # intent is one of the schema's enum values; only the confidence range is left to clamp
+        confidence = max(0.0, min(1.0, parsed["confidence"]))
+        return {"intent": parsed["intent"], "confidence": confidence, "explanation": parsed["explanation"]}
     except Exception as e:
         logger.exception(f"Error in classify_user_intent: {e}")
         return {"intent": "unclear", "confidence": 0.0, "explanation": "internal error"}
@@ -297,7 +308,7 @@ def extract_period_and_type(raw_text: str) -> Dict[str, Any]:
             return {"start_date": d1.isoformat(), "end_date": d2.isoformat(), "type": typ, "raw_period_text": m.group(0)}
 
     # month: 'tháng N' or 'tháng N/YYYY'
-    m = re.search(r"tháng\s*(\d{1,2})(?:[\s\-/](\d{4}))?", txt)
+    m = re.search(r"tháng\s*(1[0-2]|0?[1-9])(?!\d)(?:[\s\-/](\d{4}))?", txt)
     if m:
         month = int(m.group(1))
         year = int(m.group(2)) if m.group(2) else today.year
@@ -418,11 +429,11 @@ def gemini_parse_report_request(raw_text: str) -> Dict[str, Any]:
     If Gemini fails or returns invalid JSON, returns an empty dict.
     """
     try:
-        model = config.get_text_model()
-
         # Load prompt from prompts/report_request_parse.txt
+        version = None
         try:
-            prompt = read_promt_file(get_prompt_path("report_request_parse.txt"))
+            template = get_prompt("report_request_parse.txt")
+            prompt, version = template.text, template.version
         except Exception:
             prompt = (
                 "You are an assistant that extracts structured report parameters from a user's Vietnamese request.\n"
@@ -439,40 +450,18 @@ def gemini_parse_report_request(raw_text: str) -> Dict[str, Any]:
             )
 
         generation_config = {"temperature": 0.0, "response_mime_type": "application/json"}
-
-        def _call_generate():
-            return model.generate_content([prompt, raw_text], generation_config=generation_config, request_options={"timeout": 20})
-
-        max_retries = 2
-        backoff = 1
-        response = None
-        for attempt in range(1, max_retries + 1):
-            try:
-                response = _call_generate()
-                break
-            except DeadlineExceeded as e:
-                logger.warning(f"Gemini DeadlineExceeded parsing report request (attempt {attempt}/{max_retries}): {e}")
-                if attempt == max_retries:
-                    logger.error("Gemini timed out parsing report request")
-                    return {}
-                time.sleep(backoff)
-                backoff *= 2
-
-        if response is None or not getattr(response, "text", None):
-            logger.error("No response text from Gemini for report parsing")
+        try:
+            parsed = model_router.generate_json(
+                "parse_report_request", prompt, [raw_text], version=version, schema=schemas.REPORT_REQUEST,
+                generation_config=generation_config, span_name="gemini_parse_report_request",
+            )
+        except model_router.RouteTimeout:
+            logger.error("Gemini timed out parsing report request")
+            return {}
+        if parsed is None:
+            logger.error("No valid response from Gemini for report parsing")
             return {}
 
-        result_str = response.text.strip()
-        # strip code fences
-        if result_str.startswith("```json"):
-            result_str = result_str[7:]
-        if result_str.startswith("```"):
-            result_str = result_str[3:]
-        if result_str.endswith("```"):
-            result_str = result_str[:-3]
-        result_str = result_str.strip()
-
-        parsed = json.loads(result_str)
         start = parsed.get("start_date")
         end = parsed.get("end_date")
         typ = parsed.get("type")
@@ -0,0 +1,111 @@
+"""Update processor that runs different chats concurrently but keeps each chat in order.
+
+PTB's SimpleUpdateProcessor runs every update as soon as a slot is free, which can
+reorder two messages from the same user (e.g. "ghi nhận" followed by "tổng hợp").
+PerChatUpdateProcessor serializes updates per chat_id while letting up to
+`max_concurrent_updates` different chats be processed at the same time.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Deque, Dict, Hashable, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def install_blocking_executor(max_concurrent_updates: int, extra: int = 0) -> ThreadPoolExecutor:
+    """Size the running loop's default executor, used by asyncio.to_thread, for the update slots.
+
+    Handlers run their Gemini and database calls with asyncio.to_thread. The default
+    pool has min(32, CPUs + 4) threads, 5 on a one-CPU host, which would cap how many
+    chats are served in parallel whatever `max_concurrent_updates` says. Each slot has
+    at most one blocking call in flight; `extra` covers job workers and background tasks.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_concurrent_updates + extra + 4, thread_name_prefix="blocking")
+    asyncio.get_running_loop().set_default_executor(executor)
+    return executor
+
+
+def _chat_key(update: object) -> Optional[Hashable]:
+    """Return the chat id used for ordering, or None if the update has no chat."""
+    chat = getattr(update, "effective_chat", None)
+    return getattr(chat, "id", None) if chat is not None else None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently across chats with strict FIFO order within a chat.
+
+    The first update of an idle chat takes a concurrency slot and becomes that chat's
+    drainer: later updates for the same chat are appended to its queue and release their
+    slot immediately, so a chat with a backlog occupies one slot instead of many. The
+    drainer processes queued updates in arrival order before giving its slot back.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._queues: Dict[Hashable, Deque[Awaitable[Any]]] = {}
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def active_chats(self) -> int:
+        """Number of chats currently being processed."""
+        return len(self._queues)
+
+    @property
+    def pending_updates(self) -> int:
+        """Number of updates waiting behind an earlier update of the same chat."""
+        return sum(len(q) for q in self._queues.values())
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _chat_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # Another task is draining this chat; keep FIFO order by queueing behind it.
+            queue.append(coroutine)
+            return
+
+        queue = deque()
+        self._queues[key] = queue
+        if self._idle is not None:
+            self._idle.clear()
+        try:
+            # A failing update must not drop the updates queued behind it
+            try:
+                await coroutine
+            except Exception:
+                logger.exception("Error while processing update for chat %s", key)
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception:
+                    logger.exception("Error while processing queued update for chat %s", key)
+        finally:
+            del self._queues[key]
+            if queue:
+                # Only reached when the drainer itself was cancelled
+                logger.warning("Dropping %d queued updates for chat %s", len(queue), key)
+                for pending in queue:
+                    close = getattr(pending, "close", None)
+                    if close is not None:
+                        close()
+            if not self._queues and self._idle is not None:
+                self._idle.set()
+
+    async def initialize(self) -> None:
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def shutdown(self) -> None:
+        # Application.stop() already awaits the drainer tasks; this only guards against
+        # callers that shut the processor down directly.
+        if self._idle is not None and self._queues:
+            logger.info("Waiting for %d chats to finish processing", len(self._queues))
+            await self._idle.wait()
@@ -0,0 +1,149 @@
+"""Persistent, content-addressed cache of validated receipt extractions.
+
+Entries are stored in a small SQLite file under two keys per photo:
+
+- ``fuid:<file_unique_id>``: Telegram's stable id, so a resent or edited photo
+  (or a retry after a DB error) is answered before the image is even downloaded;
+- ``sha:<sha256 of the preprocessed JPEG>``: catches the same image uploaded
+  under a different id.
+
+Every key is paired with the prompt version, so editing prompts/image_input.txt
+invalidates old results. The table is capped at `vision_cache.max_entries` rows
+and evicts the least recently used ones.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .path_setup import setup_project_root
+
+try:
+    import config  # when running from src/
+except Exception:
+    setup_project_root(__file__)
+    from src import config  # when running from repo root
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vision_cache (
+    cache_key TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (cache_key, prompt_version)
+);
+CREATE INDEX IF NOT EXISTS idx_vision_cache_last_used ON vision_cache(last_used);
+"""
+
+
+class VisionCache:
+    """SQLite-backed LRU mapping (key, prompt version) -> extraction payload."""
+
+    def __init__(self, path: str, max_entries: int = 5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, key: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached payload and mark it as recently used; None on a miss or error."""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT payload FROM vision_cache WHERE cache_key = ? AND prompt_version = ?", (key, prompt_version)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._conn.execute(
+                    "UPDATE vision_cache SET last_used = ? WHERE cache_key = ? AND prompt_version = ?",
+                    (time.time(), key, prompt_version),
+                )
+                self.hits += 1
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError):
+            logger.warning("Vision cache read failed for %s", key, exc_info=True)
+            return None
+
+    def put(self, keys, prompt_version: str, payload: Dict[str, Any]) -> None:
+        """Store `payload` under every key in `keys` and evict down to `max_entries`; errors are only logged."""
+        data = json.dumps(payload, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO vision_cache (cache_key, prompt_version, payload, last_used) "
+                        "VALUES (?, ?, ?, ?)",
+                        [(key, prompt_version, data, now) for key in keys],
+                    )
+                    self._evict()
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error:
+                logger.warning("Vision cache write failed for %s", keys, exc_info=True)
+
+    def _evict(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM vision_cache").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM vision_cache WHERE rowid IN (SELECT rowid FROM vision_cache ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vision_cache").fetchone()[0]
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_CACHE: Optional[VisionCache] = None
+_CACHE_LOCK = threading.Lock()
+_OPEN_FAILED = False
+
+
+def get_vision_cache() -> Optional[VisionCache]:
+    """Return the process-wide cache, or None when `vision_cache.enabled` is off or the file cannot be opened."""
+    global _CACHE, _OPEN_FAILED
+    settings = config.get_settings()
+    if not settings.vision_cache or _OPEN_FAILED:
+        return None
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None and not _OPEN_FAILED:
+                try:
+                    _CACHE = VisionCache(settings.vision_cache_path, settings.vision_cache_max_entries)
+                except (OSError, sqlite3.Error):
+                    _OPEN_FAILED = True
+                    logger.exception("Cannot open vision cache at %s; continuing without it", settings.vision_cache_path)
+    return _CACHE
+
+
+def _on_config_reload(settings) -> None:
+    if _CACHE is not None:
+        _CACHE.max_entries = settings.vision_cache_max_entries
+
+
+config.add_reload_listener(_on_config_reload)
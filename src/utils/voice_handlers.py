@@ -7,10 +7,10 @@ import subprocess
 import sys
 import time
 from pathlib import Path
+from typing import Any, Dict, Optional
 
 from telegram import Update
 from telegram.ext import ContextTypes
-from src.utils.http_session import get_session
 
 logger = logging.getLogger(__name__)
 
@@ -62,21 +62,25 @@ def get_transcriber():
 
 # Import helper functions (text parsing and DB) - guard for different run contexts
 try:
-    from .text_processor import parse_text_for_info, generate_user_response, extract_period_and_type, preprocess_text
+    from .text_processor import (
+        parse_transactions, parse_spoken_transaction, generate_user_response, extract_period_and_type, preprocess_text,
+    )
 except Exception:
     # adjust sys.path and retry if running from repo root
     repo_root = Path(__file__).resolve().parents[2]
     if str(repo_root) not in sys.path:
         sys.path.insert(0, str(repo_root))
-    from src.utils.text_processor import parse_text_for_info, generate_user_response, extract_period_and_type, preprocess_text
+    from src.utils.text_processor import (
+        parse_transactions, parse_spoken_transaction, generate_user_response, extract_period_and_type, preprocess_text,
+    )
 
 try:
-    from database.db_operations import add_bill
+    from database.db_operations import save_bills
 except Exception:
     repo_root = Path(__file__).resolve().parents[2]
     if str(repo_root) not in sys.path:
         sys.path.insert(0, str(repo_root))
-    from database.db_operations import add_bill
+    from database.db_operations import save_bills
 
 # Import reporting module for voice-based reports
 try:
@@ -97,9 +101,272 @@ except Exception:
     repo_root = Path(__file__).resolve().parents[2]
     UPLOAD_DIR = str(repo_root / "uploads")
 
-Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+try:
+    from . import job_queue
+    from .idempotency import defer_result, idempotent_update, recording_bot, update_key
+    from .job_queue import Job
+    from .keywords import get_intent_engine
+    from .spoken_numbers import normalize_spoken
+    from .replies import ReplyManager
+    from .rate_limiter import admission_controlled, record_gemini_result
+    from .metrics import observe, span
+except Exception:
+    from src.utils import job_queue
+    from src.utils.idempotency import defer_result, idempotent_update, recording_bot, update_key
+    from src.utils.job_queue import Job
+    from src.utils.keywords import get_intent_engine
+    from src.utils.spoken_numbers import normalize_spoken
+    from src.utils.replies import ReplyManager
+    from src.utils.rate_limiter import admission_controlled, record_gemini_result
+    from src.utils.metrics import observe, span
+
+
+async def _parse_voice_transactions(transcript: str, spoken: str) -> list:
+    """Parse a single clear transaction locally (`voice.local_parse`), anything else with Gemini.
+
+    Gemini gets the transcript as heard; the local parser its normalized form.
+    """
+    if config.get_settings().voice_local_parse:
+        start = time.perf_counter()
+        payload = parse_spoken_transaction(spoken)
+        if payload is not None:
+            observe("voice_local_parse", time.perf_counter() - start)
+            return [payload]
+    return await asyncio.to_thread(parse_transactions, transcript)
+
 
+async def _save_voice_transactions(job: Job, transcript: str, spoken: str) -> Optional[Dict[str, Any]]:
+    """Parse and insert the transcript's transactions; None when there is nothing to save.
 
+    A successful insert is checkpointed in the job, so a retry (the reply could not
+    be sent, shutdown) reports the same bills instead of inserting them again.
+    """
+    saved = job.payload.get("saved")
+    if saved is not None:
+        return saved
+    payloads = await _parse_voice_transactions(transcript, spoken)
+    if not payloads:
+        return None
+    with span("db_insert"):
+        result = await asyncio.to_thread(save_bills, payloads)
+    if result.get("success"):
+        await job_queue.checkpoint(job, saved=result)
+    return result
+
+
+async def process_voice_job(job: Job, bot) -> None:
+    """Queued voice job: transcribe, then save the transaction(s) or build the report, and reply.
+
+    Payload: chat_id, audio_path (16 kHz WAV under UPLOAD_DIR), update_key (the
+    idempotency key of the voice message whose result the final reply becomes) and
+    ack_message_id, the handler's ack that is edited into the result.
+    Errors are raised for the queue to retry, except on the last attempt.
+    """
+    chat_id = job.payload["chat_id"]
+    audio_path = job.payload["audio_path"]
+    replies = ReplyManager(recording_bot(bot, job.payload.get("update_key")), chat_id,
+                           job.payload.get("ack_message_id"))
+    retrying = False
+    process_start = time.perf_counter()
+
+    try:
+        # Load transcriber (may be heavy) in a thread
+        stt = await asyncio.to_thread(get_transcriber)
+
+        # Run ASR in thread
+        with span("asr"):
+            out = await asyncio.to_thread(stt, str(audio_path))
+
+        # Extract text from pipeline output (be robust to dict/list/string returns)
+        text_result = ""
+        if isinstance(out, dict):
+            text_result = out.get("text", "")
+        elif isinstance(out, list):
+            parts = []
+            for o in out:
+                if isinstance(o, dict):
+                    parts.append(o.get("text", ""))
+                else:
+                    parts.append(str(o))
+            text_result = " ".join([p for p in parts if p])
+        else:
+            text_result = str(out)
+
+        if not text_result:
+            await replies.finish("❌ Xử lí không thành công. Vui lòng thử lại.")
+            return
+
+        logger.info(f"Voice transcribed: {text_result}")
+        
+        # Check if transcription is too short or unclear
+        if len(text_result.strip()) < 5:
+            await replies.finish(
+                "🤔 Tôi không nghe rõ. Bạn có thể nói lại được không?\n\nGợi ý:\n• Nói rõ ràng hơn\n• Ghi âm ở nơi yên tĩnh\n• Hoặc gõ text thay vì voice"
+            )
+            return
+        
+        # Spoken amounts and dates as digits, for the local heuristics and parsers below
+        spoken = normalize_spoken(text_result)
+        
+        # Classify intent using scoring system for better accuracy
+        norm = preprocess_text(spoken).lower()
+        
+        # Score-based classification: transaction indicators (verbs, an amount, a currency
+        # unit) and report indicators, weighted in utils/keywords.py and scored in one pass
+        hits = get_intent_engine().scan(norm)
+        transaction_score = hits.score("transaction")
+        report_score = hits.score("report")
+        
+        # Penalty: if has report keywords, reduce transaction score
+        if report_score > 0:
+            transaction_score = max(0, transaction_score - 2)
+        
+        # Penalty: if has transaction keywords, reduce report score slightly
+        if transaction_score > 0:
+            report_score = max(0, report_score - 1)
+        
+        # Determine intent based on scores
+        TRANSACTION_THRESHOLD = 5
+        REPORT_THRESHOLD = 4
+        
+        is_transaction = transaction_score >= TRANSACTION_THRESHOLD
+        is_report_request = report_score >= REPORT_THRESHOLD
+        
+        logger.info(f"Intent scores - Transaction: {transaction_score}, Report: {report_score}")
+        
+        # Handle dual intent (both transaction and report)
+        header = None
+        if is_report_request and is_transaction:
+            logger.info("Voice classified as: BOTH transaction and report")
+            await replies.progress("📝 Tôi nghe thấy cả giao dịch VÀ yêu cầu báo cáo. Tôi sẽ xử lý cả hai nhé!")
+            
+            # Process transaction first; its outcome heads the report message
+            try:
+                result = await _save_voice_transactions(job, text_result, spoken)
+                if result is not None:
+                    if result.get("success"):
+                        transaction_info = result.get("transaction_info", "Đã lưu giao dịch")
+                        header = f"✅ Giao dịch:\n{transaction_info}"
+                    else:
+                        header = "⚠️ Không thể lưu giao dịch, nhưng tôi sẽ tạo báo cáo."
+            except Exception as e:
+                logger.exception("Error processing transaction in dual intent")
+                header = "⚠️ Lỗi khi lưu giao dịch, nhưng tôi sẽ tạo báo cáo."
+            
+            # Then process report (code continues below)
+            # Fall through to report processing
+        
+        # Process based on intent
+        if is_report_request:
+            # Handle report request
+            logger.info("Voice classified as: Report request")
+            
+            try:
+                import config as _cfg
+                user_id = getattr(_cfg, "DEFAULT_USER_ID", 2)
+            except Exception:
+                user_id = 2
+            
+            # Extract period from voice text
+            report_req = extract_period_and_type(spoken)
+            if not report_req:
+                await replies.finish(
+                    "Không thể hiểu yêu cầu báo cáo. Vui lòng nói rõ hơn, ví dụ:\n• 'Tổng hợp tháng này'\n• 'Báo cáo chi tiêu tháng 11'\n• 'Xem tổng thu tháng trước'",
+                    header=header,
+                )
+                return
+            
+            # Get data from database
+            start = report_req.get("start_date")
+            end = report_req.get("end_date")
+            typ = report_req.get("type", "both")
+            
+            with span("summary_query"):
+                summary = await asyncio.to_thread(get_summary, user_id, start, end, typ)
+            if not summary or summary.get("error"):
+                err_text = "Lỗi khi truy vấn dữ liệu"
+                if isinstance(summary, dict) and summary.get("error"):
+                    err_text = str(summary.get("error"))
+                await replies.finish(err_text, header=header)
+                return
+            
+            # Generate report
+            period_text = report_req.get("raw_period_text") or f"{start} đến {end}"
+            with span("report_llm"):
+                report_resp = await asyncio.to_thread(generate_report, summary, period_text, typ, start, end)
+            if isinstance(report_resp, dict):
+                record_gemini_result(not report_resp.get("used_fallback"))
+            
+            elapsed_time = time.perf_counter() - process_start
+            observe("handler_voice_report", elapsed_time)
+            logger.info(f"✅ Voice report generation completed in {elapsed_time:.2f}s")
+            
+            if isinstance(report_resp, dict):
+                text = str(report_resp.get("text") or "")
+                await replies.finish(text, markdown=True, header=header)
+            else:
+                await replies.finish(str(report_resp), header=header)
+        
+        elif is_transaction:
+            # Handle transaction recording only
+            logger.info("Voice classified as: Transaction recording")
+            
+            result = await _save_voice_transactions(job, text_result, spoken)
+            if result is None:
+                # Ask user to clarify
+                await replies.finish(
+                    "🤔 Tôi không hiểu rõ giao dịch này. Bạn có thể:\n\n1️⃣ Nói lại rõ hơn (ví dụ: 'Mua cafe năm mươi nghìn')\n2️⃣ Hoặc gõ text: 'Cafe 50k'"
+                )
+                return
+            
+            elapsed_time = time.perf_counter() - process_start
+            observe("handler_voice_transaction", elapsed_time)
+            logger.info(f"✅ Voice transaction processing completed in {elapsed_time:.2f}s")
+            
+            if result.get("success"):
+                transaction_info = result.get("transaction_info", "Đã lưu giao dịch thành công")
+                await replies.finish(transaction_info)
+            else:
+                error_msg = result.get("error", "Không thể lưu giao dịch")
+                logger.error("Lỗi khi lưu bill từ giọng nói: %s", error_msg)
+                await replies.finish(f"❌ Lỗi khi lưu: {error_msg}")
+        
+        else:
+            # Unclear intent - ask user
+            logger.info("Voice classified as: Unclear intent")
+            await replies.finish(
+                "🤔 Tôi không chắc bạn muốn làm gì. Bạn muốn:\n\n1️⃣ Ghi nhận giao dịch? (Nói: 'Mua cafe 50k')\n2️⃣ Xem báo cáo? (Nói: 'Tổng hợp tháng này')\n\nHoặc gõ text cho chính xác hơn!"
+            )
+
+    except Exception:
+        elapsed_time = time.perf_counter() - process_start
+        observe("handler_voice", elapsed_time, error=True)
+        logger.error(f"❌ Voice processing failed after {elapsed_time:.2f}s")
+        if not job.last_attempt:
+            # The queue retries the job later; keep the audio file for it
+            retrying = True
+            raise
+        logger.exception("Error during background STT or DB save")
+        try:
+            await replies.finish("❌ Lỗi khi xử lý giọng nói. Vui lòng thử lại sau.")
+        except Exception:
+            logger.exception("Failed to send error message to user after background failure")
+    finally:
+        # Best-effort: delete the audio file once the job will not run again
+        try:
+            ap = Path(audio_path)
+            if not retrying and ap.exists() and str(ap.resolve()).startswith(str(Path(UPLOAD_DIR).resolve())):
+                ap.unlink()
+                logger.info("Deleted background-processed audio file: %s", ap)
+        except Exception:
+            logger.exception("Failed to delete background audio file: %s", audio_path)
+
+
+job_queue.register("voice", process_voice_job)
+
+
+@idempotent_update
+@admission_controlled("voice")
 async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Xử lý tin nhắn giọng nói: tải về, chuyển đổi, trích xuất văn bản, lưu vào DB và trả lời.
@@ -112,22 +379,26 @@ async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     dest_path = None
     dest_wav = None
+    replies = ReplyManager(context.bot, chat_id)
     try:
         # Tải tệp giọng nói về
         voice_file = await voice.get_file()
         file_url = getattr(voice_file, "file_path", None)
         if not file_url:
-            await context.bot.send_message(chat_id=chat_id, text="Không thể xử lí giọng nói. Vui lòng thử lại.")
+            await replies.finish("Không thể xử lí giọng nói. Vui lòng thử lại.")
             return
 
         # Determine extension from URL or default to .ogg
         ext = Path(file_url).suffix or ".ogg"
         timestamp = int(time.time())
         filename = f"voice_{chat_id}_{timestamp}{ext}"
+        # Created on demand rather than at import time
+        Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
         dest_path = Path(UPLOAD_DIR) / filename
 
         # Try library download methods first, then fallback to HTTP GET
         downloaded = False
+        download_start = time.perf_counter()
         try:
             if hasattr(voice_file, "download_to_drive"):
                 # async method in newer python-telegram-bot
@@ -147,6 +418,10 @@ async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         if not downloaded:
             # Fallback: fetch URL directly using shared requests Session
             try:
+                try:
+                    from .http_session import get_session
+                except Exception:
+                    from src.utils.http_session import get_session
                 session = get_session()
                 timeout = getattr(config, "HTTP_TIMEOUT", 30)
                 r = session.get(file_url, timeout=timeout)
@@ -157,8 +432,10 @@ async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             except Exception:
                 logger.exception("Failed to download voice file via HTTP fallback")
 
+        observe("download", time.perf_counter() - download_start, error=not downloaded)
+
         if not downloaded:
-            await context.bot.send_message(chat_id=chat_id, text="❌ Không thể xử lí âm thanh. Vui lòng thử lại.")
+            await replies.finish("❌ Không thể xử lí âm thanh. Vui lòng thử lại.")
             return
 
         # Convert OGG/OPUS/OGA -> WAV suitable for Whisper and transcribe
@@ -183,252 +460,37 @@ async def voice_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 str(dest_wav),
             ]
             try:
-                await asyncio.to_thread(subprocess.run, cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                with span("ffmpeg"):
+                    await asyncio.to_thread(subprocess.run, cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
                 audio_for_stt = dest_wav
                 logger.info("Audio converted to WAV for STT")
             except Exception:
                 logger.exception("ffmpeg conversion failed")
                 return
 
-        # Offload transcription + parsing + DB save to a background task so the bot
+        # Offload transcription + parsing + DB save to a queued job so the bot
         # can reply quickly. The heavy work runs in threads via asyncio.to_thread.
-        await context.bot.send_message(chat_id=chat_id, text="🔊 Đã nhận file — đang xử lí ở background. Bạn sẽ nhận thông báo khi hoàn tất.")
-
-        async def _process_and_respond(audio_path: str, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-            import time
-            process_start = time.time()
-            
-            try:
-                # Load transcriber (may be heavy) in a thread
-                stt = await asyncio.to_thread(get_transcriber)
-
-                # Run ASR in thread
-                out = await asyncio.to_thread(stt, str(audio_path))
-
-                # Extract text from pipeline output (be robust to dict/list/string returns)
-                text_result = ""
-                if isinstance(out, dict):
-                    text_result = out.get("text", "")
-                elif isinstance(out, list):
-                    parts = []
-                    for o in out:
-                        if isinstance(o, dict):
-                            parts.append(o.get("text", ""))
-                        else:
-                            parts.append(str(o))
-                    text_result = " ".join([p for p in parts if p])
-                else:
-                    text_result = str(out)
-
-                if not text_result:
-                    await context.bot.send_message(chat_id=chat_id, text="❌ Xử lí không thành công. Vui lòng thử lại.")
-                    return
-
-                logger.info(f"Voice transcribed: {text_result}")
-                
-                # Check if transcription is too short or unclear
-                if len(text_result.strip()) < 5:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="🤔 Tôi không nghe rõ. Bạn có thể nói lại được không?\n\nGợi ý:\n• Nói rõ ràng hơn\n• Ghi âm ở nơi yên tĩnh\n• Hoặc gõ text thay vì voice"
-                    )
-                    return
-                
-                # Classify intent using scoring system for better accuracy
-                norm = preprocess_text(text_result).lower()
-                
-                # Score-based classification
-                transaction_score = 0
-                report_score = 0
-                
-                # Transaction indicators (stronger signals)
-                transaction_keywords = [
-                    ("mua", 3), ("chi", 3), ("trả", 3), ("thanh toán", 3),
-                    ("chuyển khoản", 3), ("ck", 2), ("nạp", 2), ("rút", 2),
-                    ("gửi", 2), ("bán", 2), ("thu", 2), ("nhận", 2)
-                ]
-                for keyword, weight in transaction_keywords:
-                    if keyword in norm:
-                        transaction_score += weight
-                
-                # Check for amount (strong transaction signal)
-                import re
-                has_number = bool(re.search(r'\d+', norm))
-                has_currency = any(unit in norm for unit in ["nghìn", "triệu", "k", "đồng", "vnd"])
-                if has_number:
-                    transaction_score += 4
-                if has_currency:
-                    transaction_score += 2
-                
-                # Report indicators (stronger signals)
-                report_keywords = [
-                    ("tổng chi", 5), ("tổng thu", 5), ("tổng hợp", 5),
-                    ("báo cáo", 4), ("xem chi tiêu", 4), ("xem thu nhập", 4),
-                    ("thống kê", 3), ("tổng kết", 3), ("chi tiết", 2),
-                    ("tháng này", 2), ("tháng trước", 2), ("hôm nay", 1),
-                    ("tuần này", 2), ("năm nay", 2)
-                ]
-                for keyword, weight in report_keywords:
-                    if keyword in norm:
-                        report_score += weight
-                
-                # Penalty: if has report keywords, reduce transaction score
-                if report_score > 0:
-                    transaction_score = max(0, transaction_score - 2)
-                
-                # Penalty: if has transaction keywords, reduce report score slightly
-                if transaction_score > 0:
-                    report_score = max(0, report_score - 1)
-                
-                # Determine intent based on scores
-                TRANSACTION_THRESHOLD = 5
-                REPORT_THRESHOLD = 4
-                
-                is_transaction = transaction_score >= TRANSACTION_THRESHOLD
-                is_report_request = report_score >= REPORT_THRESHOLD
-                
-                logger.info(f"Intent scores - Transaction: {transaction_score}, Report: {report_score}")
-                
-                # Handle dual intent (both transaction and report)
-                if is_report_request and is_transaction:
-                    logger.info("Voice classified as: BOTH transaction and report")
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="📝 Tôi nghe thấy cả giao dịch VÀ yêu cầu báo cáo. Tôi sẽ xử lý cả hai nhé!"
-                    )
-                    
-                    # Process transaction first
-                    try:
-                        payload = await asyncio.to_thread(parse_text_for_info, text_result)
-                        if payload != {"raw": "Invalid"}:
-                            result = await asyncio.to_thread(add_bill, payload)
-                            if result.get("success"):
-                                transaction_info = result.get("transaction_info", "Đã lưu giao dịch")
-                                await context.bot.send_message(chat_id=chat_id, text=f"✅ Giao dịch:\n{transaction_info}")
-                            else:
-                                await context.bot.send_message(chat_id=chat_id, text="⚠️ Không thể lưu giao dịch, nhưng tôi sẽ tạo báo cáo.")
-                    except Exception as e:
-                        logger.exception("Error processing transaction in dual intent")
-                        await context.bot.send_message(chat_id=chat_id, text="⚠️ Lỗi khi lưu giao dịch, nhưng tôi sẽ tạo báo cáo.")
-                    
-                    # Then process report (code continues below)
-                    # Fall through to report processing
-                
-                # Process based on intent
-                if is_report_request:
-                    # Handle report request
-                    logger.info("Voice classified as: Report request")
-                    
-                    try:
-                        import config as _cfg
-                        user_id = getattr(_cfg, "DEFAULT_USER_ID", 2)
-                    except Exception:
-                        user_id = 2
-                    
-                    # Extract period from voice text
-                    report_req = extract_period_and_type(text_result)
-                    if not report_req:
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="Không thể hiểu yêu cầu báo cáo. Vui lòng nói rõ hơn, ví dụ:\n• 'Tổng hợp tháng này'\n• 'Báo cáo chi tiêu tháng 11'\n• 'Xem tổng thu tháng trước'"
-                        )
-                        return
-                    
-                    # Get data from database
-                    start = report_req.get("start_date")
-                    end = report_req.get("end_date")
-                    typ = report_req.get("type", "both")
-                    
-                    summary = await asyncio.to_thread(get_summary, user_id, start, end, typ)
-                    if not summary or summary.get("error"):
-                        err_text = "Lỗi khi truy vấn dữ liệu"
-                        if isinstance(summary, dict) and summary.get("error"):
-                            err_text = str(summary.get("error"))
-                        await context.bot.send_message(chat_id=chat_id, text=err_text)
-                        return
-                    
-                    # Generate report
-                    period_text = report_req.get("raw_period_text") or f"{start} đến {end}"
-                    report_resp = await asyncio.to_thread(generate_report, summary, period_text, typ, start, end)
-                    
-                    elapsed_time = time.time() - process_start
-                    logger.info(f"✅ Voice report generation completed in {elapsed_time:.2f}s")
-                    
-                    if isinstance(report_resp, dict):
-                        text = str(report_resp.get("text") or "")
-                        try:
-                            await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
-                        except Exception:
-                            await context.bot.send_message(chat_id=chat_id, text=text)
-                    else:
-                        await context.bot.send_message(chat_id=chat_id, text=str(report_resp))
-                
-                elif is_transaction:
-                    # Handle transaction recording only
-                    logger.info("Voice classified as: Transaction recording")
-                    
-                    payload = await asyncio.to_thread(parse_text_for_info, text_result)
-                    if payload == {"raw": "Invalid"}:
-                        # Ask user to clarify
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="🤔 Tôi không hiểu rõ giao dịch này. Bạn có thể:\n\n1️⃣ Nói lại rõ hơn (ví dụ: 'Mua cafe năm mươi nghìn')\n2️⃣ Hoặc gõ text: 'Cafe 50k'"
-                        )
-                        return
-
-                    result = await asyncio.to_thread(add_bill, payload)
-                    
-                    elapsed_time = time.time() - process_start
-                    logger.info(f"✅ Voice transaction processing completed in {elapsed_time:.2f}s")
-                    
-                    if result.get("success"):
-                        transaction_info = result.get("transaction_info", "Đã lưu giao dịch thành công")
-                        await context.bot.send_message(chat_id=chat_id, text=transaction_info)
-                    else:
-                        error_msg = result.get("error", "Không thể lưu giao dịch")
-                        logger.error("Lỗi khi lưu bill từ giọng nói: %s", error_msg)
-                        await context.bot.send_message(chat_id=chat_id, text=f"❌ Lỗi khi lưu: {error_msg}")
-                
-                else:
-                    # Unclear intent - ask user
-                    logger.info("Voice classified as: Unclear intent")
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text="🤔 Tôi không chắc bạn muốn làm gì. Bạn muốn:\n\n1️⃣ Ghi nhận giao dịch? (Nói: 'Mua cafe 50k')\n2️⃣ Xem báo cáo? (Nói: 'Tổng hợp tháng này')\n\nHoặc gõ text cho chính xác hơn!"
-                    )
-
-            except Exception:
-                elapsed_time = time.time() - process_start
-                logger.error(f"❌ Voice processing failed after {elapsed_time:.2f}s")
-                logger.exception("Error during background STT or DB save")
-                try:
-                    await context.bot.send_message(chat_id=chat_id, text="❌ Lỗi khi xử lý giọng nói. Vui lòng thử lại sau.")
-                except Exception:
-                    logger.exception("Failed to send error message to user after background failure")
-            finally:
-                # Best-effort: delete the audio file after background processing completes
-                try:
-                    ap = Path(audio_path)
-                    if ap.exists() and str(ap.resolve()).startswith(str(Path(UPLOAD_DIR).resolve())):
-                        ap.unlink()
-                        logger.info("Deleted background-processed audio file: %s", ap)
-                except Exception:
-                    logger.exception("Failed to delete background audio file: %s", audio_path)
+        await replies.ack("🔊 Đã nhận file — đang xử lí, kết quả sẽ hiện tại tin nhắn này.")
 
-        # Schedule background processing and return immediately
+        # Queue the job and return immediately; the persisted job survives a restart
         background_task_created = False
         try:
-            # Ensure we pass a string path into the background task
-            task = asyncio.create_task(_process_and_respond(str(audio_for_stt), chat_id, context))
+            await job_queue.submit(context.application, "voice", {
+                "chat_id": chat_id,
+                "audio_path": str(audio_for_stt),
+                "update_key": update_key(update.message),
+                "ack_message_id": replies.message_id,
+            }, update=update)
             background_task_created = True
+            defer_result()
+            if dest_wav is not None:
+                # Only the converted WAV is needed by the job
+                dest_path.unlink(missing_ok=True)
         except Exception:
-            logger.exception("Failed to schedule background voice processing")
+            logger.exception("Failed to queue background voice processing")
     except Exception as e:
         logger.exception("Lỗi trong voice_handler")
-        # Safely reference chat_id
-        cid = getattr(update.message, "chat_id", None)
-        if cid is not None:
-            await context.bot.send_message(chat_id=cid, text=f"Đã có lỗi xảy ra: {e}")
+        await replies.finish(f"Đã có lỗi xảy ra: {e}")
     finally:
         # Best-effort cleanup of downloaded/converted files. Only remove files under UPLOAD_DIR.
         try:
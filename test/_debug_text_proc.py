@@ -22,8 +22,8 @@ payload = {
 resp = "```json\n" + json.dumps(payload) + "\n```"
 mock_model = MockModel(resp)
 
-# patch config.get_text_model
-config.get_text_model = lambda *a, **k: mock_model
+# patch config.get_prompt_model
+config.get_prompt_model = lambda *a, **k: mock_model
 
 raw = "Mình đã trả 250000 VND cho thực phẩm hôm nay"
 out = text_processor.preprocess_and_classify_text(raw)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Unit tests for the offline benchmark helpers in benchmarks/."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import stubs  # noqa: E402
+from benchmarks.run_benchmarks import compare, percentile  # noqa: E402
+
+
+def test_latency_model_parse():
+    assert stubs.LatencyModel.parse("const:0.25").sample() == 0.25
+    uniform = stubs.LatencyModel.parse("uniform:0.1:0.2", seed=1)
+    assert all(0.1 <= uniform.sample() <= 0.2 for _ in range(50))
+
+
+def test_translate_sql_strips_postgres_dialect():
+    sql = "SELECT total_amount::text FROM bills WHERE user_id = %s AND bill_date >= %s::date FOR UPDATE SKIP LOCKED"
+    out = stubs.translate_sql(sql)
+    assert "::" not in out
+    assert "SKIP LOCKED" not in out
+    assert out.count("?") == 2
+
+
+def test_compare_flags_regressions_in_both_directions():
+    baseline = {"text": {"throughput_per_s": 100.0, "latency_p99_s": 0.5, "updates": 10}}
+    current = {"text": {"throughput_per_s": 70.0, "latency_p99_s": 0.55, "updates": 20}}
+    regressions = compare(current, baseline, threshold=0.2)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("text.throughput_per_s")
+
+    current["text"]["latency_p99_s"] = 0.7
+    assert len(compare(current, baseline, threshold=0.2)) == 2
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([float(i) for i in range(1, 101)], 0.99) == 99.0
+
+
+def test_load_test_mix_and_arrivals():
+    import random
+
+    import pytest
+
+    from benchmarks.load_test import DEFAULT_CORPUS, arrival_schedule, load_corpus, parse_mix
+
+    assert parse_mix("text=3,photo=1") == {"text": 0.75, "photo": 0.25}
+    with pytest.raises(ValueError):
+        parse_mix("sticker=1")
+
+    offsets = arrival_schedule(rate=50.0, duration=20.0, rng=random.Random(7))
+    assert offsets == sorted(offsets)
+    assert all(0 <= t < 20.0 for t in offsets)
+    assert 800 < len(offsets) < 1200
+
+    corpus = load_corpus(DEFAULT_CORPUS)
+    assert corpus and not any(line.startswith("#") for line in corpus)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Unit tests for the typed Settings object and hot reload in src/config.py."""
+
+import dataclasses
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import config  # noqa: E402
+from config import Settings  # noqa: E402
+
+BASE = {
+    "telegram": {"token": "123:abc"},
+    "google": {"gemini_api_key": "key"},
+    "database": {"url": "postgresql://localhost/db", "pool_min": 1, "pool_max": 5},
+}
+
+
+@pytest.fixture
+def restore_settings():
+    original = config.get_settings()
+    yield
+    config._apply_settings(original)
+
+
+def _write_yaml(path: Path, conf: dict) -> Path:
+    import yaml
+
+    path.write_text(yaml.safe_dump(conf, allow_unicode=True), encoding="utf-8")
+    return path
+
+
+def test_settings_parse_defaults_and_types():
+    settings = Settings.from_mapping({**BASE, "limits": {"per_chat_rate": "1.5"}, "http": {"timeout": "oops"}})
+    assert settings.token == "123:abc"
+    assert settings.telegram_mode == "polling"
+    assert settings.rate_limit_per_chat_rate == 1.5
+    assert settings.http_timeout == 10  # invalid values fall back to the default
+    assert settings.text_model == "gemini-2.5-flash"
+
+
+def test_numbers_are_clamped_to_their_range():
+    settings = Settings.from_mapping({
+        **BASE,
+        "images": {"quality": 100},
+        "limits": {"gemini_error_rate": 3},
+        "receipts": {"dedup_distance": -1},
+    })
+    assert settings.image_quality == 95
+    assert settings.rate_limit_gemini_error_rate == 1.0
+    assert settings.receipt_dedup_distance == 0
+
+
+def test_settings_is_frozen_with_slots():
+    settings = Settings.from_mapping(BASE)
+    assert not hasattr(settings, "__dict__")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        settings.http_timeout = 5
+
+
+@pytest.mark.parametrize(
+    "conf",
+    [
+        {"google": {"gemini_api_key": "key"}},
+        {"telegram": {"token": "t"}},
+        {**BASE, "telegram": {"token": "t", "mode": "carrier-pigeon"}},
+        {**BASE, "telegram": {"token": "t", "mode": "webhook"}},
+        {**BASE, "database": {"pool_min": 5, "pool_max": 2}},
+    ],
+)
+def test_settings_validation_errors(conf):
+    with pytest.raises(ValueError):
+        Settings.from_mapping(conf)
+
+
+def test_reload_applies_tunables_and_keeps_restart_only_fields(tmp_path, restore_settings):
+    current = config.get_settings()
+    calls = []
+    config.add_reload_listener(calls.append)
+    try:
+        conf = {
+            "telegram": {"token": "other-token"},
+            "google": {"gemini_api_key": current.gemini_api_key, "text_model": "gemini-2.5-pro"},
+            "http": {"timeout": current.http_timeout + 7},
+            "limits": {"per_chat_burst": 42},
+            "database": {"pool_max": current.db_pool_max + 3},
+        }
+        assert config.reload_settings(_write_yaml(tmp_path / "config.yaml", conf))
+    finally:
+        config._reload_listeners.remove(calls.append)
+
+    new = config.get_settings()
+    assert new.http_timeout == current.http_timeout + 7
+    assert config.HTTP_TIMEOUT == new.http_timeout
+    assert new.rate_limit_per_chat_burst == 42
+    assert new.text_model == "gemini-2.5-pro"
+    assert new.token == current.token  # restart-only
+    assert new.db_pool_max == current.db_pool_max  # the live pool is never resized
+    assert calls == [new]
+
+
+def test_reload_ignores_invalid_file(tmp_path, restore_settings):
+    before = config.get_settings()
+    assert not config.reload_settings(_write_yaml(tmp_path / "config.yaml", {"telegram": {}}))
+    assert config.get_settings() is before
+
+
+class _FakeModel:
+    def __init__(self, model_name=None, system_instruction=None, cached_content=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+
+
+class _FakeGenai:
+    """Minimal google.generativeai stand-in; `caching` is only present when `with_cache` is set."""
+
+    def __init__(self, with_cache: bool, fail: bool = False):
+        self.created = []
+        self.GenerativeModel = type("GenerativeModel", (_FakeModel,), {})
+        if with_cache:
+            genai = self
+
+            class CachedContent:
+                @staticmethod
+                def create(**kwargs):
+                    if fail:
+                        raise RuntimeError("model does not support caching")
+                    genai.created.append(kwargs)
+                    return kwargs
+
+            self.caching = type("caching", (), {"CachedContent": CachedContent})
+            self.GenerativeModel.from_cached_content = classmethod(lambda cls, cached_content: cls(cached_content=cached_content))
+
+
+@pytest.fixture
+def fake_genai(monkeypatch, restore_settings):
+    def _install(**kwargs):
+        genai = _FakeGenai(**kwargs)
+        monkeypatch.setattr(config, "_ensure_genai_configured", lambda: genai)
+        monkeypatch.setattr(config, "_prompt_models", {})
+        monkeypatch.setattr(config, "_context_cache_retry_at", {})
+        config._apply_settings(dataclasses.replace(config.get_settings(), context_cache=True, context_cache_min_tokens=10))
+        return genai
+
+    return _install
+
+
+def test_prompt_model_uses_system_instruction_without_cache_support(fake_genai):
+    fake_genai(with_cache=False)
+    model = config.get_prompt_model("rules " * 100, "v1")
+    assert model.system_instruction == "rules " * 100
+    assert model.model_name == config.get_settings().text_model
+    assert config.get_prompt_model("rules " * 100, "v1") is model
+    assert config.get_prompt_model("rules " * 100, "v2") is not model
+
+
+def test_prompt_model_creates_context_cache_once(fake_genai):
+    genai = fake_genai(with_cache=True)
+    model = config.get_prompt_model("rules " * 100, "v1", model_name="gemini-x")
+    assert config.get_prompt_model("rules " * 100, "v1", model_name="gemini-x") is model
+    assert len(genai.created) == 1
+    assert genai.created[0]["model"] == "models/gemini-x"
+    assert model.cached_content["system_instruction"] == "rules " * 100
+    # Short prompts are below the caching minimum and use a plain model
+    assert config.get_prompt_model("short", "v2").system_instruction == "short"
+    assert len(genai.created) == 1
+
+
+def test_prompt_model_falls_back_when_cache_creation_fails(fake_genai):
+    fake_genai(with_cache=True, fail=True)
+    model = config.get_prompt_model("rules " * 100, "v1")
+    assert model.cached_content is None
+    assert model.system_instruction == "rules " * 100
+    assert list(config._context_cache_retry_at) == [(config.get_settings().text_model, "v1")]
+
+
+def test_model_routes_defaults_and_overrides():
+    settings = Settings.from_mapping({
+        **BASE,
+        "google": {"gemini_api_key": "key", "text_model": "gemini-2.5-flash", "vision_model": "gemini-2.5-flash"},
+        "models": {"classify": {"model": "tiny", "escalate_to": "none", "timeout": "5"}, "vision": {"retries": 0}},
+    })
+    routes = settings.model_routes
+    assert routes["classify"] == config.ModelRoute("tiny", escalate_to=None, timeout=5.0, retries=2)
+    assert routes["parse_text"].escalate_to == "gemini-2.5-flash"
+    assert routes["vision"].model == "gemini-2.5-flash" and routes["vision"].retries == 1
+    assert routes["report_writer"].escalate_to is None
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Tests for the outbound Bot API call scheduler in src/utils/flood_control.py."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+from telegram.error import RetryAfter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.flood_control import PRIORITY_PROGRESS, OutboundScheduler  # noqa: E402
+
+
+class FakeApi:
+    """Stands in for Bot._do_post: records (endpoint, data) and can hold the first call."""
+
+    def __init__(self, hold_first=False):
+        self.calls = []
+        self.release = asyncio.Event()
+        self.hold_first = hold_first
+
+    async def post(self, endpoint, data):
+        self.calls.append((endpoint, dict(data)))
+        if self.hold_first and len(self.calls) == 1:
+            await self.release.wait()
+        return {"message_id": len(self.calls), "text": data.get("text")}
+
+
+def _request(scheduler, api, endpoint, priority=None, **data):
+    args = None if priority is None else {"priority": priority}
+    return asyncio.ensure_future(scheduler.process_request(
+        callback=api.post, args=(endpoint, data), kwargs={}, endpoint=endpoint, data=data, rate_limit_args=args))
+
+
+def test_per_chat_bucket_spaces_messages():
+    async def scenario():
+        api = FakeApi()
+        scheduler = OutboundScheduler(per_chat_rate=20.0, per_chat_burst=1.0)
+        start = time.monotonic()
+        await asyncio.gather(*(_request(scheduler, api, "sendMessage", chat_id=7, text=f"#{i}",
+                                        reply_markup=object()) for i in range(4)))
+        return time.monotonic() - start, api.calls
+
+    elapsed, calls = asyncio.run(scenario())
+    # One message immediately, then one every 50 ms
+    assert elapsed >= 0.14
+    assert [data["text"] for _, data in calls] == ["#0", "#1", "#2", "#3"]
+
+
+def test_retry_after_pauses_and_retries():
+    async def scenario():
+        attempts = []
+
+        async def flaky(endpoint, data):
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(1)
+            return True
+
+        scheduler = OutboundScheduler()
+        result = await scheduler.process_request(
+            callback=flaky, args=("sendMessage", {"chat_id": 7, "text": "x"}), kwargs={},
+            endpoint="sendMessage", data={"chat_id": 7, "text": "x"}, rate_limit_args=None)
+        return result, attempts, scheduler.snapshot()
+
+    result, attempts, stats = asyncio.run(scenario())
+    assert result is True and len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.95
+    assert stats["retry_after"] == 1
+
+
+def test_queued_results_for_one_chat_are_merged():
+    async def scenario():
+        api = FakeApi(hold_first=True)
+        scheduler = OutboundScheduler()
+        first = _request(scheduler, api, "sendMessage", chat_id=7, text="ack", priority=PRIORITY_PROGRESS)
+        await asyncio.sleep(0.01)
+        results = [_request(scheduler, api, "sendMessage", chat_id=7, text=t) for t in ("✅ một", "✅ hai")]
+        await asyncio.sleep(0.01)
+        api.release.set()
+        return await first, await asyncio.gather(*results), api.calls, scheduler.snapshot()
+
+    first, results, calls, stats = asyncio.run(scenario())
+    assert [data["text"] for _, data in calls] == ["ack", "✅ một\n\n✅ hai"]
+    assert results[0] is results[1] and stats["merged"] == 1
+
+
+def test_results_overtake_progress_and_replace_stale_edits():
+    async def scenario():
+        api = FakeApi(hold_first=True)
+        scheduler = OutboundScheduler()
+        first = _request(scheduler, api, "sendMessage", chat_id=7, text="ack 1", priority=PRIORITY_PROGRESS)
+        await asyncio.sleep(0.01)
+        queued = [
+            _request(scheduler, api, "sendMessage", chat_id=7, text="ack 2", priority=PRIORITY_PROGRESS),
+            _request(scheduler, api, "editMessageText", chat_id=7, message_id=1, text="đang xử lý",
+                     priority=PRIORITY_PROGRESS),
+            _request(scheduler, api, "editMessageText", chat_id=7, message_id=1, text="✅ xong"),
+        ]
+        await asyncio.sleep(0.01)
+        api.release.set()
+        await first
+        await asyncio.gather(*queued)
+        return api.calls, scheduler.snapshot()
+
+    calls, stats = asyncio.run(scenario())
+    assert [data["text"] for _, data in calls] == ["ack 1", "✅ xong", "ack 2"]
+    assert stats["superseded"] == 1 and stats["queued"] == 0
+
+
+def test_calls_without_a_chat_are_not_queued():
+    async def scenario():
+        api = FakeApi()
+        scheduler = OutboundScheduler(global_rate=0.01, global_burst=1.0)
+        await _request(scheduler, api, "sendMessage", chat_id=7, text="x")
+        # The global bucket is empty now, but getFile is not throttled
+        return await asyncio.wait_for(_request(scheduler, api, "getFile", file_id="f"), 0.5)
+
+    assert asyncio.run(scenario())["message_id"] == 2
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Tests for idempotent update ingestion in src/utils/idempotency.py."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import stubs  # noqa: E402
+from utils import idempotency, rate_limiter  # noqa: E402
+from utils.idempotency import UpdateLedger, defer_result, idempotent_update, recording_bot  # noqa: E402
+from utils.replies import ReplyManager  # noqa: E402
+
+
+class MemoryStore:
+    """Stands in for the idempotency_keys table."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def claim(self, key):
+        if key in self.rows:
+            return {"claimed": False, "result": self.rows[key]}
+        self.rows[key] = None
+        return {"claimed": True}
+
+    def complete(self, key, result):
+        self.rows[key] = result
+
+    def release(self, keys=None):
+        stale = [k for k, v in self.rows.items() if v is None and (keys is None or k in keys)]
+        for key in stale:
+            del self.rows[key]
+        return len(stale)
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    ledger = UpdateLedger(max_entries=100, store=MemoryStore())
+    monkeypatch.setattr(idempotency, "_LEDGER", ledger)
+    return ledger
+
+
+def _update(message_id, chat_id=7):
+    return stubs.FakeUpdate(stubs.FakeMessage(chat_id=chat_id, message_id=message_id, text="cafe 55k"))
+
+
+def _counting_handler(calls, *, fail=False, background=None):
+    @idempotent_update
+    async def handler(update, context):
+        calls.append(update.message.message_id)
+        await context.bot.send_message(chat_id=update.message.chat_id, text="Đã nhận được thông tin đang xử lý...")
+        if fail:
+            raise RuntimeError("boom")
+        if background is not None:
+            context.application.create_task(background(context, update.message.chat_id))
+            defer_result()
+            return
+        await context.bot.send_message(chat_id=update.message.chat_id, text=f"✅ Đã lưu #{len(calls)}")
+
+    return handler
+
+
+def test_redelivered_update_replays_the_original_reply(ledger):
+    calls = []
+    handler = _counting_handler(calls)
+
+    async def scenario():
+        bot = stubs.FakeBot()
+        context = stubs.FakeContext(bot)
+        await handler(_update(1), context)
+        await handler(_update(1), context)
+        await handler(_update(2), context)
+        return [m["text"] for m in bot.sent]
+
+    sent = asyncio.run(scenario())
+    assert calls == [1, 2]
+    assert sent[:3] == ["Đã nhận được thông tin đang xử lý...", "✅ Đã lưu #1", "✅ Đã lưu #1"]
+    assert ledger.store.rows == {"tg:7:1": "✅ Đã lưu #1", "tg:7:2": "✅ Đã lưu #2"}
+    assert ledger.snapshot()["replayed"] == 1
+
+
+def test_duplicate_while_in_flight_is_dropped(ledger):
+    calls = []
+
+    async def scenario():
+        started = asyncio.Event()
+
+        @idempotent_update
+        async def slow_handler(update, context):
+            calls.append(update.message.message_id)
+            started.set()
+            await asyncio.sleep(0.02)
+            await context.bot.send_message(chat_id=7, text="✅ xong")
+
+        bot = stubs.FakeBot()
+        context = stubs.FakeContext(bot)
+        first = asyncio.create_task(slow_handler(_update(5), context))
+        await started.wait()
+        await slow_handler(_update(5), context)
+        await first
+        return bot.sent
+
+    sent = asyncio.run(scenario())
+    assert calls == [5] and len(sent) == 1
+    assert ledger.snapshot()["dropped_in_flight"] == 1
+
+
+def test_failed_handler_releases_the_claim(ledger):
+    calls = []
+
+    async def scenario():
+        context = stubs.FakeContext(stubs.FakeBot())
+        with pytest.raises(RuntimeError):
+            await _counting_handler(calls, fail=True)(_update(3), context)
+        await _counting_handler(calls)(_update(3), context)
+
+    asyncio.run(scenario())
+    assert calls == [3, 3]
+    assert ledger.store.rows == {"tg:7:3": "✅ Đã lưu #2"}
+
+
+def test_reply_from_background_task_is_recorded(ledger):
+    async def later(context, chat_id):
+        await asyncio.sleep(0.01)
+        await context.bot.send_message(chat_id=chat_id, text="✅ Giọng nói đã lưu")
+
+    async def scenario():
+        context = stubs.FakeContext(stubs.FakeBot())
+        await _counting_handler([], background=later)(_update(9), context)
+        await context.application.wait_tasks()
+
+    asyncio.run(scenario())
+    assert ledger.store.rows["tg:7:9"] == "✅ Giọng nói đã lưu"
+
+
+def test_shed_update_is_processed_on_redelivery(ledger):
+    calls = []
+
+    async def scenario():
+        shed = [False, True]
+
+        @idempotent_update
+        async def handler(update, context):
+            if shed.pop():
+                await context.bot.send_message(chat_id=7, text=rate_limiter.SHED_MESSAGES["rate_limited"])
+                return rate_limiter.Shed("rate_limited")
+            calls.append(update.message.message_id)
+            await context.bot.send_message(chat_id=7, text="✅ Đã lưu")
+
+        context = stubs.FakeContext(stubs.FakeBot())
+        assert await handler(_update(6), context) is None
+        await handler(_update(6), context)
+
+    asyncio.run(scenario())
+    assert calls == [6]
+    assert ledger.store.rows == {"tg:7:6": "✅ Đã lưu"}
+
+
+def test_handler_without_reply_is_not_recorded(ledger):
+    calls = []
+
+    @idempotent_update
+    async def silent(update, context):
+        calls.append(update.message.message_id)
+
+    async def scenario():
+        context = stubs.FakeContext(stubs.FakeBot())
+        await silent(_update(8), context)
+        await silent(_update(8), context)
+
+    asyncio.run(scenario())
+    assert calls == [8, 8]
+    assert ledger.store.rows == {}
+
+
+def test_queued_job_records_its_result_not_the_ack(ledger):
+    async def job(bot, message_id):
+        replies = ReplyManager(recording_bot(bot, "tg:7:10"), 7, message_id)
+        await replies.progress("🎧 Đang phiên âm...")
+        await replies.finish("✅ Giọng nói đã lưu")
+
+    @idempotent_update
+    async def handler(update, context):
+        replies = ReplyManager(context.bot, 7)
+        await replies.ack("🔊 Đã nhận file — đang xử lí")
+        context.application.create_task(job(context.application.bot, replies.message_id))
+        defer_result()
+
+    async def scenario():
+        context = stubs.FakeContext(stubs.FakeBot())
+        await handler(_update(10), context)
+        # Claimed but without a result until the job answers
+        assert ledger.store.rows == {"tg:7:10": None}
+        await handler(_update(10), context)
+        await context.application.wait_tasks()
+        return [m["text"] for m in context.bot.sent]
+
+    sent = asyncio.run(scenario())
+    assert sent == ["🔊 Đã nhận file — đang xử lí", "🎧 Đang phiên âm...", "✅ Giọng nói đã lưu"]
+    assert ledger.store.rows == {"tg:7:10": "✅ Giọng nói đã lưu"}
+    assert ledger.snapshot()["dropped_in_flight"] == 1
+
+
+def test_restart_replays_from_the_store(ledger, monkeypatch):
+    calls = []
+
+    async def deliver():
+        bot = stubs.FakeBot()
+        await _counting_handler(calls)(_update(4), stubs.FakeContext(bot))
+        return [m["text"] for m in bot.sent]
+
+    asyncio.run(deliver())
+    # A new process: empty memory, same table
+    monkeypatch.setattr(idempotency, "_LEDGER", UpdateLedger(store=ledger.store))
+    assert asyncio.run(deliver()) == ["✅ Đã lưu #1"]
+    assert calls == [4]
+
+
+def test_database_claim_complete_and_release(monkeypatch):
+    from database import db_operations
+
+    db = stubs.SqliteDatabase()
+    monkeypatch.setattr(db_operations, "connect_to_heroku_db", db.connect)
+
+    assert db_operations.claim_idempotency_key("tg:1:1") == {"claimed": True}
+    assert db_operations.claim_idempotency_key("tg:1:1") == {"claimed": False, "result": None}
+    db_operations.complete_idempotency_key("tg:1:1", "✅ Đã lưu")
+    assert db_operations.claim_idempotency_key("tg:1:1") == {"claimed": False, "result": "✅ Đã lưu"}
+
+    assert db_operations.claim_idempotency_key("tg:1:2") == {"claimed": True}
+    assert db_operations.claim_idempotency_key("tg:1:3") == {"claimed": True}
+    assert db_operations.release_idempotency_keys(["tg:1:2"]) == 1
+    assert db_operations.release_idempotency_keys() == 1
+    assert db_operations.claim_idempotency_key("tg:1:2") == {"claimed": True}
+
+
+def test_startup_release_keeps_live_claims_of_other_replicas(monkeypatch):
+    from database import db_operations
+
+    db = stubs.SqliteDatabase()
+    monkeypatch.setattr(db_operations, "connect_to_heroku_db", db.connect)
+    store = idempotency.DatabaseStore("bot-1")
+
+    store.claim("tg:1:1")
+    idempotency.DatabaseStore("bot-2").claim("tg:1:2")
+    idempotency.DatabaseStore("bot-3").claim("tg:1:3")
+    store.claim("tg:1:4")
+    store.complete("tg:1:4", "✅ Đã lưu")
+    with db.lock:
+        # bot-3 died an hour ago; the reply to tg:1:4 was recorded three days ago
+        db.conn.execute("UPDATE idempotency_keys SET created_at = datetime('now', '-1 hour') WHERE key = 'tg:1:3'")
+        db.conn.execute("UPDATE idempotency_keys SET created_at = datetime('now', '-3 days') WHERE key = 'tg:1:4'")
+
+    assert store.release_unfinished(stale_after=900) == 2
+    with db.lock:
+        assert [r[0] for r in db.conn.execute("SELECT key FROM idempotency_keys ORDER BY key")] == ["tg:1:2", "tg:1:4"]
+    assert store.cleanup(ttl=2 * 86400, stale_after=900) == 1
+    assert store.claim("tg:1:2") == {"claimed": False, "result": None}
+    assert store.claim("tg:1:4") == {"claimed": True}
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Unit tests for the receipt preprocessing pipeline in src/utils/image_preprocessing.py."""
+
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.stubs import StubReceiptReader, render_receipt  # noqa: E402
+from utils.image_preprocessing import find_receipt_box, otsu_threshold, preprocess, target_size  # noqa: E402
+
+
+def _open(content: bytes):
+    from PIL import Image
+
+    return Image.open(BytesIO(content))
+
+
+def test_otsu_threshold_splits_two_levels():
+    histogram = [0] * 256
+    histogram[40] = 500
+    histogram[220] = 300
+    assert 40 <= otsu_threshold(histogram) < 220
+
+
+def test_find_receipt_box_locates_the_paper():
+    fixture = render_receipt(1000, 1400, paper_box=(0.2, 0.1, 0.8, 0.9))
+    left, top, right, bottom = find_receipt_box(_open(fixture.image).convert("L"))
+    assert abs(left - 200) <= 40 and abs(right - 800) <= 40
+    assert abs(top - 140) <= 50 and abs(bottom - 1260) <= 50
+
+
+def test_find_receipt_box_leaves_full_frame_scans_alone():
+    fixture = render_receipt(1000, 1400, paper_box=(0.0, 0.0, 1.0, 1.0))
+    assert find_receipt_box(_open(fixture.image).convert("L")) is None
+
+
+def test_target_size_by_aspect_ratio():
+    assert target_size(1200, 1600, 800) == (600, 800)
+    assert target_size(400, 300, 800) == (400, 300)  # never upscales
+    # Long receipt: the short side keeps max_side / 2 instead of shrinking to 167 px
+    assert target_size(600, 2880, 800) == (400, 1920)
+    assert target_size(600, 6000, 800, long_side_cap=2400) == (240, 2400)
+
+
+def test_small_jpeg_is_passed_through_unchanged():
+    fixture = render_receipt(480, 640, line_h=16, quality=75)
+    result = preprocess(fixture.image, max_side=800, with_hash=True)
+    assert result.passthrough and result.data == fixture.image
+    assert result.image_hash is not None
+
+
+def test_adaptive_output_is_cropped_grayscale_jpeg():
+    fixture = render_receipt(1200, 1600)
+    result = preprocess(fixture.image, max_side=800)
+    img = _open(result.data)
+    assert result.cropped and img.format == "JPEG" and img.mode == "L"
+    assert max(img.size) == 800 and img.size == (result.width, result.height)
+
+
+def test_long_receipt_stays_readable_only_with_adaptive_sizing():
+    fixture = render_receipt(1080, 3840, paper_box=(0.2, 0.02, 0.8, 0.98), line_h=26)
+    reader = StubReceiptReader()
+    assert reader.count_lines(preprocess(fixture.image, adaptive=True).data) == fixture.lines
+    assert reader.count_lines(preprocess(fixture.image, adaptive=False).data) != fixture.lines
+
+
+def test_legacy_mode_keeps_plain_resize():
+    fixture = render_receipt(1200, 1600)
+    result = preprocess(fixture.image, max_side=800, adaptive=False)
+    img = _open(result.data)
+    assert not result.cropped and img.mode == "RGB" and img.size == (600, 800)
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale():
+    fixture = render_receipt(3024, 4032, line_h=96)
+    result = preprocess(fixture.image, max_side=800)
+    # DCT scaling to 1/2: the short side still covers max_side
+    assert result.decoded_pixels == 1512 * 2016
+    assert StubReceiptReader().count_lines(result.data) == fixture.lines
+
+
+class _StreamedResponse:
+    def __init__(self, body: bytes, length=None):
+        self.body = body
+        self.headers = {} if length is None else {"Content-Length": str(length)}
+        self.chunks_read = 0
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            self.chunks_read += 1
+            yield self.body[i:i + chunk_size]
+
+
+def test_read_capped_returns_body_within_limit():
+    from utils.image_processor import _read_capped
+
+    body = bytes(range(256)) * 1000
+    assert _read_capped(_StreamedResponse(body, len(body)), len(body)) == body
+
+
+def test_read_capped_rejects_by_header_and_while_streaming():
+    from utils.image_processor import ImageTooLarge, _read_capped
+
+    big = _StreamedResponse(b"x" * 1_000_000, length=1_000_000)
+    with pytest.raises(ImageTooLarge):
+        _read_capped(big, 200_000)
+    assert big.chunks_read == 0
+
+    unknown = _StreamedResponse(b"x" * 1_000_000)
+    with pytest.raises(ImageTooLarge):
+        _read_capped(unknown, 200_000)
+    assert unknown.chunks_read < 5
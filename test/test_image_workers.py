@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Tests for the image preprocessing worker pool in src/utils/image_workers.py."""
+
+import dataclasses
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+from benchmarks.stubs import render_receipt  # noqa: E402
+from utils import image_workers  # noqa: E402
+from utils.image_preprocessing import preprocess  # noqa: E402
+from utils.image_workers import ImageWorkerPool, PreprocessQueueFull, PreprocessTimeout  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ImageWorkerPool(workers=1, queue_size=2, timeout=30.0)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_result_matches_in_process(pool):
+    fixture = render_receipt(1200, 1600)
+    result = pool.run(fixture.image, max_side=800, with_hash=True)
+    assert result == preprocess(fixture.image, max_side=800, with_hash=True)
+    snap = pool.snapshot()
+    assert snap["completed"] >= 1 and snap["in_flight"] == 0
+
+
+def test_pool_handles_concurrent_callers(pool):
+    fixtures = [render_receipt(900, 1200, seed=i) for i in range(3)]
+    results = [None] * len(fixtures)
+
+    def _run(i):
+        results[i] = pool.run(fixtures[i].image)
+
+    threads = [threading.Thread(target=_run, args=(i,)) for i in range(len(fixtures))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [r.data for r in results] == [preprocess(f.image).data for f in fixtures]
+
+
+def test_worker_errors_propagate(pool):
+    with pytest.raises(Exception):
+        pool.run(b"not an image")
+    assert pool.snapshot()["failed"] >= 1
+
+
+def test_full_queue_and_timeout_are_reported(monkeypatch):
+    pool = ImageWorkerPool(workers=1, queue_size=0, timeout=0.05)
+    try:
+        assert pool._slots.acquire(blocking=False)
+        with pytest.raises(PreprocessQueueFull):
+            pool.run(b"x")
+        pool._slots.release()
+
+        class _NeverDone:
+            def result(self, timeout=None):
+                raise TimeoutError()
+
+            def cancel(self):
+                return True
+
+        monkeypatch.setattr(pool._executor, "submit", lambda *a, **k: _NeverDone())
+        with pytest.raises(PreprocessTimeout):
+            pool.run(b"x")
+        snap = pool.snapshot()
+        assert snap["rejected"] == 1 and snap["timeouts"] == 1 and snap["in_flight"] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_get_pool_follows_settings():
+    original = config.get_settings()
+    try:
+        config._apply_settings(dataclasses.replace(original, image_workers=0))
+        assert image_workers.get_pool() is None
+        assert image_workers.snapshot() == {"workers": 0}
+
+        config._apply_settings(dataclasses.replace(original, image_workers=1, image_worker_timeout=5.0))
+        pool = image_workers.get_pool()
+        assert pool is not None and pool.workers == 1 and image_workers.get_pool() is pool
+
+        # Same size: the timeout is updated in place; another size replaces the pool
+        config._apply_settings(dataclasses.replace(original, image_workers=1, image_worker_timeout=9.0))
+        assert image_workers.get_pool() is pool and pool.timeout == 9.0
+        config._apply_settings(dataclasses.replace(original, image_workers=2))
+        assert image_workers.get_pool() is not pool
+    finally:
+        image_workers.shutdown_pool()
+        config._apply_settings(original)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""Import-graph checks: heavy dependencies stay lazy and imports have no side effects."""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY = ("google.generativeai", "google.api_core", "PIL", "psycopg2", "requests", "transformers", "torch")
+
+
+def _modules_loaded_by(import_stmt: str, cwd: Path) -> list:
+    code = f"{import_stmt}; import json, sys; print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))"
+    proc = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=cwd, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def test_handlers_import_without_heavy_dependencies():
+    assert _modules_loaded_by("import src.utils.telegram_handlers, src.utils.voice_handlers", REPO_ROOT) == []
+
+
+def test_config_import_from_src_is_lightweight():
+    assert _modules_loaded_by("import config", REPO_ROOT / "src") == []
+
+
+def test_database_modules_import_without_psycopg2():
+    assert _modules_loaded_by("import database.db_operations", REPO_ROOT) == []
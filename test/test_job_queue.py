@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Tests for the durable background job queue in src/utils/job_queue.py."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import stubs  # noqa: E402
+from utils import job_queue  # noqa: E402
+from utils.job_queue import JobQueue, JobStore  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    registry = {}
+    monkeypatch.setattr(job_queue, "_HANDLERS", registry)
+    return registry
+
+
+def _queue(store, **kwargs):
+    options = dict(workers=2, max_attempts=3, visibility_timeout=5.0, retry_delay=0.0, poll_interval=0.01)
+    options.update(kwargs)
+    return JobQueue(store, **options)
+
+
+async def _until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_enqueued_job_runs_once_and_is_removed(store, handlers):
+    seen = []
+
+    async def handler(job, bot):
+        seen.append((job.payload, job.attempts, bot))
+
+    handlers["voice"] = handler
+
+    async def scenario():
+        queue = _queue(store)
+        queue.start("bot")
+        await queue.enqueue("voice", {"chat_id": 7, "audio_path": "a.wav"})
+        await _until(lambda: queue.snapshot()["completed"] == 1)
+        await queue.drain(1.0)
+        return queue.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert seen == [({"chat_id": 7, "audio_path": "a.wav"}, 1, "bot")]
+    assert stats["queued"] == 0 and stats["running"] == 0 and stats["enqueued"] == 1
+
+
+def test_failing_job_is_retried_then_kept_as_failed(store, handlers):
+    attempts = []
+
+    async def handler(job, bot):
+        attempts.append((job.attempts, job.last_attempt))
+        raise RuntimeError("gemini down")
+
+    handlers["album"] = handler
+
+    async def scenario():
+        queue = _queue(store, max_attempts=3)
+        queue.start(None)
+        await queue.enqueue("album", {"chat_id": 7})
+        await _until(lambda: queue.snapshot()["failed"] == 1)
+        await queue.drain(1.0)
+        return queue.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert attempts == [(1, False), (2, False), (3, True)]
+    assert stats["retried"] == 2 and stats["dead"] == 1
+    # A failed job no longer counts as pending work
+    assert stats["depth"] == 0
+
+
+def test_job_with_an_expired_lease_is_claimed_again(store):
+    job_id = store.enqueue("voice", {"chat_id": 1}, max_attempts=3)
+    first = store.claim(("voice",), lease_s=0.0)
+    assert first.job_id == job_id and first.attempts == 1
+    # The claiming process died: its lease runs out and another worker takes over
+    time.sleep(0.01)
+    second = store.claim(("voice",), lease_s=60.0)
+    assert second.job_id == job_id and second.attempts == 2
+    assert store.claim(("voice",), lease_s=60.0) is None
+
+
+def test_drain_puts_an_unfinished_job_back_without_counting_the_attempt(store, handlers):
+    started = []
+
+    async def handler(job, bot):
+        started.append(job.attempts)
+        await asyncio.sleep(10)
+
+    handlers["voice"] = handler
+
+    async def scenario():
+        queue = _queue(store)
+        queue.start(None)
+        await queue.enqueue("voice", {"chat_id": 7})
+        await _until(lambda: started)
+        await queue.drain(0.05)
+        return queue.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert stats["released"] == 1 and stats["queued"] == 1 and stats["depth"] == 1
+    assert store.claim(("voice",), lease_s=60.0).attempts == 1
+
+
+def test_submit_without_a_started_queue_runs_the_handler_as_a_task(handlers, monkeypatch):
+    seen = []
+
+    async def handler(job, bot):
+        seen.append((job.payload, job.last_attempt, bot))
+
+    handlers["voice"] = handler
+    monkeypatch.setattr(job_queue, "_QUEUE", None)
+
+    async def scenario():
+        context = stubs.FakeContext(stubs.FakeBot())
+        await job_queue.submit(context.application, "voice", {"chat_id": 7})
+        await context.application.wait_tasks()
+        return context.application.bot
+
+    bot = asyncio.run(scenario())
+    assert seen == [({"chat_id": 7}, True, bot)]
+
+
+def test_checkpoint_survives_a_retry(store, handlers, monkeypatch):
+    inserts = []
+
+    async def handler(job, bot):
+        if "saved" not in job.payload:
+            inserts.append(job.attempts)
+            await job_queue.checkpoint(job, saved={"bill_ids": [41]})
+        if not job.last_attempt:
+            # e.g. the reply could not be sent after the insert
+            raise RuntimeError("telegram down")
+
+    handlers["voice"] = handler
+
+    async def scenario():
+        queue = _queue(store, max_attempts=2)
+        monkeypatch.setattr(job_queue, "_QUEUE", queue)
+        queue.start(None)
+        await queue.enqueue("voice", {"chat_id": 7})
+        await _until(lambda: queue.snapshot()["completed"] == 1)
+        await queue.drain(1.0)
+
+    asyncio.run(scenario())
+    assert inserts == [1]
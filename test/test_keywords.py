@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Tests for the weighted keyword automaton in src/utils/keywords.py."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.keywords import Keyword, KeywordEngine, fold, get_intent_engine  # noqa: E402
+
+
+def test_fold_keeps_one_character_per_character():
+    text = "Tổng CHI tháng 11 đồng"
+    assert fold(text) == "tong chi thang ## dong"
+    assert len(fold(text)) == len(text)
+
+
+def test_unaccented_text_matches_accented_phrases():
+    engine = get_intent_engine()
+    assert engine.scan("tong chi thang 11").score("report_request") > 0
+    assert engine.scan("Báo cáo 30 ngày").phrases >= {"báo cáo", "## ngày"}
+    assert engine.scan("ăn trưa 50k").score("report_request") == 0
+
+
+def test_different_diacritics_do_not_match():
+    engine = KeywordEngine([Keyword("x", "thu", 2)])
+    assert engine.scan("thu tiền nhà").score("x") == 2
+    assert engine.scan("thứ hai đi chợ").score("x") == 0
+
+
+def test_phrases_match_whole_words():
+    engine = KeywordEngine([Keyword("x", "chi"), Keyword("y", "k")])
+    assert engine.scan("chiều nay").score("x") == 0
+    assert engine.scan("chi tiền, chi tiếp").score("x") == 1
+    assert engine.scan("cafe 50k").score("y") == 1
+    assert engine.scan("kem").score("y") == 0
+
+
+def test_group_counts_once_and_overlapping_phrases_all_match():
+    engine = get_intent_engine()
+    hits = engine.scan("chuyển khoản 2 triệu đồng")
+    # chuyển khoản 3 + currency 2 (triệu and đồng share the group)
+    assert hits.score("transaction") == 5
+    # An amount of at least 100 adds 6; a lone "2" does not
+    assert engine.scan("chuyển khoản 2000000 đồng").score("transaction") == 11
+    report = engine.scan("tổng chi tiết tháng này")
+    assert {"tổng chi", "chi tiết", "tháng này"} <= report.phrases
+
+
+def test_number_edges_match_whole_numbers():
+    engine = get_intent_engine()
+    assert engine.scan("tổng chi tháng 11").score("report_request") > 0
+    assert engine.scan("báo cáo 365 ngày").phrases >= {"### ngày"}
+    # A month is at most two digits: this is an amount
+    hits = engine.scan("gửi xe tháng 150k")
+    assert hits.score("report_request") == 0
+    assert "###" in hits.phrases
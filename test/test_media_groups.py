@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Tests for album (media group) batching: collector, batch extraction and the photo handler path."""
+
+import asyncio
+import dataclasses
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+from benchmarks import stubs  # noqa: E402
+from utils import image_processor, model_router, rate_limiter, schemas, telegram_handlers, vision_cache  # noqa: E402
+from utils.media_groups import MediaGroupCollector  # noqa: E402
+
+RECEIPT = {"total_amount": 55000, "bill_date": "2025-10-10", "merchant_name": "Highland",
+           "category_name": "Ăn uống", "category_type": 0, "note": ""}
+
+
+def test_collector_waits_for_a_quiet_window():
+    async def scenario():
+        collector = MediaGroupCollector()
+        assert collector.add("g", 1) is True
+        task = asyncio.create_task(collector.collect("g", 0.05))
+        await asyncio.sleep(0.03)
+        assert collector.add("g", 2) is False
+        await asyncio.sleep(0.03)
+        assert collector.add("g", 3) is False
+        items = await task
+        return items, collector.pending()
+
+    assert asyncio.run(scenario()) == ([1, 2, 3], 0)
+
+
+@pytest.fixture
+def offline_images(monkeypatch):
+    monkeypatch.setattr(vision_cache, "get_vision_cache", lambda: None)
+    monkeypatch.setattr(image_processor, "process_image_from_url",
+                        lambda url, with_hash=False: (url.encode(), hash(url) & 0xFFFF))
+    calls = {"batch": [], "single": []}
+
+    def fake_batch(payloads, template):
+        calls["batch"].append(payloads)
+        return [None if p.endswith(b"bad") else {**RECEIPT, "note": p.decode()} for p in payloads]
+
+    def fake_single(payload, template):
+        calls["single"].append(payload)
+        return {**RECEIPT, "note": payload.decode()}
+
+    monkeypatch.setattr(image_processor, "_extract_batch_with_gemini", fake_batch)
+    monkeypatch.setattr(image_processor, "_extract_with_gemini", fake_single)
+    return calls
+
+
+def test_extract_batch_sends_one_request_in_order(offline_images):
+    results = image_processor.extract_batch(["a", "bad", "c"])
+    assert len(offline_images["batch"]) == 1 and offline_images["single"] == []
+    assert [r.get("note") for r in results] == ["a", None, "c"]
+    assert results[1] == {"raw": "Invalid"}
+    assert all("receipt_hash" in r for r in (results[0], results[2]))
+
+
+def test_extract_batch_falls_back_to_single_requests(offline_images, monkeypatch):
+    monkeypatch.setattr(image_processor, "_extract_batch_with_gemini", lambda payloads, template: None)
+    results = image_processor.extract_batch(["a", "b"])
+    assert offline_images["single"] == [b"a", b"b"]
+    assert [r["note"] for r in results] == ["a", "b"]
+
+
+def test_batch_request_labels_images_and_maps_declined(monkeypatch):
+    seen = {}
+
+    def fake_generate_json(task, system_instruction, contents, **kwargs):
+        seen.update(task=task, contents=contents, schema=kwargs["schema"])
+        assert kwargs["validate"]([RECEIPT, RECEIPT]) and not kwargs["validate"]([RECEIPT])
+        return [dict(RECEIPT), {"error": "not a receipt"}]
+
+    monkeypatch.setattr(model_router, "generate_json", fake_generate_json)
+    template = image_processor.get_prompt("image_input.txt")
+    answers = image_processor._extract_batch_with_gemini([b"one", b"two"], template)
+    assert seen["task"] == "vision" and seen["schema"] is schemas.TRANSACTION_LIST
+    assert seen["contents"][0] == "Receipt 1" and seen["contents"][2] == "Receipt 2"
+    assert seen["contents"][3] == {"mime_type": "image/jpeg", "data": b"two"}
+    assert answers == [RECEIPT, None]
+
+
+def test_album_gets_one_ack_one_insert_and_one_reply(monkeypatch):
+    original = config.get_settings()
+    config._apply_settings(dataclasses.replace(original, image_album_window=0.05))
+    monkeypatch.setattr(rate_limiter, "_CONTROLLER", rate_limiter.AdmissionController(
+        per_chat_rate=1e9, per_chat_burst=1e9, max_in_flight=10**9, gemini_min_samples=10**9))
+    batches, inserts = [], []
+
+    def fake_extract_batch(paths, user_key=None, file_unique_ids=None):
+        batches.append(paths)
+        return [{**RECEIPT, "receipt_hash": 1}, {"raw": "Invalid"}, {**RECEIPT, "receipt_hash": 2}]
+
+    def fake_add_bills(bills):
+        inserts.append([dict(b) for b in bills])
+        return {"success": True, "bill_ids": [10, 11], "transaction_info": f"✅ Đã lưu {len(bills)} giao dịch"}
+
+    monkeypatch.setattr(telegram_handlers, "extract_batch", fake_extract_batch)
+    monkeypatch.setattr(telegram_handlers, "add_bills", fake_add_bills)
+
+    async def scenario():
+        bot = stubs.FakeBot()
+        context = stubs.FakeContext(bot)
+        for i in range(3):
+            message = stubs.FakeMessage(chat_id=7, message_id=i, media_group_id="album-1",
+                                        photo=[stubs.FakePhotoSize(f"fixture://{i}.jpg", f"uid-{i}")])
+            await telegram_handlers.photo_handler(stubs.FakeUpdate(message), context)
+        await context.application.wait_tasks()
+        return bot.sent
+
+    try:
+        sent = asyncio.run(scenario())
+    finally:
+        config._apply_settings(original)
+
+    assert batches == [["fixture://0.jpg", "fixture://1.jpg", "fixture://2.jpg"]]
+    assert len(inserts) == 1 and len(inserts[0]) == 2
+    assert [m["text"] for m in sent] == [
+        "Đã nhận được 3 ảnh, đang xử lý...",
+        "✅ Đã lưu 2 giao dịch\n\n⚠️ 1 ảnh không chứa thông tin giao dịch hợp lệ.",
+    ]
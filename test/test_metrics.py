@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Unit tests for src/utils/metrics.py."""
+
+import sys
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils import metrics  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_span_records_duration_and_errors():
+    with metrics.span("db_insert"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.span("db_insert"):
+            raise ValueError("boom")
+
+    snap = metrics.snapshot()["db_insert"]
+    assert snap["count"] == 2
+    assert snap["errors"] == 1
+    assert snap["sum"] >= 0.0
+
+
+def test_quantiles_from_samples():
+    for ms in range(1, 101):
+        metrics.observe("report_llm", ms / 1000)
+    snap = metrics.snapshot()["report_llm"]
+    assert snap["p50"] == pytest.approx(0.050, abs=0.002)
+    assert snap["p90"] == pytest.approx(0.090, abs=0.002)
+    assert snap["p99"] == pytest.approx(0.099, abs=0.002)
+
+
+def test_render_prometheus_includes_histogram_and_sources():
+    metrics.observe("summary_query", 0.02)
+    metrics.register_source("admission", lambda: {"admitted": 3, "note": "ignored"})
+    text = metrics.render_prometheus()
+    assert 'pefi_stage_duration_seconds_bucket{stage="summary_query",le="0.025"} 1' in text
+    assert 'pefi_stage_duration_seconds_bucket{stage="summary_query",le="0.01"} 0' in text
+    assert 'pefi_stage_duration_seconds_count{stage="summary_query"} 1' in text
+    assert 'pefi_stage_duration_quantile_seconds{stage="summary_query",quantile="0.99"}' in text
+    assert 'pefi_admission{key="admitted"} 3' in text
+    assert "ignored" not in text
+
+
+def test_http_exporter_serves_metrics():
+    metrics.observe("asr", 0.5)
+    server = metrics.start_http_exporter(0, host="127.0.0.1")
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+            body = resp.read().decode("utf-8")
+        assert resp.status == 200
+        assert 'stage="asr"' in body
+    finally:
+        server.shutdown()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Unit tests for per-task model routing and escalation in src/utils/model_router.py."""
+
+import dataclasses
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import config  # noqa: E402
+from utils import model_router  # noqa: E402
+
+
+class DummyResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ScriptedModel:
+    def __init__(self, name, answers, calls):
+        self.name = name
+        self._answers = answers
+        self._calls = calls
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        self._calls.append((self.name, request_options["timeout"]))
+        answer = self._answers[self.name]
+        if isinstance(answer, Exception):
+            raise answer
+        return DummyResponse(answer)
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """Install a route for "parse_text" and models that answer from a dict keyed by model name."""
+    original = config.get_settings()
+    calls = []
+
+    def _install(answers, **route):
+        routes = dict(original.model_routes)
+        routes["parse_text"] = config.ModelRoute(**{"model": "lite", "escalate_to": "big", "timeout": 7, **route})
+        config._apply_settings(dataclasses.replace(original, model_routes=routes))
+        monkeypatch.setattr(
+            config, "get_prompt_model",
+            lambda system_instruction, version=None, model_name=None: ScriptedModel(model_name, answers, calls),
+        )
+        monkeypatch.setattr(model_router.time, "sleep", lambda s: None)
+        return calls
+
+    yield _install
+    config._apply_settings(original)
+
+
+def _has_amount(data):
+    return isinstance(data, dict) and data.get("total_amount") is not None
+
+
+def test_valid_answer_stays_on_cheap_model(routed):
+    calls = routed({"lite": json.dumps({"total_amount": 30000}), "big": "{}"})
+    data = model_router.generate_json("parse_text", "rules", ["ăn sáng 30k"], validate=_has_amount)
+    assert data == {"total_amount": 30000}
+    assert calls == [("lite", 7)]
+
+
+def test_invalid_answer_escalates_to_larger_model(routed):
+    calls = routed({"lite": "```json\n{\"note\": \"x\"}\n```", "big": json.dumps({"total_amount": 45000})})
+    data = model_router.generate_json("parse_text", "rules", ["grab 45k"], validate=_has_amount)
+    assert data == {"total_amount": 45000}
+    assert [name for name, _ in calls] == ["lite", "big"]
+    assert model_router.snapshot()["parse_text_escalations"] >= 1
+
+
+def test_returns_none_when_no_model_validates(routed):
+    routed({"lite": "not json", "big": "also not json"})
+    assert model_router.generate_json("parse_text", "rules", ["?"], validate=_has_amount) is None
+
+
+def test_no_escalation_configured(routed):
+    calls = routed({"lite": "not json", "big": json.dumps({"total_amount": 1})}, escalate_to=None)
+    assert model_router.generate_json("parse_text", "rules", ["?"], validate=_has_amount) is None
+    assert [name for name, _ in calls] == ["lite"]
+
+
+def test_timeouts_retry_then_raise(routed):
+    from google.api_core.exceptions import DeadlineExceeded
+
+    calls = routed({"lite": DeadlineExceeded("slow"), "big": "{}"}, retries=3)
+    with pytest.raises(model_router.RouteTimeout):
+        model_router.generate_json("parse_text", "rules", ["?"])
+    assert [name for name, _ in calls] == ["lite"] * 3
+
+
+class SequenceModel:
+    """Answers with the next item of a shared list and records the contents of every call."""
+
+    def __init__(self, name, answers, calls):
+        self.name = name
+        self._answers = answers
+        self._calls = calls
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        self._calls.append((self.name, list(contents), generation_config))
+        return DummyResponse(self._answers.pop(0))
+
+
+def _install_sequence(monkeypatch, answers):
+    calls = []
+    monkeypatch.setattr(
+        config, "get_prompt_model",
+        lambda system_instruction, version=None, model_name=None: SequenceModel(model_name, answers, calls),
+    )
+    return calls
+
+
+def test_schema_repair_prompt_fixes_answer(routed, monkeypatch):
+    from utils import schemas
+
+    routed({})
+    calls = _install_sequence(monkeypatch, [
+        json.dumps({"total_amount": "ba mươi nghìn", "category_name": "Ăn uống", "category_type": 0}),
+        json.dumps({"total_amount": 30000, "category_name": "Ăn uống", "category_type": 0}),
+    ])
+    data = model_router.generate_json("parse_text", "rules", ["ăn sáng ba mươi nghìn"], schema=schemas.TRANSACTION)
+    assert data["total_amount"] == 30000 and data["merchant_name"] == "Payment"
+    assert [name for name, _, _ in calls] == ["lite", "lite"]
+    repair = calls[1][1][-1]
+    assert "total_amount" in repair and "ba mươi nghìn" in repair
+    assert calls[0][2]["response_schema"] == schemas.TRANSACTION.gemini_schema()
+
+
+def test_schema_repair_then_escalation(routed, monkeypatch):
+    from utils import schemas
+
+    routed({})
+    calls = _install_sequence(monkeypatch, ["{}", "{}", json.dumps({"intent": "unclear"})])
+    data = model_router.generate_json("parse_text", "rules", ["?"], schema=schemas.INTENT)
+    assert data == {"intent": "unclear", "confidence": 0.0, "explanation": ""}
+    assert [name for name, _, _ in calls] == ["lite", "lite", "big"]
+
+
+def test_declined_answer_is_not_repaired(routed, monkeypatch):
+    from utils import schemas
+
+    routed({})
+    calls = _install_sequence(monkeypatch, [json.dumps({"error": "Not a valid transaction text"})])
+    data = model_router.generate_json("parse_text", "rules", ["hôm nay trời đẹp"], schema=schemas.TRANSACTION)
+    assert schemas.TRANSACTION.declined(data)
+    assert len(calls) == 1
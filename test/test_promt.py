@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Unit tests for the prompt registry in src/utils/promt.py."""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils.promt import PromptRegistry, PromptTemplate, get_prompt, get_prompt_path  # noqa: E402
+
+
+def test_render_matches_str_format_for_report_prompt():
+    text = get_prompt_path("report_generation.txt").read_text(encoding="utf-8")
+    values = {"INPUT_JSON": '{"total_income": 1000}', "TEMPLATE_FRAGMENT": "# Báo cáo chi"}
+    template = get_prompt("report_generation.txt")
+    assert template.fields == ("INPUT_JSON", "TEMPLATE_FRAGMENT")
+    assert template.render(**values) == text.format(**values)
+
+
+def test_template_with_stray_braces_substitutes_only_named_slots():
+    template = PromptTemplate("t", 'Return {"error": "x"}\nINPUT:\n{INPUT_JSON}\n{other}')
+    assert template.render(INPUT_JSON="[1]") == 'Return {"error": "x"}\nINPUT:\n[1]\n{other}'
+    # Missing values keep the placeholder, like the old .replace fallback
+    assert template.render() == template.text
+
+
+def test_registry_loads_all_and_reloads_on_mtime_change(tmp_path):
+    (tmp_path / "a.txt").write_text("Hello {NAME}", encoding="utf-8")
+    (tmp_path / "b.txt").write_text("static", encoding="utf-8")
+    registry = PromptRegistry(tmp_path, check_interval=0.0)
+
+    first = registry.get("a.txt")
+    assert set(registry.versions()) == {"a.txt", "b.txt"}
+    assert registry.get("a.txt") is first
+
+    path = tmp_path / "a.txt"
+    path.write_text("Hi {NAME}!", encoding="utf-8")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, first.mtime_ns + 1_000_000))
+    second = registry.get("a.txt")
+    assert second.version != first.version
+    assert second.render(NAME="An") == "Hi An!"
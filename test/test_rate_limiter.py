@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Unit tests for src/utils/rate_limiter.py using a fake clock."""
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils import rate_limiter  # noqa: E402
+from utils.rate_limiter import AdmissionController, TokenBucket  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=2.0, clock=clock)
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.time_until_available() == 1.0
+    clock.now += 1.0
+    assert bucket.try_acquire()
+
+
+def test_per_chat_limit_does_not_affect_other_chats():
+    clock = FakeClock()
+    ctrl = AdmissionController(per_chat_rate=0.1, per_chat_burst=2, clock=clock)
+    assert ctrl.admit(1, "photo") is None
+    ctrl.release()
+    assert ctrl.admit(1, "photo") == rate_limiter.SHED_RATE_LIMITED
+    assert ctrl.admit(2, "text") is None
+    assert ctrl.counters["shed_rate_limited"] == 1
+    assert ctrl.counters["admitted"] == 2
+
+
+def test_sheds_when_too_many_in_flight():
+    ctrl = AdmissionController(max_in_flight=1, clock=FakeClock())
+    assert ctrl.admit(1) is None
+    assert ctrl.admit(2) == rate_limiter.SHED_OVERLOADED
+    ctrl.release()
+    assert ctrl.admit(2) is None
+
+
+def test_queued_background_jobs_count_against_voice_and_photo():
+    ctrl = AdmissionController(max_in_flight=3, clock=FakeClock())
+    ctrl.backlog = lambda: 2
+    assert ctrl.admit(1, "voice") is None
+    # One voice handler in flight plus two queued transcriptions
+    assert ctrl.admit(2, "voice") == rate_limiter.SHED_OVERLOADED
+    assert ctrl.admit(2, "album_photo") == rate_limiter.SHED_OVERLOADED
+    # Text does not wait on the job workers
+    assert ctrl.admit(2, "text") is None
+    assert ctrl.snapshot()["backlog"] == 2
+
+
+def test_sheds_gemini_work_when_error_rate_high():
+    clock = FakeClock()
+    ctrl = AdmissionController(gemini_error_threshold=0.5, gemini_min_samples=4, gemini_window_s=60, clock=clock)
+    for ok in (False, False, False, True):
+        ctrl.record_gemini_result(ok)
+    assert ctrl.admit(1, "photo") == rate_limiter.SHED_GEMINI_DEGRADED
+    # Text (e.g. deterministic reports) is still admitted
+    assert ctrl.admit(1, "text") is None
+    # Old errors age out of the window
+    clock.now += 61
+    assert ctrl.admit(1, "photo") is None
+
+
+def test_decorator_sends_one_notice_per_cooldown(monkeypatch):
+    ctrl = AdmissionController(per_chat_rate=0.0, per_chat_burst=1, clock=FakeClock())
+    monkeypatch.setattr(rate_limiter, "_CONTROLLER", ctrl)
+    sent = []
+    calls = []
+
+    class Bot:
+        async def send_message(self, chat_id, text):
+            sent.append(text)
+
+    @rate_limiter.admission_controlled("text")
+    async def handler(update, context):
+        calls.append(update)
+
+    update = SimpleNamespace(message=SimpleNamespace(chat_id=7))
+    context = SimpleNamespace(bot=Bot())
+
+    async def _run():
+        for _ in range(3):
+            await handler(update, context)
+
+    asyncio.run(_run())
+    assert len(calls) == 1
+    assert sent == [rate_limiter.SHED_MESSAGES[rate_limiter.SHED_RATE_LIMITED]]
+    assert ctrl.in_flight == 0
+
+
+def test_reconfigure_updates_existing_buckets():
+    clock = FakeClock()
+    ctrl = AdmissionController(per_chat_rate=1.0, per_chat_burst=4, clock=clock)
+    assert ctrl.admit(1, "text") is None
+    ctrl.reconfigure(per_chat_rate=0.0, per_chat_burst=1, max_in_flight=5)
+    assert ctrl.max_in_flight == 5
+    assert ctrl._buckets[1].capacity == 1.0
+    assert ctrl.admit(1, "text") is None
+    assert ctrl.admit(1, "text") == rate_limiter.SHED_RATE_LIMITED
+
+
+def test_album_photos_are_admitted_at_album_cost(monkeypatch):
+    ctrl = AdmissionController(per_chat_rate=0.0, per_chat_burst=6, clock=FakeClock())
+    monkeypatch.setattr(rate_limiter, "_CONTROLLER", ctrl)
+    calls = []
+
+    @rate_limiter.admission_controlled("photo")
+    async def handler(update, context):
+        calls.append(update)
+
+    class Bot:
+        async def send_message(self, chat_id, text):
+            pass
+
+    album = SimpleNamespace(message=SimpleNamespace(chat_id=7, media_group_id="g1"))
+    single = SimpleNamespace(message=SimpleNamespace(chat_id=8, media_group_id=None))
+    context = SimpleNamespace(bot=Bot())
+
+    async def _run():
+        for _ in range(10):
+            await handler(album, context)
+            await handler(single, context)
+
+    asyncio.run(_run())
+    # A 10-photo album fits in one burst; single photos still cost 2 tokens each
+    assert calls.count(album) == 10 and calls.count(single) == 3
+    assert ctrl.counters["admitted_album_photo"] == 10
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Unit tests for receipt perceptual hashing and the per-user index in src/utils/receipt_dedup.py."""
+
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.stubs import make_receipt_image  # noqa: E402
+from utils import image_processor, receipt_dedup  # noqa: E402
+from utils.receipt_dedup import ReceiptHashIndex, dhash, hamming  # noqa: E402
+
+
+def _hash(content: bytes) -> int:
+    from PIL import Image
+
+    return dhash(Image.open(BytesIO(content)))
+
+
+def test_dhash_survives_rescale_and_recompression():
+    from PIL import Image
+
+    original = make_receipt_image(1200, 1600, seed=3)
+    img = Image.open(BytesIO(original)).resize((600, 800))
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=40)
+    assert hamming(_hash(original), _hash(buf.getvalue())) <= 2
+    assert _hash(original).bit_length() <= receipt_dedup.HASH_SIZE ** 2
+
+
+def test_index_is_per_user_and_respects_distance():
+    index = ReceiptHashIndex(max_distance=2)
+    index.add("alice", 0b1111, {"total_amount": 55000}, bill_id=7)
+    hit = index.find("alice", 0b1101)
+    assert hit is not None and hit.bill_id == 7 and hit.payload == {"total_amount": 55000}
+    assert index.find("alice", 0b0000) is None  # distance 4
+    assert index.find("bob", 0b1111) is None
+    assert index.snapshot()["hits"] == 1
+
+
+def test_index_expires_and_caps_entries(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(receipt_dedup.time, "time", lambda: clock[0])
+    index = ReceiptHashIndex(max_distance=0, ttl_s=60, max_per_user=2)
+    for h in (1, 2, 3):
+        index.add("u", h, {})
+    assert index.find("u", 1) is None  # evicted by max_per_user
+    assert index.find("u", 3) is not None
+    clock[0] += 61
+    assert index.find("u", 3) is None
+
+
+@pytest.fixture
+def fresh_index(monkeypatch):
+    index = ReceiptHashIndex(max_distance=4)
+    monkeypatch.setattr(receipt_dedup, "_INDEX", index)
+    monkeypatch.setattr(image_processor.vision_cache, "get_vision_cache", lambda: None)
+    return index
+
+
+def test_extract_text_answers_duplicates_without_gemini(monkeypatch, fresh_index):
+    monkeypatch.setattr(image_processor, "process_image_from_url", lambda url, with_hash=False: (b"jpeg", 0xABC))
+    calls = []
+
+    def fake_generate_json(*args, **kwargs):
+        calls.append(args)
+        return {"total_amount": 55000, "bill_date": "2025-10-10", "merchant_name": "Highland",
+                "category_name": "Ăn uống", "category_type": 0, "note": ""}
+
+    monkeypatch.setattr(image_processor.model_router, "generate_json", fake_generate_json)
+
+    first = image_processor.extract_text("fixture://a.jpg", user_key=42)
+    assert first["receipt_hash"] == 0xABC and "duplicate_of" not in first
+    fresh_index.add(42, first.pop("receipt_hash"), first, bill_id=9)
+
+    second = image_processor.extract_text("fixture://a.jpg", user_key=42)
+    assert second["duplicate_of"] == 9 and second["total_amount"] == 55000
+    assert len(calls) == 1
+
+    # Another user, or no user key (caption "lưu lại"), goes to Gemini again
+    assert "duplicate_of" not in image_processor.extract_text("fixture://a.jpg", user_key=43)
+    assert len(calls) == 2
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Tests for single-message replies and the local Markdown check in src/utils/replies.py."""
+
+import asyncio
+import sys
+from pathlib import Path
+
+from telegram.error import BadRequest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import stubs  # noqa: E402
+from utils import idempotency, telegram_handlers  # noqa: E402
+from utils.replies import ReplyManager, escape_markdown, split_message, to_telegram_markdown  # noqa: E402
+
+
+def test_llm_markdown_becomes_telegram_markdown():
+    report = "# Báo cáo **tháng 11**\n\n- Tổng chi: 1,500,000 VND\n* **Ăn uống** — 40%\n__Lời khuyên__"
+    assert to_telegram_markdown(report) == (
+        "*Báo cáo tháng 11*\n\n- Tổng chi: 1,500,000 VND\n• *Ăn uống* — 40%\n_Lời khuyên_"
+    )
+
+
+def test_unbalanced_markers_are_escaped():
+    assert to_telegram_markdown("chi_tieu 5 * 3 [ghi chú") == "chi\\_tieu 5 \\* 3 \\[ghi chú"
+    assert to_telegram_markdown("`code` and [link](https://x.y)") == "`code` and [link](https://x.y)"
+    assert to_telegram_markdown("**") == "\\*\\*"
+    assert escape_markdown("Cafe_Highland *") == "Cafe\\_Highland \\*"
+
+
+def test_split_message_cuts_at_line_breaks():
+    chunks = split_message("a" * 6 + "\n" + "b" * 6, limit=10)
+    assert chunks == ["aaaaaa", "bbbbbb"]
+    assert split_message("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+def test_ack_is_edited_into_the_result():
+    async def scenario():
+        bot = stubs.FakeBot()
+        replies = ReplyManager(bot, 7)
+        await replies.ack("Đã nhận được thông tin đang xử lý...")
+        await replies.progress("Đã nhận được thông tin đang xử lý...")
+        await replies.finish("# Báo cáo", markdown=True, footer="(Lưu ý: văn bản cơ bản_)")
+        return bot.sent, replies.message_id
+
+    sent, message_id = asyncio.run(scenario())
+    assert len(sent) == 2 and "edit" not in sent[0]
+    assert sent[1]["edit"] == message_id
+    assert sent[1]["text"] == "*Báo cáo*\n\n(Lưu ý: văn bản cơ bản\\_)"
+    assert sent[1]["parse_mode"] == "Markdown"
+
+
+class _UneditableBot(stubs.FakeBot):
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        raise BadRequest("Message to edit not found")
+
+
+def test_failed_edit_falls_back_to_a_new_message():
+    async def scenario():
+        bot = _UneditableBot()
+        replies = ReplyManager(bot, 7, message_id=42)
+        await replies.finish("✅ Đã lưu")
+        return bot.sent
+
+    assert [m["text"] for m in asyncio.run(scenario())] == ["✅ Đã lưu"]
+
+
+def test_report_with_fallback_is_one_edited_message(monkeypatch):
+    monkeypatch.setattr(idempotency, "_LEDGER", idempotency.UpdateLedger())
+    monkeypatch.setattr(telegram_handlers, "get_summary", lambda *args: {"total_expense": 1})
+    monkeypatch.setattr(telegram_handlers, "generate_report",
+                        lambda *args: {"text": "# Báo cáo\n- Tổng chi: 1 VND", "used_fallback": True})
+
+    async def scenario():
+        bot = stubs.FakeBot()
+        message = stubs.FakeMessage(chat_id=7, message_id=stubs.next_message_id(), text="tổng chi tháng 11")
+        await telegram_handlers.text_handler(stubs.FakeUpdate(message), stubs.FakeContext(bot))
+        return bot.sent
+
+    sent = asyncio.run(scenario())
+    assert len(sent) == 2 and sent[1]["edit"] is not None
+    assert sent[1]["text"].startswith("*Báo cáo*\n- Tổng chi: 1 VND\n\n(Lưu ý:")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Unit tests for the response schemas and validators in src/utils/schemas.py."""
+
+import sys
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils import schemas  # noqa: E402
+from utils.schemas import SchemaError  # noqa: E402
+
+
+def test_transaction_normalizes_types_and_fills_defaults():
+    out = schemas.TRANSACTION.validate({
+        "merchant_name": None,
+        "total_amount": "55.000 đ",
+        "bill_date": "10/10/2025",
+        "category_name": " Ăn uống ",
+        "category_type": "0",
+        "note": None,
+    })
+    assert out == {
+        "merchant_name": "Payment",
+        "total_amount": 55000,
+        "bill_date": "2025-10-10",
+        "category_name": "Ăn uống",
+        "category_type": 0,
+        "note": "",
+    }
+    assert schemas.TRANSACTION.validate({
+        "total_amount": 1.5e6, "category_name": "Lương", "category_type": 1,
+    })["bill_date"] == date.today().isoformat()
+
+
+@pytest.mark.parametrize("raw, expected", [(250000, 250000), ("1,250,000", 1250000), ("200k", 200000), ("1.5tr", 1500000)])
+def test_amount_formats(raw, expected):
+    out = schemas.TRANSACTION.validate({"total_amount": raw, "category_name": "Ăn uống", "category_type": 0})
+    assert out["total_amount"] == expected
+
+
+def test_transaction_reports_every_invalid_field():
+    with pytest.raises(SchemaError) as info:
+        schemas.TRANSACTION.validate({
+            "total_amount": 12.5, "bill_date": "hôm qua", "category_name": "Ăn uống", "category_type": 2,
+        })
+    fields = sorted(e.split(":", 1)[0] for e in info.value.errors)
+    assert fields == ["bill_date", "category_type", "total_amount"]
+
+
+def test_declined_answer_is_recognized():
+    assert schemas.TRANSACTION.declined({"error": "Not a valid transaction text"})
+    assert not schemas.TRANSACTION.declined({"error": "x", "total_amount": 1000})
+    assert not schemas.INTENT.declined({"error": "x"})
+    # Constrained decoding: the required keys are present but null or zeroed
+    zeroed = {"error": "Ảnh không phải hóa đơn", "total_amount": 0, "category_name": "", "category_type": 0,
+              "merchant_name": None}
+    assert schemas.TRANSACTION.declined(zeroed)
+    assert schemas.TRANSACTION.declined({"error": "x", "total_amount": None, "category_name": None,
+                                         "category_type": None})
+
+
+def test_gemini_schema_shape():
+    schema = schemas.TRANSACTION.gemini_schema()
+    assert schema["type"] == "object"
+    assert schema["required"] == ["total_amount", "category_name", "category_type"]
+    assert schema["properties"]["merchant_name"]["nullable"] is True
+    assert schema["properties"]["error"] == {"type": "string", "nullable": True}
+    # The model must be able to decline with the required fields left null
+    assert schema["properties"]["total_amount"]["nullable"] is True
+    assert "nullable" not in schemas.INTENT.gemini_schema()["properties"]["intent"]
+    with pytest.raises(schemas.SchemaError):
+        schemas.TRANSACTION.validate({"total_amount": 0, "category_name": "Ăn uống", "category_type": 0})
+    assert schemas.REPORT_REQUEST.gemini_schema()["properties"]["type"]["enum"] == ["thu", "chi", "both"]
+
+
+def test_transaction_list_validates_items_and_keeps_declined():
+    data = [
+        {"total_amount": "55.000 đ", "category_name": "Ăn uống", "category_type": "0"},
+        {"error": "not a receipt"},
+    ]
+    out = schemas.TRANSACTION_LIST.validate(data)
+    assert out[0]["total_amount"] == 55000 and out[0]["category_type"] == 0
+    assert out[1] == {"error": "not a receipt"}
+    assert schemas.TRANSACTION_LIST.gemini_schema()["items"] == schemas.TRANSACTION.gemini_schema()
+
+    with pytest.raises(SchemaError) as exc:
+        schemas.TRANSACTION_LIST.validate([{"total_amount": 1, "category_name": "x", "category_type": 0}, {}])
+    assert all(e.startswith("[1] ") for e in exc.value.errors)
+    with pytest.raises(SchemaError):
+        schemas.TRANSACTION_LIST.validate({"total_amount": 1})
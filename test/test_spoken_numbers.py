@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Tests for spoken-number normalization (src/utils/spoken_numbers.py) and the local voice transaction parser."""
+
+import sys
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.spoken_numbers import normalize_spoken  # noqa: E402
+from utils.text_processor import parse_spoken_transaction  # noqa: E402
+
+TODAY = date(2025, 11, 20)
+
+
+def test_spoken_amounts_become_integers():
+    cases = {
+        "mua cà phê năm mươi nghìn": "mua cà phê 50000",
+        "hai triệu rưỡi": "2500000",
+        "một trăm linh năm": "105",
+        "hai mươi mốt": "21",
+        "mười lăm": "15",
+        "hai triệu tư": "2400000",
+        "trăm mốt nghìn": "110000",
+        "một nghìn không trăm năm mươi": "1050",
+        "1,5 triệu": "1500000",
+        "Năm Mươi Nghìn đồng": "50000 đồng",
+    }
+    for spoken, expected in cases.items():
+        assert normalize_spoken(spoken, TODAY) == expected, spoken
+
+
+def test_ordinary_words_are_left_alone():
+    for text in ("tổng hợp năm nay", "chuyển cho ba", "không mua", "mua một ly", "năm, mươi"):
+        assert normalize_spoken(text, TODAY) == text
+    assert normalize_spoken("mười năm", TODAY) == "10 năm"
+    assert normalize_spoken("một ly trà sữa ba mươi lăm nghìn", TODAY) == "một ly trà sữa 35000"
+
+
+def test_spoken_dates_become_iso():
+    assert normalize_spoken("ăn trưa ngày mười lăm tháng mười một", TODAY) == "ăn trưa 2025-11-15"
+    assert normalize_spoken("mùng năm tháng tư năm hai nghìn không trăm hai mươi lăm", TODAY) == "2025-04-05"
+    assert normalize_spoken("báo cáo tháng mười một", TODAY) == "báo cáo tháng 11"
+    # Not a date: left as spoken
+    assert normalize_spoken("ngày 31 tháng 2", TODAY) == "ngày 31 tháng 2"
+
+
+def test_local_parse_of_a_single_clear_transaction():
+    payload = parse_spoken_transaction(normalize_spoken("phở bò bốn mươi lăm nghìn hôm qua", TODAY), TODAY)
+    assert payload["total_amount"] == 45000
+    assert payload["category_name"] == "Ăn uống" and payload["category_type"] == 0
+    assert payload["bill_date"] == "2025-11-19"
+
+    income = parse_spoken_transaction(normalize_spoken("nhận lương mười lăm triệu", TODAY), TODAY)
+    assert income["category_name"] == "Lương" and income["category_type"] == 1
+
+    # Punctuation after the amount ends the clause, it does not hide the amount
+    lunch = parse_spoken_transaction(normalize_spoken("ăn trưa năm mươi nghìn.", TODAY), TODAY)
+    assert lunch["total_amount"] == 50000
+
+
+def test_ambiguous_transcripts_go_to_gemini():
+    for spoken in (
+        "ăn sáng ba mươi nghìn và grab bốn mươi nghìn",  # two amounts
+        "mua cà phê năm mươi nghìn, trả nợ ba trăm nghìn",  # two amounts, the first before a comma
+        "cà phê 1.500.000 vnđ",  # a number that is not a plain amount
+        "chuyển khoản cho ba hai triệu",  # no category
+        "siêu thị cuối tuần sáu trăm rưỡi",  # 650 VND: the unit was not said
+        "nhận tiền ăn năm mươi nghìn",  # income words on an expense category
+    ):
+        assert parse_spoken_transaction(normalize_spoken(spoken, TODAY), TODAY) is None, spoken
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """Unit tests for src/utils/text_processor.py
 
-These tests mock the Gemini model returned by `config.get_text_model()` so they run
+These tests mock the Gemini model returned by `config.get_prompt_model()` so they run
 without network/API access.
 """
 
@@ -38,7 +38,7 @@ def test_preprocess_and_classify_summarize(monkeypatch):
     })
     mock_model = MockModel(resp)
 
-    monkeypatch.setattr(config, "get_text_model", lambda *a, **k: mock_model)
+    monkeypatch.setattr(config, "get_prompt_model", lambda *a, **k: mock_model)
 
     raw = "\n  Tổng hợp chi tiêu tháng này cho tôi  \n\n"
     out = text_processor.preprocess_and_classify_text(raw)
@@ -60,7 +60,7 @@ def test_preprocess_and_classify_record(monkeypatch):
     resp = "```json\n" + json.dumps(payload) + "\n```"
     mock_model = MockModel(resp)
 
-    monkeypatch.setattr(config, "get_text_model", lambda *a, **k: mock_model)
+    monkeypatch.setattr(config, "get_prompt_model", lambda *a, **k: mock_model)
 
     raw = "250000 VND cho thực phẩm hôm nay"
     out = text_processor.preprocess_and_classify_text(raw)
@@ -73,7 +73,7 @@ def test_preprocess_and_classify_record(monkeypatch):
 
 def test_heuristic_income_phrase(monkeypatch):
     # No Gemini call should be needed; heuristic should classify as record_transaction
-    monkeypatch.setattr(config, "get_text_model", lambda *a, **k: (_ for _ in ()).throw(Exception("Should not be called")))
+    monkeypatch.setattr(config, "get_prompt_model", lambda *a, **k: (_ for _ in ()).throw(Exception("Should not be called")))
 
     raw = "Nhận lương 12 triệu"
     out = text_processor.preprocess_and_classify_text(raw)
@@ -85,7 +85,7 @@ def test_heuristic_income_phrase(monkeypatch):
 
 def test_heuristic_expense_phrase(monkeypatch):
     # Expense phrase should also be recognized
-    monkeypatch.setattr(config, "get_text_model", lambda *a, **k: (_ for _ in ()).throw(Exception("Should not be called")))
+    monkeypatch.setattr(config, "get_prompt_model", lambda *a, **k: (_ for _ in ()).throw(Exception("Should not be called")))
 
     raw = "Tôi trả 200k cho cafe"
     out = text_processor.preprocess_and_classify_text(raw)
@@ -95,6 +95,38 @@ def test_heuristic_expense_phrase(monkeypatch):
     assert "heuristic" in cls["explanation"].lower()
 
 
+def test_parse_transactions_returns_every_transaction(monkeypatch):
+    # Several transactions in one message come back from a single call
+    items = [
+        {"merchant_name": "Payment", "total_amount": "30.000", "bill_date": "2025-10-10",
+         "category_name": "Ăn uống", "category_type": 0, "note": "ăn sáng"},
+        {"merchant_name": "Grab", "total_amount": 45000, "bill_date": "2025-10-10",
+         "category_name": "Xe cộ", "category_type": "0", "note": "grab"},
+    ]
+    calls = []
+
+    class CountingModel(MockModel):
+        def generate_content(self, inputs, generation_config=None, request_options=None):
+            calls.append(inputs)
+            return super().generate_content(inputs, generation_config, request_options)
+
+    monkeypatch.setattr(config, "get_prompt_model", lambda *a, **k: CountingModel(json.dumps(items)))
+
+    out = text_processor.parse_transactions("ăn sáng 30k, grab 45k")
+    assert len(calls) == 1
+    assert [t["total_amount"] for t in out] == [30000, 45000]
+    assert all(t["user_id"] == 2 and t["category_type"] == 0 for t in out)
+
+
+def test_parse_transactions_empty_for_non_transaction(monkeypatch):
+    monkeypatch.setattr(config, "get_prompt_model", lambda *a, **k: MockModel("[]"))
+    assert text_processor.parse_transactions("hôm nay trời đẹp quá") == []
+
+    declined = json.dumps([{"error": "Not a valid transaction text"}])
+    monkeypatch.setattr(config, "get_prompt_model", lambda *a, **k: MockModel(declined))
+    assert text_processor.parse_transactions("hôm nay trời đẹp quá") == []
+
+
 def _run_as_script():
     """Run tests without pytest by invoking the test functions and printing results.
 
@@ -122,6 +154,8 @@ def _run_as_script():
 
     _run(test_preprocess_and_classify_summarize)
     _run(test_preprocess_and_classify_record)
+    _run(test_parse_transactions_returns_every_transaction)
+    _run(test_parse_transactions_empty_for_non_transaction)
 
     print(f"\nSummary: {passed}/{total} tests passed")
 
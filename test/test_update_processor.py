@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Unit tests for src/utils/update_processor.py (no Telegram connection needed)."""
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils.update_processor import PerChatUpdateProcessor  # noqa: E402
+
+
+def _update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+async def _run_updates(processor, updates, handler):
+    await processor.initialize()
+    tasks = [asyncio.create_task(processor.process_update(u, handler(u, i))) for i, u in enumerate(updates)]
+    await asyncio.gather(*tasks)
+    await processor.shutdown()
+
+
+def test_same_chat_keeps_fifo_order():
+    processor = PerChatUpdateProcessor(4)
+    done = []
+
+    async def handler(update, i):
+        # Earlier messages are slower; without per-chat ordering they would finish last
+        await asyncio.sleep(0.02 * (5 - i))
+        done.append(i)
+
+    asyncio.run(_run_updates(processor, [_update(1)] * 5, handler))
+    assert done == [0, 1, 2, 3, 4]
+
+
+def test_different_chats_run_concurrently():
+    processor = PerChatUpdateProcessor(4)
+    running = {"now": 0, "peak": 0}
+
+    async def handler(update, i):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.02)
+        running["now"] -= 1
+
+    asyncio.run(_run_updates(processor, [_update(c) for c in range(4)], handler))
+    assert running["peak"] == 4
+
+
+def test_backlogged_chat_does_not_starve_other_chats():
+    # One slot only: chat 1 has a backlog, chat 2 must still run right after chat 1's current update
+    processor = PerChatUpdateProcessor(2)
+    order = []
+
+    async def handler(update, i):
+        await asyncio.sleep(0.01)
+        order.append((update.effective_chat.id, i))
+
+    updates = [_update(1), _update(1), _update(1), _update(2)]
+    asyncio.run(_run_updates(processor, updates, handler))
+    assert [i for chat, i in order if chat == 1] == [0, 1, 2]
+    assert order.index((2, 3)) < order.index((1, 2))
+    assert processor.active_chats == 0
+    assert processor.pending_updates == 0
+
+
+def test_failing_first_update_does_not_drop_queued_ones():
+    processor = PerChatUpdateProcessor(2)
+    done = []
+
+    async def handler(update, i):
+        await asyncio.sleep(0.01)
+        if i == 0:
+            raise RuntimeError("boom")
+        done.append(i)
+
+    asyncio.run(_run_updates(processor, [_update(1)] * 3, handler))
+    assert done == [1, 2]
+    assert processor.active_chats == 0
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Unit tests for the persistent vision extraction cache in src/utils/vision_cache.py."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from utils import image_processor, vision_cache  # noqa: E402
+from utils.vision_cache import VisionCache  # noqa: E402
+
+RECEIPT = {"total_amount": 55000, "bill_date": "2025-10-10", "merchant_name": "Highland",
+           "category_name": "Ăn uống", "category_type": 0, "note": ""}
+
+
+def test_cache_persists_and_keys_on_prompt_version(tmp_path):
+    path = str(tmp_path / "vision.sqlite3")
+    cache = VisionCache(path)
+    cache.put(["fuid:a", "sha:1"], "v1", RECEIPT)
+    cache.close()
+
+    reopened = VisionCache(path)
+    assert reopened.get("fuid:a", "v1") == RECEIPT
+    assert reopened.get("sha:1", "v1") == RECEIPT
+    assert reopened.get("fuid:a", "v2") is None
+    assert reopened.snapshot() == {"entries": 2, "hits": 2, "misses": 1}
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(vision_cache.time, "time", lambda: clock[0])
+    cache = VisionCache(":memory:", max_entries=2)
+    for key in ("a", "b"):
+        clock[0] += 1
+        cache.put([key], "v", {"k": key})
+    clock[0] += 1
+    assert cache.get("a", "v") is not None  # "b" is now the oldest
+    clock[0] += 1
+    cache.put(["c"], "v", {"k": "c"})
+    assert cache.get("b", "v") is None
+    assert cache.get("a", "v") is not None and cache.get("c", "v") is not None
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    cache = VisionCache(":memory:")
+    monkeypatch.setattr(vision_cache, "get_vision_cache", lambda: cache)
+    downloads = []
+
+    def fake_process(url, with_hash=False):
+        downloads.append(url)
+        return (b"same-jpeg-bytes", 0xF00)
+
+    monkeypatch.setattr(image_processor, "process_image_from_url", fake_process)
+    calls = []
+
+    def fake_gemini(payload, template):
+        calls.append(payload)
+        return dict(RECEIPT)
+
+    monkeypatch.setattr(image_processor, "_extract_with_gemini", fake_gemini)
+    return cache, downloads, calls
+
+
+def test_extract_text_reuses_cached_result(memory_cache):
+    cache, downloads, calls = memory_cache
+    first = image_processor.extract_text("fixture://a.jpg", file_unique_id="AgAD1")
+    assert first["total_amount"] == 55000 and first["receipt_hash"] == 0xF00
+
+    # Same file_unique_id: neither downloaded nor sent to Gemini again
+    again = image_processor.extract_text("fixture://a.jpg", file_unique_id="AgAD1")
+    assert again == first
+    assert len(downloads) == 1 and len(calls) == 1
+
+    # Different id but identical preprocessed bytes: downloaded, answered from the JPEG hash
+    other = image_processor.extract_text("fixture://b.jpg", file_unique_id="AgAD2")
+    assert other["total_amount"] == 55000
+    assert len(downloads) == 2 and len(calls) == 1
+    assert cache.get("fuid:AgAD2", image_processor.get_prompt("image_input.txt").version) is not None